@@ -0,0 +1,67 @@
+"""
+Benchmark of the scalar power allocators against their batched counterparts on large charging stations.
+
+For each allocator and station size, the time of one allocation is measured in two modes:
+  scalar  - the legacy allocator, calling set_temp_max_pc()/set_temp_pd() on each plain EV
+  batched - the batched allocator on the station arrays of an EVFleet, writing the result into the fleet
+The results of both modes are checked to be the same.
+
+Usage: python -m benchmark.alloc [-evs 500,2000,10000] [-repeat 50]
+"""
+import time
+from typing import Callable, List, Tuple
+import numpy as np
+from feasytools import ArgChecker
+from v2sim import EV, Trip, VehType, UniCS, CSType, ConstPriceGetter, EVFleet, AllocEnv, MaxPCAllocPool, V2GAllocPool
+
+
+def make_station(evs: int) -> Tuple[UniCS, List[EV]]:
+    cs = UniCS("cs", "e", evs, "b", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 7.0 / 3600, ConstPriceGetter(1.0))
+    vehs = [EV(f"v{i}", VehType.Private, 60, 0.2 + 0.05 * (i % 10), 0.2, 0.9, 0.9, 0.9,
+        120, 7, 7, 1, 0.9, 0.2, 0.6, 0.8, [Trip(f"t{i}", 36000 + 60 * (i % 97), "a", "b")], {}) for i in range(evs)]
+    for ev in vehs: cs.add_veh(ev)
+    return cs, sorted(cs._chi, key=lambda ev: ev.name)
+
+
+def timeit(func: Callable[[], None], repeat: int) -> float:
+    st = time.perf_counter()
+    for _ in range(repeat): func()
+    return (time.perf_counter() - st) / repeat * 1000
+
+
+def run(evs: int, repeat: int):
+    t = 30000
+    cs, plain = make_station(evs)
+    cs2, fleet_evs = make_station(evs)
+    fleet = EVFleet(fleet_evs)
+    slots = fleet.slots_of(fleet_evs)
+    assert slots is not None
+    pc0 = 7.0 / 3600; tot = pc0 * evs / 3
+    for name in ("Average", "Prioritized", "TimeBased", "V2G-Average"):
+        if name.startswith("V2G-"):
+            func = V2GAllocPool.get(name[4:])
+            bfunc = V2GAllocPool.batch_of(func)
+            out = fleet.pd_max; attr = "_EV__tmp_pd"
+        else:
+            func = MaxPCAllocPool.get(name)
+            bfunc = MaxPCAllocPool.batch_of(func)
+            out = fleet.pc_max; attr = "_EV__tmp_pc_max"
+        def scalar():
+            func(AllocEnv(cs, plain, t), len(plain), pc0, tot)
+        def batched():
+            ret = bfunc(AllocEnv(cs2, fleet_evs, t, fleet, slots), pc0, tot)
+            if ret is not None: out[slots] = ret
+        ts = timeit(scalar, repeat)
+        tb = timeit(batched, repeat)
+        expected = {ev.name: getattr(ev, attr) for ev in plain}
+        assert np.allclose(out[slots], [expected[ev.name] for ev in fleet_evs], rtol=1e-12)
+        print(f"{evs:>6} {name:>12} {ts:>9.3f} ms {tb:>9.3f} ms {ts / tb:>7.1f}x")
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    sizes = [int(x) for x in args.pop_str("evs", "500,2000,10000").split(",")]
+    repeat = args.pop_int("repeat", 50)
+    print(f"{'EVs':>6} {'allocator':>12} {'scalar':>12} {'batched':>12} {'speedup':>8}")
+    for n in sizes:
+        run(n, repeat)
@@ -0,0 +1,84 @@
+"""
+Benchmark of saving and loading a UXsim world: gzipped cloudpickle dumps against chunked checkpoints (v2sim.sim.checkpoint).
+
+A single world is run for -hours simulated hours, with -vph vehicles between random OD pairs added every hour
+and the arrived vehicles removed as V2Sim does. The world is then saved and loaded in both formats.
+The checkpoint is saved twice more into the same folder:
+  same  - nothing changed, so no chunk is written
+  +step - after -advance simulated seconds, only the changed chunks are written
+Reported are the save and load times, the size on disk and the chunks written by each save.
+
+Usage: python -m benchmark.checkpoint [-case cases/ux_37nodes] [-hours 8] [-vph 2000] [-step 10] [-advance 60] [-chunk 1024] [-out bench_ckpt]
+"""
+import random, shutil, time
+from pathlib import Path
+from feasytools import ArgChecker
+from v2sim import RoadNet
+from v2sim.sim.uxworld import SingleWorld
+from v2sim.sim.checkpoint import save_checkpoint, load_checkpoint, CheckpointStats
+
+
+def _find_net(case_dir: Path) -> Path:
+    for f in case_dir.iterdir():
+        if f.name.endswith(".net.xml") or f.name.endswith(".net.xml.gz"):
+            return f
+    raise FileNotFoundError(f"No road network found in {case_dir}")
+
+
+def _report(name: str, stats: CheckpointStats):
+    print(f"  {name:<16} {stats.seconds:8.3f} s {stats.bytes_total / 2**20:9.2f} MB "
+          f"{stats.chunks_written:>4}/{stats.chunks} chunks, {stats.bytes_written / 2**20:.2f} MB written")
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    case = Path(args.pop_str("case", "cases/ux_37nodes"))
+    hours = args.pop_int("hours", 8)
+    vph = args.pop_int("vph", 2000)
+    step = args.pop_int("step", 10)
+    advance = args.pop_int("advance", 60)
+    chunk = args.pop_int("chunk", 1024)
+    out = Path(args.pop_str("out", "bench_ckpt"))
+
+    rnet = RoadNet.load(str(_find_net(case)))
+    W = rnet.create_singleworld(
+        tmax=(hours + 1) * 3600, deltan=1, reaction_time=step, random_seed=0, print_mode=0,
+        vehicle_logging_timestep_interval=-1, reduce_memory_delete_vehicle_route_pref=True,
+        hard_deterministic_mode=True,
+    )
+    rnd = random.Random(0)
+    nodes = [n for n in rnet.nodes if rnet.is_node_in_largest_scc(n)]
+    W.exec_simulation(0)
+    vid = 0
+    for hour in range(hours):
+        for _ in range(vph):
+            o, d = rnd.sample(nodes, 2)
+            W.add_vehicle(f"v{vid}", o, d)
+            vid += 1
+        W.exec_simulation((hour + 1) * 3600)
+        if hour + 1 < hours:
+            for _ in W.get_arrived_vehicles(): pass
+    print(f"Case: {case}, {hours} h, {vph} vehicles/h, {len(W.world.VEHICLES)} vehicles in the world")
+
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir(parents=True)
+    legacy = out / "world.gz"
+    folder = out / "checkpoint"
+
+    print("Save:")
+    st = time.perf_counter()
+    W.save(str(legacy))
+    print(f"  {'cloudpickle+gzip':<16} {time.perf_counter() - st:8.3f} s {legacy.stat().st_size / 2**20:9.2f} MB")
+    _report("checkpoint", save_checkpoint(folder, W, chunk))
+    _report("checkpoint same", save_checkpoint(folder, W, chunk))
+    W.exec_simulation(hours * 3600 + advance)
+    _report("checkpoint +step", save_checkpoint(folder, W, chunk))
+
+    print("Load:")
+    st = time.perf_counter()
+    W1 = SingleWorld.load(str(legacy))
+    print(f"  {'cloudpickle+gzip':<16} {time.perf_counter() - st:8.3f} s")
+    st = time.perf_counter()
+    W2 = load_checkpoint(folder)
+    print(f"  {'checkpoint':<16} {time.perf_counter() - st:8.3f} s")
+    assert isinstance(W2, SingleWorld) and len(W2.world.VEHICLES) == len(W.world.VEHICLES)
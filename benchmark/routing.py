@@ -0,0 +1,76 @@
+"""
+Microbenchmark of the route searches in v2sim.sim.routing.
+
+It compares the predecessor-map Dijkstra used by V2Sim with a reference implementation
+that copies the path lists on every heap push, on the same compiled graph and the same OD pairs.
+
+Usage: python -m benchmark.routing [-n 500] [-seed 0] [-cases cases/ux_37nodes,cases/ux_Nanjing]
+"""
+import heapq, random, time
+from typing import Set
+from pathlib import Path
+from feasytools import ArgChecker
+from v2sim import RoadNet
+from v2sim.sim.routing import CSRGraph, Stage, dijMF
+
+
+def dijMF_path_copy(cg: CSRGraph, ctime: int, from_node: str, to_nodes: Set[str]) -> Stage:
+    """Reference version of dijMF which carries the whole path in every heap entry"""
+    src = cg.node_index[from_node]; targets = cg.index_of(to_nodes)
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+    heap = [(0., 0., src, [src], [])]
+    visited = set()
+    min_time = {src: 0.}
+    best = None; best_time = float('inf')
+    while heap:
+        cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
+        if cur_node in visited: continue
+        visited.add(cur_node)
+        if cur_node in targets and cur_time < best_time:
+            best_time = cur_time
+            best = (path.copy(), path_edges.copy(), cur_time, cur_len)
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
+            if neighbor in visited: continue
+            next_time = cur_time + tts[k]
+            if neighbor not in min_time or next_time < min_time[neighbor]:
+                min_time[neighbor] = next_time
+                heapq.heappush(heap, (next_time, cur_len + lens[k], neighbor, path + [neighbor], path_edges + [k]))
+    return Stage([], [], float('inf'), float('inf')) if best is None else cg.to_stage(*best)
+
+
+def _find_net(case_dir: Path) -> Path:
+    for f in case_dir.iterdir():
+        if f.name.endswith(".net.xml") or f.name.endswith(".net.xml.gz"):
+            return f
+    raise FileNotFoundError(f"No road network found in {case_dir}")
+
+
+def bench_case(case_dir: Path, n: int, seed: int):
+    rnet = RoadNet.load(str(_find_net(case_dir)))
+    cg = CSRGraph(rnet.get_gl())
+    rnd = random.Random(seed)
+    ods = [tuple(rnd.sample(cg.node_ids, 2)) for _ in range(n)]
+    for o, d in ods:
+        s1 = dijMF(cg, 0, o, {d})
+        s2 = dijMF_path_copy(cg, 0, o, {d})
+        assert s1.edges == s2.edges, f"Route mismatch between {o} and {d}"
+    
+    res = {}
+    for name, func in (("path-copy", lambda o, d: dijMF_path_copy(cg, 0, o, {d})), ("predecessor", lambda o, d: dijMF(cg, 0, o, {d}))):
+        st = time.perf_counter()
+        for o, d in ods: func(o, d)
+        res[name] = time.perf_counter() - st
+    print(f"{case_dir.name}: {cg.node_count} nodes, {cg.edge_count} edges, {n} queries")
+    for name, t in res.items():
+        print(f"  {name:<12} {t:8.3f} s  {t / n * 1e3:8.3f} ms/query")
+    print(f"  speedup      {res['path-copy'] / res['predecessor']:8.2f}x")
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    n = args.pop_int("n", 500)
+    seed = args.pop_int("seed", 0)
+    cases = args.pop_str("cases", "cases/ux_37nodes,cases/ux_Nanjing").split(",")
+    for c in cases:
+        bench_case(Path(c), n, seed)
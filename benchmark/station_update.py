@@ -0,0 +1,86 @@
+"""
+Benchmark of CSHub.update() against update_parallel() for growing numbers of charging stations.
+
+Three modes are timed on identical hubs of slow charging stations:
+  serial     - CSHub.update()
+  per-call   - a new ThreadPoolExecutor for every step, as update_parallel() used to do
+  persistent - CSHub.update_parallel() with the long-lived worker pool of the hub
+The crossover is the smallest station count at which the persistent pool beats the serial update by the margin,
+since the timings of repeated runs vary by 10~20%.
+Under the GIL the pool cannot overlap the pure-Python station updates, so no crossover is expected there.
+
+Usage: python -m benchmark.station_update [-stations 100,1000,10000] [-evs 10] [-steps 20] [-step 10] [-workers 4] [-margin 0.2]
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from feasytools import ArgChecker
+from v2sim import EV, VehType, UniCS, CSType, SCSHub, ConstPriceGetter, PyVersion
+
+
+def make_hub(stations: int, evs: int) -> SCSHub:
+    cs_list = [
+        UniCS(f"cs{i}", f"e{i}", evs, f"b{i % 10}", float(i), 0.0, CSType.SCS, 7.0, 0.0, ConstPriceGetter(1.0))
+        for i in range(stations)
+    ]
+    hub = SCSHub(cs_list)
+    for i in range(stations):
+        for j in range(evs):
+            ev = EV(f"v{i}_{j}", VehType.Private, 60, 0.2 + 0.05 * (j % 10), 0.2, 0.9, 0.9, 0.9,
+                120, 7, 7, 1, 0.9, 0.2, 0.6, 0.8, [], {})
+            hub.add_veh(ev, i)
+    return hub
+
+
+def _per_call(hub: SCSHub, sec: int, t: int, workers: int):
+    # Reproduction of the former update_parallel(), which created a pool for every call
+    cnt = len(hub)
+    each_size = (cnt + workers - 1) // workers
+    def update_range(l: int, r: int):
+        return [hub[i].update(sec, t, 0.0, 1.0, 1.0) for i in range(l, r)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(update_range, i * each_size, min((i + 1) * each_size, cnt)) for i in range(workers)]
+        for f in futures: f.result()
+
+
+def run(stations: int, evs: int, steps: int, step: int, workers: int) -> List[float]:
+    ret: List[float] = []
+    for mode in ("serial", "per-call", "persistent"):
+        hub = make_hub(stations, evs)
+        st = time.perf_counter()
+        for k in range(steps):
+            t = 36000 + k * step
+            if mode == "serial":
+                hub.update(step, t, 1.0, 1.0)
+            elif mode == "per-call":
+                _per_call(hub, step, t, workers)
+            else:
+                hub.update_parallel(step, t, 1.0, 1.0, workers)
+        ret.append((time.perf_counter() - st) / steps * 1000)
+        hub.close_pool()
+    return ret
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    stations = [int(x) for x in args.pop_str("stations", "100,1000,10000").split(",")]
+    evs = args.pop_int("evs", 10)
+    steps = args.pop_int("steps", 20)
+    step = args.pop_int("step", 10)
+    workers = args.pop_int("workers", 4)
+    margin = args.pop_float("margin", 0.2)
+
+    ver = PyVersion()
+    print(f"Python {ver[0]}.{ver[1]}.{ver[2]}, GIL {'enabled' if ver[3] else 'disabled'}, "
+        f"{evs} EVs/station, {steps} steps, {workers} workers")
+    print(f"{'stations':>8} {'serial':>12} {'per-call':>12} {'persistent':>12}")
+    crossover = None
+    for n in stations:
+        ser, per, pst = run(n, evs, steps, step, workers)
+        print(f"{n:>8} {ser:>9.2f} ms {per:>9.2f} ms {pst:>9.2f} ms")
+        if crossover is None and pst < ser * (1 - margin):
+            crossover = n
+    if crossover is None:
+        print(f"Persistent pool is not faster than the serial update by {margin:.0%} at any tested size.")
+    else:
+        print(f"Crossover: persistent pool is faster from {crossover} stations.")
@@ -0,0 +1,153 @@
+"""
+Benchmark of the IPC between SUMOParallelBackend and its partition workers.
+
+A forked process stands in for one libsumo worker. Every step, the parent sends a batch of
+boundary-crossing vehicles (add_routes) and a "step" command; the worker answers with arrival
+snapshots and departed IDs, as a partition worker does at peak. Two transports are compared:
+  pipe - pickled dicts over multiprocessing.Pipe
+  shm  - fixed-layout records in shared-memory rings (v2sim.sim.sumo_ipc), the pipe only carrying locators
+Reported are round-trip messages per second and the latency of the step reply.
+
+Vehicle routes use the edges of the first partition of the case, or of the whole net if the case is not partitioned.
+They are drawn from a pool of -routes distinct segments (the backend caches OD routes, so segments repeat);
+-routes 0 gives every vehicle its own route. Vehicle IDs are drawn from a fleet of -fleet vehicles. The first -warmup steps are run but not timed, so that
+the interned ID tables are warm as in a long simulation.
+
+Usage: python -m benchmark.sumo_ipc [-d cases/sumo_Nanjing] [-steps 300] [-adds 500] [-arrivals 500] [-route 30] [-routes 200] [-fleet 20000] [-warmup 50]
+"""
+import multiprocessing as mp
+import random, time
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+from feasytools import ArgChecker
+from v2sim import RoadNet
+from v2sim.sim.sumo_backend import detect_sumo_partition
+from v2sim.sim.sumo_ipc import ShmChannel
+
+
+_POOL = 10
+
+
+def load_edges(case_dir: Path) -> List[str]:
+    part = detect_sumo_partition(case_dir)
+    if part is not None:
+        return part.edges[min(part.edges)]
+    for f in case_dir.iterdir():
+        if f.name.endswith(".net.xml") or f.name.endswith(".net.xml.gz"):
+            return [e.getID() for e in RoadNet.load(str(f)).sumo.getEdges()]
+    raise FileNotFoundError(f"No road network found in {case_dir}")
+
+
+def make_steps(edges: List[str], steps: int, arrivals: int, fleet: int, seed: int) -> List[Tuple[dict, List[str]]]:
+    """Arrival snapshots and departed IDs of a few steps, generated by the worker before timing starts"""
+    rnd = random.Random(seed + 1)
+    ret = []
+    for _ in range(steps):
+        arrived = {}
+        for k in rnd.sample(range(fleet), arrivals):
+            vid = f"v{k}"
+            arrived[vid] = (vid, rnd.uniform(0, 5000), rnd.choice(edges), (rnd.uniform(0, 1e4), rnd.uniform(0, 1e4)))
+        ret.append((arrived, [f"v{k}" for k in rnd.sample(range(fleet), arrivals)]))
+    return ret
+
+
+def make_adds(edges: List[str], steps: int, adds: int, route: int, routes: int, fleet: int, seed: int) -> List[list]:
+    """add_routes batches of a few steps, generated before timing starts"""
+    rnd = random.Random(seed)
+    pool = [rnd.sample(edges, min(route, len(edges))) for _ in range(routes)]
+    # Copy the route for each vehicle, as the backend does when it splits routes into segments
+    return [[(f"v{rnd.randrange(fleet)}", list(rnd.choice(pool)) if pool else rnd.sample(edges, min(route, len(edges))),
+        False, None, None) for _ in range(adds)] for _ in range(steps)]
+
+
+def worker(conn, edges: List[str], shm: Optional[Tuple[str, str]], arrivals: int, fleet: int, seed: int):
+    channel = None if shm is None else ShmChannel.attach(shm, edges)
+    workload = make_steps(edges, _POOL, arrivals, fleet, seed)
+    conn.send(("ok", None))
+    known = 0
+    while True:
+        op, args = conn.recv()
+        if op == "close":
+            break
+        if op == "add_routes_shm":
+            assert channel is not None
+            known += len(channel.unpack_routes(args[0]))
+            conn.send(("ok", None))
+        elif op == "add_routes":
+            known += len(args[0])
+            conn.send(("ok", None))
+        elif op == "step":
+            t = args[0]
+            arrived, departed = workload[t % _POOL]
+            reply = None if channel is None else channel.pack_step(t, arrived, departed)
+            if reply is None:
+                reply = {"time": t, "arrived": arrived, "departed": departed}
+            conn.send(("ok", reply))
+    if channel is not None:
+        channel.close()
+    conn.send(("ok", None))
+
+
+def run(mode: str, edges: List[str], steps: int, adds: int, arrivals: int, route: int, routes: int, fleet: int, warmup: int, seed: int):
+    ctx = mp.get_context("fork")
+    channel = ShmChannel.create(edges) if mode == "shm" else None
+    conn, child = ctx.Pipe()
+    proc = ctx.Process(target=worker, args=(child, edges, None if channel is None else channel.ring_names, arrivals, fleet, seed), daemon=True)
+    proc.start()
+    batches = make_adds(edges, _POOL, adds, route, routes, fleet, seed)
+    conn.recv()
+    lat = np.zeros(steps)
+    msgs = 0
+    st = time.perf_counter()
+    for s in range(warmup + steps):
+        # Batches and replies are taken from small pools, so that the data stays small and the
+        # interned tables warm up as they do over a long simulation with a fixed fleet.
+        items = batches[s % _POOL]
+        if s == warmup:
+            msgs = 0
+            st = time.perf_counter()
+        msg = None if channel is None else channel.pack_routes(items)
+        if msg is None:
+            conn.send(("add_routes", (items,)))
+        else:
+            conn.send(("add_routes_shm", (msg,)))
+        conn.recv()
+        t0 = time.perf_counter()
+        conn.send(("step", (s,)))
+        _, reply = conn.recv()
+        if "shm" in reply:
+            assert channel is not None
+            reply = channel.unpack_step(reply)
+        if s >= warmup:
+            lat[s - warmup] = time.perf_counter() - t0
+        msgs += 2
+    total = time.perf_counter() - st
+    conn.send(("close", ()))
+    conn.recv()
+    proc.join()
+    if channel is not None:
+        channel.close()
+    return msgs / total, lat.mean() * 1e3, np.percentile(lat, 95) * 1e3
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    case = Path(args.pop_str("d", "cases/sumo_Nanjing"))
+    steps = args.pop_int("steps", 300)
+    adds = args.pop_int("adds", 500)
+    arrivals = args.pop_int("arrivals", 500)
+    route = args.pop_int("route", 30)
+    routes = args.pop_int("routes", 200)
+    fleet = args.pop_int("fleet", 20000)
+    warmup = args.pop_int("warmup", 50)
+    seed = args.pop_int("seed", 0)
+    edges = load_edges(case)
+    print(f"{case.name}: {len(edges)} edges, {steps} steps, {adds} route adds and {arrivals} arrivals per step, "
+          f"{route} edges per route, {routes or 'unique'} routes, {fleet} vehicles")
+    print(f"  {'mode':<6} {'msg/s':>10} {'mean step ms':>14} {'p95 step ms':>13}")
+    res = {}
+    for mode in ("pipe", "shm"):
+        res[mode] = run(mode, edges, steps, adds, arrivals, route, routes, fleet, warmup, seed)
+        print(f"  {mode:<6} {res[mode][0]:10.1f} {res[mode][1]:14.3f} {res[mode][2]:13.3f}")
+    print(f"  speedup {res['shm'][0] / res['pipe'][0]:.2f}x msg/s")
@@ -0,0 +1,74 @@
+"""
+Memory benchmark of multi-day UXsim runs with and without the retention window of the per-timestep link and signal series.
+
+Each mode runs in its own process. Vehicles between random OD pairs are added every simulated hour,
+arrived vehicles are removed as V2Sim does, and the resident set size (RSS) is printed after each simulated day.
+With the full history, RSS grows with the simulated time; with a retention window it stays flat.
+
+Usage: python -m benchmark.uxsim_memory [-days 3] [-window 3600] [-vph 200] [-step 10] [-case cases/ux_37nodes] [-array]
+"""
+import os, random, resource, time
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List, Optional
+from feasytools import ArgChecker
+from v2sim import RoadNet
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # Peak RSS on the platforms without procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _find_net(case_dir: Path) -> Path:
+    for f in case_dir.iterdir():
+        if f.name.endswith(".net.xml") or f.name.endswith(".net.xml.gz"):
+            return f
+    raise FileNotFoundError(f"No road network found in {case_dir}")
+
+
+def run(case_dir: str, days: int, window: Optional[float], vph: int, step: int, array: bool) -> List[float]:
+    rnet = RoadNet.load(str(_find_net(Path(case_dir))))
+    W = rnet.create_singleworld(
+        tmax=days * 86400, deltan=1, reaction_time=step, random_seed=0, print_mode=0,
+        vehicle_logging_timestep_interval=-1, reduce_memory_delete_vehicle_route_pref=True,
+        hard_deterministic_mode=True, array_links=array, link_history_window=window,
+    )
+    rnd = random.Random(0)
+    nodes = [n for n in rnet.nodes if rnet.is_node_in_largest_scc(n)]
+    W.exec_simulation(0)
+    rss = [_rss_mb()]
+    vid = 0
+    for hour in range(days * 24):
+        for _ in range(vph):
+            o, d = rnd.sample(nodes, 2)
+            W.add_vehicle(f"v{vid}", o, d)
+            vid += 1
+        W.exec_simulation((hour + 1) * 3600)
+        for _ in W.get_arrived_vehicles(): pass
+        if (hour + 1) % 24 == 0:
+            rss.append(_rss_mb())
+    return rss
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    case = args.pop_str("case", "cases/ux_37nodes")
+    days = args.pop_int("days", 3)
+    window = args.pop_float("window", 3600)
+    vph = args.pop_int("vph", 200)
+    step = args.pop_int("step", 10)
+    array = args.pop_bool("array")
+
+    print(f"Case: {case}, {days} days, {vph} vehicles/h, step {step} s, {'array' if array else 'list'} links")
+    ctx = get_context("spawn")
+    for name, win in (("full history", None), (f"window {window:g} s", window)):
+        st = time.time()
+        with ctx.Pool(1) as pool:
+            rss = pool.apply(run, (case, days, win, vph, step, array))
+        print(f"{name:>16}: " + ", ".join(f"day {i}: {r:.1f} MB" for i, r in enumerate(rss)) +
+            f" ({time.time() - st:.1f} s)")
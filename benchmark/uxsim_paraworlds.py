@@ -0,0 +1,72 @@
+"""
+Scaling benchmark of the process-based ParaWorlds versus SingleWorld.
+
+The road network is partitioned geographically into 2/4/8 parts and each part is simulated in a worker process.
+Vehicles between random OD pairs are added every step. The wall time of each backend is reported, along with
+the critical path of the workers, i.e., the sum over steps of the slowest worker, which is the time
+that lock-step parallel simulation takes with enough CPU cores.
+
+Usage: python -m benchmark.uxsim_paraworlds [-case cases/ux_Nanjing] [-parts 2,4,8] [-hours 1] [-vps 2] [-step 10]
+"""
+import os, random, time
+from pathlib import Path
+from typing import List
+from feasytools import ArgChecker
+from v2sim import RoadNet
+
+
+def _find_net(case_dir: Path) -> Path:
+    for f in case_dir.iterdir():
+        if f.name.endswith(".net.xml") or f.name.endswith(".net.xml.gz"):
+            return f
+    raise FileNotFoundError(f"No road network found in {case_dir}")
+
+
+def run(rnet: RoadNet, parts: int, hours: float, vps: int, step: int):
+    kwargs = dict(
+        tmax=hours * 3600 + step, deltan=1, reaction_time=step, random_seed=0, print_mode=0,
+        vehicle_logging_timestep_interval=-1, reduce_memory_delete_vehicle_route_pref=True,
+        hard_deterministic_mode=True,
+    )
+    st = time.time()
+    if parts <= 1:
+        W = rnet.create_singleworld(**kwargs)
+    else:
+        rnet.partition_roadnet(parts)
+        W = rnet.create_procworlds(**kwargs)
+    t_create = time.time() - st
+
+    rnd = random.Random(0)
+    nodes: List[str] = [n for n in rnet.nodes if rnet.is_node_in_largest_scc(n)]
+    vid = arrived = 0
+    st = time.time()
+    for t in range(step, int(hours * 3600) + 1, step):
+        for _ in range(vps):
+            o, d = rnd.sample(nodes, 2)
+            W.add_vehicle(f"v{vid}", o, d)
+            vid += 1
+        W.exec_simulation(t)
+        arrived += sum(1 for _ in W.get_arrived_vehicles())
+    t_run = time.time() - st
+    critical = W.busy_time[1] if parts > 1 else t_run
+    W.shutdown()
+    return t_create, t_run, critical, vid, arrived
+
+
+if __name__ == "__main__":
+    args = ArgChecker()
+    case = args.pop_str("case", "cases/ux_Nanjing")
+    parts = [int(p) for p in args.pop_str("parts", "2,4,8").split(",")]
+    hours = args.pop_float("hours", 1)
+    vps = args.pop_int("vps", 2)
+    step = args.pop_int("step", 10)
+
+    net = _find_net(Path(case))
+    print(f"Case: {case}, {hours:g} h, {vps} vehicles/step, step {step} s, {os.cpu_count()} CPUs")
+    base = None
+    for p in [1] + parts:
+        t_create, t_run, critical, added, arrived = run(RoadNet.load(str(net)), p, hours, vps, step)
+        if base is None: base = t_run
+        name = "SingleWorld" if p <= 1 else f"{p} processes"
+        print(f"{name:>14}: create {t_create:.1f} s, run {t_run:.1f} s (x{base / t_run:.2f}), "
+            f"critical path {critical:.1f} s (x{base / critical:.2f}), {arrived}/{added} arrived")
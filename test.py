@@ -1,7 +1,57 @@
 from unit_test.veh import *
-test_ev()
-test_gv()
-
 from unit_test.station import *
-test_gs()
-test_cs()
\ No newline at end of file
+from unit_test.routing import *
+from unit_test.partition import *
+from unit_test.rebalance import *
+from unit_test.checkpoint import *
+from unit_test.sumo_backend import *
+from unit_test.wrapper import *
+
+# Worker processes are spawned by some tests, which import this module again
+if __name__ == "__main__":
+    test_ev()
+    test_gv()
+
+    test_gs()
+    test_cs()
+    test_update_parallel()
+    test_fleet()
+    test_charge_rate_curve()
+    test_batch_alloc()
+    test_aggregates()
+    test_price_snapshot()
+    test_willingness_timeline()
+
+    test_astar_alt()
+    test_late_dest()
+    test_speed_change()
+    test_route_cache()
+    test_route_cache_lru()
+    test_reverse_table()
+    test_ch_query()
+    test_ch_persist()
+
+    test_trip_flows()
+    test_partition_stats()
+    test_multilevel_partition()
+    test_rebalance()
+
+    test_checkpoint_roundtrip()
+    test_checkpoint_incremental()
+    test_checkpoint_deep_chain()
+    test_checkpoint_columns()
+    test_checkpoint_resume()
+    test_checkpoint_procworlds()
+
+    test_subscriptions()
+    test_no_tracking()
+    test_unsubscribed_fallback()
+    test_traveltime_reporter()
+    test_parallel_traveltime_merge()
+    test_shm_channel()
+    test_worker_drain()
+    test_pipelined_step()
+
+    test_sim_params_sumo()
+    test_sim_params_default()
+    test_sim_params_uxsim()
@@ -0,0 +1,182 @@
+import shutil, tempfile
+from pathlib import Path
+import numpy as np
+from v2sim.sim import checkpoint
+from v2sim.sim.checkpoint import save_checkpoint, load_checkpoint, load_columns, is_checkpoint
+
+
+class _Car:
+    def __init__(self, name, soc, leader=None):
+        self.name = name
+        self.soc = soc
+        self.trips = 0
+        self.parked = False
+        self.leader = leader
+        self.route = [name, "e1"]
+
+
+class _Lane:
+    __slots__ = ("cars", "length")
+
+    def __init__(self, cars, length):
+        self.cars = cars
+        self.length = length
+
+
+def _setup() -> Path:
+    # Records are only made of V2Sim classes; the classes of this test are added for the test
+    checkpoint._SPLIT_MODULES = ("v2sim.", _Car.__module__)
+    return Path(tempfile.mkdtemp())
+
+def _teardown(folder: Path):
+    checkpoint._SPLIT_MODULES = ("v2sim.",)
+    shutil.rmtree(folder, ignore_errors=True)
+
+def test_checkpoint_roundtrip():
+    folder = _setup()
+    try:
+        cars = [_Car(f"v{i}", i / 10) for i in range(25)]
+        for a, b in zip(cars[1:], cars):
+            a.leader = b
+        cars[3].trips = 2**70 # Too large for a column
+        lane = _Lane(cars, 120.5)
+        stats = save_checkpoint(folder, {"lane": lane, "first": cars[0], "n": 25}, chunk_size=10)
+        assert is_checkpoint(folder) and stats.records == 26 and stats.chunks == 4
+        root = load_checkpoint(folder)
+        l2 = root["lane"]
+        assert isinstance(l2, _Lane) and l2.length == 120.5 and root["first"] is l2.cars[0]
+        for c, c2 in zip(cars, l2.cars):
+            assert (c.name, c.soc, c.trips, c.parked, c.route) == (c2.name, c2.soc, c2.trips, c2.parked, c2.route)
+        assert all(a.leader is b for a, b in zip(l2.cars[1:], l2.cars)) and l2.cars[0].leader is None
+    finally:
+        _teardown(folder)
+
+def test_checkpoint_incremental():
+    folder = _setup()
+    try:
+        cars = [_Car(f"v{i}", 0.5) for i in range(40)]
+        assert save_checkpoint(folder, cars, chunk_size=10).chunks_written == 4
+        files = set(p.name for p in folder.iterdir())
+        assert save_checkpoint(folder, cars, chunk_size=10).chunks_written == 0
+        assert set(p.name for p in folder.iterdir()) == files
+        cars[35].soc = 0.4
+        stats = save_checkpoint(folder, cars, chunk_size=10)
+        assert stats.chunks_written == 1 and stats.chunks == 4
+        # Replaced chunks are removed
+        assert len(list(folder.glob("*.npy"))) == 4
+        assert load_checkpoint(folder)[35].soc == 0.4
+    finally:
+        _teardown(folder)
+
+def test_checkpoint_deep_chain():
+    folder = _setup()
+    try:
+        head = None
+        for i in range(20000): # Far deeper than the recursion limit
+            head = _Car(f"v{i}", 1.0, head)
+        # Each record only discovers the next one, and chunks are still filled
+        assert save_checkpoint(folder, head, chunk_size=1000).chunks == 20
+        car, n = load_checkpoint(folder), 0
+        while car is not None:
+            car, n = car.leader, n + 1
+        assert n == 20000
+    finally:
+        _teardown(folder)
+
+def test_checkpoint_columns():
+    folder = _setup()
+    try:
+        cars = [_Car(f"v{i}", i / 4) for i in range(30)]
+        cars[12].parked = True
+        save_checkpoint(folder, cars, chunk_size=8)
+        cols = load_columns(folder, f"{_Car.__module__}:_Car")
+        assert set(cols.dtype.names) >= {"soc", "trips", "parked"} and "name" not in cols.dtype.names
+        assert np.allclose(cols["soc"], [i / 4 for i in range(30)])
+        assert np.flatnonzero(cols["parked"]).tolist() == [12]
+    finally:
+        _teardown(folder)
+
+def _snapshot(inst):
+    ti = inst.core
+    return ti.current_time, [(k, int(v._sta), v._energy, v.odometer, v._cs) for k, v in ti._vehs.items()]
+
+def test_checkpoint_resume():
+    from v2sim import V2SimInstance, TimeConfig
+    from v2sim.core import LoadStateOption
+    from v2sim.gen import TrafficGenerator
+    folder = Path(tempfile.mkdtemp())
+    try:
+        case = folder / "case"
+        shutil.copytree("cases/ux_37nodes", case)
+        TrafficGenerator(str(case), silent=True).VTripsFromArgs("-n 300 -day 1 -seed 1")
+        tc = TimeConfig(0, 10, 86400)
+        # The v2g plugin holds an open file, which cannot be saved
+        a = V2SimInstance.from_project(str(case), tc, 86400, str(folder / "a"), 1, True, disabled_plugins=["v2g"])
+        a.start()
+        a.step_until(28800)
+        a.save(folder / "state")
+        assert is_checkpoint(folder / "state" / "traffic") and is_checkpoint(folder / "state" / "plugins")
+        saved = _snapshot(a)
+        a.step_until(32400)
+        assert _snapshot(a)[1] != saved[1] # Vehicles moved after saving
+        b = V2SimInstance.from_project(str(case), tc, 86400, str(folder / "b"), 1, True, disabled_plugins=["v2g"],
+            state_option=LoadStateOption.FromGiven, state_dir=str(folder / "state"))
+        b.start()
+        assert b.core.current_time == 28800
+        b.step_until(32400)
+        # The resumed run continues exactly like the uninterrupted one
+        assert _snapshot(a) == _snapshot(b)
+        a.stop(); b.stop()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def _run_procworlds(worlds, until, arrivals):
+    for PW in worlds:
+        PW.exec_simulation(until)
+    for PW, arr in zip(worlds, arrivals):
+        for veh_id, veh in PW.get_arrived_vehicles():
+            route, ts = veh.traveled_route()
+            arr.append((veh_id, [l.name for l in route.links], ts))
+
+def test_checkpoint_procworlds():
+    import random
+    import cloudpickle
+    from v2sim import RoadNet
+    rn = RoadNet.load("cases/ux_37nodes/ux_37nodes.net.xml")
+    folder = Path(tempfile.mkdtemp())
+    worlds = []
+    try:
+        a = rn.create_procworlds(tmax=7200, deltan=1, reaction_time=10, random_seed=0,
+            vehicle_logging_timestep_interval=-1, hard_deterministic_mode=True)
+        worlds.append(a)
+        assert a.world_count > 1
+        rnd = random.Random(0)
+        nodes = sorted(a.node_coords)
+        arrivals = [[]]
+        for i in range(100):
+            a.add_vehicle(f"v{i}", *rnd.sample(nodes, 2))
+        for t in range(10, 910, 10):
+            _run_procworlds(worlds, t, arrivals)
+        save_checkpoint(folder, a)
+        # One checkpoint per world in a subfolder
+        for wid in range(a.world_count):
+            assert is_checkpoint(folder / f"world{wid}")
+        files = {p.relative_to(folder) for p in folder.rglob("*")}
+        assert save_checkpoint(folder, a).chunks_written == 0
+        assert {p.relative_to(folder) for p in folder.rglob("*")} == files
+        # Resumed from the folder and from an in-memory copy
+        worlds.append(load_checkpoint(folder))
+        worlds.append(cloudpickle.loads(cloudpickle.dumps(a)))
+        arrivals = [[] for _ in worlds]
+        for i in range(100, 150):
+            O, D = rnd.sample(nodes, 2)
+            for PW in worlds: PW.add_vehicle(f"v{i}", O, D)
+        for t in range(910, 2410, 10):
+            _run_procworlds(worlds, t, arrivals)
+        # The resumed worlds continue exactly like the uninterrupted one
+        assert len(arrivals[0]) > 0
+        assert arrivals[0] == arrivals[1] == arrivals[2]
+        assert worlds[0].get_running_vehicle_count() == worlds[1].get_running_vehicle_count() == worlds[2].get_running_vehicle_count()
+    finally:
+        for PW in worlds: PW.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,69 @@
+import random
+import numpy as np
+from v2sim import RoadNet
+from v2sim.partition import TripFlows, partition_nodes
+
+def _net():
+    return RoadNet.load("cases/ux_12nodes/ux_12nodes.net.xml")
+
+def _flows(rn: RoadNet):
+    rnd = random.Random(0)
+    ns = [n for n in rn.nodes if n.startswith("T")]
+    od = {}
+    for _ in range(200):
+        o, d = rnd.sample(ns, 2)
+        od[(o, d)] = od.get((o, d), 0) + 1
+    return TripFlows.from_od(rn, od)
+
+def test_trip_flows():
+    rn = _net()
+    # T1 -> T4 -> T8 -> T9 (16 km) is the shortest route from T1 to T9, and gneE0 goes from T1 to T2 directly
+    fl = TripFlows.from_od(rn, {("T1", "T9"): 10, ("T1", "T2"): 4}, hours=2)
+    flow = dict(zip(fl.edge_ids, fl.flow.tolist()))
+    through = dict(zip(fl.edge_ids, fl.through.tolist()))
+    assert {e: f for e, f in flow.items() if f > 0} == {"gneE18": 10, "gneE39": 10, "gneE27": 10, "gneE0": 4}
+    assert {e: f for e, f in through.items() if f > 0} == {"gneE18": 10, "gneE39": 10}
+    turns = {(fl.edge_ids[a], fl.edge_ids[b]): c for a, b, c in zip(fl.turn_from, fl.turn_to, fl.turn_count)}
+    assert turns == {("gneE18", "gneE39"): 10, ("gneE39", "gneE27"): 10}
+    assert fl.trips == 14 and fl.unrouted == 0 and fl.hours == 2
+    assert abs(fl.edge_load().sum() - 2 * len(fl.edge_ids)) < 1e-9
+
+def test_partition_stats():
+    rn = _net()
+    # T1 ~ T6 and their stations in partition 0, the others in partition 1
+    side = {n: 0 if int(n.lstrip("CST")) <= 6 else 1 for n in rn.nodes}
+    for e in rn.edges.values():
+        e.world_id = side[e.from_node.name]
+    fl = TripFlows.from_od(rn, {("T1", "T9"): 10, ("T1", "T2"): 4}, hours=2)
+    st = rn.partition_stats(fl)
+    # Edges between T3-T7, T4-T8, T5-T9 and T6-T10 in both directions
+    assert st.parts == 2 and st.edge_cut == 8
+    # Trips from T1 to T9 are handed over once, from gneE39 (T4 -> T8) to gneE27 (T8 -> T9)
+    assert st.transfers_per_hour == 5.0
+    assert abs(sum(st.loads.values()) - 2 * len(rn.edges)) < 1e-9
+    assert abs(st.imbalance - (max(st.loads.values()) / len(rn.edges) - 1)) < 1e-9
+    st = rn.partition_stats()
+    assert st.transfers_per_hour is None
+    assert st.loads == {w: float(sum(1 for e in rn.edges.values() if e.world_id == w)) for w in (0, 1)}
+
+def test_multilevel_partition():
+    rn = _net()
+    fl = _flows(rn)
+    for k in (2, 3, 4):
+        for imbalance in (0.03, 0.1):
+            parts = partition_nodes(rn, k, fl, imbalance, seed=0)
+            assert set(parts.keys()) == set(rn.nodes)
+            assert all(0 <= p < k for p in parts.values())
+            # The same seed gives the same partition
+            assert partition_nodes(rn, k, fl, imbalance, seed=0) == parts
+            rn.partition_roadnet(k, "multilevel", fl, imbalance, seed=0)
+            assert all(e.world_id == parts[e.from_node.name] for e in rn.edges.values())
+            st = rn.partition_stats(fl)
+            assert st.parts == k
+            assert st.imbalance <= imbalance + 1e-9
+    # Without trips, the number of edges is balanced
+    rn.partition_roadnet(2, "multilevel", None, 0.03, seed=0)
+    st = rn.partition_stats()
+    assert st.imbalance <= 0.03 + 1e-9
+    cnt = np.bincount([e.world_id for e in rn.edges.values()])
+    assert abs(cnt.max() / cnt.mean() - 1 - st.imbalance) < 1e-9
@@ -0,0 +1,60 @@
+import os, random, tempfile
+from v2sim import RoadNet
+from v2sim.sim.uxworld import RebalanceConfig
+
+def _run(rebalance: RebalanceConfig, seconds: int = 1800, drain: int = 5400):
+    rn = RoadNet.load("cases/ux_12nodes/ux_12nodes.net.xml")
+    # T1 ~ T6 and their stations in world 0, the others in world 1
+    for e in rn.edges.values():
+        e.world_id = 0 if int(e.from_node.name.lstrip("CST")) <= 6 else 1
+    W = rn.create_paraworlds(rebalance=rebalance, tmax=seconds + drain + 10, deltan=1, reaction_time=1,
+        random_seed=0, vehicle_logging_timestep_interval=-1, hard_deterministic_mode=True)
+    W.exec_simulation(0)
+    # All trips are in world 0
+    nodes = ["T1", "T2", "T3", "T4", "T5", "T6"]
+    rnd = random.Random(0)
+    added = 0
+    arrived = []
+    for t in range(10, seconds + drain + 1, 10):
+        if t <= seconds:
+            for _ in range(3):
+                o, d = rnd.sample(nodes, 2)
+                W.add_vehicle(f"v{added}", o, d)
+                added += 1
+        W.exec_simulation(t)
+        arrived.extend((t, veh_id) for veh_id, _ in W.get_arrived_vehicles())
+    W.shutdown()
+    return W, rn, added, arrived
+
+def test_rebalance():
+    log = tempfile.mktemp(suffix=".csv")
+    try:
+        W, rn, added, arrived = _run(RebalanceConfig(interval=300, threshold=1.1, log_file=log))
+        migs = W.migrations
+        assert len(migs) > 0
+        # World 0 hands edges over first
+        assert migs[0].src == 0 and migs[0].dst == 1
+        with open(log, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert len(lines) == len(migs) + 1
+        assert lines[1].split(",")[:4] == [str(migs[0].time), migs[0].edge, "0", "1"]
+
+        # A migrated edge admits inflow in the world of its last migration only, and the old copy is detached once left
+        owner = {m.edge: m.dst for m in migs}
+        for edge, wid in owner.items():
+            assert W.wid_of_edges[edge] == wid
+            new, old = W[wid].get_link(edge), W[1 - wid].get_link(edge)
+            assert new.capacity_in > 0 and old.capacity_in == 0
+            assert edge in new.start_node.outlinks
+            assert len(old.vehicles) == 0 and edge not in old.start_node.outlinks
+
+        # No vehicle is lost or arrives twice
+        ids = [veh_id for _, veh_id in arrived]
+        assert len(ids) == added and len(set(ids)) == added
+
+        # Replaying the log gives the same arrivals
+        W2, _, added2, arrived2 = _run(RebalanceConfig(interval=300, threshold=1.1, replay=log))
+        assert [m[:4] for m in W2.migrations] == [m[:4] for m in migs]
+        assert added2 == added and arrived2 == arrived
+    finally:
+        if os.path.exists(log): os.remove(log)
@@ -0,0 +1,227 @@
+import random, shutil, tempfile
+import numpy as np
+from pathlib import Path
+from v2sim import RoadNet
+from v2sim.sim.ch import ContractionHierarchy, CH_FILE_SUFFIX
+from v2sim.sim.routing import CSRGraph, ReverseTable, RouteCache, Stage, dijMF, dijMC, dijMS, astarF, astarMF, astarMC
+
+class _Link:
+    def __init__(self, name, length, tt):
+        self.name = name
+        self.length = length
+        self.tt = tt
+
+    def instant_travel_time(self, t):
+        return self.tt
+
+def _line_graph():
+    # a -> b -> c, and a -> c directly
+    links = {n: _Link(n, 100., 10.) for n in ("ab", "bc", "ac")}
+    gl = {"a": [("b", links["ab"]), ("c", links["ac"])], "b": [("c", links["bc"])], "c": []}
+    return CSRGraph(gl), links
+
+def _world():
+    rn = RoadNet.load("cases/ux_37nodes/ux_37nodes.net.xml")
+    W = rn.create_singleworld(tmax=3600, deltan=1, reaction_time=1, random_seed=0,
+        print_mode=0, vehicle_logging_timestep_interval=-1)
+    W.exec_simulation(600)
+    return W
+
+def test_astar_alt():
+    W = _world()
+    cg = W.get_cgl(); co = W.get_coords()
+    assert len(cg.landmarks()) > 0
+    rnd = random.Random(0)
+    nodes = cg.node_ids
+    for _ in range(200):
+        O = rnd.choice(nodes)
+        Ds = rnd.sample(nodes, 4)
+        r1 = dijMF(cg, 600, O, {Ds[0]})
+        r2 = astarF(cg, co, 600, O, Ds[0])
+        assert abs(r1.travelTime - r2.travelTime) < 1e-6 or r1.travelTime == r2.travelTime
+        if len(r2.nodes) > 0:
+            assert r2.nodes[0] == O and r2.nodes[-1] == Ds[0]
+
+        r1 = dijMF(cg, 600, O, set(Ds))
+        r2 = astarMF(cg, co, 600, O, set(Ds), 10.0)
+        assert abs(r1.travelTime - r2.travelTime) < 1e-6 or r1.travelTime == r2.travelTime
+
+        scores = {d: rnd.random() * 10 for d in Ds}
+        r1 = dijMC(cg, 600, O, 0.5, Ds, scores)
+        r2 = astarMC(cg, co, 600, O, 0.5, Ds, scores)
+        assert len(r1.nodes) == len(r2.nodes) == 0 or abs(
+            (0.5 * r1.travelTime / 60 + scores[r1.nodes[-1]]) -
+            (0.5 * r2.travelTime / 60 + scores[r2.nodes[-1]])
+        ) < 1e-6
+
+def test_reverse_table():
+    W = _world()
+    cg = W.get_cgl()
+    rnd = random.Random(0)
+    nodes = cg.node_ids
+    Ds = rnd.sample(nodes, 5)
+    scores = {d: rnd.random() * 10 for d in Ds}
+    rt = ReverseTable(cg, 600, Ds)
+    score = lambda r: 0.5 * r.travelTime / 60 + scores[r.nodes[-1]]
+    fallback = 0
+    for O in rnd.sample(nodes, 20):
+        r1 = dijMC(cg, 600, O, 0.5, Ds, scores)
+        r2 = rt.best(O, 0.5, scores)
+        assert r2 is not None
+        assert len(r1.nodes) == len(r2.nodes) == 0 or abs(score(r1) - score(r2)) < 1e-6
+        if len(r2.nodes) == 0: continue
+        assert r2.nodes[0] == O and r2.nodes[-1] in Ds
+        assert abs(r2.length - sum(cg._len[cg.edge_index[e]] for e in r2.edges)) < 1e-6
+        if r2.length == 0: continue
+        # The best station is longer than max_length: the caller falls back to dijMC
+        max_len = r2.length - 1
+        assert rt.best(O, 0.5, scores, max_len) is None
+        r3 = dijMC(cg, 600, O, 0.5, Ds, scores, max_len)
+        assert len(r3.nodes) == 0 or (r3.length <= max_len and score(r3) >= score(r2) - 1e-6)
+        fallback += 1
+    assert fallback > 0
+
+def test_speed_change():
+    # Landmarks built before a speed increase must not be used for the faster links
+    W = _world()
+    cg = W.get_cgl(); co = W.get_coords()
+    cg.landmarks()
+    for link in W.links():
+        W.change_free_flow_speed(link.name, link.free_flow_speed * 3)
+    W.exec_simulation(1200)
+    for link in W.links():
+        assert abs(cg.fftt[cg.edge_index[link.name]] - link.length / link.free_flow_speed) < 1e-9
+    rnd = random.Random(0)
+    nodes = cg.node_ids
+    for _ in range(200):
+        O, D = rnd.sample(nodes, 2)
+        r1 = dijMF(cg, 1200, O, {D})
+        r2 = astarF(cg, co, 1200, O, D)
+        assert abs(r1.travelTime - r2.travelTime) < 1e-6 or r1.travelTime == r2.travelTime
+
+def test_late_dest():
+    # A destination tracked late gets the same DUO preferences as one tracked from the start
+    rn = RoadNet.load("cases/ux_37nodes/ux_37nodes.net.xml")
+    worlds = []
+    for eager in (True, False):
+        W = rn.create_singleworld(tmax=3600, deltan=1, reaction_time=1, random_seed=0,
+            print_mode=0, vehicle_logging_timestep_interval=-1, hard_deterministic_mode=True)
+        W.exec_simulation(0)
+        if eager:
+            for n in W.world.NODES: W.world.ROUTECHOICE.route_pref[n.id]
+        worlds.append(W.world)
+    for step in range(6):
+        for w in worlds:
+            # Closed links change the shortest paths between the searches
+            for i, l in enumerate(w.LINKS):
+                l.capacity_in = 0 if (i + step) % 5 == 0 else 1
+            w.ROUTECHOICE.route_search_all(0)
+            w.ROUTECHOICE.homogeneous_DUO_update()
+        if step == 3:
+            for n in worlds[1].NODES[:10]: worlds[1].ROUTECHOICE.route_pref[n.id]
+    ra, rb = worlds[0].ROUTECHOICE.route_pref.rows, worlds[1].ROUTECHOICE.route_pref.rows
+    assert len(rb) == 10
+    for k in rb:
+        assert (ra[k] == rb[k]).all()
+
+def test_route_cache():
+    cg, links = _line_graph()
+    route = Stage(["a", "b", "c"], ["ab", "bc"], 20., 200.)
+    rc = RouteCache(bucket=900, max_entries=2, tolerance=0.2)
+    assert rc.get(cg, 0, "a", "c", True) is None
+    rc.put(cg, 0, "a", "c", True, route)
+    # Not found routes are not cached
+    rc.put(cg, 0, "a", "b", True, Stage([], [], 0., 0.))
+    assert len(rc) == 1
+    ret = rc.get(cg, 10, "a", "c", True)
+    assert ret is not None and ret.edges == ["ab", "bc"] and ret.travelTime == 20.
+    # Routes are not shared across time buckets, nor between fastest and shortest queries
+    assert rc.get(cg, 900, "a", "c", True) is None
+    assert rc.get(cg, 10, "a", "c", False) is None
+    # Travel time drift within the tolerance is served with the current travel time
+    links["ab"].tt = 13.
+    ret = rc.get(cg, 20, "a", "c", True)
+    assert ret is not None and ret.travelTime == 23.
+    # Drift past the tolerance invalidates the route
+    links["ab"].tt = 20.
+    assert rc.get(cg, 30, "a", "c", True) is None
+    assert len(rc) == 0
+    # A shortest route is not invalidated by drift
+    rc.put(cg, 30, "a", "c", False, route)
+    links["ab"].tt = 100.
+    assert rc.get(cg, 40, "a", "c", False) is not None
+    assert rc.stats() == {"size": 1, "hits": 3, "misses": 4, "evictions": 0, "invalidations": 1}
+
+def test_route_cache_lru():
+    cg, _ = _line_graph()
+    rc = RouteCache(bucket=900, max_entries=2)
+    r1 = Stage(["a", "c"], ["ac"], 10., 100.)
+    r2 = Stage(["a", "b"], ["ab"], 10., 100.)
+    r3 = Stage(["b", "c"], ["bc"], 10., 100.)
+    rc.put(cg, 0, "a", "c", True, r1)
+    rc.put(cg, 0, "a", "b", True, r2)
+    # Using a route makes it the most recently used one, so the other one is evicted
+    assert rc.get(cg, 0, "a", "c", True) is not None
+    rc.put(cg, 0, "b", "c", True, r3)
+    assert len(rc) == 2 and rc.evictions == 1
+    assert rc.get(cg, 0, "a", "b", True) is None
+    assert rc.get(cg, 0, "a", "c", True) is not None
+    assert rc.get(cg, 0, "b", "c", True) is not None
+    rc.clear()
+    assert len(rc) == 0 and rc.hits == 3
+
+def test_ch_query():
+    W = _world()
+    cg = W.get_cgl()
+    ch = ContractionHierarchy.build(cg)
+    rnd = random.Random(0)
+    nodes = cg.node_ids
+    for _ in range(200):
+        O = rnd.choice(nodes)
+        Ds = set(rnd.sample(nodes, 3))
+        r1 = dijMS(cg, 600, O, Ds)
+        r2 = ch.query(cg, 600, O, Ds)
+        assert len(r1.nodes) == len(r2.nodes) == 0 or abs(r1.length - r2.length) < 1e-6
+        if len(r2.nodes) > 0:
+            assert r2.nodes[0] == O and r2.nodes[-1] in Ds
+            # The route is made of original edges and connected
+            for e, u, v in zip(r2.edges, r2.nodes, r2.nodes[1:]):
+                k = cg.edge_index[e]
+                assert cg.node_ids[cg._src[k]] == u and cg.node_ids[cg._tgt[k]] == v
+            assert abs(r2.travelTime - sum(cg.travel_times(600)[cg.edge_index[e]] for e in r2.edges)) < 1e-6
+
+def test_ch_persist():
+    W = _world()
+    cg = W.get_cgl()
+    folder = Path(tempfile.mkdtemp())
+    try:
+        net = folder / "ux_37nodes.net.xml"
+        shutil.copy("cases/ux_37nodes/ux_37nodes.net.xml", net)
+        path = folder / (net.name + CH_FILE_SUFFIX)
+        builds = []
+        build = ContractionHierarchy.build
+        def counted_build(*args, **kwargs):
+            builds.append(1)
+            return build(*args, **kwargs)
+        ContractionHierarchy.build = staticmethod(counted_build)
+        try:
+            ch1 = ContractionHierarchy.load_or_build(net, cg)
+            assert path.is_file() and len(builds) == 1
+            # Loaded from the file as long as the network is unchanged
+            ch2 = ContractionHierarchy.load_or_build(net, cg)
+            assert len(builds) == 1
+            assert ch2.net_hash == ch1.net_hash and ch2.node_ids == ch1.node_ids and ch2.edge_ids == ch1.edge_ids
+            for a, b in zip(ch1.up + ch1.down, ch2.up + ch2.down):
+                assert np.array_equal(a, b)
+            assert np.array_equal(ch1.rank, ch2.rank) and np.array_equal(ch1.arc_child, ch2.arc_child)
+            # Rebuilt once the network file changes
+            with open(net, "a") as f:
+                f.write("\n<!-- changed -->\n")
+            ch3 = ContractionHierarchy.load_or_build(net, cg)
+            assert len(builds) == 2 and ch3.net_hash != ch1.net_hash
+            ContractionHierarchy.load_or_build(net, cg)
+            assert len(builds) == 2
+        finally:
+            ContractionHierarchy.build = staticmethod(build)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -1,5 +1,6 @@
+import numpy as np
 from v2sim import *
-from feasytools import SegFunc
+from feasytools import RangeList, SegFunc
 
 def test_gs():
     gs1 = GS("gs1", "node1", 6, 100.0, 200.0, ConstPriceGetter(1.0), None, 0.7)
@@ -58,4 +59,167 @@ def test_cs():
     for ev in ret2:
         assert ev._energy >= ev._etar
     for ev in evs[5:7]:
-        assert ev not in cs1, f"{ev._name} should have been removed"
\ No newline at end of file
+        assert ev not in cs1, f"{ev._name} should have been removed"
+
+def test_update_parallel():
+    def make_hub():
+        cs_list = [UniCS(f"cs{i}", f"n{i}", 2, "b1", 0.0, 0.0, CSType.FCS, 300.0, 0.0, ConstPriceGetter(1.0)) for i in range(7)]
+        hub = FCSHub(cs_list)
+        for i in range(28):
+            hub.add_veh(EV(f"e{i}", VehType.Private, 60, 0.5 + 0.01 * i, 0.2, 0.9, 0.9, 0.9, 300, 7, 20, 1, 0.9, 0.2, 0.6, 0.8, [], {}), i % 7)
+        return hub
+    h1 = make_hub(); h2 = make_hub()
+    for t in range(0, 3600, 300):
+        r1 = h1.update(300, t, 1.0, 1.0)
+        r2 = h2.update_parallel(300, t, 1.0, 1.0, 3)
+        assert [ev._name for ev in r1] == [ev._name for ev in r2]
+        assert h1.get_Pc() == h2.get_Pc()
+    assert len(h1._veh) == len(h2._veh) == 0
+    h2.close_pool()
+
+def test_fleet():
+    ChargeRatePool.add("Half", _half_rate)
+    ChargeRatePool.add_curve("Taper", [0.0, 0.5, 0.9, 1.0], [0.8, 1.0, 0.6, 0.1])
+    def make():
+        cs_list = [
+            UniCS("f1", "n1", 3, "b1", 0.0, 0.0, CSType.FCS, 120.0 / 3600, 0.0, ConstPriceGetter(1.2)),
+            UniCS("s1", "n2", 4, "b1", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 0.0, ConstPriceGetter(0.8), pc_alloc="Prioritized"),
+            BiCS("s2", "n3", 4, "b1", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 7.0 / 3600, ConstPriceGetter(0.6), price_sell=ConstPriceGetter(1.5)),
+            BiCS("f2", "n4", 2, "b1", 0.0, 0.0, CSType.FCS, 60.0 / 3600, 30.0 / 3600, ConstPriceGetter(1.0), price_sell=ConstPriceGetter(1.1)),
+        ]
+        rmods = ["Linear", "Equal", "Half", "Taper"]
+        evs = [EV(f"e{i}", VehType.Private, 50 + i, 0.3 + 0.04 * i, 0.2, 0.9, 0.92, 0.93, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6, [], {},
+            rmod=rmods[i % 4], max_sc_cost=1.0 if i % 4 else 0.5,
+            sc_time=RangeList([(0, 1800), (3000, 7200)]) if i % 5 == 1 else None,
+            v2g_time=RangeList([(600, 2400)]) if i % 2 else None) for i in range(16)]
+        hub = MixedHub(cs_list[:1] + cs_list[3:], cs_list[1:3], [])
+        return hub, evs
+    h1, e1 = make()
+    h2, e2 = make()
+    fleet = EVFleet(e2, min_batch=1)
+    h2.attach_fleet(fleet)
+    assert len(fleet) == 16 and all(ev in fleet for ev in e2)
+    for hub, evs in ((h1, e1), (h2, e2)):
+        for i, ev in enumerate(evs):
+            if i < 5: hub.fcs.add_veh(ev, i % 2)
+            else: hub.scs.add_veh(ev, i % 2)
+        for i, ev in enumerate(evs):
+            ev.set_leave_at_etar(i % 3 == 0)
+    for t in range(0, 7200, 60):
+        res = []
+        for hub in (h1, h2):
+            hub.scs.get_V2G_cap(t); hub.fcs.get_V2G_cap(t)
+            hub.scs.set_V2G_demand([0.0, 0.002 if t < 3600 else 0.0])
+            hub.fcs.set_V2G_demand([0.0, 0.004])
+            r = hub.fcs.update(60, t, 0.5, 0.9) + hub.scs.update(60, t, 0.5, 0.9)
+            res.append([ev.name for ev in r])
+        assert res[0] == res[1]
+        for c1, c2 in zip(h1, h2):
+            assert abs(c1.Pc - c2.Pc) < 1e-9 and abs(c1.Pd - c2.Pd) < 1e-9
+            assert abs(c1.revenue - c2.revenue) < 1e-9 and abs(c1.cost - c2.cost) < 1e-9
+        for a, b in zip(e1, e2):
+            assert abs(a.E - b.E) < 1e-9 and abs(a._cost - b._cost) < 1e-9 and abs(a._earn - b._earn) < 1e-9
+    assert any(ev._earn > 0 for ev in e2)
+    assert fleet.rmod.tolist().count(-1) == 4
+
+def test_charge_rate_curve():
+    soc = np.linspace(0.0, 1.0, 101)
+    ev = EV("e", VehType.Private, 50, 0.5, 0.2, 0.9, 0.9, 0.9, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6, [], {})
+    scalar = ChargeRatePool.get("Linear")
+    vector = ChargeRatePool.get_vector("Linear")
+    assert vector is not None
+    expected = []
+    for s in soc:
+        ev._energy = s * ev._cap
+        expected.append(scalar(2.0, ev))
+    assert np.allclose(vector(np.full(len(soc), 2.0), soc), expected, rtol=0, atol=1e-12)
+    ChargeRatePool.add("Half", _half_rate)
+    assert ChargeRatePool.get_vector("Half") is None
+
+def _half_rate(rate: float, ev: EV) -> float:
+    return rate * 0.5
+
+def test_batch_alloc():
+    cs = UniCS("s1", "n1", 30, "b1", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 0.0, ConstPriceGetter(1.0))
+    evs = [EV(f"e{i}", VehType.Private, 50, 0.3, 0.2, 0.9, 0.9, 0.9, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6,
+        [Trip(f"t{i}", 3600 * (i % 5), "a", "b")], {}) for i in range(30)]
+    for ev in evs: cs.add_veh(ev)
+    chi = list(cs._chi)
+    for t in (0, 7200):
+        for name in ("Average", "Prioritized", "TimeBased"):
+            for tot in (float("inf"), 0.03, 1e-3):
+                func = MaxPCAllocPool.get(name)
+                func(AllocEnv(cs, chi, t), len(chi), 7.0 / 3600, tot)
+                expected = [ev._EV__tmp_pc_max for ev in chi]
+                pc = MaxPCAllocPool.batch_of(func)(AllocEnv(cs, chi, t), 7.0 / 3600, tot)
+                assert pc is not None and np.allclose(pc, expected, rtol=1e-12, atol=1e-15)
+    pd = V2GAllocPool.batch_of(V2GAllocPool.get("Average"))(AllocEnv(cs, chi, 0), 0.01, 1.0)
+    assert pd is not None and np.allclose(pd, 0.01 / len(chi))
+    # Legacy allocators set the power themselves, and batched ones can be used as legacy allocators
+    assert MaxPCAllocPool.batch_of(_half_pile)(AllocEnv(cs, chi, 0), 0.002, 1.0) is None
+    assert all(ev._EV__tmp_pc_max == 0.001 for ev in chi)
+    MaxPCAllocPool.add_batch("HalfBatch", lambda env, pc0, tot: np.full(env.count, pc0 / 4))
+    MaxPCAllocPool.get("HalfBatch")(AllocEnv(cs, chi, 0), len(chi), 0.002, 1.0)
+    assert all(ev._EV__tmp_pc_max == 0.0005 for ev in chi)
+
+def _half_pile(env: AllocEnv, vcnt: int, max_pc0: float, max_pc_tot: float):
+    for ev in env.EVs: ev.set_temp_max_pc(max_pc0 / 2)
+
+def test_aggregates():
+    CS.check_aggregates = True
+    try:
+        cs_list = [
+            UniCS("f1", "n1", 3, "b1", 0.0, 0.0, CSType.FCS, 120.0 / 3600, 0.0, ConstPriceGetter(1.2)),
+            BiCS("s1", "n2", 4, "b1", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 7.0 / 3600, ConstPriceGetter(0.6), price_sell=ConstPriceGetter(1.5)),
+        ]
+        evs = [EV(f"e{i}", VehType.Private, 50 + i, 0.3 + 0.04 * i, 0.2, 0.9, 0.92, 0.93, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6, [], {})
+            for i in range(12)]
+        hub = MixedHub(cs_list[:1], cs_list[1:], [])
+        for i, ev in enumerate(evs):
+            if i < 5: hub.fcs.add_veh(ev, 0)
+            else: hub.scs.add_veh(ev, 0)
+            ev.set_leave_at_etar(i % 3 == 0)
+        for t in range(0, 7200, 60):
+            hub.scs.get_V2G_cap(t)
+            hub.scs.set_V2G_demand([0.002 if t < 3600 else 0.0])
+            hub.fcs.update(60, t, 0.5, 0.9); hub.scs.update(60, t, 0.5, 0.9)
+            if t == 1800: hub.scs.pop_veh(evs[6]); hub.scs.pop_veh(evs[11])
+            for cs in cs_list:
+                vehs = list(cs.vehicles())
+                assert abs(cs.averageSOC() - (sum(ev.soc for ev in vehs) / len(vehs) if vehs else 0.0)) < 1e-9
+                assert cs.V2G_pmax >= 0
+        assert len(hub.fcs[0]) < 5
+    finally:
+        CS.check_aggregates = False
+
+def test_price_snapshot():
+    func = SegFunc([0, 3600, 7200, 36000], [0.5, 1.0, 0.8, 1.2])
+    pg = ToUPriceGetter(func)
+    ts = list(range(0, 50000, 300)) + [100, 40000, 3600, 3599, 0, 86400]
+    assert [pg.get_price(t, None, None) for t in ts] == [func(t) for t in ts] # type: ignore
+    cs = UniCS("s1", "n1", 3, "b1", 0.0, 0.0, CSType.SCS, 7.0 / 3600, 0.0, pg)
+    ev = EV("e", VehType.Private, 50, 0.5, 0.2, 0.9, 0.9, 0.9, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6, [], {})
+    assert not cs.pbuy_vehicle_dependent
+    assert cs.pbuy(4000, ev) == 1.0 and cs.pbuy(8000, ev) == 0.8
+    pg.set(2.0)
+    assert not cs.pbuy_vehicle_dependent and cs.pbuy(8000, ev) == 2.0
+    pg.clear()
+    assert cs.pbuy(8000, ev) == 0.8
+    soc_pg = ToUSoCPriceGetter(func, 0.4, 0.3)
+    assert soc_pg.vehicle_dependent and abs(soc_pg(4000, cs, ev) - 1.3) < 1e-12
+
+def test_willingness_timeline():
+    windows = [None, [(0, 1800)], [(600, 2400), (3000, 3600)], [(100, 200), (150, 400)], []]
+    evs = [EV(f"e{i}", VehType.Private, 50, 0.3 + 0.05 * i, 0.2, 0.9, 0.9, 0.9, 120, 7, 7, 1, 0.9, 0.2, 0.5, 0.6, [], {},
+        sc_time=windows[i % 5], v2g_time=windows[(i + 2) % 5], min_v2g_earn=0.5 * (i % 3)) for i in range(12)]
+    fleet = EVFleet(evs)
+    slots = fleet.slots_of(evs)
+    assert slots is not None
+    for t in list(range(0, 4000, 50)) + [1000, 120, 3700]:
+        for c in (0.5, 2.0):
+            exp = [ev.willing_to_slow_charge(t, c) for ev in evs]
+            assert fleet.willing_to_slow_charge(slots, t, c).tolist() == exp
+            exp = [ev.willing_to_v2g(t, c) for ev in evs]
+            assert fleet.willing_to_v2g(slots, t, c).tolist() == exp
+    evs[0]._sc_time = RangeList([(0, 10)])
+    assert not fleet.willing_to_slow_charge(slots, 3700, 0.0)[0]
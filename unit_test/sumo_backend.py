@@ -0,0 +1,206 @@
+import shutil, tempfile
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+from v2sim.sim import sumo_backend
+from v2sim.sim.sumo_backend import SUMOSingleBackend
+
+VAR_DISTANCE, VAR_ROAD_ID, VAR_POSITION = 0x84, 0x50, 0x42
+
+class _FakeLibsumo:
+    """Stand-in for libsumo. Vehicles drive 10 m per second along edge e0, and every API call is counted."""
+    def __init__(self, departs):
+        self.calls = Counter()
+        self.t = 0
+        self.departs = departs # vehicle id -> (depart time, arrival time)
+        self.subs = set()
+        self.constants = SimpleNamespace(VAR_DISTANCE=VAR_DISTANCE, VAR_ROAD_ID=VAR_ROAD_ID, VAR_POSITION=VAR_POSITION)
+        c = self._counted
+        self.simulation = SimpleNamespace(getTime=c("getTime", lambda: self.t),
+            getArrivedIDList=c("getArrivedIDList", lambda: [v for v, (_, a) in self.departs.items() if self.prev < a <= self.t]),
+            getDepartedIDList=c("getDepartedIDList", lambda: [v for v, (d, _) in self.departs.items() if self.prev < d <= self.t]))
+        self.vehicle = SimpleNamespace(getIDList=c("getIDList", self._running),
+            getDistance=c("getDistance", self._dist), getRoadID=c("getRoadID", lambda v: "e0"),
+            getPosition=c("getPosition", lambda v: (self._dist(v), 0.0)),
+            subscribe=c("subscribe", self._subscribe),
+            getAllSubscriptionResults=c("getAllSubscriptionResults", self._results))
+        self.prev = -1
+
+    def _counted(self, name, func):
+        def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def _running(self):
+        return [v for v, (d, a) in self.departs.items() if d <= self.t < a]
+
+    def _dist(self, v):
+        return 10.0 * (min(self.t, self.departs[v][1]) - self.departs[v][0])
+
+    def _subscribe(self, v, var_ids):
+        assert tuple(var_ids) == (VAR_DISTANCE, VAR_ROAD_ID, VAR_POSITION)
+        self.subs.add(v)
+
+    def _results(self):
+        # Like libsumo, subscriptions of vehicles that left the network are dropped
+        self.subs &= set(self._running())
+        return {v: {VAR_DISTANCE: self._dist(v), VAR_ROAD_ID: "e0", VAR_POSITION: (self._dist(v), 0.0)} for v in self.subs}
+
+    def simulationStep(self, t):
+        self.prev = self.t; self.t = int(t)
+
+
+def _backend(api, track_running=True):
+    b = SUMOSingleBackend(snet=None, sumocfg_file="", net_file="", start_time=0, end_time=100, step_length=1,
+        routing_algo="dijkstra", seed=0, gui=False, mesosim=False, track_running=track_running)
+    b._api = api # type: ignore
+    b._tc = api.constants
+    b._sub_vars = (VAR_DISTANCE, VAR_ROAD_ID, VAR_POSITION)
+    return b
+
+def test_subscriptions():
+    departs = {f"v{i}": (i % 7 + 1, 20 + i % 11) for i in range(50)}
+    api = _FakeLibsumo(departs)
+    b = _backend(api)
+    for t in range(1, 40):
+        res = b.simulation_step(t)
+        running = [v for v, (d, a) in departs.items() if d <= t < a]
+        assert list(res.running) == running
+        for v in running:
+            assert res.running[v].distance == 10.0 * (t - departs[v][0])
+            assert res.running[v].road == "e0" and res.running[v].position == (res.running[v].distance, 0.0)
+        assert set(res.arrived) == {v for v, (_, a) in departs.items() if a == t}
+    # Running vehicles are read in bulk, only arrivals are queried one by one
+    assert api.calls["subscribe"] == len(departs)
+    assert api.calls["getAllSubscriptionResults"] == 39
+    assert api.calls["getDistance"] == len(departs)
+
+def test_no_tracking():
+    departs = {f"v{i}": (1, 10) for i in range(5)}
+    api = _FakeLibsumo(departs)
+    b = _backend(api, track_running=False)
+    for t in range(1, 5):
+        assert len(b.simulation_step(t).running) == 0
+    assert api.calls["subscribe"] == 0 and api.calls["getDistance"] == 0
+
+def test_unsubscribed_fallback():
+    departs = {"v0": (1, 10)}
+    api = _FakeLibsumo(departs)
+    b = _backend(api)
+    b.simulation_step(2)
+    api.subs.clear() # e.g. after loading a saved SUMO state
+    assert b.simulation_step(3).running["v0"].distance == 20.0
+    assert api.calls["subscribe"] == 2 and "v0" in api.subs
+    assert sumo_backend.SUMOStepResult is type(b.simulation_step(4))
+
+def test_traveltime_reporter():
+    edge_tt = {"a": 10.0, "b": 20.0, "c": 30.0}
+    cur = dict(edge_tt)
+    api = SimpleNamespace(edge=SimpleNamespace(getTraveltime=lambda e: cur[e]))
+    rep = sumo_backend._TravelTimeReporter(edge_tt, interval=60, threshold=0.05)
+    assert rep.poll(api, 0) is None # Nothing changed yet
+    cur["b"] = 40.0; cur["c"] = 31.0
+    assert rep.poll(api, 30) is None # Not due before t=60
+    idx, vals = rep.poll(api, 60)
+    assert idx.tolist() == [1] and vals.tolist() == [40.0] # c is within the threshold
+    cur["b"] = 41.0
+    assert rep.poll(api, 120) is None # Compared with the last reported value
+    rep.reset()
+    idx, vals = rep.poll(api, 130)
+    assert idx.tolist() == [1] and vals.tolist() == [41.0]
+
+def test_parallel_traveltime_merge():
+    edges = {"a": (100.0, 10.0), "b": (200.0, 10.0), "c": (300.0, 10.0)}
+    def edge(eid):
+        length, speed = edges[eid]
+        return SimpleNamespace(getLength=lambda: length, getSpeed=lambda: speed)
+    snet = SimpleNamespace(getEdge=edge)
+    b = sumo_backend.SUMOParallelBackend(snet=snet, partition=None, start_time=0, end_time=100, # type: ignore
+        step_length=10, routing_algo="dijkstra", seed=0, gui=False)
+    b._add_tt_edges(0, {"a": 10.0, "b": 20.0})
+    b._add_tt_edges(1, {"c": 30.0})
+    assert not b._merge_traveltimes(0, (np.zeros(0, dtype=np.int32), np.zeros(0)))
+    # Changes arrive on the step reply and invalidate cached routes
+    replies = {0: {"time": 10, "arrived": {}, "departed": []},
+               1: {"time": 10, "arrived": {}, "departed": [], "tt": (np.array([0], dtype=np.int32), np.array([90.0]))}}
+    b._workers = {pid: SimpleNamespace(send=lambda *args: None, recv_step=lambda r=r: r) for pid, r in replies.items()} # type: ignore
+    b._route_cache[("a", "c")] = sumo_backend.Stage(["a", "b", "c"])
+    assert b.simulation_step(10).time == 10
+    assert [b.get_traveltime(e) for e in "abc"] == [10.0, 20.0, 90.0]
+    assert len(b._route_cache) == 0
+
+def test_shm_channel():
+    from v2sim.sim.sumo_ipc import ShmChannel
+    parent = ShmChannel.create(["e0", "e1"], size=4096)
+    worker = ShmChannel.attach(parent.ring_names, ["e0", "e1"])
+    try:
+        items = [("v0", ["e0", "e1"], True, None, 12.5), ("v1", ["e1"], False, 3.0, None)]
+        for _ in range(20): # Enough round-trips to wrap both rings
+            msg = parent.pack_routes(items)
+            assert msg is not None
+            assert [(v, list(r), *rest) for v, r, *rest in worker.unpack_routes(msg)] == items
+            arrived = {"v1": ("v1", 42.0, ":j0_0", (1.0, 2.0))}
+            tt = (np.array([1], dtype=np.int32), np.array([7.5]))
+            msg = worker.pack_step(30, arrived, ["v0"], tt)
+            assert msg is not None
+            res = parent.unpack_step(msg)
+            assert res["time"] == 30 and res["arrived"] == arrived and res["departed"] == ["v0"]
+            assert res["tt"][0].tolist() == [1] and res["tt"][1].tolist() == [7.5]
+        # Both ends agree on the interned names, including the internal edge seen by the worker
+        assert parent.vehs.names == worker.vehs.names == ["v0", "v1"]
+        assert parent.roads.names == worker.roads.names == ["e0", "e1", ":j0_0"]
+        # A message larger than the ring is refused and its new names are forgotten
+        assert parent.routes.names == worker.routes.names == ["e0\x00e1", "e1"]
+        assert parent.pack_routes([(f"x{i}", ["e0"] * (i + 1), False, None, None) for i in range(200)]) is None
+        assert parent.vehs.names == ["v0", "v1"] and len(parent.routes.names) == 2
+        assert worker.unpack_routes(parent.pack_routes(items[:1]))[0][1] == ("e0", "e1")
+    finally:
+        worker.close()
+        parent.close()
+
+def test_worker_drain():
+    import multiprocessing as mp
+    w = object.__new__(sumo_backend._PartitionWorker)
+    w.part_id, w.channel, w.step_pending, w.stashed = 0, None, False, None
+    w.parent_conn, child = mp.Pipe()
+    w.send("step", 10)
+    assert w.step_pending
+    child.send(("ok", {"time": 10, "arrived": {}, "departed": ["v0"]}))
+    child.send(("ok", 10))
+    # A request while the step is running reads the step reply first
+    assert w.call("time") == 10
+    assert child.recv() == ("step", (10,)) and child.recv() == ("time", ())
+    assert w.recv_step()["departed"] == ["v0"] and w.stashed is None
+
+def test_pipelined_step():
+    b = sumo_backend.SUMOParallelBackend(snet=None, partition=None, start_time=0, end_time=100, # type: ignore
+        step_length=10, routing_algo="dijkstra", seed=0, gui=False)
+    sent = []
+    def worker(pid):
+        w = SimpleNamespace(stashed=None, send=lambda op, t: sent.append((pid, op, t)),
+            call=lambda op, path: open(path, "wb").close())
+        w.recv_step = lambda: w.stashed or {"time": sent[-1][2], "arrived": {}, "departed": [f"v{pid}"]}
+        return w
+    b._workers = {0: worker(0), 1: worker(1)} # type: ignore
+    b.begin_step(10)
+    assert b.in_flight and b.get_time() == 0 and len(sent) == 2
+    res = b.finish_step()
+    assert res.time == 10 and res.departed == ["v0", "v1"] and not b.in_flight
+    # Saving with a step in flight keeps its replies, and loading resumes it
+    b.begin_step(20)
+    for w in b._workers.values():
+        w.stashed = w.recv_step()
+    folder = Path(tempfile.mkdtemp())
+    try:
+        meta = b.save_state(folder)
+        assert meta["inflight"]["until"] == 20 and meta["inflight"]["time"] == 10
+        b._workers = {0: worker(0), 1: worker(1)} # type: ignore
+        b._inflight = None
+        b.load_state(folder, meta)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    assert b.in_flight and b.get_time() == 10
+    assert b.finish_step().time == 20
+    assert b.phase_times["steps"] == 2
@@ -0,0 +1,25 @@
+from feasytools import ArgChecker
+from v2sim.sim import SUMOConfig, UXsimConfig
+from v2sim.wrapper import get_sim_params
+
+
+def test_sim_params_sumo():
+    kwargs = get_sim_params(ArgChecker("-d cases/sumo_12nodes --sumo-ignore-driving"))
+    assert isinstance(kwargs["config"], SUMOConfig)
+    assert kwargs["config"].ignore_driving
+
+
+def test_sim_params_default():
+    # Without any backend option, the backend is chosen by the case
+    kwargs = get_sim_params(ArgChecker("-d cases/sumo_12nodes"))
+    assert kwargs["config"] is None
+
+
+def test_sim_params_uxsim():
+    kwargs = get_sim_params(ArgChecker("-d cases/ux_12nodes --uxsim-route-cache 600 --uxsim-station-batch 5 "
+        "--uxsim-link-history 1800 --uxsim-rebalance 300 --uxsim-no-parallel"))
+    cfg = kwargs["config"]
+    assert isinstance(cfg, UXsimConfig)
+    assert cfg.route_cache_bucket == 600 and cfg.station_batch_min == 5 and cfg.link_history_window == 1800
+    assert cfg.rebalance_interval == 300 and cfg.no_parallel and not cfg.randomize_uxsim
+    assert cfg.route_cache_size == UXsimConfig().route_cache_size
@@ -2,7 +2,7 @@ from pathlib import Path
 import shutil
 
 from feasytools import ArgChecker
-from v2sim.net import SplitCase
+from v2sim.net import SplitCase, EvaluatePartitions
 
 def main():
     args = ArgChecker()
@@ -10,25 +10,51 @@ def main():
     input_dir = args.get_str_or_none("i")
     output_dir = args.get_str_or_none("o")
     part_cnt = args.get_int("p", 2)
+    method = args.get_str("m", "geographic")
+    use_trips = not args.get_bool("no-trips")
+    imbalance = args.get_float("imbalance", 0.03)
+    report = args.get_str_or_none("r")
+
+    if input_dir and report:
+        # Only evaluate the candidate partition counts, e.g., -r 2,4,8
+        stats = EvaluatePartitions(
+            input_dir=input_dir,
+            candidates=[int(x) for x in report.split(",")],
+            method=method,
+            use_trips=use_trips,
+            imbalance=imbalance
+        )
+        for st in stats.values():
+            print(st)
+        return
 
     if not input_dir or not output_dir:
-        print("Usage: cmd_split.py -i <input_dir> -o <output_dir> [-p <partitions>]")
+        print("Usage: cmd_split.py -i <input_dir> -o <output_dir> [-p <partitions>] [-m geographic|multilevel] [--imbalance <ratio>] [--no-trips]")
+        print("       cmd_split.py -i <input_dir> -r <partitions,partitions,...> [-m geographic|multilevel] [--imbalance <ratio>] [--no-trips]")
+        print("  -m: geographic clusters the edges by their coordinates, without balancing the load of the partitions.")
+        print("      multilevel minimises the vehicles handed over between partitions, keeping the load imbalance")
+        print("      within --imbalance (default 0.03). At such a tight tolerance it may hand over more vehicles")
+        print("      than the unbalanced geographic partition. Compare both with -r.")
         return
     if part_cnt < 2:
         print("Partitions must be at least 2.")
         return
-    
+
     if Path(output_dir).exists():
         print(f"Output directory {output_dir} already exists. Please remove it first.")
         return
     if Path(input_dir).resolve() != Path(output_dir).resolve():
         shutil.copytree(input_dir, output_dir, dirs_exist_ok=True)
-    SplitCase(
+    stats = SplitCase(
         input_dir=input_dir,
         output_dir=output_dir,
-        partitions=part_cnt
+        partitions=part_cnt,
+        method=method,
+        use_trips=use_trips,
+        imbalance=imbalance
     )
-    
+    print(stats)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
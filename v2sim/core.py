@@ -15,6 +15,7 @@ from .utils import *
 
 
 PLUGINS_FILE = "plugins.gz"
+PLUGINS_CHECKPOINT_FOLDER = "plugins"
 RESULTS_FOLDER = "results"
 TRIP_EVENT_LOG = "cproc.clog"
 SIM_INFO_LOG = "cproc.log"
@@ -145,7 +146,10 @@ def _create_plg_and_stats(plgfile:Optional[str], state_dir:Optional[str], pout:P
     plg_pool, sta_pool = create_pools()
 
     # Enable plugins
-    if state_dir is not None:
+    if state_dir is not None and is_checkpoint(Path(state_dir) / PLUGINS_CHECKPOINT_FOLDER):
+        plugin_state = load_checkpoint(Path(state_dir) / PLUGINS_CHECKPOINT_FOLDER)
+        assert isinstance(plugin_state, dict), Lang.INVALID_PLUGIN_STATES.format(Path(state_dir) / PLUGINS_CHECKPOINT_FOLDER)
+    elif state_dir is not None:
         plugin_state_file = Path(state_dir) / PLUGINS_FILE
         with gzip.open(plugin_state_file, "rb") as f:
             d = pickle.load(f)
@@ -281,6 +285,8 @@ class V2SimInstance:
         self.__sim_dur = self.__break_at - self.__actual_start_time
         self.__show_prog = show_progress
         self.save_options = save
+        # Simulated seconds between the checkpoints saved to the result folder during the simulation, 0 = none
+        self.checkpoint_interval = 0
         self.__progress = 0.0
         self.__progress_lock = threading.Lock()
 
@@ -510,15 +516,13 @@ class V2SimInstance:
         })
     
     def save(self, folder:Union[str, Path]):
-        '''Save the current state of the simulation'''
+        '''
+        Save the current state of the simulation.
+            Saving again into the same folder only rewrites the parts of the checkpoint that changed.
+        '''
         p = Path(folder) if isinstance(folder, str) else folder
         self.__inst.save(p)
-        with gzip.open(p / PLUGINS_FILE, "wb") as f:
-            pickle.dump({
-                "obj": self.__plgman.SaveStates(),
-                "version": PyVersion(),
-                "pickler": pickle.__name__
-            }, f)
+        save_checkpoint(p / PLUGINS_CHECKPOINT_FOLDER, self.__plgman.SaveStates())
     
     def stop(self, save_state_to:Union[str, Path] = ""):
         '''
@@ -558,9 +562,14 @@ class V2SimInstance:
         self.__last_mp_time = 0
         self.__mpsend("sim:start")
         self.start()
+        next_ckpt = self.__inst.current_time + self.checkpoint_interval
 
         while self.__inst.current_time < self.__break_at:
             self.step()
+            if 0 < self.checkpoint_interval and next_ckpt <= self.__inst.current_time < self.__break_at:
+                self.save(self.__pout / SAVED_STATE_FOLDER)
+                while next_ckpt <= self.__inst.current_time:
+                    next_ckpt += self.checkpoint_interval
             if self.__stopsig:
                 if self.save_options.value & SaveStateOptions.OnAbort.value:
                     p = self.__pout / SAVED_STATE_FOLDER
@@ -681,6 +690,7 @@ __all__ = [
     "V2SimInstance",
     "MsgPack",
     "PLUGINS_FILE",
+    "PLUGINS_CHECKPOINT_FOLDER",
     "RESULTS_FOLDER",
     "TRIP_EVENT_LOG",
     "SIM_INFO_LOG",
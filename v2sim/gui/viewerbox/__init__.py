@@ -2,7 +2,7 @@ from v2sim.gui.com_no_vx import *
 from v2sim.gui.langhelper import add_lang_menu
 
 import os, gzip, traceback
-from v2sim import SAVED_STATE_FOLDER, TRAFFIC_INST_FILE_NAME, TrafficInst
+from v2sim import SAVED_STATE_FOLDER, TRAFFIC_INST_FILE_NAME, TRAFFIC_CHECKPOINT_FOLDER, TrafficInst, is_checkpoint, load_checkpoint
 from v2sim.plot import AdvancedPlot, ReadOnlyStatistics
 from PIL import Image, ImageTk
 from .srd import SelectResultsDialog
@@ -291,16 +291,21 @@ class ViewerBox(Tk):
         
         self._Q.submit("loaded", load_async, res_path)
 
-        state_path = res_path / SAVED_STATE_FOLDER / TRAFFIC_INST_FILE_NAME
+        state_path = res_path / SAVED_STATE_FOLDER / TRAFFIC_CHECKPOINT_FOLDER
+        if not is_checkpoint(state_path):
+            state_path = res_path / SAVED_STATE_FOLDER / TRAFFIC_INST_FILE_NAME
 
         def load_state_async(state_path:Path):
             try:
-                import cloudpickle as pickle
-                with gzip.open(state_path, 'rb') as fp:
-                    d  = pickle.load(fp)
-                assert isinstance(d, dict)
-                assert "obj" in d
-                inst = d["obj"]
+                if state_path.name == TRAFFIC_CHECKPOINT_FOLDER:
+                    inst = load_checkpoint(state_path)
+                else:
+                    import cloudpickle as pickle
+                    with gzip.open(state_path, 'rb') as fp:
+                        d  = pickle.load(fp)
+                    assert isinstance(d, dict)
+                    assert "obj" in d
+                    inst = d["obj"]
                 from v2sim.sim.ux import TrafficUX
                 if isinstance(inst, TrafficUX):
                     mode = "ux"
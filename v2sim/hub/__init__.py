@@ -1,3 +1,4 @@
 from .s import *
 from .cs import *
-from .hub import *
\ No newline at end of file
+from .hub import *
+from .pool import *
\ No newline at end of file
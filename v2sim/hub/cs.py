@@ -1,12 +1,14 @@
 from abc import abstractmethod, ABC
 from dataclasses import dataclass
 from enum import Enum
+from functools import cached_property
 from typing import Callable, Iterable, Optional, List, Dict, Set, Tuple
 from xml.etree.ElementTree import Element
 from feasytools import RangeList
 from itertools import chain
-from ..veh import EV
-from .s import BaseStation, PriceGetterLike, _pget_from_like
+import numpy as np
+from ..veh import EV, EVFleet
+from .s import BaseStation, PriceGetterLike, _pget_from_like, _snapshot_price
 
 
 @dataclass
@@ -14,33 +16,123 @@ class AllocEnv:
     cs: 'CS'
     EVs: Iterable[EV]
     CTime: int
+    fleet: Optional[EVFleet] = None     # Fleet storing the EVs, None if they are plain EVs
+    slots: Optional[np.ndarray] = None  # Slots of the EVs in the fleet
+
+    # Station-level arrays used by batched allocators, in the order of EVs.
+    # They are read from the fleet when possible, otherwise gathered from the EVs.
+    @cached_property
+    def count(self) -> int:
+        """Number of EVs"""
+        return len(self.slots) if self.slots is not None else sum(1 for _ in self.EVs)
+
+    @cached_property
+    def pc_req(self) -> np.ndarray:
+        """Maximum charging power requested by each EV in the current session, kWh/s"""
+        if self.fleet is not None and self.slots is not None:
+            return self.fleet.pcm[self.slots]
+        return np.fromiter((ev._EV__pcm for ev in self.EVs), np.float64, self.count) # type: ignore
+
+    @cached_property
+    def pd_req(self) -> np.ndarray:
+        """Maximum V2G power offered by each EV in the current session, kWh/s"""
+        if self.fleet is not None and self.slots is not None:
+            return self.fleet.pdm[self.slots]
+        return np.fromiter((ev._EV__pdm for ev in self.EVs), np.float64, self.count) # type: ignore
+
+    @cached_property
+    def soc(self) -> np.ndarray:
+        """SoC of each EV"""
+        if self.fleet is not None and self.slots is not None:
+            return self.fleet.soc(self.slots)
+        return np.fromiter((ev.soc for ev in self.EVs), np.float64, self.count)
+
+    @cached_property
+    def depart(self) -> np.ndarray:
+        """Departure time of the current trip of each EV, s"""
+        return np.fromiter((ev.trip.depart_time for ev in self.EVs), np.float64, self.count)
+
+
+def _greedy_fill(caps: np.ndarray, total: float) -> np.ndarray:
+    """Give each EV its cap in order until the total is used up. The EV at the boundary gets the remainder."""
+    left = total - np.concatenate(([0.0], np.cumsum(caps[:-1])))
+    return np.clip(left, 0.0, caps)
+
 
 V2GAllocator = Callable[[AllocEnv, int, float, float], None]
 
+BatchV2GAllocator = Callable[[AllocEnv, float, float], Optional[np.ndarray]]
+"""
+Batched V2G allocator: (env, v2g_demand, v2g_cap) -> V2G power of each EV (kWh/s) in the order of env.EVs.
+Returning None leaves the V2G power of the EVs unchanged.
+"""
+
 def _AverageV2GAllocator(env:AllocEnv, veh_cnt: int, v2g_demand: float, v2g_cap: float):
     if veh_cnt == 0 or v2g_demand == 0: return
     pd = v2g_demand / veh_cnt
     for ev in env.EVs:
         ev.set_temp_pd(pd)
 
+def _AverageV2GBatch(env: AllocEnv, v2g_demand: float, v2g_cap: float) -> Optional[np.ndarray]:
+    if env.count == 0 or v2g_demand == 0: return None
+    return np.full(env.count, v2g_demand / env.count)
+
+def _wrap_v2g(func: V2GAllocator) -> BatchV2GAllocator:
+    # A scalar allocator sets the power on the EVs itself, so nothing is returned
+    def batch(env: AllocEnv, v2g_demand: float, v2g_cap: float) -> Optional[np.ndarray]:
+        func(env, env.count, v2g_demand, v2g_cap)
+        return None
+    return batch
+
+def _unbatch_v2g(bfunc: BatchV2GAllocator) -> V2GAllocator:
+    def func(env: AllocEnv, veh_cnt: int, v2g_demand: float, v2g_cap: float):
+        pd = bfunc(env, v2g_demand, v2g_cap)
+        if pd is None: return
+        for ev, p in zip(env.EVs, pd.tolist()): ev.set_temp_pd(p)
+    return func
+
 class V2GAllocPool:
-    """Charging rate correction function pool"""
+    """V2G power allocation function pool"""
     _pool:'Dict[str, V2GAllocator]' = {
         "Average":_AverageV2GAllocator, 
     }
+    _batch:'Dict[V2GAllocator, BatchV2GAllocator]' = {
+        _AverageV2GAllocator:_AverageV2GBatch,
+    }
 
     @staticmethod
     def add(name: str, func: V2GAllocator):
-        """Add charging rate correction function"""
+        """Add V2G power allocation function, which sets the power of each EV by set_temp_pd()"""
+        V2GAllocPool._pool[name] = func
+
+    @staticmethod
+    def add_batch(name: str, bfunc: BatchV2GAllocator):
+        """Add batched V2G power allocation function, which returns the power of all EVs as an array"""
+        func = _unbatch_v2g(bfunc)
         V2GAllocPool._pool[name] = func
+        V2GAllocPool._batch[func] = bfunc
 
     @staticmethod
     def get(name: str) -> V2GAllocator:
-        """Get charging rate correction function"""
+        """Get V2G power allocation function"""
         return V2GAllocPool._pool[name]
 
+    @staticmethod
+    def batch_of(func: V2GAllocator) -> BatchV2GAllocator:
+        """Get the batched counterpart of a V2G power allocation function. Functions without one are wrapped."""
+        bfunc = V2GAllocPool._batch.get(func)
+        if bfunc is None:
+            bfunc = V2GAllocPool._batch[func] = _wrap_v2g(func)
+        return bfunc
+
 MaxPCAllocator = Callable[[AllocEnv, int, float, float], None]
 
+BatchMaxPCAllocator = Callable[[AllocEnv, float, float], Optional[np.ndarray]]
+"""
+Batched maximum charging power allocator: (env, max_pc0, max_pc_tot) -> maximum charging power of each EV (kWh/s)
+in the order of env.EVs. Returning None leaves the maximum charging power of the EVs unchanged.
+"""
+
 def _AverageMaxPCAllocator(env: AllocEnv, vcnt:int, max_pc0: float, max_pc_tot: float):
     """
     Average maximum charging power allocator
@@ -69,7 +161,7 @@ def _TimeBasedMaxPCAllocator(env: AllocEnv, vcnt:int, max_pc0: float, max_pc_tot
         loban.append((max(0, ev.trip.depart_time - env.CTime), ev))
         # For EVs in FCS, departure time of this trip is smaller than current time. Therefore, the sequence of EVs is held the same as the original.
         # For EVs in SCS, departure time of this trip is larger than current time. Therefore, EVs departed earlier are charged first.
-    loban.sort()
+    loban.sort(key=lambda x: x[0])
     for _, ev in loban:
         if max_pc_tot > max_pc0:
             ev.set_temp_max_pc(max_pc0)
@@ -78,25 +170,75 @@ def _TimeBasedMaxPCAllocator(env: AllocEnv, vcnt:int, max_pc0: float, max_pc_tot
             ev.set_temp_max_pc(max_pc_tot)
             max_pc_tot = 0
 
+def _AverageMaxPCBatch(env: AllocEnv, max_pc0: float, max_pc_tot: float) -> Optional[np.ndarray]:
+    if env.count == 0: return None
+    return np.full(env.count, min(max_pc_tot / env.count, max_pc0))
+
+def _PrioritizedMaxPCBatch(env: AllocEnv, max_pc0: float, max_pc_tot: float) -> Optional[np.ndarray]:
+    if env.count == 0: return None
+    return _greedy_fill(np.full(env.count, max_pc0), max_pc_tot)
+
+def _TimeBasedMaxPCBatch(env: AllocEnv, max_pc0: float, max_pc_tot: float) -> Optional[np.ndarray]:
+    if env.count == 0: return None
+    # Stable sort keeps the original order of EVs with the same remaining time, as _TimeBasedMaxPCAllocator does
+    order = np.argsort(np.maximum(env.depart - env.CTime, 0), kind="stable")
+    ret = np.empty(env.count)
+    ret[order] = _greedy_fill(np.full(env.count, max_pc0), max_pc_tot)
+    return ret
+
+def _wrap_max_pc(func: MaxPCAllocator) -> BatchMaxPCAllocator:
+    # A scalar allocator sets the power on the EVs itself, so nothing is returned
+    def batch(env: AllocEnv, max_pc0: float, max_pc_tot: float) -> Optional[np.ndarray]:
+        func(env, env.count, max_pc0, max_pc_tot)
+        return None
+    return batch
+
+def _unbatch_max_pc(bfunc: BatchMaxPCAllocator) -> MaxPCAllocator:
+    def func(env: AllocEnv, vcnt: int, max_pc0: float, max_pc_tot: float):
+        pc = bfunc(env, max_pc0, max_pc_tot)
+        if pc is None: return
+        for ev, p in zip(env.EVs, pc.tolist()): ev.set_temp_max_pc(p)
+    return func
+
 
 class MaxPCAllocPool:
-    """Charging rate correction function pool"""
+    """Maximum charging power allocation function pool"""
     _pool:'Dict[str, MaxPCAllocator]' = {
         "Average":_AverageMaxPCAllocator,
         "Prioritized":_PrioritizedMaxPCAllocator,
         "TimeBased":_TimeBasedMaxPCAllocator,
     }
+    _batch:'Dict[MaxPCAllocator, BatchMaxPCAllocator]' = {
+        _AverageMaxPCAllocator:_AverageMaxPCBatch,
+        _PrioritizedMaxPCAllocator:_PrioritizedMaxPCBatch,
+        _TimeBasedMaxPCAllocator:_TimeBasedMaxPCBatch,
+    }
 
     @staticmethod
     def add(name: str, func: MaxPCAllocator):
-        """Add charging rate correction function"""
+        """Add maximum charging power allocation function, which sets the power of each EV by set_temp_max_pc()"""
         MaxPCAllocPool._pool[name] = func
 
+    @staticmethod
+    def add_batch(name: str, bfunc: BatchMaxPCAllocator):
+        """Add batched maximum charging power allocation function, which returns the power of all EVs as an array"""
+        func = _unbatch_max_pc(bfunc)
+        MaxPCAllocPool._pool[name] = func
+        MaxPCAllocPool._batch[func] = bfunc
+
     @staticmethod
     def get(name: str) -> MaxPCAllocator:
-        """Get charging rate correction function"""
+        """Get maximum charging power allocation function"""
         return MaxPCAllocPool._pool[name]
 
+    @staticmethod
+    def batch_of(func: MaxPCAllocator) -> BatchMaxPCAllocator:
+        """Get the batched counterpart of a maximum charging power allocation function. Functions without one are wrapped."""
+        bfunc = MaxPCAllocPool._batch.get(func)
+        if bfunc is None:
+            bfunc = MaxPCAllocPool._batch[func] = _wrap_max_pc(func)
+        return bfunc
+
 
 class CSType(Enum):
     FCS = "FCS"
@@ -134,6 +276,11 @@ class OwnerGroup:
 
 class CS(BaseStation[EV], ABC):
     """Charging Station"""
+    _fleet: Optional[EVFleet] = None # Default for the states saved without this attribute
+    _psell_snap: Tuple[int, float] = (-1, 0.0) # Per-step snapshot of the vehicle-independent selling price
+    check_aggregates: bool = False
+    """Check the running aggregates against recomputation on every read. For debugging only, as the check is O(n)."""
+    
     def __init__(self,
         name: str, bind: str, slots: int, bus: str, x: float, y: float, cs_type: CSType,
         max_pc: float, max_pd: float, price_buy: PriceGetterLike, price_buy_is_service_fee:bool = False,
@@ -198,6 +345,45 @@ class CS(BaseStation[EV], ABC):
         self._cload: float = 0.0
         self._dload: float = 0.0
         self._cur_v2g_cap: float = 0.0
+
+        self._fleet: Optional[EVFleet] = None # Fleet store charged by vectorised kernels
+
+        # Running aggregates, updated when EVs enter, leave, charge or discharge
+        self._soc_chi: float = 0.0  # Total SoC of the EVs being charged
+        self._soc_buf: float = 0.0  # Total SoC of the EVs waiting
+        self._v2g_pmax: float = 0.0 # Total V2G power (considering losses) of the EVs being charged, kWh/s
+    
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if "_soc_chi" not in state:
+            self._soc_chi, self._soc_buf, self._v2g_pmax = self._recompute_aggregates()
+    
+    def _recompute_aggregates(self) -> Tuple[float, float, float]:
+        """Recompute (total SoC of EVs being charged, total SoC of EVs waiting, total V2G power of EVs being charged)"""
+        return (
+            sum(ev.soc for ev in self._chi),
+            sum(ev.soc for ev in self._buf),
+            sum(ev._pdv * ev._ed for ev in self._chi),
+        )
+    
+    def _check(self):
+        exp = self._recompute_aggregates()
+        act = (self._soc_chi, self._soc_buf, self._v2g_pmax)
+        for e, a in zip(exp, act):
+            assert abs(e - a) <= 1e-6 * max(1.0, abs(e)), f"Running aggregates of {self._name} drifted: {act} != {exp}"
+    
+    def _agg_enter(self, veh: EV):
+        self._soc_chi += veh.soc; self._v2g_pmax += veh._pdv * veh._ed
+    
+    def _agg_leave(self, veh: EV):
+        if len(self._chi) == 0:
+            # Reset to exact zero, so that rounding errors do not accumulate
+            self._soc_chi = 0.0; self._v2g_pmax = 0.0
+        else:
+            self._soc_chi -= veh.soc; self._v2g_pmax -= veh._pdv * veh._ed
+    
+    def _agg_clear(self):
+        self._soc_chi = 0.0; self._soc_buf = 0.0; self._v2g_pmax = 0.0
     
     def add_single_owner(self, owner: str):
         """
@@ -218,6 +404,7 @@ class CS(BaseStation[EV], ABC):
         self._pc_actual = None
         self._pd_actual = []
         self._pc_is_constrained = False
+        self._agg_clear()
     
     def __repr__(self):
         return f"CS(name='{self._name}', slots={self._slots}, price_buy={self._pbuy}, price_buy_is_service_fee={self._pbuy_is_serv_fee}, price_sell={self._psell}, price_sell_is_service_fee={self._psell_is_serv_fee}, offline={self._offline})"
@@ -285,7 +472,15 @@ class CS(BaseStation[EV], ABC):
     def psell(self, t:int, veh: EV) -> float:
         """Electricity selling price, $/kWh"""
         if self._psell is None: raise ValueError("This charging station does not support V2G.")
-        return self._psell(t, self, veh)
+        p, snap = _snapshot_price(self._psell, self._psell_snap, t, self, veh)
+        if snap is not None: self._psell_snap = snap
+        return p
+    
+    @property
+    def psell_vehicle_dependent(self) -> bool:
+        """Whether the selling price may differ between vehicles in the same time step"""
+        if self._psell is None: raise ValueError("This charging station does not support V2G.")
+        return self._psell.vehicle_dependent and not hasattr(self._psell, "_val")
     
     def psell_is_service_fee(self) -> bool:
         """Whether the price_sell is a service fee rather than the actual price of energy."""
@@ -296,17 +491,56 @@ class CS(BaseStation[EV], ABC):
         """The actual unit revenue for user, $/kWh"""
         if self._psell is None: raise ValueError("This charging station does not support V2G.")
         if self._psell_is_serv_fee:
-            return elec_price - self._psell(t, self, veh)
+            return elec_price - self.psell(t, veh)
             # Allow negative psell, which means the user pays the grid to discharge.
             # Of course, users will not choose to discharge when the revenue is negative, but this will be handled by the vehicle's willingness to discharge rather than the CS.
         else:
-            return self._psell(t, self, veh)
+            return self.psell(t, veh)
 
     @property
     def supports_V2G(self) -> bool:
         """Check if this charging station supports V2G"""
         return self._psell is not None
 
+    def attach_fleet(self, fleet: Optional[EVFleet]):
+        """
+        Charge and discharge the EVs with the vectorised kernels of the fleet.
+        In a step when any EV in the CS is not stored in the fleet, or there are fewer EVs than fleet.min_batch,
+        the scalar methods of EV are used instead.
+
+        :param fleet: EV fleet. None means always using the scalar methods.
+        """
+        self._fleet = fleet
+
+    @property
+    def fleet(self) -> Optional[EVFleet]:
+        """EV fleet attached to this CS"""
+        return self._fleet
+
+    def _alloc_pc(self, fleet: EVFleet, evs: List[EV], slots: np.ndarray, cur_time: int):
+        """Allocate the maximum charging power to the EVs stored in the fleet"""
+        pc = MaxPCAllocPool.batch_of(self._pc_alloc)(
+            AllocEnv(self, evs, cur_time, fleet, slots), self._pc_lim1, self._pc_limtot)
+        if pc is not None: fleet.pc_max[slots] = pc
+    
+    def _alloc_pd(self, fleet: EVFleet, evs: List[EV], slots: np.ndarray, cur_time: int, v2g_demand: float):
+        """Allocate the V2G power to the EVs stored in the fleet"""
+        pd = V2GAllocPool.batch_of(self._pd_alloc)(
+            AllocEnv(self, evs, cur_time, fleet, slots), v2g_demand, self._cur_v2g_cap)
+        if pd is not None: fleet.pd_max[slots] = pd
+    
+    def _real_pbuy_of(self, t: int, evs: List[EV], energy_cost: float) -> np.ndarray:
+        """Real unit price of each EV, $/kWh"""
+        if not self.pbuy_vehicle_dependent and len(evs) > 0:
+            return np.full(len(evs), self.real_pbuy(t, evs[0], energy_cost))
+        return np.fromiter((self.real_pbuy(t, ev, energy_cost) for ev in evs), np.float64, len(evs))
+    
+    def _real_psell_of(self, t: int, evs: List[EV], elec_price: float) -> np.ndarray:
+        """Real unit revenue of each EV, $/kWh"""
+        if not self.psell_vehicle_dependent and len(evs) > 0:
+            return np.full(len(evs), self.real_psell(t, evs[0], elec_price))
+        return np.fromiter((self.real_psell(t, ev, elec_price) for ev in evs), np.float64, len(evs))
+
     @abstractmethod
     def update(
         self, sec: int, cur_time: int, v2g_demand: float, pb_e:float, ps_e:float
@@ -392,6 +626,12 @@ class CS(BaseStation[EV], ABC):
         """Current maximum V2G discharge power, MW, 3.6MW = 1kWh/s"""
         return self._cur_v2g_cap * 3.6
     
+    @property
+    def V2G_pmax(self) -> float:
+        """Total V2G power (considering losses) of all vehicles being charged regardless of their willingness, kWh/s"""
+        if self.check_aggregates: self._check()
+        return self._v2g_pmax
+    
     def is_charging(self, veh: EV) -> bool:
         """
         Get the charging status of the vehicle. If the vehicle does not exist, a ValueError will be raised.
@@ -420,14 +660,15 @@ class CS(BaseStation[EV], ABC):
         When include_waiting is True, the average SOC of all vehicles (including those waiting) is returned.
         When include_waiting is False, only the average SOC of vehicles being charged is returned.
         """
+        if self.check_aggregates: self._check()
         if include_waiting:
             n = len(self._chi) + len(self._buf)
             if n == 0: return 0.0
-            return sum(ev.soc for ev in self.vehicles()) / n
+            return (self._soc_chi + self._soc_buf) / n
         else:
             n = len(self._chi)
             if n == 0: return 0.0
-            return sum(ev.soc for ev in self._chi) / n
+            return self._soc_chi / n
     
     @abstractmethod
     def _ev_enter_chi(self, veh: EV):
@@ -448,8 +689,10 @@ class CS(BaseStation[EV], ABC):
         if len(self._chi) < self._slots:
             self._ev_enter_chi(veh)
             self._chi.add(veh)
+            self._agg_enter(veh)
         elif self._allow_que:
             self._buf.append(veh)
+            self._soc_buf += veh.soc
         else:
             return False
         return True
@@ -463,8 +706,10 @@ class CS(BaseStation[EV], ABC):
         if len(self._chi) < self._slots:
             self._ev_enter_chi(veh)
             self._chi.add(veh)
+            self._agg_enter(veh)
         else:
             self._buf.append(veh)
+            self._soc_buf += veh.soc
 
     @abstractmethod
     def _ev_leave_chi(self, veh: EV):
@@ -481,15 +726,19 @@ class CS(BaseStation[EV], ABC):
         if ev in self._chi:
             self._ev_leave_chi(ev)
             self._chi.remove(ev)
+            self._agg_leave(ev)
         else:
             try:
                 self._buf.remove(ev)
             except:
                 return False
+            self._soc_buf = self._soc_buf - ev.soc if len(self._buf) > 0 else 0.0
         if len(self._buf) > 0 and len(self._chi) < self._slots:
             veh = self._buf.popleft()
+            self._soc_buf = self._soc_buf - veh.soc if len(self._buf) > 0 else 0.0
             self._ev_enter_chi(veh)
             self._chi.add(veh)
+            self._agg_enter(veh)
         return True
 
     def has_veh(self, veh: EV) -> bool:
@@ -538,9 +787,16 @@ class UniCS(CS):
             self._buf.clear()
             for ev in self._chi: self._ev_leave_chi(ev)
             self._chi.clear()
+            self._agg_clear()
             self._cload = 0
             return ret
         
+        if self._fleet is not None and len(self._chi) >= self._fleet.min_batch:
+            evs = list(self._chi)
+            slots = self._fleet.slots_of(evs)
+            if slots is not None:
+                return self._update_fleet(self._fleet, evs, slots, sec, cur_time, pb_e)
+        
         Wcharge = 0
 
         # Set temporary maximum charging, where set_temp_max_pc is called.
@@ -550,22 +806,46 @@ class UniCS(CS):
                 AllocEnv(self, self._chi, cur_time), 
                 len(self._chi), self._pc_lim1, self._pc_limtot
             )
+            dsoc = 0.0
             if self._cs_type == CSType.FCS:
                 for ev in self._chi:
+                    e0 = ev._energy
                     c_, m_ = ev.charge(sec, self.real_pbuy(cur_time, ev, pb_e))
                     Wcharge += c_; self._revenue += m_; self._cost += c_ * pb_e
+                    dsoc += (ev._energy - e0) / ev._cap
                     if ev._energy >= ev._etar and ev._leave_at_etar: ret.append(ev)
             else:
                 for ev in self._chi:
                     uc = self.real_pbuy(cur_time, ev, pb_e)
                     if not ev.willing_to_slow_charge(cur_time, uc): continue
+                    e0 = ev._energy
                     c_, m_ = ev.charge(sec, uc)
                     Wcharge += c_; self._revenue += m_; self._cost += c_ * pb_e
+                    dsoc += (ev._energy - e0) / ev._cap
                     if ev._energy >= ev._etar and ev._leave_at_etar: ret.append(ev)
+            self._soc_chi += dsoc
             for ev in ret: self.pop_veh(ev)
         self._cload = Wcharge / sec
         return ret
     
+    def _update_fleet(self, fleet: EVFleet, evs: List[EV], slots: np.ndarray, sec: int, cur_time: int, pb_e: float) -> List[EV]:
+        """Vectorised update() when all EVs being charged are stored in the fleet"""
+        self._alloc_pc(fleet, evs, slots, cur_time)
+        uc = self._real_pbuy_of(cur_time, evs, pb_e)
+        if self._cs_type == CSType.SCS:
+            idx = np.flatnonzero(fleet.willing_to_slow_charge(slots, cur_time, uc))
+            evs = [evs[k] for k in idx]; slots = slots[idx]; uc = uc[idx]
+        e0 = fleet.energy[slots]
+        de, money = fleet.charge(slots, sec, uc)
+        self._soc_chi += float(((fleet.energy[slots] - e0) / fleet.cap[slots]).sum())
+        Wcharge = float(de.sum())
+        self._revenue += float(money.sum()); self._cost += Wcharge * pb_e
+        done = np.flatnonzero((fleet.energy[slots] >= fleet.etar[slots]) & fleet.leave[slots])
+        ret = [evs[k] for k in done]
+        for ev in ret: self.pop_veh(ev)
+        self._cload = Wcharge / sec
+        return ret
+    
     def __str__(self):
         return f"UniCS(name='{self._name}')"
     
@@ -599,12 +879,37 @@ class BiCS(CS):
     def get_V2G_cap(self, _t:int, /) -> float:
         if self.is_offline(_t): return 0.0
         assert self._psell is not None, "V2G not supported in %s." % self._name
-        self._d_evs = [ev for ev in self._chi if ev.willing_to_v2g(_t, self._psell(_t, self, ev))]
-        tot_pd = sum(ev._pdv * ev._ed for ev in self._d_evs)
+        if self.check_aggregates: self._check()
+        if self._v2g_pmax <= 0:
+            # No EV being charged is able to discharge, so their willingness does not matter
+            self._d_evs = []
+            tot_pd = 0
+        else:
+            tot_pd = self._get_V2G_cap_fleet(_t)
+            if tot_pd is None:
+                self._d_evs = [ev for ev in self._chi if ev.willing_to_v2g(_t, self.psell(_t, ev))]
+                tot_pd = sum(ev._pdv * ev._ed for ev in self._d_evs)
         self._cur_v2g_cap = tot_pd
         self.__d_evs_upd_t = _t
         return tot_pd
     
+    def _get_V2G_cap_fleet(self, t: int) -> Optional[float]:
+        """Vectorised get_V2G_cap() when all EVs being charged are stored in the fleet. None if the scalar one must be used."""
+        fleet = self._fleet
+        if fleet is None or len(self._chi) < fleet.min_batch: return None
+        chi = list(self._chi)
+        slots = fleet.slots_of(chi)
+        if slots is None: return None
+        if self.psell_vehicle_dependent:
+            ps = np.fromiter((self.psell(t, ev) for ev in chi), np.float64, len(chi))
+        else:
+            ps = self.psell(t, chi[0])
+        idx = np.flatnonzero(fleet.willing_to_v2g(slots, t, ps))
+        self._d_evs = [chi[k] for k in idx]
+        if len(idx) == 0: return 0 # Same as the sum of an empty list, so the logs stay the same
+        d_slots = slots[idx]
+        return float((fleet.pdv[d_slots] * fleet.ed[d_slots]).sum())
+    
     def update(
         self, sec: int, cur_time: int, v2g_demand: float, pb_e:float, ps_e:float
     ) -> List[EV]:
@@ -624,10 +929,17 @@ class BiCS(CS):
             self._cload = 0; self._dload = 0
             return []
         
+        v2g_enabled = v2g_demand > 0 and self._cur_v2g_cap > 0
+        if self._fleet is not None and len(self._chi) >= self._fleet.min_batch:
+            chi = list(self._chi)
+            slots = self._fleet.slots_of(chi)
+            if slots is not None:
+                fret = self._update_fleet(self._fleet, chi, slots, sec, cur_time, v2g_enabled, v2g_demand, pb_e, ps_e)
+                if fret is not None: return fret
+        
         Wcharge = 0; Wdischarge = 0
          
         ret: List[EV] = []
-        v2g_enabled = v2g_demand > 0 and self._cur_v2g_cap > 0
         if v2g_enabled:
             # V2G is enabled now. Some EVs charge and some EVs discharge.
             if self.__d_evs_upd_t != cur_time:
@@ -660,7 +972,8 @@ class BiCS(CS):
                 self._c_evs = list(self._chi)
             else:
                 self._c_evs = [ev for ev in self._chi if ev.willing_to_slow_charge(cur_time, self.real_pbuy(cur_time, ev, pb_e))]
-            
+        
+        dsoc = 0.0
         m = len(self._c_evs)
         if m > 0:
             # Allocate charging power to vehicles, where set_temp_pc is called.
@@ -671,6 +984,7 @@ class BiCS(CS):
                 # When V2G is enabled, vehicles only charge to min(_cap * _kv, _etar)
                 for ev in self._c_evs:
                     pb = self.real_pbuy(cur_time, ev, pb_e)
+                    e0 = ev._energy
                     if ev._leave_at_etar:
                         c_, m_ = ev._bidirectional_charge(sec, pb, ev._etar)
                         Wcharge += c_; self._revenue += m_; self._cost += c_ * pb_e
@@ -678,11 +992,14 @@ class BiCS(CS):
                     else:
                         c_, m_ = ev._bidirectional_charge(sec, pb, min(ev._cap * ev._kv, ev._etar))
                         Wcharge += c_; self._revenue += m_; self._cost += c_ * pb_e
+                    dsoc += (ev._energy - e0) / ev._cap
             else:
                 # When V2G is not enabled, vehicles charge to _etar
                 for ev in self._c_evs:
+                    e0 = ev._energy
                     c_, m_ = ev._bidirectional_charge(sec, self.real_pbuy(cur_time, ev, pb_e), ev._etar)
                     Wcharge += c_; self._revenue += m_; self._cost += c_ * pb_e
+                    dsoc += (ev._energy - e0) / ev._cap
                     if ev._energy >= ev._etar and ev._leave_at_etar: ret.append(ev)
         
         n = len(self._d_evs)
@@ -691,8 +1008,71 @@ class BiCS(CS):
             # If _pd_alloc do not allocate power to a vehicle, the vehicle's discharging power is set to maximum discharging power.
             self._pd_alloc(AllocEnv(self, self._d_evs, cur_time), n, v2g_demand, self._cur_v2g_cap)
             for ev in self._d_evs:
+                e0 = ev._energy
                 c_, m_ = ev.bidirectional_discharge(sec, self.real_psell(cur_time, ev, ps_e))
                 Wdischarge += c_; self._cost += m_; self._revenue += c_ * ps_e
+                dsoc += (ev._energy - e0) / ev._cap
+        
+        self._soc_chi += dsoc
+        self._cload = Wcharge / sec
+        self._dload = Wdischarge / sec
+        for ev in ret: self.pop_veh(ev)
+        return ret
+    
+    def _update_fleet(
+        self, fleet: EVFleet, chi: List[EV], slots: np.ndarray, sec: int, cur_time: int,
+        v2g_enabled: bool, v2g_demand: float, pb_e: float, ps_e: float
+    ) -> Optional[List[EV]]:
+        """
+        Vectorised update() when all EVs being charged are stored in the fleet.
+        The EVs to charge and to discharge are selected with the willingness masks of the fleet.
+        
+        :return: List of vehicles removed from CS, or None if the scalar update() must be used instead
+        """
+        d_slots: Optional[np.ndarray] = None
+        if v2g_enabled and self.__d_evs_upd_t == cur_time:
+            # Use the previously updated list of vehicles willing to discharge via V2G
+            d_slots = fleet.slots_of(self._d_evs)
+            if d_slots is None: return None
+        pb = self._real_pbuy_of(cur_time, chi, pb_e)
+        if v2g_enabled:
+            c_mask = fleet.soc(slots) < fleet.kv[slots]
+        else:
+            c_mask = np.ones(len(chi), dtype=np.bool_)
+        if self._cs_type == CSType.SCS:
+            c_mask &= fleet.willing_to_slow_charge(slots, cur_time, pb)
+        if not v2g_enabled:
+            self._d_evs = []; d_slots = slots[:0]
+        elif d_slots is None:
+            d_mask = ~c_mask & fleet.willing_to_v2g(slots, cur_time, self._real_psell_of(cur_time, chi, ps_e))
+            d_idx = np.flatnonzero(d_mask)
+            self._d_evs = [chi[k] for k in d_idx]; d_slots = slots[d_idx]
+        c_idx = np.flatnonzero(c_mask)
+        self._c_evs = [chi[k] for k in c_idx]; c_slots = slots[c_idx]; pb = pb[c_idx]
+
+        Wcharge = 0.0; Wdischarge = 0.0
+        ret: List[EV] = []
+        if len(self._c_evs) > 0:
+            self._alloc_pc(fleet, self._c_evs, c_slots, cur_time)
+            etar = fleet.etar[c_slots]; leave = fleet.leave[c_slots]
+            if v2g_enabled:
+                # When V2G is enabled, vehicles not leaving at _etar only charge to min(_cap * _kv, _etar)
+                etar = np.where(leave, etar, np.minimum(fleet.cap[c_slots] * fleet.kv[c_slots], etar))
+            e0 = fleet.energy[c_slots]
+            de, money = fleet.charge(c_slots, sec, pb, etar)
+            self._soc_chi += float(((fleet.energy[c_slots] - e0) / fleet.cap[c_slots]).sum())
+            Wcharge = float(de.sum())
+            self._revenue += float(money.sum()); self._cost += Wcharge * pb_e
+            done = np.flatnonzero((fleet.energy[c_slots] >= fleet.etar[c_slots]) & leave)
+            ret = [self._c_evs[k] for k in done]
+        
+        if len(self._d_evs) > 0:
+            self._alloc_pd(fleet, self._d_evs, d_slots, cur_time, v2g_demand)
+            e0 = fleet.energy[d_slots]
+            de, money = fleet.discharge(d_slots, sec, self._real_psell_of(cur_time, self._d_evs, ps_e))
+            self._soc_chi += float(((fleet.energy[d_slots] - e0) / fleet.cap[d_slots]).sum())
+            Wdischarge = float(de.sum())
+            self._cost += float(money.sum()); self._revenue += Wdischarge * ps_e
         
         self._cload = Wcharge / sec
         self._dload = Wdischarge / sec
@@ -703,4 +1083,4 @@ class BiCS(CS):
         return f"BiCS(name='{self._name}')"
 
 
-__all__ = ["CS", "V2GAllocPool", "MaxPCAllocPool", "AllocEnv", "V2GAllocator", "MaxPCAllocator", "CSType", "OwnerGroup", "UniCS", "BiCS"]
\ No newline at end of file
+__all__ = ["CS", "V2GAllocPool", "MaxPCAllocPool", "AllocEnv", "V2GAllocator", "MaxPCAllocator", "BatchV2GAllocator", "BatchMaxPCAllocator", "CSType", "OwnerGroup", "UniCS", "BiCS"]
\ No newline at end of file
@@ -1,4 +1,4 @@
-from typing import Dict, Iterable, Sequence, Tuple, Union, TypeVar, Generic, List, Literal
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union, TypeVar, Generic, List, Literal
 from pathlib import Path
 from collections import defaultdict
 from dataclasses import dataclass
@@ -6,12 +6,12 @@ from feasytools import RangeList
 from xml.etree.ElementTree import Element, ElementTree
 from abc import ABC, abstractmethod
 from itertools import repeat
-from concurrent.futures import Future, ThreadPoolExecutor
 from ..veh import *
 from ..locale import Lang
 from ..utils import ReadXML, PathLike
 from .cs import *
 from .s import *
+from .pool import StationPool
 
 
 def _parse_station_params(cs_node: Element) -> Dict:
@@ -136,6 +136,14 @@ def _create_kdt(s: Sequence[BaseStation]):
     return KDTree(pts) if pts else None
 
 
+def _veh_name(veh: Vehicle) -> str:
+    return veh._name
+
+def _by_name(vehs: Iterable[T_Vehicle]) -> List[T_Vehicle]:
+    """Released vehicles of a station, sorted by name so that the order does not depend on set iteration."""
+    return sorted(vehs, key=_veh_name)
+
+
 class StationHub(Generic[T_Station, T_Vehicle], ABC):
     """List of Stations(GS/CS). Index starts from 0."""
     def __init__(self, par:List[T_Station]):
@@ -144,6 +152,8 @@ class StationHub(Generic[T_Station, T_Vehicle], ABC):
         self._veh: Dict[str, int] = {}
         # Station name to index mapping
         self._remap: Dict[str, int] = {s._name: i for i, s in enumerate(self._s)} 
+        # Worker pool of update_parallel(), created on first use
+        self.__pool: Optional[StationPool] = None
         self.create_kdtree()
     
     def save(self, filePath:Union[str, Path]):
@@ -158,6 +168,28 @@ class StationHub(Generic[T_Station, T_Vehicle], ABC):
         for s in self._s: s.reset()
         self._veh.clear()
     
+    def _get_pool(self, max_workers: int) -> StationPool:
+        """Get the long-lived worker pool of this hub. Internal use only."""
+        if self.__pool is None or self.__pool.max_workers != max_workers:
+            if self.__pool is not None: self.__pool.shutdown()
+            self.__pool = StationPool(max_workers)
+        return self.__pool
+    
+    def close_pool(self):
+        """Stop the worker threads used by update_parallel()."""
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_StationHub__pool"] = None
+        return state
+    
+    def __setstate__(self, state: dict):
+        state.setdefault("_StationHub__pool", None)
+        self.__dict__.update(state)
+    
     def __iter__(self):
         return self._s.__iter__()
     
@@ -313,6 +345,7 @@ class CSHub(StationHub[CS, EV]):
         self.__T_pd_cap:int = -1
         self.__pd_dem: List[float] = []
         self.__auto_leave_at_etar = auto_leave_at_etar
+        self.__fleet: Optional[EVFleet] = None
     
     def reset(self):
         """Reset station hub to initial state."""
@@ -329,6 +362,7 @@ class CSHub(StationHub[CS, EV]):
     def _append(self, cs: CS):
         """Append a charging station. If you want to add multiple charging stations, use extend() instead."""
         super()._append(cs)
+        cs.attach_fleet(self.__fleet)
         self.__pd_cap.append(0.0)
         if len(self.__pd_dem) > 0:
             self.__pd_dem.append(0.0)
@@ -344,6 +378,24 @@ class CSHub(StationHub[CS, EV]):
         for cs in cs_list: self._append(cs)
         self.create_kdtree()
         
+    def attach_fleet(self, fleet: Optional[EVFleet]):
+        """
+        Charge the EVs stored in the fleet with its vectorised kernels in all charging stations.
+
+        :param fleet: EV fleet. None means using the scalar methods of EV.
+        """
+        self.__fleet = fleet
+        for cs in self._s: cs.attach_fleet(fleet)
+    
+    @property
+    def fleet(self) -> Optional[EVFleet]:
+        """EV fleet attached to the charging stations"""
+        return self.__fleet
+    
+    def __setstate__(self, state: dict):
+        state.setdefault("_CSHub__fleet", None)
+        super().__setstate__(state)
+    
     def get_veh_count(self, only_charging: bool = False) -> List[int]:
         """
         List of the number of vehicles at all charging stations. When only_charging is True, only the number of vehicles being charged is returned.
@@ -439,18 +491,19 @@ class CSHub(StationHub[CS, EV]):
         # Do not use multithreading since the overhead is too large for small number of CSs
         ret:List[EV] = []       
         for cs, pd in zip(self._s, v2g_demand):
-            lst = cs.update(sec, cur_time, pd, pb_e, ps_e)
+            lst = _by_name(cs.update(sec, cur_time, pd, pb_e, ps_e))
             for ev in lst:
                 del self._veh[ev._name]
             ret.extend(lst)
         return ret
     
     def update_parallel(self, sec: int, cur_time: int, pb_e:float, ps_e:float, max_workers: int) -> List[EV]:
-        """Parallel version of update() method. It may be faster when there are many charging stations."""
-        cnt = len(self._s)
-        if cnt == 0: return []
-        workers = min(max_workers, len(self._s))
-        each_size = (len(self._s) + workers - 1) // workers
+        """
+        Parallel version of update() method. It may be faster when there are many charging stations.
+        The stations are split into chunks of similar vehicle counts and updated by the long-lived worker pool of this hub.
+        The returned list is in the same order as update().
+        """
+        if len(self._s) == 0: return []
         N = len(self.__pd_dem)
 
         def update_range(l:int, r:int):
@@ -458,21 +511,15 @@ class CSHub(StationHub[CS, EV]):
             for i in range(l, r):
                 cs = self._s[i]
                 pd = self.__pd_dem[i] if i < N else 0.0
-                ret.append(cs.update(sec, cur_time, pd, pb_e, ps_e))
+                ret.append(_by_name(cs.update(sec, cur_time, pd, pb_e, ps_e)))
             return ret
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(update_range, i * each_size, min((i + 1) * each_size, len(self._s))) 
-                for i in range(workers)
-            ]
-            ret:List[EV] = []
-            for future in futures:
-                lst = future.result()
-                for evs in lst:
-                    for ev in evs:
-                        del self._veh[ev._name]
-                    ret.extend(evs)
+        ret:List[EV] = []
+        for lst in self._get_pool(max_workers).map_ranges(update_range, [len(cs) for cs in self._s]):
+            for evs in lst:
+                for ev in evs:
+                    del self._veh[ev._name]
+                ret.extend(evs)
         return ret
 
     def __repr__(self):
@@ -498,32 +545,26 @@ class GSHub(StationHub[GS, GV]):
         """
         ret:List[GV] = []
         for gs in self._s:
-            ret.extend(gs.update(sec, cur_time, pb_g))
+            ret.extend(_by_name(gs.update(sec, cur_time, pb_g)))
         return ret
     
     def update_parallel(self, sec: int, cur_time: int, pb_g:float, max_workers: int) -> List[GV]:
-        """Parallel version of update() method. It may be faster when there are many gas stations."""
-        cnt = len(self._s)
-        if cnt == 0: return []
-
-        workers = min(max_workers, cnt)
-        each_size = (cnt + workers - 1) // workers
+        """
+        Parallel version of update() method. It may be faster when there are many gas stations.
+        The returned list is in the same order as update().
+        """
+        if len(self._s) == 0: return []
 
         def update_range(l:int, r:int):
-            ret = []
+            ret:List[List[GV]] = []
             for i in range(l, r):
-                ret.append(self._s[i].update(sec, cur_time, pb_g))
+                ret.append(_by_name(self._s[i].update(sec, cur_time, pb_g)))
             return ret
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(update_range, i * each_size, min((i + 1) * each_size, cnt)) 
-                for i in range(workers)
-            ]
-            ret = []
-            for future in futures:
-                for lst in future.result():
-                    ret.extend(lst)
+        ret:List[GV] = []
+        for lst in self._get_pool(max_workers).map_ranges(update_range, [len(gs) for gs in self._s]):
+            for gvs in lst:
+                ret.extend(gvs)
         return ret
     
     def get_veh_count(self) -> List[int]:
@@ -585,6 +626,17 @@ class MixedHub:
         self.fcs.reset()
         self.scs.reset()
         self.gs.reset()
+    
+    def attach_fleet(self, fleet: Optional[EVFleet]):
+        """Attach the EV fleet to all FCS and SCS."""
+        self.fcs.attach_fleet(fleet)
+        self.scs.attach_fleet(fleet)
+    
+    def close_pools(self):
+        """Stop the worker threads used by update_parallel() of all hubs."""
+        self.fcs.close_pool()
+        self.scs.close_pool()
+        self.gs.close_pool()
 
     def get_bind_of(self, name:str) -> str:
         if name in self.fcs._remap:
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, TypeVar
+
+
+T_Result = TypeVar("T_Result")
+
+
+def split_chunks(weights: Sequence[int], parts: int) -> List[Tuple[int, int]]:
+    """
+    Split the stations into at most `parts` contiguous ranges of similar total weight.
+
+    :param weights: Weight of each station, e.g. the number of vehicles in it
+    :param parts: Maximum number of ranges
+    :return: List of (l, r) ranges, covering [0, len(weights)) in order
+    """
+    cnt = len(weights)
+    if cnt == 0: return []
+    parts = max(1, min(parts, cnt))
+    # An empty station still costs a little, so every station weighs at least 1
+    total = sum(weights) + cnt
+    ret: List[Tuple[int, int]] = []
+    l = 0; acc = 0
+    for i, w in enumerate(weights):
+        acc += w + 1
+        k = len(ret) + 1
+        if k < parts and acc * parts >= total * k:
+            ret.append((l, i + 1))
+            l = i + 1
+    if l < cnt:
+        ret.append((l, cnt))
+    return ret
+
+
+class StationPool:
+    """
+    Long-lived worker pool used by the update_parallel() methods of a station hub.
+    The pool is created once and reused by every simulation step,
+    so the per-step cost is only the dispatch of the chunks.
+
+    The workers are threads, which only overlap the station updates on free-threaded Python.
+    Under the GIL, TrafficInst uses the serial update() instead. A process backend is not provided:
+    the fleet kernels of a station are NumPy calls on a few slots of the EVFleet arrays,
+    surrounded by allocators, price getters and willingness checks on live EV objects.
+    Workers in other processes would need the station and vehicle state mirrored every step,
+    and the per-station round trips cost more than the kernels they would run.
+    """
+    def __init__(self, max_workers: int):
+        """
+        :param max_workers: Maximum number of worker threads
+        """
+        assert max_workers >= 1
+        self.__max_workers = max_workers
+        self.__pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def max_workers(self) -> int:
+        """Maximum number of worker threads"""
+        return self.__max_workers
+
+    def map_ranges(self, func: Callable[[int, int], T_Result], weights: Sequence[int]) -> List[T_Result]:
+        """
+        Call func(l, r) for each chunk of stations in the worker threads.
+
+        :param func: Function updating the stations in [l, r)
+        :param weights: Weight of each station, used to balance the chunks
+        :return: Results of all chunks, in the order of the stations
+        """
+        # The main thread takes the first chunk instead of waiting idle
+        ranges = split_chunks(weights, self.__max_workers + 1)
+        if len(ranges) <= 1:
+            return [func(l, r) for l, r in ranges]
+        if self.__pool is None:
+            self.__pool = ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="v2sim-station")
+        futures = [self.__pool.submit(func, l, r) for l, r in ranges[1:]]
+        ret = [func(*ranges[0])]
+        ret.extend(f.result() for f in futures)
+        return ret
+
+    def shutdown(self):
+        """Stop the worker threads. The pool is recreated on the next call of map_ranges()."""
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=True)
+            self.__pool = None
+
+    def __getstate__(self):
+        # Threads cannot be pickled. They are recreated on demand after loading.
+        state = self.__dict__.copy()
+        state["_StationPool__pool"] = None
+        return state
+
+
+__all__ = ["StationPool", "split_chunks"]
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from bisect import bisect_right
 from collections import deque
 from itertools import chain
 from typing import Deque, Dict, List, Optional, Set, Tuple, Type, TypeVar, Generic, Union
@@ -12,6 +13,12 @@ T_Vehicle = TypeVar("T_Vehicle", bound=Vehicle)
 
 class PriceGetter(ABC):
     """Price getter interface"""
+    vehicle_dependent: bool = True
+    """
+    Whether the price may differ between vehicles, or change within a time step.
+    Stations compute the price of a vehicle-independent getter only once per step.
+    """
+
     @abstractmethod
     def get_price(self, t: int, station: "BaseStation[T_Vehicle]", veh: T_Vehicle) -> float:...
     
@@ -53,6 +60,8 @@ PriceGetterLike = Union[PriceGetter, float, SegFunc, Tuple[List[int], List[float
 
 class ConstPriceGetter(PriceGetter):
     """Constant price getter"""
+    vehicle_dependent = False
+
     def __init__(self, price: float):
         super().__init__()
         self._price = price
@@ -76,12 +85,38 @@ class ConstPriceGetter(PriceGetter):
 
 class ToUPriceGetter(PriceGetter):
     """Time-of-Use price getter"""
+    vehicle_dependent = False
+
     def __init__(self, price_func: SegFunc):
         super().__init__()
         self._price_func = price_func
+        self._compile()
+    
+    def _compile(self):
+        # Breakpoints of the price function. As the simulation time advances monotonically,
+        # the lookup starts from the segment of the last query, which is O(1) amortised.
+        self._tl: List[int] = list(self._price_func._tl)
+        self._d: List[float] = list(self._price_func._d)
+        self._cur: int = 0
+    
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if "_tl" not in state: self._compile()
+    
+    def _lookup(self, t: int) -> float:
+        """Same as self._price_func(t)"""
+        tl = self._tl; i = self._cur
+        if len(tl) == 0 or t < tl[0]:
+            return self._price_func(t)
+        if tl[i] > t:
+            i = bisect_right(tl, t) - 1
+        elif i + 1 < len(tl) and tl[i + 1] <= t:
+            i = bisect_right(tl, t, i + 1) - 1
+        self._cur = i
+        return self._d[i]
     
     def get_price(self, t: int, station: "BaseStation[T_Vehicle]", veh: T_Vehicle) -> float:
-        return self._price_func(t)
+        return self._lookup(t)
 
     def _to_xml(self, tag: str) -> Element:
         return self._price_func.toXMLNode(tag, "item", "btime", "price")
@@ -105,6 +140,8 @@ class ToUPriceGetter(PriceGetter):
 
 class ToUSoCPriceGetter(ToUPriceGetter):
     """ToU price getter with SoC-based penalty"""
+    vehicle_dependent = True
+
     def __init__(self, base_price: SegFunc, soc_threshold: float, penalty_price: float):
         super().__init__(base_price)
         self._soc_threshold = soc_threshold
@@ -113,9 +150,9 @@ class ToUSoCPriceGetter(ToUPriceGetter):
     def __call__(self, t: int, station: "BaseStation[T_Vehicle]", veh: T_Vehicle) -> float:
         soc = veh.soc  # Assuming veh has a soc attribute representing State-of-Charge
         if soc > self._soc_threshold:
-            return self._price_func(t) + self._penalty_price
+            return self._lookup(t) + self._penalty_price
         else:
-            return self._price_func(t)
+            return self._lookup(t)
     
     def to_xml(self, tag: str) -> Element:
         elem = self._price_func.toXMLNode(tag, "item", "btime", "price")
@@ -128,6 +165,8 @@ class ToUSoCPriceGetter(ToUPriceGetter):
 
 class ToUQueuePriceGetter(ToUPriceGetter):
     """ToU price getter with queue-based penalty"""
+    vehicle_dependent = True # The queue changes as vehicles leave within a step
+
     def __init__(self, base_price: SegFunc, queue_threshold: int, unit_penalty_price: float, max_penalty_price: float):
         super().__init__(base_price)
         self._queue_threshold = queue_threshold
@@ -137,9 +176,9 @@ class ToUQueuePriceGetter(ToUPriceGetter):
     def __call__(self, t: int, station: "BaseStation[T_Vehicle]", veh: T_Vehicle) -> float:
         queue_length = station.wait_count()
         if queue_length > self._queue_threshold:
-            return self._price_func(t) + min(self._unit_penalty_price * (self._queue_threshold - queue_length), self._max_penalty_price)
+            return self._lookup(t) + min(self._unit_penalty_price * (self._queue_threshold - queue_length), self._max_penalty_price)
         else:
-            return self._price_func(t)
+            return self._lookup(t)
     
     def to_xml(self, tag: str) -> Element:
         elem = self._price_func.toXMLNode(tag, "item", "btime", "price")
@@ -206,7 +245,25 @@ def _pget_from_like(like: PriceGetterLike) -> PriceGetter:
         raise TypeError(f"Unsupported PriceGetterLike type: {type(like)}")
 
 
+def _snapshot_price(getter: PriceGetter, snap: Tuple[int, float], t: int, station: "BaseStation", veh: Vehicle) -> Tuple[float, Optional[Tuple[int, float]]]:
+    """
+    Price of a vehicle from the per-step snapshot of a station.
+
+    :return: (price, new snapshot). The new snapshot is None if the snapshot is still valid or not applicable.
+    """
+    if getter.vehicle_dependent or hasattr(getter, "_val"):
+        return getter(t, station, veh), None
+    if snap[0] == t:
+        return snap[1], None
+    p = getter(t, station, veh)
+    return p, (t, p)
+
+
 class BaseStation(Generic[T_Vehicle], ABC):
+    # Per-step snapshot of the vehicle-independent buying price: (time, price).
+    # It is replaced as a whole, so that a thread never sees the price of another step.
+    _pbuy_snap: Tuple[int, float] = (-1, 0.0)
+
     def __init__(self, name: str, bind: str, slots: int, x: float, y: float, price_buy: PriceGetterLike, 
             price_buy_is_service_fee:bool = False, offline: Optional[RangeList] = None,
             allow_queuing: bool=True, pos: float = float("inf")):
@@ -302,7 +359,14 @@ class BaseStation(Generic[T_Vehicle], ABC):
 
     def pbuy(self, t: int, veh: T_Vehicle) -> float:
         """Price of unit energy for users, $/kWh or $/L. If price_buy_is_service_fee is True, this price is a service fee added on top of the energy cost (e.g., electricity purchase price), otherwise it is the actual price of energy."""
-        return self._pbuy(t, self, veh)
+        p, snap = _snapshot_price(self._pbuy, self._pbuy_snap, t, self, veh)
+        if snap is not None: self._pbuy_snap = snap
+        return p
+    
+    @property
+    def pbuy_vehicle_dependent(self) -> bool:
+        """Whether the buying price may differ between vehicles in the same time step"""
+        return self._pbuy.vehicle_dependent and not hasattr(self._pbuy, "_val")
     
     @property
     def pbuy_is_service_fee(self) -> bool:
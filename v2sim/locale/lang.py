@@ -243,7 +243,13 @@ You can load the commands from a file as an argument in the command prompt/termi
     BAD_TRIP_DEPART_TIME = "Trip departure time must be in ascending order, but got {0} after {1} for vehicle {2}'s trip {3}"
     PARA_WORLDS = "Paraworlds created. Number of sub-worlds: {0}."
     SINGLE_WORLD = "Single world created."
+    PROC_PARA_WORLDS = "Process-based Paraworlds created. Number of sub-worlds: {0}."
+    PROC_WORLD_FAILED = "Worker process of sub-world {0} failed:\n{1}"
     ROUTE_ALGO_NOT_SUPPORTED = "Route calculation algorithm '{0}' is not supported. Candidates are: dijkstra, astar"
+    ROUTE_CACHE_STATS = "Route cache: {size} entries, {hits} hits, {misses} misses, {evictions} evictions, {invalidations} invalidations."
+    CH_LOADED = "Contraction hierarchy loaded: {} arcs."
+    CH_LOAD_FAILED = "Failed to load contraction hierarchy {0}: {1}"
+    CH_SAVE_FAILED = "Failed to save contraction hierarchy {0}: {1}"
     VEH_NOT_FOUND = "Vehicle {0} not found in the simulator."
     VEH_HAS_NO_LINK = "Vehicle {0} has no link assigned."
     NO_AVAILABLE_FCS = "No FCS is available at this time, please check the configuration."
@@ -255,7 +261,10 @@ You can load the commands from a file as an argument in the command prompt/termi
     EDGE_NOT_FOUND = "Edge {0} does not exist."
     INVALID_SUMO_NETWORK = "Invalid SUMO network: {0}"
     UNKNOWN_NET_FORMAT = "Unknown network format: {0}. Candidates: raw, sumo, auto."
-    GIL_NOT_DISABLED = "Warning: ParaWorlds requires Python to be built with GIL disabled. Falling back to SingleWorld."
+    UNKNOWN_PARTITION_METHOD = "Unknown partitioning method: {0}. Candidates: multilevel, geographic."
+    GIL_NOT_DISABLED = "ParaWorlds requires Python to be built with GIL disabled. Using process-based ParaWorlds instead."
+    PROC_WORLDS_SINGLE_CPU = "Warning: Process-based ParaWorlds requires more than one CPU. Falling back to SingleWorld."
+    REBALANCE_NOT_SUPPORTED = "Warning: Load rebalancing is only supported by thread-based ParaWorlds. Ignored."
     NO_GEO_PROJ = "Network does not provide geo-projection"
     SIMULATION_MAY_STALL = "Simulation may stall: average speed < 0.001 m/s at time {0}."
     PY_VERSION_MISMATCH_TI = "Python version mismatch for TrafficInst: Expect {0}, got {1}."
@@ -215,7 +215,13 @@ class _locale:
     BAD_TRIP_DEPART_TIME = "行程出发时间必须按升序排列，但车辆{2}的行程{3}的出发时间{0}早于{1}"
     PARA_WORLDS = "已创建{0}个并行仿真."
     SINGLE_WORLD = "已创建单个串行仿真."
+    PROC_PARA_WORLDS = "已创建{0}个多进程并行仿真."
+    PROC_WORLD_FAILED = "子仿真{0}的工作进程出错:\n{1}"
     ROUTE_ALGO_NOT_SUPPORTED = "寻路算法'{0}'无效. 可用项为: dijkstra, astar"
+    ROUTE_CACHE_STATS = "路径缓存: {size}条, 命中{hits}次, 未命中{misses}次, 淘汰{evictions}次, 失效{invalidations}次."
+    CH_LOADED = "收缩层次索引已加载: {}条弧."
+    CH_LOAD_FAILED = "无法加载收缩层次索引{0}: {1}"
+    CH_SAVE_FAILED = "无法保存收缩层次索引{0}: {1}"
     VEH_NOT_FOUND = "车辆{0}不在仿真中."
     VEH_HAS_NO_LINK = "车辆{0}不在任何道路上."
     NO_AVAILABLE_FCS = "目前没有可用快充站，请调整配置."
@@ -227,7 +233,10 @@ class _locale:
     EDGE_NOT_FOUND = "边{0}不存在."
     INVALID_SUMO_NETWORK = "无效的SUMO网络: {0}"
     UNKNOWN_NET_FORMAT = "未知的网络格式: {0}. 可用项: raw, sumo, auto."
-    GIL_NOT_DISABLED = "警告: 并行仿真需要在禁用GIL的情况下启动Python. 已回退到串行仿真."
+    UNKNOWN_PARTITION_METHOD = "未知的路网划分方法: {0}. 可用项: multilevel, geographic."
+    GIL_NOT_DISABLED = "多线程并行仿真需要在禁用GIL的情况下启动Python. 已改用多进程并行仿真."
+    PROC_WORLDS_SINGLE_CPU = "警告: 多进程并行仿真需要多个CPU. 已回退到串行仿真."
+    REBALANCE_NOT_SUPPORTED = "警告: 仅多线程并行仿真支持负载再平衡. 已忽略."
     NO_GEO_PROJ = "网络不提供地理投影"
     SIMULATION_MAY_STALL = "仿真可能停滞：时间 {0} 处平均速度 < 0.001 米/秒。"
     PY_VERSION_MISMATCH_TI = "TrafficInst 的 Python 版本不匹配：预期 {0}，实际 {1}。"
@@ -4,13 +4,16 @@ import numpy as np
 import sumolib
 from xml.etree.ElementTree import Element, ElementTree, SubElement
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union, Set
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union, Set
 from collections import defaultdict
 from dataclasses import dataclass, field
 from scipy.cluster.vq import kmeans, vq
 from scipy.spatial import KDTree
 from .utils import DetectFiles, ReadXML
 from .locale import Lang
+if TYPE_CHECKING:
+    from .partition import TripFlows, PartitionStats
+    from .sim.uxworld import RebalanceConfig
 
 
 def _largeStackExec(func, *args):
@@ -672,8 +675,12 @@ class RoadNet:
             return self.create_singleworld(**kwargs)
         else:
             if not hasattr(sys, "_is_gil_enabled") or sys._is_gil_enabled(): # type: ignore
+                if (os.cpu_count() or 1) < 2:
+                    if not silent: print(Lang.PROC_WORLDS_SINGLE_CPU)
+                    return self.create_singleworld(**kwargs)
                 if not silent: print(Lang.GIL_NOT_DISABLED)
-                return self.create_singleworld(**kwargs)
+                if kwargs.get("rebalance") is not None and not silent: print(Lang.REBALANCE_NOT_SUPPORTED)
+                return self.create_procworlds(**kwargs)
             return self.create_paraworlds(**kwargs)
 
     def get_gl(self) -> Dict[str, List[Tuple[str, Edge]]]:
@@ -692,6 +699,7 @@ class RoadNet:
         kwargs.pop("silent", None)
         kwargs.pop("name", None)
         kwargs.pop("save_mode", None)
+        kwargs.pop("rebalance", None)
         world = World(name="0", save_mode=False, **kwargs)
            
         gl: Graph = {nid: [] for nid in self.nodes}
@@ -708,7 +716,14 @@ class RoadNet:
         
         return SingleWorld(world, gl)
 
-    def create_paraworlds(self, **kwargs):
+    def create_paraworlds(self, rebalance: Optional['RebalanceConfig'] = None, **kwargs):
+        """
+        Create partitioned worlds simulated in threads, one world per world_id.
+
+        Args:
+            rebalance: Configuration of the adaptive load rebalancing. If given, the boundary edges of
+                the neighbouring partitions within rebalance.depth hops are copied into each world, closed until migrated there.
+        """
         from .sim.uxsim import World
         from .sim.uxworld import ParaWorlds
         from .sim.routing import Graph
@@ -743,7 +758,56 @@ class RoadNet:
                 length = edge.length, free_flow_speed = edge.speed_limit, number_of_lanes = edge.lanes)
             gl[fr].append((to, link))
         
-        return ParaWorlds(worlds, gl)
+        if rebalance is None:
+            return ParaWorlds(worlds, gl)
+        
+        # Copy the edges within rebalance.depth hops from the region of each world, in the order of self.edges
+        incident:Dict[str, List[Edge]] = defaultdict(list)
+        for edge in self.edges.values():
+            incident[edge.from_node.name].append(edge)
+            incident[edge.to_node.name].append(edge)
+        for wid, W in worlds.items():
+            reached = set(W.NODES_NAME_DICT)
+            halo:Set[str] = set()
+            for _ in range(rebalance.depth):
+                ring = {e.name for n in reached for e in incident[n] if e.world_id != wid and e.name not in halo}
+                halo |= ring
+                reached |= {n for e in ring for n in (self.edges[e].from_node.name, self.edges[e].to_node.name)}
+            for edge in self.edges.values():
+                if edge.name not in halo: continue
+                fr = edge.from_node.name
+                to = edge.to_node.name
+                if fr not in W.NODES_NAME_DICT:
+                    W.addNode(name = fr, x = edge.from_node.x, y = edge.from_node.y)
+                if to not in W.NODES_NAME_DICT:
+                    W.addNode(name = to, x = edge.to_node.x, y = edge.to_node.y)
+                W.addLink(name = edge.name, start_node = fr, end_node = to, length = edge.length,
+                    free_flow_speed = edge.speed_limit, number_of_lanes = edge.lanes)
+        owners = {edge.name: edge.world_id for edge in self.edges.values()}
+        return ParaWorlds(worlds, gl, owners, rebalance)
+
+    def create_procworlds(self, **kwargs):
+        """Create partitioned worlds simulated in worker processes, one process per world_id"""
+        from .sim.uxworld import ProcParaWorlds, RemoteNode
+
+        kwargs.pop("silent", None)
+        kwargs.pop("rebalance", None)
+        kwargs.pop("name", None)
+        kwargs.pop("print_mode", None)
+        kwargs.pop("save_mode", None)
+
+        if all(edge.world_id == -1 for edge in self.edges.values()):
+            for edge in self.edges.values():
+                edge.world_id = 0
+        
+        if any(edge.world_id == -1 for edge in self.edges.values()):
+            raise RuntimeError("Some edges do not specify world_id while others do. Please specify world_id for all edges or none.")
+        
+        nodes = {nid: RemoteNode(nid, node.x, node.y) for nid, node in self.nodes.items()}
+        edges = [(edge.world_id, (edge.name, nodes[edge.from_node.name], nodes[edge.to_node.name],
+            edge.length, edge.speed_limit, edge.lanes)) for edge in self.edges.values()]
+        
+        return ProcParaWorlds(nodes.values(), edges, kwargs)
 
     def hasGeoProj(self):
         return self.projParameter != "!"
@@ -801,14 +865,41 @@ class RoadNet:
             y -= y_off
         return self.getGeoProj()(x, y, inverse=True)
 
-    def partition_roadnet(self, num_partitions: int) -> None:
-        edge_groups = self._group_reverse_edges()
-
-        partition_assignment = self._geographic_clustering(edge_groups, num_partitions)
+    def partition_roadnet(self, num_partitions: int, method: str = "geographic",
+            trips: Union[None, str, 'TripFlows'] = None, imbalance: float = 0.03, seed: int = 0) -> None:
+        """Assign world_id to all edges.
+        
+        Args:
+            num_partitions: Number of partitions.
+            method: "geographic" clusters the edges by k-means on their coordinates,
+                "multilevel" minimises the expected cross-partition handoffs by multilevel graph partitioning.
+            trips: Trip file or expected traffic, used by the multilevel method to weight edges and nodes by flow.
+            imbalance: Tolerated load imbalance of the multilevel method. The geographic method does not balance the load,
+                so at a tight tolerance the multilevel method may hand over more vehicles than the geographic one.
+            seed: Random seed of the multilevel method.
+        """
+        if method == "geographic":
+            edge_groups = self._group_reverse_edges()
+            partition_assignment = self._geographic_clustering(edge_groups, num_partitions)
+        elif method == "multilevel":
+            from .partition import TripFlows, partition_nodes
+            if isinstance(trips, (str, Path)):
+                trips = TripFlows.from_trip_file(self, trips)
+            parts = partition_nodes(self, num_partitions, trips, imbalance, seed)
+            partition_assignment = {eid: parts[e.from_node.name] for eid, e in self.edges.items()}
+        else:
+            raise ValueError(Lang.UNKNOWN_PARTITION_METHOD.format(method))
         
         for edge_id, partition_id in partition_assignment.items():
             self.edges[edge_id].world_id = partition_id
 
+    def partition_stats(self, trips: Union[None, str, 'TripFlows'] = None) -> 'PartitionStats':
+        """Evaluate the current partition: edge cut, cross-partition transfers per hour (if trips are given) and load imbalance"""
+        from .partition import TripFlows, partition_stats
+        if isinstance(trips, (str, Path)):
+            trips = TripFlows.from_trip_file(self, trips)
+        return partition_stats(self, trips)
+
     def _group_reverse_edges(self) -> List[Set[str]]:
         edge_lookup = {}
         for edge_id, edge in self.edges.items():
@@ -1072,13 +1163,25 @@ def ConvertCase(input_dir:str, output_dir:str, part_cnt:int, auto_partition:bool
     return converted
 
 
+def _partition(rn:RoadNet, partitions:int, method:str, trip_file:Optional[str], imbalance:float):
+    trips = None
+    if trip_file is not None:
+        from .partition import TripFlows
+        trips = TripFlows.from_trip_file(rn, trip_file)
+    rn.partition_roadnet(partitions, method, trips, imbalance)
+    return rn.partition_stats(trips)
+
+
 def SplitSUMONetwork(
     net_file:str,
     output_file:str,
-    partitions:int
+    partitions:int,
+    method:str = "geographic",
+    trip_file:Optional[str] = None,
+    imbalance:float = 0.03,
 ):
     rn = RoadNet.load_sumo(net_file, only_passenger=False)
-    rn.partition_roadnet(partitions)
+    stats = _partition(rn, partitions, method, trip_file, imbalance)
     parts = defaultdict(list)
     nodes = defaultdict(set)
 
@@ -1106,35 +1209,79 @@ def SplitSUMONetwork(
             "edges": {str(pid): edges for pid, edges in parts.items()},
             "meso": {str(pid): False for pid in parts}
         }, fp, indent=4)
+    return stats
     
 
 def SplitUXNetwork(
     net_file:str,
     output_file:str,
-    partitions:int
+    partitions:int,
+    method:str = "geographic",
+    trip_file:Optional[str] = None,
+    imbalance:float = 0.03,
 ):
     rn = RoadNet.load(net_file)
-    rn.partition_roadnet(partitions)
+    stats = _partition(rn, partitions, method, trip_file, imbalance)
     rn.save(output_file)
+    return stats
 
 
-def SplitCase(input_dir:str, output_dir:str, partitions:int):
+def SplitCase(input_dir:str, output_dir:str, partitions:int, method:str = "geographic", use_trips:bool = True,
+        imbalance:float = 0.03):
     """Split a case into multiple parts by partitioning the road network.
     
     Args:
         input_dir: Input directory path.
         output_dir: Output directory path.
         partitions: Number of partitions to split into.
+        method: Partitioning method, "geographic" or "multilevel".
+        use_trips: Whether to weight the partitioning by the flows of the trip file in the case, if any.
+        imbalance: Tolerated load imbalance of the multilevel method.
+    
+    Returns:
+        Quality of the partition.
     """
     files = DetectFiles(input_dir)
-    assert files.net is not None and files.sumo is not None, "No network file found in the input directory."
+    assert files.net is not None, "No network file found in the input directory."
+    trip_file = files.veh if use_trips else None
     
     if files.sumo:
         output_file = str(Path(output_dir) / (Path(files.net).stem + "_partitions" + Path(files.net).suffix))
-        SplitSUMONetwork(files.net, output_file, partitions)
+        return SplitSUMONetwork(files.net, output_file, partitions, method, trip_file, imbalance)
     else:
         output_file = str(Path(output_dir) / Path(files.net).name)
-        SplitUXNetwork(files.net, output_file, partitions)
+        return SplitUXNetwork(files.net, output_file, partitions, method, trip_file, imbalance)
 
 
-__all__ = ["Node", "Edge", "SubNet", "RoadNet", "ConvertCase", "SplitCase", "SplitSUMONetwork", "SplitUXNetwork"]
\ No newline at end of file
+def EvaluatePartitions(input_dir:str, candidates:List[int], method:str = "geographic", use_trips:bool = True,
+        imbalance:float = 0.03):
+    """Partition the road network of a case into each candidate number of parts and evaluate the quality, without saving.
+    
+    Args:
+        input_dir: Input directory path.
+        candidates: Candidate numbers of partitions.
+        method: Partitioning method, "geographic" or "multilevel".
+        use_trips: Whether to weight the partitioning by the flows of the trip file in the case, if any.
+        imbalance: Tolerated load imbalance of the multilevel method.
+    
+    Returns:
+        Number of partitions -> quality of the partition.
+    """
+    files = DetectFiles(input_dir)
+    assert files.net is not None, "No network file found in the input directory."
+    if files.sumo:
+        rn = RoadNet.load_sumo(files.net, only_passenger=False)
+    else:
+        rn = RoadNet.load(files.net)
+    trips = None
+    if use_trips and files.veh is not None:
+        from .partition import TripFlows
+        trips = TripFlows.from_trip_file(rn, files.veh)
+    ret = {}
+    for k in candidates:
+        rn.partition_roadnet(k, method, trips, imbalance)
+        ret[k] = rn.partition_stats(trips)
+    return ret
+
+
+__all__ = ["Node", "Edge", "SubNet", "RoadNet", "ConvertCase", "SplitCase", "SplitSUMONetwork", "SplitUXNetwork", "EvaluatePartitions"]
\ No newline at end of file
@@ -0,0 +1,489 @@
+"""
+Multilevel graph partitioning of road networks.
+
+Nodes of the road network are partitioned, and each edge goes to the partition of its start node.
+A vehicle is then handed over to another partition exactly when it passes an edge whose end nodes
+are in different partitions and continues its trip. The partitioner minimises the expected number
+of such handoffs (edge cut weighted by the flow through the edges) while balancing the load of the
+partitions (number of edges plus the traffic on them). The expected flows are derived from the OD
+counts of a trip file by free-flow shortest routes.
+
+The k-way partition is made by recursive bisection. Each bisection is multilevel:
+the graph is coarsened by heavy-edge matching, the coarsest graph is bisected by greedy
+graph growing, and the bisection is refined by Fiduccia-Mattheyses (FM) passes while uncoarsening.
+"""
+import heapq, math
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from .utils import ReadXML
+
+if TYPE_CHECKING:
+    from .net import RoadNet
+
+# Attribute names of origins and destinations in trip files, same as LoadVehicles
+_O_ATTRS = ("from", "origin", "o", "O", "fromNode", "from_node", "fromEdge", "from_edge")
+_D_ATTRS = ("to", "dest", "d", "D", "toNode", "to_node", "toEdge", "to_edge")
+
+# Graphs with no more nodes than this are not coarsened further
+_COARSEST = 64
+# Number of tries of the initial bisection
+_INIT_TRIES = 8
+# Number of independent multilevel runs of each bisection, the best of which is kept
+_NCUTS = 4
+# FM pass stops after this many moves without improvement
+_FM_PATIENCE = 50
+# Cost of cutting an edge besides its handoffs, relative to the handoffs of an edge of average flow
+_EDGE_COST = 0.1
+
+
+@dataclass
+class TripFlows:
+    """
+    Expected traffic on a road network, derived from the OD counts of a trip file.
+    Each OD pair is routed along its free-flow shortest route.
+    """
+    edge_ids: List[str]
+    # Number of trips using each edge
+    flow: np.ndarray
+    # Number of trips passing each edge and continuing their trips, i.e., the trips leaving the end node of the edge on another edge
+    through: np.ndarray
+    # Consecutive edge pairs on the routes and their trip counts
+    turn_from: np.ndarray
+    turn_to: np.ndarray
+    turn_count: np.ndarray
+    # Time span of the departures in hours, at least 1
+    hours: float
+    trips: int
+    unrouted: int
+
+    @staticmethod
+    def load_od(rnet: 'RoadNet', trip_file: Union[str, Path]) -> Tuple[Dict[Tuple[str, str], int], float]:
+        """
+        Count the trips between each pair of nodes in a trip file.
+        Origins and destinations given as edges are mapped to the start and end nodes of the edges.
+
+        Returns:
+            OD counts, and the time span of the departures in hours.
+        """
+        rt = ReadXML(trip_file).getroot()
+        od: Dict[Tuple[str, str], int] = {}
+        t0 = math.inf; t1 = -math.inf
+        def _node(name: str, attr: str) -> Optional[str]:
+            if name in rnet.nodes: return name
+            edge = rnet.edges.get(name)
+            if edge is None: return None
+            return getattr(edge, attr).name
+        for veh in rt:
+            for trip in veh:
+                if trip.tag != "trip": continue
+                a = trip.attrib
+                O = next((a[k] for k in _O_ATTRS if k in a), "")
+                D = next((a[k] for k in _D_ATTRS if k in a), "")
+                if O == "" or D == "":
+                    route = a.get("route_edges", "").split()
+                    if len(route) == 0: continue
+                    if O == "": O = route[0]
+                    if D == "": D = route[-1]
+                o = _node(O, "from_node"); d = _node(D, "to_node")
+                if o is None or d is None or o == d: continue
+                od[(o, d)] = od.get((o, d), 0) + 1
+                if "depart" in a:
+                    t = float(a["depart"])
+                    t0 = min(t0, t); t1 = max(t1, t)
+        hours = max(1.0, (t1 - t0) / 3600) if t1 >= t0 else 1.0
+        return od, hours
+
+    @staticmethod
+    def from_od(rnet: 'RoadNet', od: Dict[Tuple[str, str], int], hours: float = 1.0, chunk: int = 256) -> 'TripFlows':
+        """
+        Route the OD counts along the free-flow shortest routes.
+
+        Args:
+            rnet: Road network
+            od: (origin node, destination node) -> number of trips
+            hours: Time span of the trips in hours
+            chunk: Number of origins searched together
+        """
+        nidx = {n: i for i, n in enumerate(rnet.nodes)}
+        edges = list(rnet.edges.values())
+        E = len(edges)
+        # Free-flow travel time of each edge. The fastest of parallel edges is used.
+        best: Dict[Tuple[int, int], Tuple[float, int]] = {}
+        for k, e in enumerate(edges):
+            u = nidx[e.from_node.name]; v = nidx[e.to_node.name]
+            if u == v: continue
+            w = e.length / e.speed_limit if e.speed_limit > 0 else e.length
+            if (u, v) not in best or w < best[(u, v)][0]:
+                best[(u, v)] = (max(w, 1e-6), k)
+        rows = np.fromiter((u for u, _ in best), dtype=np.int64, count=len(best))
+        cols = np.fromiter((v for _, v in best), dtype=np.int64, count=len(best))
+        wts = np.fromiter((w for w, _ in best.values()), dtype=np.float64, count=len(best))
+        G = csr_matrix((wts, (rows, cols)), shape=(len(nidx), len(nidx)))
+        eid = {uv: k for uv, (_, k) in best.items()}
+
+        by_origin: Dict[int, List[Tuple[int, int]]] = {}
+        for (o, d), c in od.items():
+            if o in nidx and d in nidx:
+                by_origin.setdefault(nidx[o], []).append((nidx[d], c))
+        flow = np.zeros(E); through = np.zeros(E)
+        turns: Dict[Tuple[int, int], int] = {}
+        trips = sum(od.values()); routed = 0
+        origins = list(by_origin.keys())
+        for i in range(0, len(origins), chunk):
+            idx = origins[i:i + chunk]
+            _, pred = dijkstra(G, directed=True, indices=idx, return_predecessors=True)
+            for r, o in enumerate(idx):
+                pr = pred[r].tolist()
+                for d, c in by_origin[o]:
+                    if pr[d] < 0: continue
+                    path: List[int] = []
+                    v = d
+                    while v != o:
+                        u = pr[v]
+                        path.append(eid[(u, v)])
+                        v = u
+                    path.reverse()
+                    routed += c
+                    for k in path: flow[k] += c
+                    for a, b in zip(path, path[1:]):
+                        through[a] += c
+                        turns[(a, b)] = turns.get((a, b), 0) + c
+        return TripFlows(
+            [e.name for e in edges], flow, through,
+            np.fromiter((a for a, _ in turns), dtype=np.int64, count=len(turns)),
+            np.fromiter((b for _, b in turns), dtype=np.int64, count=len(turns)),
+            np.fromiter(turns.values(), dtype=np.float64, count=len(turns)),
+            hours, trips, trips - routed,
+        )
+
+    @staticmethod
+    def from_trip_file(rnet: 'RoadNet', trip_file: Union[str, Path]) -> 'TripFlows':
+        """Load the OD counts of a trip file and route them along the free-flow shortest routes"""
+        od, hours = TripFlows.load_od(rnet, trip_file)
+        return TripFlows.from_od(rnet, od, hours)
+
+    def edge_load(self) -> np.ndarray:
+        """
+        Simulation load of each edge: 1 for the edge itself plus its flow, scaled such that
+        the edges and the traffic contribute equally to the total load.
+        """
+        E = len(self.edge_ids)
+        s = self.flow.sum()
+        return np.ones(E) if s <= 0 else 1 + self.flow * (E / s)
+
+
+@dataclass
+class PartitionStats:
+    """Quality of a partition of a road network"""
+    parts: int
+    # Number of edges whose end node has an out-edge in another partition
+    edge_cut: int
+    # Expected number of vehicles handed over between partitions per hour. None if no trips are given.
+    transfers_per_hour: Optional[float]
+    # Load of the heaviest partition over the average load, minus 1
+    imbalance: float
+    # Load of each partition
+    loads: Dict[int, float]
+
+    def __str__(self):
+        tr = "n/a" if self.transfers_per_hour is None else f"{self.transfers_per_hour:.1f}"
+        return (f"{self.parts} partitions: edge cut {self.edge_cut}, "
+            f"transfers {tr} veh/h, imbalance {self.imbalance * 100:.1f}%")
+
+
+def partition_stats(rnet: 'RoadNet', flows: Optional[TripFlows] = None) -> PartitionStats:
+    """
+    Evaluate the current partition (world_id of edges) of a road network.
+
+    Args:
+        rnet: Road network
+        flows: Expected traffic. If None, the transfers are not evaluated and every edge has load 1.
+    """
+    edges = list(rnet.edges.values())
+    wid = np.array([e.world_id for e in edges], dtype=np.int64)
+    out_worlds: Dict[str, set] = {}
+    for e in edges:
+        out_worlds.setdefault(e.from_node.name, set()).add(e.world_id)
+    cut = sum(1 for e in edges if len(out_worlds.get(e.to_node.name, set()) - {e.world_id}) > 0)
+    if flows is not None:
+        assert flows.edge_ids == [e.name for e in edges], "Trip flows are not computed on this road network."
+        crossing = wid[flows.turn_from] != wid[flows.turn_to]
+        transfers = float(flows.turn_count[crossing].sum()) / flows.hours
+        load = flows.edge_load()
+    else:
+        transfers = None
+        load = np.ones(len(edges))
+    loads = {int(w): float(load[wid == w].sum()) for w in np.unique(wid)}
+    avg = sum(loads.values()) / max(1, len(loads))
+    imbalance = max(loads.values()) / avg - 1 if avg > 0 else 0.0
+    return PartitionStats(len(loads), cut, transfers, imbalance, loads)
+
+
+def _coarsen(A: csr_matrix, vw: np.ndarray, max_vw: float, rng: np.random.Generator):
+    """Heavy-edge matching. Returns the map to coarse nodes, the coarse graph and the coarse node weights."""
+    n = A.shape[0]
+    indptr = A.indptr.tolist(); indices = A.indices.tolist(); data = A.data.tolist()
+    w = vw.tolist()
+    cmap = [-1] * n
+    nc = 0
+    for u in rng.permutation(n).tolist():
+        if cmap[u] >= 0: continue
+        best = -1; bw = -1.0
+        for i in range(indptr[u], indptr[u + 1]):
+            v = indices[i]
+            if cmap[v] < 0 and v != u and data[i] > bw and w[u] + w[v] <= max_vw:
+                best = v; bw = data[i]
+        cmap[u] = nc
+        if best >= 0: cmap[best] = nc
+        nc += 1
+    cm = np.array(cmap, dtype=np.int64)
+    P = csr_matrix((np.ones(n), (np.arange(n), cm)), shape=(n, nc))
+    Ac = (P.T @ A @ P).tocsr()
+    Ac.setdiag(0)
+    Ac.eliminate_zeros()
+    return cm, Ac, np.bincount(cm, weights=vw, minlength=nc)
+
+
+class _Bisection:
+    """Bisection state of a graph, refined by FM passes"""
+    def __init__(self, A: csr_matrix, vw: np.ndarray, part: np.ndarray, frac: float, ub: float, coarse: bool = False):
+        self.indptr: List[int] = A.indptr.tolist()
+        self.indices: List[int] = A.indices.tolist()
+        self.data: List[float] = A.data.tolist()
+        self.vw: List[float] = vw.tolist()
+        self.n = A.shape[0]
+        self.part: List[int] = part.tolist()
+        total = float(vw.sum())
+        target = (total * frac, total * (1 - frac))
+        # Every side may exceed its target by the tolerance. Nodes of a coarse graph may be too heavy to
+        # meet it, so there a side may also exceed its target by the heaviest node. Finer levels restore the balance.
+        slack = max(vw.max(initial=0.), 0.) if coarse else 0.
+        self.max_w = (max(target[0] * ub, target[0] + slack), max(target[1] * ub, target[1] + slack))
+        self.target = target
+        self.W = [0.0, 0.0]
+        for u in range(self.n):
+            self.W[self.part[u]] += self.vw[u]
+
+    def gain(self, u: int) -> float:
+        """Reduction of the cut if u moves to the other side"""
+        g = 0.0; s = self.part[u]
+        for i in range(self.indptr[u], self.indptr[u + 1]):
+            g += self.data[i] if self.part[self.indices[i]] != s else -self.data[i]
+        return g
+
+    def cut(self) -> float:
+        c = 0.0
+        for u in range(self.n):
+            s = self.part[u]
+            for i in range(self.indptr[u], self.indptr[u + 1]):
+                if self.part[self.indices[i]] != s: c += self.data[i]
+        return c / 2
+
+    def overweight(self) -> float:
+        return max(0., self.W[0] - self.max_w[0]) + max(0., self.W[1] - self.max_w[1])
+
+    def fm_pass(self) -> bool:
+        """One FM pass. Returns whether the bisection is improved."""
+        part = self.part; vw = self.vw; W = self.W
+        gain = [self.gain(u) for u in range(self.n)]
+        heaps: Tuple[List[Tuple[float, int]], List[Tuple[float, int]]] = ([], [])
+        for u in range(self.n):
+            heaps[part[u]].append((-gain[u], u))
+        heapq.heapify(heaps[0]); heapq.heapify(heaps[1])
+        locked = [False] * self.n
+        moves: List[int] = []
+        cur = 0.0
+        best = (-self.overweight(), 0.0); best_len = 0
+        idle = 0
+        while idle < _FM_PATIENCE:
+            cand = None
+            ow = (W[0] > self.max_w[0], W[1] > self.max_w[1])
+            for s in (0, 1):
+                h = heaps[s]
+                while h and (locked[h[0][1]] or -h[0][0] != gain[h[0][1]]):
+                    heapq.heappop(h)
+                if not h: continue
+                g, u = -h[0][0], h[0][1]
+                # Moves must not overload the other side, and an overloaded side must be relieved first
+                if W[1 - s] + vw[u] > self.max_w[1 - s] and not ow[s]: continue
+                if ow[1 - s] and not ow[s]: continue
+                if cand is None or g > cand[0]: cand = (g, u, s)
+            if cand is None: break
+            g, u, s = cand
+            heapq.heappop(heaps[s])
+            part[u] = 1 - s; W[s] -= vw[u]; W[1 - s] += vw[u]
+            locked[u] = True
+            moves.append(u)
+            cur += g
+            for i in range(self.indptr[u], self.indptr[u + 1]):
+                v = self.indices[i]
+                if locked[v]: continue
+                gain[v] += -2 * self.data[i] if part[v] == part[u] else 2 * self.data[i]
+                heapq.heappush(heaps[part[v]], (-gain[v], v))
+            score = (-self.overweight(), cur)
+            if score > best:
+                best = score; best_len = len(moves); idle = 0
+            else:
+                idle += 1
+        for u in reversed(moves[best_len:]):
+            s = part[u]
+            part[u] = 1 - s; W[s] -= vw[u]; W[1 - s] += vw[u]
+        return best_len > 0
+
+    def refine(self, passes: int = 8):
+        for _ in range(passes):
+            if not self.fm_pass(): break
+
+
+def _grow_bisection(A: csr_matrix, vw: np.ndarray, frac: float, rng: np.random.Generator) -> np.ndarray:
+    """Greedy graph growing: side 0 grows from a random node by the node of the largest cut reduction"""
+    n = A.shape[0]
+    indptr = A.indptr.tolist(); indices = A.indices.tolist(); data = A.data.tolist()
+    w = vw.tolist()
+    target = float(vw.sum()) * frac
+    part = [1] * n
+    gain = [0.0] * n
+    for u in range(n):
+        for i in range(indptr[u], indptr[u + 1]):
+            gain[u] -= data[i]
+    heap: List[Tuple[float, int]] = []
+    W0 = 0.0
+    order = rng.permutation(n).tolist()
+    pos = 0
+    while W0 < target:
+        while heap and (part[heap[0][1]] == 0 or -heap[0][0] != gain[heap[0][1]]):
+            heapq.heappop(heap)
+        if heap:
+            u = heapq.heappop(heap)[1]
+        else:
+            # Start from a new component
+            while pos < n and part[order[pos]] == 0: pos += 1
+            if pos == n: break
+            u = order[pos]
+        part[u] = 0; W0 += w[u]
+        for i in range(indptr[u], indptr[u + 1]):
+            v = indices[i]
+            if part[v] == 1:
+                gain[v] += 2 * data[i]
+                heapq.heappush(heap, (-gain[v], v))
+    return np.array(part, dtype=np.int64)
+
+
+def _bisect(A: csr_matrix, vw: np.ndarray, frac: float, ub: float, rng: np.random.Generator) -> np.ndarray:
+    """Best of several multilevel bisections. Side 0 gets frac of the total node weight."""
+    best = None
+    for _ in range(_NCUTS):
+        part, key = _bisect_once(A, vw, frac, ub, rng)
+        if best is None or key < best[0]:
+            best = (key, part)
+    assert best is not None
+    return best[1]
+
+
+def _bisect_once(A: csr_matrix, vw: np.ndarray, frac: float, ub: float, rng: np.random.Generator):
+    """One multilevel bisection. Returns the bisection and its (overweight, cut)."""
+    levels = []
+    max_vw = 1.5 * float(vw.sum()) / _COARSEST
+    while A.shape[0] > _COARSEST:
+        cmap, Ac, vwc = _coarsen(A, vw, max_vw, rng)
+        if Ac.shape[0] > 0.9 * A.shape[0]: break
+        levels.append((A, vw, cmap))
+        A, vw = Ac, vwc
+    best = None
+    for _ in range(_INIT_TRIES):
+        b = _Bisection(A, vw, _grow_bisection(A, vw, frac, rng), frac, ub, len(levels) > 0)
+        b.refine()
+        key = (b.overweight(), b.cut())
+        if best is None or key < best[0]:
+            best = (key, np.array(b.part, dtype=np.int64))
+    assert best is not None
+    key, part = best
+    for i in range(len(levels) - 1, -1, -1):
+        Af, vwf, cmap = levels[i]
+        b = _Bisection(Af, vwf, part[cmap], frac, ub, i > 0)
+        b.refine()
+        part = np.array(b.part, dtype=np.int64)
+        key = (b.overweight(), b.cut())
+    return part, key
+
+
+def multilevel_partition(A: csr_matrix, vw: np.ndarray, k: int, imbalance: float = 0.03, seed: int = 0) -> np.ndarray:
+    """
+    Partition an undirected weighted graph into k parts by recursive multilevel bisection.
+
+    Args:
+        A: Symmetric adjacency matrix, whose entries are the edge weights
+        vw: Node weights
+        k: Number of parts
+        imbalance: Tolerated imbalance of the part weights
+        seed: Random seed
+    Returns:
+        Part of each node, 0 ~ k-1
+    """
+    n = A.shape[0]
+    labels = np.zeros(n, dtype=np.int64)
+    if k <= 1 or n == 0: return labels
+    rng = np.random.default_rng(seed)
+    # The tolerance is split among the levels of the recursion
+    ub = (1 + imbalance) ** (1 / math.ceil(math.log2(k)))
+    A = A.tocsr()
+    stack = [(np.arange(n), k, 0)]
+    while stack:
+        idx, kk, base = stack.pop()
+        if kk == 1:
+            labels[idx] = base
+            continue
+        if len(idx) <= kk:
+            labels[idx] = base + np.arange(len(idx)) % kk
+            continue
+        k0 = kk // 2
+        part = _bisect(A[idx][:, idx], vw[idx], k0 / kk, ub, rng)
+        stack.append((idx[part == 0], k0, base))
+        stack.append((idx[part == 1], kk - k0, base + k0))
+    return labels
+
+
+def partition_nodes(rnet: 'RoadNet', num_partitions: int, flows: Optional[TripFlows] = None,
+        imbalance: float = 0.03, seed: int = 0) -> Dict[str, int]:
+    """
+    Partition the nodes of a road network. Each edge is meant to go to the partition of its start node.
+
+    Args:
+        rnet: Road network
+        num_partitions: Number of partitions
+        flows: Expected traffic. If None, the edge cut and the number of edges are balanced instead.
+        imbalance: Tolerated imbalance of the partition loads
+        seed: Random seed
+    Returns:
+        Node name -> partition
+    """
+    nidx = {n: i for i, n in enumerate(rnet.nodes)}
+    edges = list(rnet.edges.values())
+    E = len(edges)
+    if flows is not None:
+        assert flows.edge_ids == [e.name for e in edges], "Trip flows are not computed on this road network."
+        load = flows.edge_load()
+        s = flows.through.sum()
+        # The handoffs dominate the cost. The small constant only prefers fewer cut edges among cuts of equal flow.
+        cost = np.ones(E) if s <= 0 else _EDGE_COST + flows.through * (E / s)
+    else:
+        load = np.ones(E)
+        cost = np.ones(E)
+    src = np.array([nidx[e.from_node.name] for e in edges], dtype=np.int64)
+    dst = np.array([nidx[e.to_node.name] for e in edges], dtype=np.int64)
+    keep = src != dst
+    N = len(nidx)
+    # Cutting edge (u, v) costs the handoffs in both directions
+    A = csr_matrix((np.concatenate([cost[keep], cost[keep]]),
+        (np.concatenate([src[keep], dst[keep]]), np.concatenate([dst[keep], src[keep]]))), shape=(N, N))
+    A.sum_duplicates()
+    vw = np.bincount(src, weights=load, minlength=N)
+    labels = multilevel_partition(A, vw, num_partitions, imbalance, seed)
+    return {n: int(labels[i]) for n, i in nidx.items()}
+
+
+__all__ = ["TripFlows", "PartitionStats", "partition_stats", "multilevel_partition", "partition_nodes"]
@@ -1,3 +1,4 @@
 from .base import *
+from .checkpoint import *
 from .tlog import *
 from .utils import *
\ No newline at end of file
@@ -18,6 +18,8 @@ T_OD = TypeVar("T_OD")
 
 
 TRAFFIC_INST_FILE_NAME = "inst.gz"
+# Saved states in the checkpoint format (see checkpoint.py) are kept in this subfolder
+TRAFFIC_CHECKPOINT_FOLDER = "traffic"
 StepCallback = Callable[['TrafficInst'], None]
 
 
@@ -32,7 +34,8 @@ class TrafficInst(ABC):
         self, start_time: int, step_len: int, end_time: int, roadnet:RoadNet, 
         trip_logger: TripLogger, vehs: VDict, hubs: MixedHub, pdn: Grid,
         gasoline_price: TimeFunc, seed: int = 0, silent: bool = False, 
-        dist_based_restoration: bool = False, step_callback:Optional[StepCallback] = None
+        dist_based_restoration: bool = False, step_callback:Optional[StepCallback] = None,
+        ev_fleet: bool = False
     ):  
         self._st: int = start_time
         self._ct: int = start_time
@@ -52,6 +55,9 @@ class TrafficInst(ABC):
         self.__has_gil = self.__pyver[3]
         self.__last_station_upd = 0
         self.__last_station_para_upd = 0
+        if ev_fleet:
+            # Store the charging state of EVs in arrays and charge them with vectorised kernels
+            self._hubs.attach_fleet(EVFleet(self._vehs.evs.values()))
         random.seed(seed)
 
     def _prepare_trips_and_scs(self, add_veh_to_scs: bool = True):
@@ -442,6 +448,7 @@ class CommonConfig:
     routing_algorithm: str = "astar"
     gasoline_price: TimeFunc = ConstFunc(5.0)
     add_veh_to_scs: bool = True
+    ev_fleet: bool = False
 
 
 @dataclass
@@ -450,6 +457,7 @@ class SUMOConfig:
     suppress_route_not_found: bool = True
     gui: bool = False
     mesosim: bool = False
+    pipelined: bool = False
 
 
 @dataclass
@@ -457,3 +465,14 @@ class UXsimConfig:
     show_uxsim_info: bool = False
     randomize_uxsim: bool = False
     no_parallel: bool = False
+    route_cache_bucket: int = 0
+    route_cache_size: int = 65536
+    route_cache_tolerance: float = 0.2
+    station_batch_min: int = 0
+    use_ch: bool = False
+    array_links: bool = False
+    link_history_window: float = 0
+    rebalance_interval: int = 0
+    rebalance_threshold: float = 1.25
+    rebalance_log: str = ""
+    rebalance_replay: str = ""
@@ -0,0 +1,300 @@
+import hashlib, heapq
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+from ..locale import Lang
+from .routing import CSRGraph, Stage, _no_route
+
+CH_FILE_SUFFIX = ".ch.npz"
+CH_VERSION = 1
+
+_INF = float('inf')
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    """SHA-256 hash of a file"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy index of a compiled routing graph under the static length metric.
+    Shortest route queries are answered by a bidirectional upward search, which only visits
+    a small part of the graph. Node and edge IDs are the same as the CSRGraph it is built from.
+    """
+    def __init__(self, node_ids: List[str], edge_ids: List[str], rank: np.ndarray,
+            arc_edge: np.ndarray, arc_child: np.ndarray,
+            up: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+            down: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], net_hash: str = ""):
+        """
+        Use ContractionHierarchy.build() or ContractionHierarchy.load() instead.
+
+        :param rank: Contraction order of nodes
+        :param arc_edge: Original edge index of each arc, -1 for shortcuts
+        :param arc_child: The two arcs that a shortcut consists of, (-1, -1) for original edges
+        :param up: CSR (offsets, targets, weights, arcs) of the arcs to higher ranked nodes
+        :param down: CSR (offsets, sources, weights, arcs) of the arcs from higher ranked nodes, indexed by end node
+        :param net_hash: Hash of the network file which the index is built from
+        """
+        self.node_ids = node_ids
+        self.edge_ids = edge_ids
+        self.rank = rank
+        self.arc_edge = arc_edge
+        self.arc_child = arc_child
+        self.up = up
+        self.down = down
+        self.net_hash = net_hash
+        self.__lists()
+
+    def __lists(self):
+        # List mirrors for the scalar search loops
+        self._up = tuple(a.tolist() for a in self.up)
+        self._down = tuple(a.tolist() for a in self.down)
+        self._arc_edge: List[int] = self.arc_edge.tolist()
+        self._arc_child: List[List[int]] = self.arc_child.tolist()
+
+    @staticmethod
+    def build(cg: CSRGraph, net_hash: str = "", witness_limit: int = 500) -> 'ContractionHierarchy':
+        """
+        Build the index by contracting nodes in the order of edge difference.
+
+        :param cg: Compiled routing graph
+        :param net_hash: Hash of the network file, stored for checking whether the index is outdated
+        :param witness_limit: Maximum number of settled nodes in a witness search
+        """
+        N = cg.node_count
+        arc_edge: List[int] = []
+        arc_child: List[Tuple[int, int]] = []
+        arc_w: List[float] = []
+        # Remaining graph: node -> {neighbor: (weight, arc)}
+        out_adj: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(N)]
+        in_adj: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(N)]
+        for k in range(cg.edge_count):
+            u = cg._src[k]; v = cg._tgt[k]; w = cg._len[k]
+            if u == v: continue
+            if v in out_adj[u] and out_adj[u][v][0] <= w: continue
+            a = len(arc_w)
+            arc_w.append(w); arc_edge.append(k); arc_child.append((-1, -1))
+            out_adj[u][v] = (w, a); in_adj[v][u] = (w, a)
+
+        def witness(src: int, excl: int, limit: float) -> Dict[int, float]:
+            dist = {src: 0.}
+            heap = [(0., src)]
+            settled = 0
+            while heap and settled < witness_limit:
+                d, x = heapq.heappop(heap)
+                if d > dist[x]: continue
+                if d > limit: break
+                settled += 1
+                for y, (w, _) in out_adj[x].items():
+                    if y == excl: continue
+                    nd = d + w
+                    if nd < dist.get(y, _INF):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return dist
+
+        def shortcuts(v: int) -> List[Tuple[int, int, float, int, int]]:
+            ret = []
+            if len(out_adj[v]) == 0: return ret
+            max_out = max(w for w, _ in out_adj[v].values())
+            for u, (wu, au) in in_adj[v].items():
+                dist = witness(u, v, wu + max_out)
+                for x, (wx, ax) in out_adj[v].items():
+                    if x == u: continue
+                    if dist.get(x, _INF) > wu + wx:
+                        ret.append((u, x, wu + wx, au, ax))
+            return ret
+
+        deleted_nbrs = [0] * N
+        def priority(v: int) -> int:
+            return len(shortcuts(v)) - len(in_adj[v]) - len(out_adj[v]) + deleted_nbrs[v]
+
+        heap = [(priority(v), v) for v in range(N)]
+        heapq.heapify(heap)
+        rank = np.full(N, -1, dtype=np.int64)
+        up_lists: List[List[Tuple[int, float, int]]] = [[] for _ in range(N)]
+        down_lists: List[List[Tuple[int, float, int]]] = [[] for _ in range(N)]
+        order = 0
+        while heap:
+            p, v = heapq.heappop(heap)
+            if rank[v] >= 0: continue
+            # Lazy update: contract v only if it is still the best candidate
+            p2 = priority(v)
+            if heap and p2 > heap[0][0]:
+                heapq.heappush(heap, (p2, v))
+                continue
+            for u, x, w, au, ax in shortcuts(v):
+                if x in out_adj[u] and out_adj[u][x][0] <= w: continue
+                a = len(arc_w)
+                arc_w.append(w); arc_edge.append(-1); arc_child.append((au, ax))
+                out_adj[u][x] = (w, a); in_adj[x][u] = (w, a)
+            # All remaining neighbors of v are ranked higher than v
+            for x, (w, a) in out_adj[v].items():
+                up_lists[v].append((x, w, a))
+                del in_adj[x][v]
+                deleted_nbrs[x] += 1
+            for u, (w, a) in in_adj[v].items():
+                down_lists[v].append((u, w, a))
+                del out_adj[u][v]
+                deleted_nbrs[u] += 1
+            out_adj[v].clear(); in_adj[v].clear()
+            rank[v] = order
+            order += 1
+
+        def to_csr(lists: List[List[Tuple[int, float, int]]]):
+            off = [0]; tgt = []; wt = []; arc = []
+            for lst in lists:
+                for x, w, a in lst:
+                    tgt.append(x); wt.append(w); arc.append(a)
+                off.append(len(tgt))
+            return (np.array(off, dtype=np.int64), np.array(tgt, dtype=np.int64),
+                np.array(wt, dtype=np.float64), np.array(arc, dtype=np.int64))
+
+        return ContractionHierarchy(
+            list(cg.node_ids), list(cg.edge_ids), rank,
+            np.array(arc_edge, dtype=np.int64), np.array(arc_child, dtype=np.int64).reshape(-1, 2),
+            to_csr(up_lists), to_csr(down_lists), net_hash
+        )
+
+    def matches(self, cg: CSRGraph) -> bool:
+        """Check whether the index is built from a graph with the same node and edge IDs"""
+        return self.node_ids == cg.node_ids and self.edge_ids == cg.edge_ids
+
+    def save(self, path: Union[str, Path]):
+        """Save the index to a .npz file"""
+        np.savez_compressed(path,
+            version=np.array(CH_VERSION), net_hash=np.array(self.net_hash),
+            node_ids=np.array(self.node_ids, dtype=str), edge_ids=np.array(self.edge_ids, dtype=str),
+            rank=self.rank, arc_edge=self.arc_edge, arc_child=self.arc_child,
+            up_off=self.up[0], up_tgt=self.up[1], up_w=self.up[2], up_arc=self.up[3],
+            down_off=self.down[0], down_src=self.down[1], down_w=self.down[2], down_arc=self.down[3],
+        )
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> 'ContractionHierarchy':
+        """Load the index from a .npz file"""
+        with np.load(path, allow_pickle=False) as d:
+            if int(d["version"]) != CH_VERSION:
+                raise ValueError(f"Unsupported contraction hierarchy version: {int(d['version'])}")
+            return ContractionHierarchy(
+                d["node_ids"].tolist(), d["edge_ids"].tolist(), d["rank"],
+                d["arc_edge"], d["arc_child"],
+                (d["up_off"], d["up_tgt"], d["up_w"], d["up_arc"]),
+                (d["down_off"], d["down_src"], d["down_w"], d["down_arc"]),
+                str(d["net_hash"]),
+            )
+
+    @staticmethod
+    def load_or_build(net_file: Union[str, Path], cg: CSRGraph, silent: bool = True) -> 'ContractionHierarchy':
+        """
+        Load the index persisted next to the network file.
+        It is rebuilt and saved again if it does not exist or the hash of the network file has changed.
+
+        :param net_file: Road network file
+        :param cg: Compiled routing graph of the road network
+        """
+        net_file = Path(net_file)
+        path = net_file.parent / (net_file.name + CH_FILE_SUFFIX)
+        h = file_hash(net_file)
+        if path.is_file():
+            try:
+                ch = ContractionHierarchy.load(path)
+                if ch.net_hash == h and ch.matches(cg):
+                    return ch
+            except Exception as e:
+                if not silent: print(Lang.CH_LOAD_FAILED.format(path, e))
+        ch = ContractionHierarchy.build(cg, h)
+        try:
+            ch.save(path)
+        except OSError as e:
+            if not silent: print(Lang.CH_SAVE_FAILED.format(path, e))
+        return ch
+
+    def __search(self, csr: Tuple[List[int], List[int], List[float], List[int]], sources: Iterable[int]):
+        off, tgt, wt, arc = csr
+        dist: Dict[int, float] = {}
+        pred: Dict[int, int] = {}
+        heap = []
+        for s in sources:
+            dist[s] = 0.
+            heap.append((0., s))
+        heapq.heapify(heap)
+        visited = set()
+        while heap:
+            d, x = heapq.heappop(heap)
+            if x in visited: continue
+            visited.add(x)
+            for i in range(off[x], off[x + 1]):
+                y = tgt[i]
+                nd = d + wt[i]
+                if nd < dist.get(y, _INF):
+                    dist[y] = nd
+                    pred[y] = arc[i]
+                    heapq.heappush(heap, (nd, y))
+        return dist, pred
+
+    def __unpack(self, a: int, out: List[int]):
+        stack = [a]
+        while stack:
+            a = stack.pop()
+            k = self._arc_edge[a]
+            if k >= 0:
+                out.append(k)
+            else:
+                a1, a2 = self._arc_child[a]
+                stack.append(a2); stack.append(a1)
+
+    def query(self, cg: CSRGraph, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
+        """
+        Find the SHORTEST route to any node in to_nodes, like dijMS.
+        The travel time of the route is evaluated at ctime.
+        """
+        src = cg.node_index.get(from_node)
+        targets = cg.index_of(to_nodes)
+        if src is None or len(targets) == 0:
+            return _no_route()
+        df, pf = self.__search(self._up, (src,))
+        db, pb = self.__search(self._down, targets)
+        best = _INF; meet = -1
+        for x, d in df.items():
+            t = d + db.get(x, _INF)
+            if t < best:
+                best = t; meet = x
+        if meet < 0:
+            return _no_route()
+
+        # Unpack the forward half backwards and then the backward half forwards
+        arcs: List[int] = []
+        x = meet
+        while x in pf:
+            a = pf[x]; arcs.append(a)
+            x = cg._src[self.__first_edge(a)]
+        arcs.reverse()
+        edges: List[int] = []
+        for a in arcs: self.__unpack(a, edges)
+        x = meet
+        while x in pb:
+            a = pb[x]
+            self.__unpack(a, edges)
+            x = cg._tgt[self.__last_edge(a)]
+
+        tts = cg.travel_times(ctime)
+        nodes = [src]
+        nodes.extend(cg._tgt[k] for k in edges)
+        return cg.to_stage(nodes, edges, sum(tts[k] for k in edges), sum(cg._len[k] for k in edges))
+
+    def __first_edge(self, a: int) -> int:
+        while self._arc_edge[a] < 0: a = self._arc_child[a][0]
+        return self._arc_edge[a]
+
+    def __last_edge(self, a: int) -> int:
+        while self._arc_edge[a] < 0: a = self._arc_child[a][1]
+        return self._arc_edge[a]
+
+
+__all__ = ["ContractionHierarchy", "CH_FILE_SUFFIX", "file_hash"]
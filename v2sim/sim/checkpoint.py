@@ -0,0 +1,505 @@
+"""
+Incremental, chunked checkpoints of object graphs.
+
+The instances of the classes defined in V2Sim (vehicles, stations, UXsim nodes, links and
+vehicles, ...) are stored as records, grouped by class into chunks of at most ``chunk_size``
+records. References between them are replaced by (section, index) pairs, so pickling never
+follows long chains of objects, such as the leader/follower links of UXsim vehicles, and
+neither a raised recursion limit nor a large thread stack is needed.
+
+In each chunk, the attributes holding a bool, an int or a float in every record are stored as
+the columns of a structured NumPy array (.npy, memory-mappable); the other attributes are pickled
+into a zlib-compressed blob. A JSON manifest lists the chunks with the digests of their content. Saving into a
+folder holding an earlier checkpoint only writes the chunks whose content has changed.
+Objects whose state lives in other processes save it as checkpoints of their own in subfolders
+(see checkpoint_folder). dumps_checkpoint encodes the same records into bytes instead of a folder.
+"""
+import copyreg, hashlib, importlib, io, json, os, threading, time, zlib
+import cloudpickle
+import pickle
+import numpy as np
+from numpy.lib import recfunctions as rfn
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from ..utils import PyVersion, CheckPyVersion
+
+CHECKPOINT_MANIFEST = "manifest.json"
+CHECKPOINT_VERSION = 1
+
+# Records of a chunk are ordered by discovery; this column keeps the global order.
+_SEQ = "@seq"
+_SPLIT_MODULES = ("v2sim.",)
+_BASE_MODULES = ("abc", "typing")
+_PLAIN = frozenset((str, int, float, bool, type(None), bytes, tuple, list, dict, set, frozenset, type))
+_COLUMN_DTYPES = {bool: "?", int: "<i8", float: "<f8"}
+# Blobs are mostly link and vehicle series with long runs of zeros; fast compression is enough.
+_ZLEVEL = 1
+_object_getstate = getattr(object, "__getstate__", None)
+
+
+def _splittable(cls: type) -> bool:
+    """Whether the instances of a class are stored as records"""
+    if not (getattr(cls, "__module__", None) or "").startswith(_SPLIT_MODULES):
+        return False
+    # Classes with a custom reduction (enums, NumPy subclasses, named tuples, ...) are pickled as usual
+    if cls.__reduce_ex__ is not object.__reduce_ex__ or cls.__reduce__ is not object.__reduce__:
+        return False
+    if hasattr(cls, "__getnewargs_ex__") or hasattr(cls, "__getnewargs__"):
+        return False
+    for base in cls.__mro__[1:]:
+        mod = getattr(base, "__module__", None) or ""
+        if base is not object and not mod.startswith(_SPLIT_MODULES) and mod not in _BASE_MODULES:
+            return False
+    return True
+
+
+def _get_state(obj: Any) -> Any:
+    """State of an object as pickled by the default reduction"""
+    cls = type(obj)
+    if getattr(cls, "__getstate__", _object_getstate) is not _object_getstate:
+        state = obj.__getstate__()
+        # Columns are popped from the state, which must not be the live __dict__
+        if type(state) is dict:
+            return dict(state)
+        if isinstance(state, tuple) and len(state) == 2 and type(state[0]) is dict:
+            return dict(state[0]), state[1]
+        return state
+    state = obj.__dict__.copy() if hasattr(obj, "__dict__") else None
+    names = copyreg._slotnames(cls) # type: ignore
+    if names:
+        return state, {n: getattr(obj, n) for n in names if hasattr(obj, n)}
+    return state
+
+
+def _set_state(obj: Any, state: Any):
+    """Restore the state of an object as the default unpickling does"""
+    setstate = getattr(obj, "__setstate__", None)
+    if setstate is not None:
+        setstate(state)
+        return
+    slots = None
+    if isinstance(state, tuple) and len(state) == 2:
+        state, slots = state
+    if state:
+        obj.__dict__.update(state)
+    if slots:
+        for k, v in slots.items():
+            setattr(obj, k, v)
+
+
+def _dict_part(state: Any) -> Optional[dict]:
+    if type(state) is dict:
+        return state
+    if isinstance(state, tuple) and len(state) == 2 and type(state[0]) is dict:
+        return state[0]
+    return None
+
+
+def _class_name(cls: type) -> str:
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _import_class(name: str) -> type:
+    mod, qualname = name.split(":")
+    ret: Any = importlib.import_module(mod)
+    for part in qualname.split("."):
+        ret = getattr(ret, part)
+    return ret
+
+
+@dataclass
+class CheckpointStats:
+    """Statistics of a saved checkpoint"""
+    records: int = 0
+    chunks: int = 0
+    chunks_written: int = 0
+    bytes_total: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+
+
+class _Section:
+    __slots__ = ("cls", "objs", "seq", "done")
+
+    def __init__(self, cls: type):
+        self.cls = cls
+        self.objs: List[Any] = []
+        self.seq: List[int] = []
+        self.done = 0
+
+
+class _RefPickler(cloudpickle.Pickler):
+    """Pickler replacing the records by references"""
+    def __init__(self, file, graph: '_GraphWriter'):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._graph = graph
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple[int, int]]:
+        if type(obj) in _PLAIN:
+            return None
+        return self._graph.ref(obj)
+
+
+class _RefUnpickler(pickle.Unpickler):
+    def __init__(self, file, objs: List[List[Any]]):
+        super().__init__(file)
+        self._objs = objs
+
+    def persistent_load(self, pid: Tuple[int, int]) -> Any:
+        return self._objs[pid[0]][pid[1]]
+
+
+class _GraphWriter:
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.sections: List[_Section] = []
+        self._sec_of: Dict[type, int] = {}
+        self._index: Dict[int, Tuple[int, int]] = {}
+        self._count = 0
+
+    def ref(self, obj: Any) -> Optional[Tuple[int, int]]:
+        ret = self._index.get(id(obj))
+        if ret is not None:
+            return ret
+        cls = type(obj)
+        sid = self._sec_of.get(cls)
+        if sid is None:
+            sid = len(self.sections) if _splittable(cls) else -1
+            self._sec_of[cls] = sid
+            if sid >= 0:
+                self.sections.append(_Section(cls))
+        if sid < 0:
+            return None
+        sec = self.sections[sid]
+        # The section keeps the object alive, so its id is not reused during saving
+        ret = (sid, len(sec.objs))
+        sec.objs.append(obj)
+        sec.seq.append(self._count)
+        self._count += 1
+        self._index[id(obj)] = ret
+        return ret
+
+    def dumps(self, obj: Any) -> bytes:
+        buf = io.BytesIO()
+        _RefPickler(buf, self).dump(obj)
+        return buf.getvalue()
+
+    @staticmethod
+    def _fits(d: Optional[dict], name: str, t: type) -> bool:
+        """Whether a record has a value of a column"""
+        if d is None:
+            return False
+        v = d.get(name, None)
+        return type(v) is t and (t is not int or -2**63 <= v < 2**63)
+
+    def encode_chunk(self, sec: _Section, start: int) -> Tuple[bytes, bytes, int]:
+        """
+        Encode the records of a section from start into (npy bytes, pickled states, stop).
+        Pickling the states discovers more records. Those of the same section join the chunk
+        while it is not full and they have its columns, so that chains of records are not cut
+        into chunks of one record.
+        """
+        columns: Optional[Dict[str, type]] = None
+        values: Dict[str, list] = {}
+        buf = io.BytesIO()
+        # The states share one pickler, so objects referenced by several records are pickled once
+        pickler = _RefPickler(buf, self)
+        stop = start
+        while stop < min(start + self.chunk_size, len(sec.objs)):
+            states = [_get_state(obj) for obj in sec.objs[stop:start + self.chunk_size]]
+            dicts = [_dict_part(s) for s in states]
+            if columns is None:
+                columns = {}
+                if dicts[0] is not None:
+                    for name, v in dicts[0].items():
+                        t = type(v)
+                        if t in _COLUMN_DTYPES and all(self._fits(d, name, t) for d in dicts):
+                            columns[name] = t
+                values = {name: [] for name in columns}
+            for state, d in zip(states, dicts):
+                if not all(self._fits(d, name, t) for name, t in columns.items()):
+                    break
+                for name in columns:
+                    values[name].append(d.pop(name)) # type: ignore
+                pickler.dump(state)
+                stop += 1
+            else:
+                continue
+            break
+        assert columns is not None
+        arr = np.empty(stop - start, dtype=[(_SEQ, "<i8")] + [(name, _COLUMN_DTYPES[t]) for name, t in columns.items()])
+        arr[_SEQ] = sec.seq[start:stop]
+        for name, vals in values.items():
+            arr[name] = vals
+        npy = io.BytesIO()
+        np.save(npy, arr, allow_pickle=False)
+        return npy.getvalue(), buf.getvalue(), stop
+
+    def encode(self, root: Any) -> Tuple[bytes, List[List[Tuple[bytes, bytes, int, int]]]]:
+        root_bin = self.dumps(root)
+        chunks: List[List[Tuple[bytes, bytes, int, int]]] = []
+        while True:
+            # Encoding a chunk discovers more records; full chunks are encoded first,
+            # so that sections are not cut into small pieces while they are still growing.
+            progressed = False
+            for partial in (False, True):
+                i = 0
+                while i < len(self.sections):
+                    sec = self.sections[i]
+                    if len(chunks) <= i:
+                        chunks.append([])
+                    while len(sec.objs) - sec.done >= (1 if partial else self.chunk_size):
+                        npy, blob, stop = self.encode_chunk(sec, sec.done)
+                        chunks[i].append((npy, blob, sec.done, stop - sec.done))
+                        sec.done = stop
+                        progressed = True
+                    i += 1
+                if progressed:
+                    break
+            if not progressed:
+                return root_bin, chunks
+
+
+def _digest(*parts: bytes) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for p in parts:
+        h.update(p)
+    return h.hexdigest()
+
+
+def _read_manifest(folder: Path) -> Optional[dict]:
+    try:
+        with open(folder / CHECKPOINT_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_blob(path: Path) -> bytes:
+    with open(path, "rb") as fp:
+        return zlib.decompress(fp.read())
+
+
+def is_checkpoint(folder: Union[str, Path]) -> bool:
+    """Check whether a folder holds a checkpoint"""
+    return (Path(folder) / CHECKPOINT_MANIFEST).is_file()
+
+
+def _encode(obj: Any, chunk_size: int) -> Tuple[dict, List[List[Tuple[str, bytes, bool]]], int]:
+    """
+    Encode an object graph into files.
+
+    :return: Manifest, groups of (file name, content, whether to compress) - the root, then one group
+        per chunk - and the number of records
+    """
+    assert chunk_size > 0, "Chunk size must be positive"
+    graph = _GraphWriter(chunk_size)
+    root_bin, chunks = graph.encode(obj)
+    root_name = f"root_{_digest(root_bin)}.bin"
+    groups: List[List[Tuple[str, bytes, bool]]] = [[(root_name, root_bin, True)]]
+    sections = []
+    records = 0
+    for sid, sec in enumerate(graph.sections):
+        items = []
+        for k, (npy, blob, start, count) in enumerate(chunks[sid]):
+            stem = f"c{sid}_{k}_{_digest(npy, blob)}"
+            groups.append([(stem + ".npy", npy, False), (stem + ".bin", blob, True)])
+            items.append({"start": start, "count": count, "file": stem})
+        records += len(sec.objs)
+        sections.append({"class": _class_name(sec.cls), "count": len(sec.objs), "chunks": items})
+    manifest = {
+        "format": CHECKPOINT_VERSION,
+        "version": PyVersion(),
+        "pickler": cloudpickle.__name__,
+        "chunk_size": chunk_size,
+        "root": root_name,
+        "sections": sections,
+    }
+    return manifest, groups, records
+
+
+_current = threading.local()
+
+
+class _Folder:
+    """Sets the folder of the checkpoint being saved or loaded in this thread"""
+    def __init__(self, folder: Optional[Path]):
+        self.folder = folder
+
+    def __enter__(self):
+        self.prev = getattr(_current, "folder", None)
+        _current.folder = self.folder
+
+    def __exit__(self, *exc):
+        _current.folder = self.prev
+
+
+def checkpoint_folder() -> Optional[Path]:
+    """
+    Folder of the checkpoint being saved or loaded in this thread. None if the object graph is not saved into
+    or loaded from a folder. Objects keeping a part of their state elsewhere, such as the worlds in worker
+    processes, may save that part as checkpoints of its own in subfolders of it.
+    """
+    return getattr(_current, "folder", None)
+
+
+def save_checkpoint(folder: Union[str, Path], obj: Any, chunk_size: int = 1024) -> CheckpointStats:
+    """
+    Save an object graph into a checkpoint folder.
+    Chunks already in the folder with the same content are not written again,
+    and files no longer referenced by the manifest are removed.
+
+    :param folder: Checkpoint folder, created if it does not exist
+    :param obj: Root object
+    :param chunk_size: Maximum number of records per chunk
+    :return: Statistics of the checkpoint
+    """
+    st = time.perf_counter()
+    f = Path(folder)
+    f.mkdir(parents=True, exist_ok=True)
+    with _Folder(f):
+        manifest, groups, records = _encode(obj, chunk_size)
+    stats = CheckpointStats(records=records, chunks=len(groups) - 1)
+    keep = {CHECKPOINT_MANIFEST}
+
+    def put(name: str, data: bytes, compress: bool) -> bool:
+        keep.add(name)
+        p = f / name
+        if p.is_file():
+            # Files are named after the digest of their content and written atomically
+            stats.bytes_total += p.stat().st_size
+            return False
+        if compress:
+            data = zlib.compress(data, _ZLEVEL)
+        tmp = f / (name + ".tmp")
+        with open(tmp, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp, p)
+        stats.bytes_total += len(data)
+        stats.bytes_written += len(data)
+        return True
+
+    for i, group in enumerate(groups):
+        written = False
+        for name, data, compress in group:
+            written |= put(name, data, compress)
+        if i > 0:
+            stats.chunks_written += written
+    # Chunk files are named after their digests, so the old checkpoint stays
+    # complete until the new manifest replaces the old one.
+    tmp = f / (CHECKPOINT_MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp, f / CHECKPOINT_MANIFEST)
+    for p in f.iterdir():
+        if p.name not in keep and p.suffix in (".npy", ".bin", ".tmp") and p.name[:1] in "cr":
+            p.unlink()
+    stats.seconds = time.perf_counter() - st
+    return stats
+
+
+def dumps_checkpoint(obj: Any, chunk_size: int = 1024) -> bytes:
+    """
+    Encode an object graph like save_checkpoint, but into bytes. Pickling the result never recurses
+    into the object graph, which save_checkpoint avoids as well.
+
+    :param obj: Root object
+    :param chunk_size: Maximum number of records per chunk
+    """
+    with _Folder(None):
+        manifest, groups, _ = _encode(obj, chunk_size)
+    files = {name: zlib.compress(data, _ZLEVEL) if compress else data for group in groups for name, data, compress in group}
+    return pickle.dumps({"manifest": manifest, "files": files}, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _check_manifest(m: Optional[dict], where: Any) -> dict:
+    if m is None:
+        raise FileNotFoundError(f"No checkpoint found in {where}")
+    if m.get("format") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint format: {m.get('format')}")
+    if not CheckPyVersion(m["version"]):
+        raise RuntimeError(f"Python version mismatch for checkpoint: Expect {PyVersion()}, got {m['version']}")
+    if m["pickler"] != cloudpickle.__name__:
+        raise RuntimeError(f"Pickler mismatch for checkpoint: Expect {cloudpickle.__name__}, got {m['pickler']}")
+    return m
+
+
+def _decode(m: dict, read_npy: Callable[[str], np.ndarray], read_blob: Callable[[str], bytes]) -> Any:
+    classes = [_import_class(s["class"]) for s in m["sections"]]
+    objs = [[cls.__new__(cls) for _ in range(s["count"])] for cls, s in zip(classes, m["sections"])]
+    pending: List[Tuple[int, Any, Any]] = []
+    for sid, s in enumerate(m["sections"]):
+        for c in s["chunks"]:
+            cols = read_npy(c["file"] + ".npy")
+            unpickler = _RefUnpickler(io.BytesIO(read_blob(c["file"] + ".bin")), objs)
+            states = [unpickler.load() for _ in range(c["count"])]
+            names = [n for n in cols.dtype.names if n != _SEQ]
+            values = [cols[n].tolist() for n in names]
+            seq = cols[_SEQ].tolist()
+            start = c["start"]
+            for i, state in enumerate(states):
+                d = _dict_part(state)
+                if d is not None:
+                    for n, v in zip(names, values):
+                        d[n] = v[i]
+                pending.append((seq[i], objs[sid][start + i], state))
+    # Records referenced by a record are discovered after it. Restoring in the
+    # reverse order sets them up first, as nested unpickling would.
+    pending.sort(key=lambda x: x[0], reverse=True)
+    for _, obj, state in pending:
+        _set_state(obj, state)
+    return _RefUnpickler(io.BytesIO(read_blob(m["root"])), objs).load()
+
+
+def load_checkpoint(folder: Union[str, Path]) -> Any:
+    """
+    Load the object graph saved in a checkpoint folder.
+
+    :param folder: Checkpoint folder
+    :return: Root object
+    """
+    f = Path(folder)
+    m = _check_manifest(_read_manifest(f), f)
+    with _Folder(f):
+        return _decode(m, lambda name: np.load(f / name, mmap_mode="r", allow_pickle=False), lambda name: _read_blob(f / name))
+
+
+def loads_checkpoint(data: bytes) -> Any:
+    """
+    Load an object graph encoded by dumps_checkpoint.
+
+    :param data: Encoded object graph
+    :return: Root object
+    """
+    d = pickle.loads(data)
+    m = _check_manifest(d.get("manifest") if isinstance(d, dict) else None, "the data")
+    files: Dict[str, bytes] = d["files"]
+    with _Folder(None):
+        return _decode(m, lambda name: np.load(io.BytesIO(files[name]), allow_pickle=False),
+            lambda name: zlib.decompress(files[name]))
+
+
+def load_columns(folder: Union[str, Path], class_name: str) -> np.ndarray:
+    """
+    Read the columns of the records of a class without loading the checkpoint.
+
+    :param folder: Checkpoint folder
+    :param class_name: "module:qualname" of the class, e.g. "v2sim.veh.ev:EV"
+    :return: Structured array with one row per record
+    """
+    f = Path(folder)
+    m = _check_manifest(_read_manifest(f), f)
+    for s in m["sections"]:
+        if s["class"] == class_name:
+            parts = [np.load(f / (c["file"] + ".npy"), mmap_mode="r", allow_pickle=False) for c in s["chunks"]]
+            if not parts:
+                break
+            # Chunks hold the columns present in all their records
+            names = [n for n in parts[0].dtype.names if all(n in p.dtype.names for p in parts)]
+            return np.concatenate([rfn.repack_fields(p[names]) for p in parts])
+    raise KeyError(f"No records of {class_name} in {folder}")
+
+
+__all__ = ["CHECKPOINT_MANIFEST", "CheckpointStats", "is_checkpoint", "checkpoint_folder", "save_checkpoint", "load_checkpoint",
+    "dumps_checkpoint", "loads_checkpoint", "load_columns"]
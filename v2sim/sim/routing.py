@@ -1,6 +1,8 @@
 import heapq, math
+from collections import OrderedDict
+import numpy as np
 from dataclasses import dataclass
-from typing import Callable, Iterable, List, Dict, Mapping, Protocol, Sequence, Tuple, TypeVar
+from typing import Any, Callable, Iterable, List, Dict, Mapping, Optional, Protocol, Sequence, Set, Tuple, TypeVar, Union
 from scipy.spatial import KDTree
 
 
@@ -20,222 +22,667 @@ class LinkLike(Protocol):
 
 Graph = Mapping[str, Sequence[Tuple[str, LinkLike]]]  # node ID -> List of (to_node ID, Link object)
 
-def dijMC(gl: Graph, ctime: int, from_node: str, omega: float, to_nodes: Iterable[str],
+
+class CSRGraph:
+    """
+    Compiled routing graph in CSR (compressed sparse row) layout.
+    Nodes and edges are numbered by integers. The out-edges of node i are edges offsets[i] ~ offsets[i+1]-1,
+    whose end nodes are stored in targets. Travel times are kept in an array that is refreshed
+    from the links at most once per time step, so the searches never touch the link objects.
+    """
+    def __init__(self, gl: Graph, node_coords: Optional[CoordsDict] = None):
+        """
+        Compile a routing graph.
+
+        :param gl: Adjacency mapping, node ID -> List of (to_node ID, Link object)
+        :param node_coords: Node coordinates used by A* heuristics. None means no coordinates.
+        """
+        self.node_ids: List[str] = list(gl.keys())
+        self.node_index: Dict[str, int] = {nid: i for i, nid in enumerate(self.node_ids)}
+        for adj in gl.values():
+            for to, _ in adj:
+                if to not in self.node_index:
+                    self.node_index[to] = len(self.node_ids)
+                    self.node_ids.append(to)
+
+        offsets = [0]
+        targets: List[int] = []
+        self.__links: List[LinkLike] = []
+        for nid in self.node_ids:
+            for to, link in gl.get(nid, ()):
+                targets.append(self.node_index[to])
+                self.__links.append(link)
+            offsets.append(len(targets))
+
+        self.edge_ids: List[str] = [link.name for link in self.__links]
+        self.edge_index: Dict[str, int] = {eid: i for i, eid in enumerate(self.edge_ids)}
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.targets = np.array(targets, dtype=np.int64)
+        self.sources = np.repeat(np.arange(len(self.node_ids), dtype=np.int64), np.diff(self.offsets))
+        self.lengths = np.array([float(link.length) for link in self.__links], dtype=np.float64)
+        self.tt = np.zeros(len(self.__links), dtype=np.float64)
+        # Free-flow travel time, a lower bound of the travel time of each edge. 0 if the speed is unknown.
+        ffs = np.array([float(getattr(link, "free_flow_speed", 0.)) for link in self.__links], dtype=np.float64)
+        self.fftt = np.divide(self.lengths, ffs, out=np.zeros_like(self.lengths), where=ffs > 0)
+        self.__landmarks: Optional['Landmarks'] = None
+
+        # List mirrors of the arrays. Indexing a list is much faster than indexing
+        # a numpy array in the scalar search loops below.
+        self._off: List[int] = offsets
+        self._tgt: List[int] = targets
+        self._src: List[int] = self.sources.tolist()
+        self._len: List[float] = self.lengths.tolist()
+        self._tt: List[float] = []
+        self.__ctime: Optional[int] = None
+
+        self.has_coords = False
+        self.xs = np.zeros(len(self.node_ids), dtype=np.float64)
+        self.ys = np.zeros(len(self.node_ids), dtype=np.float64)
+        if node_coords is not None:
+            self.set_coords(node_coords)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_ids)
+
+    def landmarks(self) -> 'Landmarks':
+        """Landmarks for the A* heuristic of this graph. Built on the first call."""
+        if self.__landmarks is None:
+            self.__landmarks = Landmarks(self)
+        return self.__landmarks
+
+    def set_coords(self, node_coords: CoordsDict):
+        """Set node coordinates. All nodes must be included."""
+        for i, nid in enumerate(self.node_ids):
+            self.xs[i], self.ys[i] = node_coords[nid]
+        self._xs: List[float] = self.xs.tolist()
+        self._ys: List[float] = self.ys.tolist()
+        self.has_coords = True
+
+    def refresh(self, ctime: int):
+        """Refresh the travel time array from the links at ctime"""
+        self._tt = [link.instant_travel_time(ctime) for link in self.__links]
+        self.tt = np.array(self._tt, dtype=np.float64)
+        self.__ctime = ctime
+
+    def replace_link(self, edge_id: str, link: LinkLike):
+        """Read the travel time of an edge from another link object from now on"""
+        self.__links[self.edge_index[edge_id]] = link
+        self.__ctime = None
+        self.update_free_flow((edge_id,))
+
+    def update_free_flow(self, edge_ids: Optional[Iterable[str]] = None):
+        """
+        Re-read the free-flow speed of the given edges from their links and drop the landmarks built on
+        the old free-flow travel times. It must be called after the free-flow speed of a link changes,
+        otherwise the A* heuristic may overestimate and the fastest searches may miss the fastest route.
+
+        :param edge_ids: Edges whose free-flow speed changed. None means all edges.
+        """
+        ks = range(len(self.__links)) if edge_ids is None else [self.edge_index[e] for e in edge_ids]
+        for k in ks:
+            ffs = float(getattr(self.__links[k], "free_flow_speed", 0.))
+            self.fftt[k] = self.lengths[k] / ffs if ffs > 0 else 0.
+        self.__landmarks = None
+
+    def travel_times(self, ctime: int) -> List[float]:
+        """Travel time of all edges at ctime. The links are only read when ctime changes."""
+        if self.__ctime != ctime:
+            self.refresh(ctime)
+        return self._tt
+
+    def index_of(self, nodes: Iterable[str]) -> Set[int]:
+        """Integer IDs of the given nodes. Nodes not in the graph are ignored."""
+        idx = self.node_index
+        return {idx[n] for n in nodes if n in idx}
+
+    def to_stage(self, nodes: Sequence[int], edges: Sequence[int], travelTime: float, length: float) -> Stage:
+        """Resolve a route in integer IDs into a Stage"""
+        nids = self.node_ids; eids = self.edge_ids
+        return Stage([nids[i] for i in nodes], [eids[k] for k in edges], travelTime, length)
+
+    def trace(self, pred: Dict[int, int], dst: int, travelTime: float, length: float) -> Stage:
+        """
+        Rebuild the route ending at dst from a predecessor map and resolve it into a Stage.
+
+        :param pred: Node -> edge entering the node on the route. The origin node has no entry.
+        :param dst: Destination node
+        """
+        edges: List[int] = []
+        v = dst
+        while v in pred:
+            k = pred[v]
+            edges.append(k)
+            v = self._src[k]
+        edges.reverse()
+        nodes = [v]
+        nodes.extend(self._tgt[k] for k in edges)
+        return self.to_stage(nodes, edges, travelTime, length)
+
+
+class RouteCache:
+    """
+    LRU cache of routes between two nodes, keyed by (origin, destination, fastest, time bucket).
+    A cached fastest route is dropped when the current travel time of its edges
+    drifts from the travel time at caching by more than the relative tolerance.
+    """
+    def __init__(self, bucket: int = 900, max_entries: int = 65536, tolerance: float = 0.2):
+        """
+        :param bucket: Length of a time bucket in seconds. Routes are only shared within a bucket.
+        :param max_entries: Maximum number of cached routes. The least recently used route is evicted first.
+        :param tolerance: Relative travel time drift that invalidates a cached fastest route.
+        """
+        assert bucket > 0, "Bucket length must be positive."
+        assert max_entries > 0, "Cache size must be positive."
+        assert tolerance >= 0, "Tolerance must be non-negative."
+        self.bucket = bucket
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        # key -> (route, edge indices in the compiled graph)
+        self.__data: OrderedDict[Tuple[str, str, bool, int], Tuple[Stage, List[int]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.__data)
+
+    def get(self, cg: CSRGraph, ctime: int, O: str, D: str, fastest: bool) -> Optional[Stage]:
+        """
+        Get a cached route. The travel time of the returned route is evaluated at ctime.
+
+        :return: Cached route, or None if not cached or invalidated.
+        """
+        key = (O, D, fastest, ctime // self.bucket)
+        item = self.__data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        stage, edges = item
+        tts = cg.travel_times(ctime)
+        cur_tt = sum(tts[k] for k in edges)
+        if fastest and abs(cur_tt - stage.travelTime) > self.tolerance * stage.travelTime:
+            del self.__data[key]
+            self.invalidations += 1
+            self.misses += 1
+            return None
+        self.__data.move_to_end(key)
+        self.hits += 1
+        return Stage(stage.nodes, stage.edges, cur_tt, stage.length)
+
+    def put(self, cg: CSRGraph, ctime: int, O: str, D: str, fastest: bool, stage: Stage):
+        """Cache a route found at ctime. Routes not found are not cached."""
+        if len(stage.nodes) == 0: return
+        key = (O, D, fastest, ctime // self.bucket)
+        self.__data[key] = (stage, [cg.edge_index[e] for e in stage.edges])
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.max_entries:
+            self.__data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all cached routes. The counters are kept."""
+        self.__data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache: size, hits, misses, evictions and invalidations"""
+        return {
+            "size": len(self.__data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    @property
+    def hit_rate(self) -> float:
+        """Ratio of hits to all queries"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+GraphLike = Union[Graph, CSRGraph]
+
+def _csr(gl: GraphLike) -> CSRGraph:
+    # A plain mapping is compiled on the fly, which is slow. Compile it once and reuse it instead.
+    return gl if isinstance(gl, CSRGraph) else CSRGraph(gl)
+
+def _no_route() -> Stage:
+    return Stage([], [], float('inf'), float('inf'))
+
+def _xy_of(cg: CSRGraph, node_coords: CoordsDict) -> Tuple[List[float], List[float]]:
+    if cg.has_coords:
+        return cg._xs, cg._ys
+    xs: List[float] = []; ys: List[float] = []
+    for nid in cg.node_ids:
+        x, y = node_coords[nid]
+        xs.append(x); ys.append(y)
+    return xs, ys
+
+def dijMC(gl: GraphLike, ctime: int, from_node: str, omega: float, to_nodes: Iterable[str],
           node_scores: Dict[str, float], max_length: float = float('inf')) -> Stage:
     """
     Find the BEST route based on score = omega * (time + waiting) + charging_cost.
     Uses time as primary key, length as secondary key.
     """
-    # (time, length, node, path, path_edges)
-    
-    heap = [(0., 0., from_node, [from_node], [])]
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    if src is None: return _no_route()
+    targets = cg.index_of(to_nodes)
+    scores = {cg.node_index[n]: s for n, s in node_scores.items() if n in cg.node_index}
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+
+    # (time, length, node)
+    heap = [(0., 0., src)]
     visited = set()
-    min_time = {from_node: 0.}
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    min_time = {src: 0.}
     best_score = float('inf')
-    best_stage = Stage([], [], float('inf'), float('inf'))
+    best = None
 
     while heap:
-        cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        cur_time, cur_len, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
         visited.add(cur_node)
-        
+
         # 检查是否到达目标节点且满足长度约束
-        if cur_node in to_nodes:
-            score = omega * cur_time / 60 + node_scores[cur_node]
+        if cur_node in targets:
+            score = omega * cur_time / 60 + scores[cur_node]
             if score < best_score:
                 best_score = score
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
-        
+                best = (cur_node, cur_time, cur_len)
+
         # 探索邻居节点
-        for neighbor, link in gl.get(cur_node, []):
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            next_time = cur_time + link.instant_travel_time(ctime)
-            next_len = cur_len + link.length
-            
+
+            next_time = cur_time + tts[k]
+            next_len = cur_len + lens[k]
+
             if next_len > max_length:
                 continue
-                
+
             if neighbor not in min_time or next_time < min_time[neighbor]:
                 min_time[neighbor] = next_time
-                heapq.heappush(heap, (next_time, next_len, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return best_stage
+                pred[neighbor] = k
+                heapq.heappush(heap, (next_time, next_len, neighbor))
 
-def dijMF(gl: Graph, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
+    return _no_route() if best is None else cg.trace(pred, *best)
+
+def dijMF(gl: GraphLike, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
     """
     Find the FASTEST route to any node in to_nodes.
     Uses time as primary key, length as secondary key.
     """
-    # (time, length, node, path, path_edges)
-    heap = [(0., 0., from_node, [from_node], [])]
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    if src is None: return _no_route()
+    targets = cg.index_of(to_nodes)
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+
+    # (time, length, node)
+    heap = [(0., 0., src)]
     visited = set()
-    min_time = {from_node: 0.}
-    best_stage = Stage([], [], float('inf'), float('inf'))
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    min_time = {src: 0.}
+    best = None
+    best_time = float('inf')
+
     while heap:
-        cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
+        cur_time, cur_len, cur_node = heapq.heappop(heap)
 
         if cur_node in visited:
             continue
         visited.add(cur_node)
-        
-        if cur_node in to_nodes:
-            if cur_time < best_stage.travelTime:
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
-        
-        for neighbor, link in gl.get(cur_node, []):
+
+        if cur_node in targets:
+            if cur_time < best_time:
+                best_time = cur_time
+                best = (cur_node, cur_time, cur_len)
+
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            next_time = cur_time + link.instant_travel_time(ctime)
-            next_len = cur_len + link.length
-            
+
+            next_time = cur_time + tts[k]
+            next_len = cur_len + lens[k]
+
             if neighbor not in min_time or next_time < min_time[neighbor]:
                 min_time[neighbor] = next_time
-                heapq.heappush(heap, (next_time, next_len, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return best_stage
+                pred[neighbor] = k
+                heapq.heappush(heap, (next_time, next_len, neighbor))
 
-def dijMS(gl: Graph, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
+    return _no_route() if best is None else cg.trace(pred, *best)
+
+def dijMS(gl: GraphLike, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
     """
     Find the SHORTEST route to any node in to_nodes.
     Uses length as primary key, time as secondary key.
     """
-    # (length, time, node, path, path_edges)
-    heap = [(0., 0., from_node, [from_node], [])]
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    if src is None: return _no_route()
+    targets = cg.index_of(to_nodes)
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+
+    # (length, time, node)
+    heap = [(0., 0., src)]
     visited = set()
-    min_length = {from_node: 0.}
-    best_stage = Stage([], [],float('inf'), float('inf'))
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    min_length = {src: 0.}
+    best = None
+    best_len = float('inf')
+
     while heap:
-        cur_len, cur_time, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        cur_len, cur_time, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
         visited.add(cur_node)
-        
-        if cur_node in to_nodes:
-            if cur_len < best_stage.length:
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
 
-        for neighbor, link in gl.get(cur_node, []):
+        if cur_node in targets:
+            if cur_len < best_len:
+                best_len = cur_len
+                best = (cur_node, cur_time, cur_len)
+
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            next_len = cur_len + link.length
-            next_time = cur_time + link.instant_travel_time(ctime)
-            
+
+            next_len = cur_len + lens[k]
+            next_time = cur_time + tts[k]
+
             if neighbor not in min_length or next_len < min_length[neighbor]:
                 min_length[neighbor] = next_len
-                heapq.heappush(heap, (next_len, next_time, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return best_stage
+                pred[neighbor] = k
+                heapq.heappush(heap, (next_len, next_time, neighbor))
+
+    return _no_route() if best is None else cg.trace(pred, *best)
+
+def _simple_csr(cg: CSRGraph, weights: np.ndarray) -> Tuple[Any, np.ndarray]:
+    # Sparse adjacency matrix keeping the lightest one of the parallel edges,
+    # since a sparse matrix sums duplicated entries up. Also returns the kept edge indices.
+    from scipy.sparse import csr_matrix
+    order = np.lexsort((weights, cg.targets, cg.sources))
+    src = cg.sources[order]; dst = cg.targets[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    order = order[first]
+    N = cg.node_count
+    return csr_matrix((weights[order], (cg.sources[order], cg.targets[order])), shape=(N, N)), order
+
+
+class Landmarks:
+    """
+    Free-flow travel time from and to a few landmark nodes, used as the ALT (A*, landmarks and
+    triangle inequality) heuristic. Since the actual travel time of an edge is never below its
+    free-flow travel time, the bound is admissible and consistent for the time-dependent searches.
+    """
+    # Maximum number of bounds kept in the cache, summed over the cached target sets
+    CACHE_FLOATS = 2 ** 19
+
+    def __init__(self, cg: CSRGraph, count: int = 16):
+        """
+        Select landmarks by farthest selection and compute the free-flow travel times.
+
+        :param cg: Compiled routing graph
+        :param count: Number of landmarks
+        """
+        from scipy.sparse.csgraph import dijkstra
+        N = cg.node_count
+        # Slightly shrink the weights so that rounding never breaks the lower bound
+        w = np.maximum(cg.fftt * (1 - 1e-9), 1e-12)
+        fwd, _ = _simple_csr(cg, w)
+        rev = fwd.T.tocsr()
+        count = min(count, N)
+
+        ids: List[int] = []
+        dfrom: List[np.ndarray] = []; dto: List[np.ndarray] = []
+        if count > 0:
+            # Start from the node farthest away from node 0, then repeatedly pick the node
+            # farthest away from all selected landmarks
+            d0 = dijkstra(fwd, directed=True, indices=0)
+            nxt = int(np.argmax(np.where(np.isfinite(d0), d0, -1)))
+            mind = np.full(N, np.inf)
+            while len(ids) < count:
+                ids.append(nxt)
+                df = dijkstra(fwd, directed=True, indices=nxt)
+                dt = dijkstra(rev, directed=True, indices=nxt)
+                dfrom.append(df); dto.append(dt)
+                d = df + dt
+                mind = np.minimum(mind, np.where(np.isfinite(d), d, -1))
+                mind[ids] = -1
+                nxt = int(np.argmax(mind))
+                if mind[nxt] <= 0: break
+        self.ids = ids
+        # dfrom[i, v]: free-flow time from landmark i to v; dto[i, v]: from v to landmark i
+        self.dfrom = np.array(dfrom, dtype=np.float64).reshape(len(ids), N)
+        self.dto = np.array(dto, dtype=np.float64).reshape(len(ids), N)
+        # sorted targets -> bounds, least recently used first
+        self.__cache: OrderedDict[Tuple[int, ...], List[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getstate__(self):
+        # The cache is not saved
+        state = self.__dict__.copy()
+        state["_Landmarks__cache"] = OrderedDict()
+        return state
+
+    def lower_bounds(self, targets: Iterable[int]) -> List[float]:
+        """
+        Lower bound of the travel time from every node to the nearest one of the targets.
+        For multiple targets, min_t max_L is bounded from below by max_L min_t.
+        inf means none of the targets is reachable.
+        The bounds of recently used target sets are cached, since the searches of a simulation
+        keep heading for the same trip destinations and stations.
+        """
+        T = sorted(set(targets))
+        N = self.dfrom.shape[1]
+        if len(self.ids) == 0 or len(T) == 0:
+            return [0.] * N
+        key = tuple(T)
+        ret = self.__cache.get(key)
+        if ret is not None:
+            self.__cache.move_to_end(key)
+            return ret
+        a = self.dfrom[:, T].min(axis=1, keepdims=True)  # min_t d(L, t)
+        b = self.dto[:, T].max(axis=1, keepdims=True)    # max_t d(t, L)
+        with np.errstate(invalid='ignore'):
+            # d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+            h = np.fmax(a - self.dfrom, self.dto - b)
+        h = np.where(np.isnan(h), 0., h).max(axis=0)
+        ret = np.maximum(h, 0.).tolist()
+        self.__cache[key] = ret
+        while len(self.__cache) * N > self.CACHE_FLOATS and len(self.__cache) > 1:
+            self.__cache.popitem(last=False)
+        return ret
+
+
+class ReverseTable:
+    """
+    Travel time from every node to each of the given target nodes at a given time,
+    found by one multi-source search on the reversed graph. It answers many dijMC-like
+    queries towards the same targets without running a forward search per query.
+    """
+    def __init__(self, cg: CSRGraph, ctime: int, to_nodes: Iterable[str]):
+        from scipy.sparse.csgraph import dijkstra
+        self.cg = cg
+        self.ctime = ctime
+        self.targets: List[int] = sorted(cg.index_of(to_nodes))
+        self.__tpos: Dict[int, int] = {t: i for i, t in enumerate(self.targets)}
+        N = cg.node_count
+        tt = np.maximum(np.array(cg.travel_times(ctime), dtype=np.float64), 1e-9)
+
+        # Keep the fastest one of the parallel edges
+        fwd, order = _simple_csr(cg, tt)
+        # (from node, to node) -> edge index
+        self.__edge_of: Dict[Tuple[int, int], int] = {
+            (u, v): k for u, v, k in zip(cg.sources[order].tolist(), cg.targets[order].tolist(), order.tolist())
+        }
+        rev = fwd.T.tocsr()
+        if len(self.targets) > 0:
+            # time[i, v]: travel time from v to targets[i]; nxt[i, v]: next node from v towards targets[i]
+            self.time, self.nxt = dijkstra(rev, directed=True, indices=self.targets, return_predecessors=True)
+        else:
+            self.time = np.zeros((0, N)); self.nxt = np.zeros((0, N), dtype=np.int32)
+
+    def route(self, from_node: str, to_node: str) -> Stage:
+        """Fastest route from from_node to one of the targets"""
+        cg = self.cg
+        src = cg.node_index[from_node]; i = self.__tpos[cg.node_index[to_node]]
+        nxt = self.nxt[i]; lens = cg._len
+        nodes = [src]; edges: List[int] = []; length = 0.
+        v = src
+        while v != self.targets[i]:
+            w = int(nxt[v])
+            k = self.__edge_of[(v, w)]
+            edges.append(k); nodes.append(w); length += lens[k]
+            v = w
+        return cg.to_stage(nodes, edges, float(self.time[i, src]), length)
+
+    def best(self, from_node: str, omega: float, node_scores: Dict[str, float],
+            max_length: float = float('inf')) -> Optional[Stage]:
+        """
+        Find the BEST route like dijMC, with score = omega * time / 60 + node_scores[target].
+
+        :return: The best route. If the best target is only reachable by a route longer than
+            max_length, None is returned and the caller should run dijMC instead.
+        """
+        cg = self.cg
+        src = cg.node_index.get(from_node)
+        if src is None or len(self.targets) == 0: return _no_route()
+        nids = cg.node_ids
+        sc = np.array([node_scores[nids[t]] for t in self.targets], dtype=np.float64)
+        total = omega * self.time[:, src] / 60 + sc
+        i = int(np.argmin(total))
+        if not np.isfinite(total[i]): return _no_route()
+        # Unconstrained best target. If its fastest route is within max_length,
+        # no other target can do better under the length constraint.
+        ret = self.route(from_node, nids[self.targets[i]])
+        return ret if ret.length <= max_length else None
 
-def dijF(gl: Graph, ctime: int, from_node: str, to_node: str) -> Stage:
+
+def dijF(gl: GraphLike, ctime: int, from_node: str, to_node: str) -> Stage:
     """Fastest path between two specific nodes."""
     return dijMF(gl, ctime, from_node, {to_node})
 
-def dijS(gl: Graph, ctime: int, from_node: str, to_node: str) -> Stage:
+def dijS(gl: GraphLike, ctime: int, from_node: str, to_node: str) -> Stage:
     """Shortest path between two specific nodes."""
     return dijMS(gl, ctime, from_node, {to_node})
 
-def astarF(gl: Graph, node_coords: CoordsDict, ctime: int, from_node: str, to_node: str) -> Stage:
+def astarF(gl: GraphLike, node_coords: CoordsDict, ctime: int, from_node: str, to_node: str) -> Stage:
     """
     A* algorithm for FASTEST path using time as cost.
     Uses f_score (time + heuristic) as primary key, time as secondary key, length as tertiary key.
+    The heuristic is the landmark lower bound of the travel time, so the result is as fast as dijF.
+    node_coords is kept for compatibility and not used.
     """
-    to_coord = node_coords[to_node]
-    
-    def heuristic(node):
-        coord = node_coords[node]
-        return math.hypot(coord[0] - to_coord[0], coord[1] - to_coord[1])
-    
-    heap = []
-    initial_h = heuristic(from_node)
-    # (f_score, time, length, node, path, path_edges)
-    heapq.heappush(heap, (initial_h, 0, 0, from_node, [from_node], []))
-    
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    dst = cg.node_index.get(to_node)
+    if src is None or dst is None: return _no_route()
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+    h = cg.landmarks().lower_bounds((dst,))
+
+    # (f_score, time, length, node)
+    heap = [(h[src], 0., 0., src)]
+
     visited = set()
-    g_scores = {from_node: 0}  # g_score = actual travel time
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    g_scores = {src: 0.}  # g_score = actual travel time
+
     while heap:
-        f_score, cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        f_score, cur_time, cur_len, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
-            
-        if cur_node == to_node:
-            return Stage(path, path_edges, cur_time, cur_len)
-            
+
+        if cur_node == dst:
+            return cg.trace(pred, cur_node, cur_time, cur_len)
+
         visited.add(cur_node)
 
-        for neighbor, link in gl.get(cur_node, []):
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            time_cost = link.instant_travel_time(ctime)
-            next_time = cur_time + time_cost
-            next_len = cur_len + link.length
-            
+
+            next_time = cur_time + tts[k]
+            next_len = cur_len + lens[k]
+
             if neighbor not in g_scores or next_time < g_scores[neighbor]:
                 g_scores[neighbor] = next_time
-                h_score = heuristic(neighbor)
-                f_score = next_time + h_score
-                
-                heapq.heappush(heap, (f_score, next_time, next_len, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return Stage([], [], float('inf'), float('inf'))
+                f_score = next_time + h[neighbor]
+                if f_score == math.inf: continue  # Destination unreachable from neighbor
+
+                pred[neighbor] = k
+                heapq.heappush(heap, (f_score, next_time, next_len, neighbor))
 
-def astarS(gl: Graph, node_coords: CoordsDict, ctime: int, from_node: str, to_node: str) -> Stage:
+    return _no_route()
+
+def astarS(gl: GraphLike, node_coords: CoordsDict, ctime: int, from_node: str, to_node: str) -> Stage:
     """
     A* algorithm for SHORTEST path using length as cost.
     Uses f_score (length + heuristic) as primary key, length as secondary key, time as tertiary key.
     """
-    to_coord = node_coords[to_node]
-    
-    def heuristic(node):
-        coord = node_coords[node]
-        return math.hypot(coord[0] - to_coord[0], coord[1] - to_coord[1])
-    
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    dst = cg.node_index.get(to_node)
+    if src is None or dst is None: return _no_route()
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+    xs, ys = _xy_of(cg, node_coords)
+    tx = xs[dst]; ty = ys[dst]
+
     heap = []
-    initial_h = heuristic(from_node)
-    # (f_score, length, time, node, path, path_edges)
-    heapq.heappush(heap, (initial_h, 0, 0, from_node, [from_node], []))
-    
+    initial_h = math.hypot(xs[src] - tx, ys[src] - ty)
+    # (f_score, length, time, node)
+    heapq.heappush(heap, (initial_h, 0, 0, src))
+
     visited = set()
-    g_scores = {from_node: 0}  # g_score = actual path length
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    g_scores = {src: 0}  # g_score = actual path length
+
     while heap:
-        f_score, cur_len, cur_time, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        f_score, cur_len, cur_time, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
-            
-        if cur_node == to_node:
-            return Stage(path, path_edges, cur_time, cur_len)
-            
+
+        if cur_node == dst:
+            return cg.trace(pred, cur_node, cur_time, cur_len)
+
         visited.add(cur_node)
-        
-        for neighbor, link in gl.get(cur_node, []):
+
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            length_cost = link.length
-            next_len = cur_len + length_cost
-            next_time = cur_time + link.instant_travel_time(ctime)
-            
+
+            next_len = cur_len + lens[k]
+            next_time = cur_time + tts[k]
+
             if neighbor not in g_scores or next_len < g_scores[neighbor]:
                 g_scores[neighbor] = next_len
-                h_score = heuristic(neighbor)
+                h_score = math.hypot(xs[neighbor] - tx, ys[neighbor] - ty)
                 f_score = next_len + h_score
 
-                heapq.heappush(heap, (f_score, next_len, next_time, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return Stage([], [], float('inf'), float('inf'))
+                pred[neighbor] = k
+                heapq.heappush(heap, (f_score, next_len, next_time, neighbor))
+
+    return _no_route()
 
 # 构建kDTree的预处理函数
 def build_target_kdtree(node_coords: CoordsDict, to_nodes: Iterable[str]) -> Tuple[KDTree, Dict[int, str]]:
@@ -245,13 +692,13 @@ def build_target_kdtree(node_coords: CoordsDict, to_nodes: Iterable[str]) -> Tup
     """
     target_coords:List[Tuple[float, float]] = []
     index_to_node = {}
-    
+
     for idx, node_id in enumerate(to_nodes):
         if node_id in node_coords:
             coord = node_coords[node_id]
             target_coords.append(coord)
             index_to_node[idx] = node_id
-    
+
     kdtree = KDTree(target_coords)
     return kdtree, index_to_node # pyright: ignore[reportReturnType]
 
@@ -263,12 +710,12 @@ def create_heuristic_with_kdtree(node_coords: CoordsDict, kdtree: KDTree) -> Cal
     def heuristic(node):
         if node not in node_coords or kdtree is None:
             return float('inf')
-        
+
         coord = node_coords[node]
         # 查询最近的一个目标节点
         distance, _ = kdtree.query([coord], k=1)
         return distance[0]
-    
+
     return heuristic
 
 def create_time_heuristic_with_kdtree(node_coords: CoordsDict, kdtree: KDTree, avg_speed: float = 20.0) -> Callable:
@@ -278,170 +725,189 @@ def create_time_heuristic_with_kdtree(node_coords: CoordsDict, kdtree: KDTree, a
     def heuristic(node):
         if node not in node_coords or kdtree is None:
             return float('inf')
-        
+
         coord = node_coords[node]
         # 查询最近的一个目标节点
         distance, _ = kdtree.query([coord], k=1)
         return distance[0] / avg_speed  # 将距离转换为时间估计
-    
+
     return heuristic
 
-# 修改后的A*算法（以astarMF为例）
-def astarMF(gl: Graph, node_coords: CoordsDict, ctime: int, from_node: str, to_nodes: Iterable[str], avg_speed:float) -> Stage:
+def _target_distance(cg: CSRGraph, node_coords: CoordsDict, targets: Set[int]) -> Callable[[int], float]:
+    # Distance from a node (integer ID) to the nearest target, using a kDTree of the targets
+    xs, ys = _xy_of(cg, node_coords)
+    kdtree = KDTree([(xs[i], ys[i]) for i in targets])
+    def distance(node: int) -> float:
+        d, _ = kdtree.query((xs[node], ys[node]), k=1)
+        return float(d)
+    return distance
+
+def astarMF(gl: GraphLike, node_coords: CoordsDict, ctime: int, from_node: str, to_nodes: Iterable[str], avg_speed:float) -> Stage:
     """
-    A* version of dijMF - Find the FASTEST route to any node in to_nodes using kDTree heuristic.
+    A* version of dijMF - Find the FASTEST route to any node in to_nodes.
+    The heuristic is the landmark lower bound of the travel time to the nearest target,
+    so the first target reached is as fast as the one found by dijMF.
+    node_coords and avg_speed are kept for compatibility and not used.
     """
-    # 构建kDTree
-    kdtree, index_to_node = build_target_kdtree(node_coords, to_nodes)
-    
-    # 创建启发式函数
-    heuristic = create_time_heuristic_with_kdtree(node_coords, kdtree, avg_speed=avg_speed)
-    
-    # (estimated_total_time, time, length, node, path, path_edges)
-    initial_h = heuristic(from_node)
-    heap = [(initial_h, 0., 0., from_node, [from_node], [])]
-    
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    targets = cg.index_of(to_nodes)
+    if src is None or len(targets) == 0: return _no_route()
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+    h = cg.landmarks().lower_bounds(targets)
+
+    # (estimated_total_time, time, length, node)
+    heap = [(h[src], 0., 0., src)]
+
     visited = set()
-    g_scores = {from_node: 0.}  # g_score = actual travel time
-    best_stage = Stage([], [], float('inf'), float('inf'))
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    g_scores = {src: 0.}  # g_score = actual travel time
+
     while heap:
-        est_total_time, cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        est_total_time, cur_time, cur_len, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
-            
-        if cur_node in to_nodes:
-            if cur_time < best_stage.travelTime:
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
-        
+
+        # The heuristic is consistent, so the first target popped is the fastest one
+        if cur_node in targets:
+            return cg.trace(pred, cur_node, cur_time, cur_len)
+
         visited.add(cur_node)
 
-        for neighbor, link in gl.get(cur_node, []):
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            time_cost = link.instant_travel_time(ctime)
-            next_time = cur_time + time_cost
-            next_len = cur_len + link.length
-            
+
+            next_time = cur_time + tts[k]
+            next_len = cur_len + lens[k]
+
             if neighbor not in g_scores or next_time < g_scores[neighbor]:
                 g_scores[neighbor] = next_time
-                h_score = heuristic(neighbor)
-                est_total = next_time + h_score
+                est_total = next_time + h[neighbor]
+                if est_total == math.inf: continue  # No target reachable from neighbor
 
-                heapq.heappush(heap, (est_total, next_time, next_len, neighbor, path + [neighbor], path_edges + [link.name]))
+                pred[neighbor] = k
+                heapq.heappush(heap, (est_total, next_time, next_len, neighbor))
 
-    return best_stage
+    return _no_route()
 
-def astarMS(gl: Graph, node_coords: CoordsDict, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
+def astarMS(gl: GraphLike, node_coords: CoordsDict, ctime: int, from_node: str, to_nodes: Iterable[str]) -> Stage:
     """
     A* version of dijMS - Find the SHORTEST route to any node in to_nodes using kDTree heuristic.
     """
-    # 构建kDTree
-    kdtree, index_to_node = build_target_kdtree(node_coords, to_nodes)
-    
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    targets = cg.index_of(to_nodes)
+    if src is None or len(targets) == 0: return _no_route()
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+
     # 创建启发式函数
-    heuristic = create_heuristic_with_kdtree(node_coords, kdtree)
-    
-    # (estimated_total_length, length, time, node, path, path_edges)
-    initial_h = heuristic(from_node)
-    heap = [(initial_h, 0., 0., from_node, [from_node], [])]
-    
+    distance = _target_distance(cg, node_coords, targets)
+
+    # (estimated_total_length, length, time, node)
+    initial_h = distance(src)
+    heap = [(initial_h, 0., 0., src)]
+
     visited = set()
-    g_scores = {from_node: 0.}  # g_score = actual path length
-    best_stage = Stage([], [], float('inf'), float('inf'))
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    g_scores = {src: 0.}  # g_score = actual path length
+    best = None
+    best_len = float('inf')
+
     while heap:
-        est_total_len, cur_len, cur_time, cur_node, path, path_edges = heapq.heappop(heap)
-        
+        est_total_len, cur_len, cur_time, cur_node = heapq.heappop(heap)
+
         if cur_node in visited:
             continue
-            
-        if cur_node in to_nodes:
-            if cur_len < best_stage.length:
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
-        
+
+        if cur_node in targets:
+            if cur_len < best_len:
+                best_len = cur_len
+                best = (cur_node, cur_time, cur_len)
+
         visited.add(cur_node)
 
-        for neighbor, link in gl.get(cur_node, []):
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            length_cost = link.length
-            next_len = cur_len + length_cost
-            next_time = cur_time + link.instant_travel_time(ctime)
-            
+
+            next_len = cur_len + lens[k]
+            next_time = cur_time + tts[k]
+
             if neighbor not in g_scores or next_len < g_scores[neighbor]:
                 g_scores[neighbor] = next_len
-                h_score = heuristic(neighbor)
+                h_score = distance(neighbor)
                 est_total = next_len + h_score
-                
-                heapq.heappush(heap, (est_total, next_len, next_time, neighbor, path + [neighbor], path_edges + [link.name]))
-    
-    return best_stage
 
-def astarMC(gl: Graph, node_coords: CoordsDict, ctime: int, from_node: str, omega: float,
+                pred[neighbor] = k
+                heapq.heappush(heap, (est_total, next_len, next_time, neighbor))
+
+    return _no_route() if best is None else cg.trace(pred, *best)
+
+def astarMC(gl: GraphLike, node_coords: CoordsDict, ctime: int, from_node: str, omega: float,
             to_nodes:Iterable[str], node_scores: Dict[str, float],
             max_length: float = float('inf'), avg_speed: float = 20.0) -> Stage:
     """
-    A* version of dijMC - Find the BEST route using kDTree heuristic.
+    A* version of dijMC - Find the BEST route based on score = omega * time / 60 + node_scores[target].
+    Nodes are expanded in the order of time + landmark lower bound of the time to the nearest target,
+    and the search stops once no route can beat the best score found.
+    node_coords and avg_speed are kept for compatibility and not used.
     """
-    # 构建kDTree
-    kdtree, index_to_node = build_target_kdtree(node_coords, to_nodes)
-    
-    # 创建启发式函数（使用距离启发式）
-    distance_heuristic = create_heuristic_with_kdtree(node_coords, kdtree)
-    
-    # 将距离启发式转换为score启发式（近似）
-    def score_heuristic(node):
-        dist = distance_heuristic(node)
-        # 将距离转换为近似的score增量（这是一个保守估计）
-        return omega * (dist / avg_speed / 60.0)  # 假设平均速度20.0m/s，转换为分钟
-    
-    # (estimated_total_score, actual_score, time, length, node, path, path_edges)
-    initial_h = score_heuristic(from_node)
-    initial_score = omega * 0 / 60.0 + node_scores.get(from_node, 0)
-    heap = [(initial_h + initial_score, initial_score, 0., 0., from_node, [from_node], [])]
-    
+    cg = _csr(gl)
+    src = cg.node_index.get(from_node)
+    targets = cg.index_of(to_nodes)
+    if src is None or len(targets) == 0: return _no_route()
+    scores = {cg.node_index[n]: s for n, s in node_scores.items() if n in cg.node_index}
+    off = cg._off; tgt = cg._tgt; lens = cg._len; tts = cg.travel_times(ctime)
+    h = cg.landmarks().lower_bounds(targets)
+    min_score = min(scores[t] for t in targets)
+    k_time = omega / 60
+
+    # (estimated_total_time, time, length, node)
+    heap = [(h[src], 0., 0., src)]
     visited = set()
-    best_score = {from_node: initial_score}
-    best_stage = Stage([], [], float('inf'), float('inf'))
-    min_actual_score = float('inf')
-    
+    pred: Dict[int, int] = {}  # node -> edge entering it on the best known route
+    min_time = {src: 0.}
+    best_score = float('inf')
+    best = None
+
     while heap:
-        est_total_score, cur_score, cur_time, cur_len, cur_node, path, path_edges = heapq.heappop(heap)
+        est_total_time, cur_time, cur_len, cur_node = heapq.heappop(heap)
+
+        # Lower bound of the score of any route through the remaining nodes
+        if k_time * est_total_time + min_score >= best_score:
+            break
 
-        if cur_score > min_actual_score:
-            continue
-            
         if cur_node in visited:
             continue
         visited.add(cur_node)
-        
-        if cur_node in to_nodes and cur_len <= max_length:
-            if cur_score < min_actual_score:
-                min_actual_score = cur_score
-                best_stage = Stage(path.copy(), path_edges.copy(), cur_time, cur_len)
 
-        for neighbor, link in gl.get(cur_node, []):
+        if cur_node in targets:
+            score = k_time * cur_time + scores[cur_node]
+            if score < best_score:
+                best_score = score
+                best = (cur_node, cur_time, cur_len)
+
+        for k in range(off[cur_node], off[cur_node + 1]):
+            neighbor = tgt[k]
             if neighbor in visited:
                 continue
-                
-            next_time = cur_time + link.instant_travel_time(ctime)
-            next_len = cur_len + link.length
-            
+
+            next_time = cur_time + tts[k]
+            next_len = cur_len + lens[k]
+
             if next_len > max_length:
                 continue
-            
-            neighbor_score = omega * next_time / 60.0 + node_scores.get(neighbor, 0)
-            
-            if neighbor not in best_score or neighbor_score < best_score[neighbor]:
-                best_score[neighbor] = neighbor_score
-                h_score = score_heuristic(neighbor)
-                est_total = neighbor_score + h_score
-                
-                heapq.heappush(heap, (est_total, neighbor_score, next_time, next_len, 
-                                    neighbor, path + [neighbor], path_edges + [link.name]))
-
-    return best_stage
\ No newline at end of file
+
+            if neighbor not in min_time or next_time < min_time[neighbor]:
+                min_time[neighbor] = next_time
+                est_total = next_time + h[neighbor]
+                if est_total == math.inf: continue  # No target reachable from neighbor
+
+                pred[neighbor] = k
+                heapq.heappush(heap, (est_total, next_time, next_len, neighbor))
+
+    return _no_route() if best is None else cg.trace(pred, *best)
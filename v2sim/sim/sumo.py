@@ -14,11 +14,12 @@ from ..utils import *
 from ..locale import Lang
 from .utils import CaseData
 from .tlog import TripLogger
-from .base import CommonConfig, SUMOConfig, TrafficInst, TRAFFIC_INST_FILE_NAME
+from .base import CommonConfig, SUMOConfig, TrafficInst, TRAFFIC_INST_FILE_NAME, TRAFFIC_CHECKPOINT_FOLDER
+from .checkpoint import is_checkpoint, load_checkpoint, save_checkpoint
 
 from .sumo_backend import (
     Stage, SUMO_FILE_NAME, SUMOSingleBackend, SUMOParallelBackend,
-    SUMOStepResult, detect_sumo_partition,
+    SUMOStepResult, detect_sumo_partition, _trace_edges,
 )
 
 ATTR_SUMO_DEST_SCS = "_sumo_dest_scs"
@@ -34,16 +35,16 @@ def dijMC(
     Find the BEST route based on score = omega * (time + waiting) + charging_cost.
     Uses time as primary key, length as secondary key.
     """
-    # (time, length, edge, path, path_edges)
-
-    heap = [(0., 0, from_edge, [from_edge], [])]
+    # (time, length, edge)
+    heap = [(0., 0, from_edge)]
     visited = set()
+    pred: Dict[str, str] = {}  # edge -> previous edge on the best known route
     min_time = {from_edge: 0.}
     best_score = float('inf')
-    best_stage = Stage(edges = [], travelTime=float('inf'), length=float('inf'))
+    best = None
 
     while heap:
-        cur_time, cur_len, cur_edge, path, path_edges = heapq.heappop(heap)
+        cur_time, cur_len, cur_edge = heapq.heappop(heap)
 
         if cur_edge in visited: continue
         visited.add(cur_edge)
@@ -52,7 +53,7 @@ def dijMC(
             score = omega * cur_time + node_scores.get(cur_edge, 0)
             if score < best_score:
                 best_score = score
-                best_stage = Stage(edges=path_edges + [cur_edge], travelTime=cur_time, length=cur_len)
+                best = (cur_edge, cur_time, cur_len)
 
         e:Edge = gl.getEdge(cur_edge)
         try:
@@ -69,9 +70,13 @@ def dijMC(
                 continue
             if neighbor not in min_time or new_time < min_time[neighbor]:
                 min_time[neighbor] = new_time
-                heapq.heappush(heap, (new_time, new_len, neighbor, path + [neighbor], path_edges + [cur_edge]))
+                pred[neighbor] = cur_edge
+                heapq.heappush(heap, (new_time, new_len, neighbor))
 
-    return best_stage
+    if best is None:
+        return Stage(edges = [], travelTime=float('inf'), length=float('inf'))
+    best_edge, best_time, best_len = best
+    return Stage(edges=_trace_edges(pred, best_edge), travelTime=best_time, length=best_len)
 
 class TrafficSUMO(TrafficInst):
     def __init__(
@@ -81,15 +86,17 @@ class TrafficSUMO(TrafficInst):
         road_net_file: str,
         initial_state_folder: str = "",
         add_veh_to_scs: bool = True,
+        ev_fleet: bool = False,
         routing_algorithm:str = "CH",
         ignore_driving:bool = False,
         suppress_route_not_found:bool = True,
         gui: bool = False,
         sumocfg_file: str = "",
         mesosim: bool = False,
+        pipelined: bool = False,
         case_dir: str = "",
     ):
-        super().__init__(start_time, step_len, end_time, roadnet, trip_logger, vehs, hubs, pdn, gasoline_price, seed, silent)
+        super().__init__(start_time, step_len, end_time, roadnet, trip_logger, vehs, hubs, pdn, gasoline_price, seed, silent, ev_fleet=ev_fleet)
         self.__seed = seed
         self.__gui = gui
         self.__sumocfg_file = sumocfg_file
@@ -98,6 +105,9 @@ class TrafficSUMO(TrafficInst):
         assert self.__ralgo in ["CH", "dijkstra", "astar", "CHWrapper"], f"Invalid routing algorithm: {self.__ralgo}"
         self.__suppress_route_not_found = suppress_route_not_found
         self.__mesosim = mesosim
+        # Partitioned SUMO only: the workers run the next step while the
+        # stations of the current one are updated.
+        self.__pipelined = False
         
         # Read road network
         self.__snet_file = road_net_file
@@ -128,6 +138,7 @@ class TrafficSUMO(TrafficInst):
                 seed=seed,
                 gui=gui,
                 mesosim=mesosim,
+                track_running=not self.__ignore_driving,
             )
         else:
             if gui and not silent:
@@ -142,6 +153,7 @@ class TrafficSUMO(TrafficInst):
                 seed=seed,
                 gui=False,
             )
+            self.__pipelined = pipelined
             if not silent:
                 micro = sum(1 for pid, meso in partition.meso.items() if not meso)
                 meso = sum(1 for pid, meso in partition.meso.items() if meso)
@@ -661,7 +673,11 @@ class TrafficSUMO(TrafficInst):
             step_len: Step length (seconds)
             v2g_demand: V2G demand list (kWh/s)
         """
-        step_result: SUMOStepResult = self.__sumo.simulation_step(self._ct + step_len)
+        if self.__pipelined and self.__sumo.in_flight:
+            # Issued at the end of the previous call
+            step_result: SUMOStepResult = self.__sumo.finish_step()
+        else:
+            step_result = self.__sumo.simulation_step(self._ct + step_len)
         new_time = int(step_result.time)
         deltaT = new_time - self._ct
         self._ct = new_time
@@ -745,10 +761,30 @@ class TrafficSUMO(TrafficInst):
                 else:
                     print(f"Error: {veh.brief()}, {veh._sta}")
 
+        if self.__pipelined:
+            # Start the next step now, so the stations, plugins and statistics
+            # of this step are processed while the partitions are stepping.
+            # Vehicles leaving stations in post_simulation_step are therefore
+            # inserted into SUMO one step later than in the sequential mode.
+            self.__sumo.begin_step(self._ct + step_len)
         super().post_simulation_step(deltaT)
 
+    @property
+    def phase_times(self) -> Dict[str, float]:
+        """Accumulated time of each traffic step phase (partitioned SUMO only, otherwise empty)"""
+        if isinstance(self.__sumo, SUMOParallelBackend):
+            return self.__sumo.phase_times
+        return {}
+
     def simulation_stop(self):
+        pt = self.phase_times
+        if pt and pt["steps"] > 0 and not self.silent:
+            busy = pt["overlap"] + pt["wait"]
+            print(f"SUMO partition steps: {pt['steps']}, issue {pt['issue']:.2f}s, overlapped {pt['overlap']:.2f}s, "
+                  f"wait {pt['wait']:.2f}s, reconcile {pt['reconcile']:.2f}s, "
+                  f"overlap ratio {pt['overlap'] / busy if busy > 0 else 0:.1%}")
         self.__sumo.close()
+        self._hubs.close_pools()
         self._log.close()
 
     def save(self, folder: Union[str, Path]):
@@ -764,27 +800,26 @@ class TrafficSUMO(TrafficInst):
             "hubs":self._hubs,
             "sumo_backend": backend_meta,
         }
-        with gzip.open(str(f / TRAFFIC_INST_FILE_NAME), "wb") as f:
-            pickle.dump({
-                "obj": obj,
-                "version": PyVersion(),
-                "pickler": pickle.__name__,
-            }, f)
+        save_checkpoint(f / TRAFFIC_CHECKPOINT_FOLDER, obj)
 
     save_state = save  # Alias
 
     def __load_v2sim_state(self, folder: str):
-        inst = Path(folder) / TRAFFIC_INST_FILE_NAME
-        if not inst.exists():
-            raise FileNotFoundError(Lang.ERROR_STATE_FILE_NOT_FOUND.format(inst))
-        with gzip.open(str(inst), "rb") as f:
-            d = pickle.load(f)
-        assert isinstance(d, dict) and "obj" in d and "pickler" in d and "version" in d, "Invalid TrafficInst state file."
-        if not CheckPyVersion(d["version"]):
-            raise RuntimeError(f"Python version mismatch for TrafficInst: Expect {PyVersion()}, got {d['version']}")
-        if d["pickler"] != pickle.__name__:
-            raise RuntimeError(f"Pickler mismatch for TrafficInst: Expect {pickle.__name__}, got {d['pickler']}")
-        d = d["obj"]
+        if is_checkpoint(Path(folder) / TRAFFIC_CHECKPOINT_FOLDER):
+            d = load_checkpoint(Path(folder) / TRAFFIC_CHECKPOINT_FOLDER)
+            assert isinstance(d, dict), "Invalid TrafficInst checkpoint."
+        else:
+            inst = Path(folder) / TRAFFIC_INST_FILE_NAME
+            if not inst.exists():
+                raise FileNotFoundError(Lang.ERROR_STATE_FILE_NOT_FOUND.format(inst))
+            with gzip.open(str(inst), "rb") as f:
+                d = pickle.load(f)
+            assert isinstance(d, dict) and "obj" in d and "pickler" in d and "version" in d, "Invalid TrafficInst state file."
+            if not CheckPyVersion(d["version"]):
+                raise RuntimeError(f"Python version mismatch for TrafficInst: Expect {PyVersion()}, got {d['version']}")
+            if d["pickler"] != pickle.__name__:
+                raise RuntimeError(f"Pickler mismatch for TrafficInst: Expect {pickle.__name__}, got {d['pickler']}")
+            d = d["obj"]
         self._ct = d["ctime"]
         self._fQ = d["fQ"]
         self._que = d["que"]
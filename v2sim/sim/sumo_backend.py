@@ -13,11 +13,16 @@ import json
 import math
 import multiprocessing as mp
 import platform
+import time
 import traceback
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
+
+from .sumo_ipc import ShmChannel
+
 @dataclass
 class Stage:
     """Small route-stage object compatible with the fields V2Sim uses.
@@ -273,6 +278,19 @@ def detect_sumo_partition(case_dir: Union[str, Path], default_meso: bool = False
     return SUMOPartitionSpec(part_folder, part_json, edges, edge_to_part, meso, net_files)
 
 
+def _trace_edges(pred: Dict[str, str], last_edge: str) -> List[str]:
+    """Rebuild an edge route ending at ``last_edge`` from a predecessor map.
+
+    ``pred`` maps an edge to the edge before it on the best known route; the
+    first edge of the route has no entry.
+    """
+    edges = [last_edge]
+    while edges[-1] in pred:
+        edges.append(pred[edges[-1]])
+    edges.reverse()
+    return edges
+
+
 def _safe_outgoing(edge: Any) -> Iterable[Any]:
     try:
         outgoing = edge.getAllowedOutgoing("passenger")
@@ -329,20 +347,21 @@ class _RouteFinderMixin:
         except Exception:
             return Stage(edges=[], travelTime=float("inf"), length=float("inf"))
 
-        heap: List[Tuple[float, float, str, List[str]]] = []
+        heap: List[Tuple[float, float, str]] = []
         start_len = float(self._snet.getEdge(from_edge).getLength())
         start_time = self.get_traveltime(from_edge)
-        heapq.heappush(heap, (start_time, start_len, from_edge, [from_edge]))
+        heapq.heappush(heap, (start_time, start_len, from_edge))
         best: Dict[str, float] = {from_edge: start_time}
+        pred: Dict[str, str] = {}
         visited = set()
 
         while heap:
-            cur_time, cur_len, cur_edge, path = heapq.heappop(heap)
+            cur_time, cur_len, cur_edge = heapq.heappop(heap)
             if cur_edge in visited:
                 continue
             visited.add(cur_edge)
             if cur_edge == to_edge:
-                return Stage(edges=path, travelTime=cur_time, length=cur_len)
+                return Stage(edges=_trace_edges(pred, cur_edge), travelTime=cur_time, length=cur_len)
 
             edge_obj = self._snet.getEdge(cur_edge)
             for out_edge in _safe_outgoing(edge_obj):
@@ -359,7 +378,8 @@ class _RouteFinderMixin:
                     continue
                 if n_time < best.get(nid, float("inf")):
                     best[nid] = n_time
-                    heapq.heappush(heap, (n_time, n_len, nid, path + [nid]))
+                    pred[nid] = cur_edge
+                    heapq.heappush(heap, (n_time, n_len, nid))
 
         return Stage(edges=[], travelTime=float("inf"), length=float("inf"))
 
@@ -380,8 +400,17 @@ class SUMOSingleBackend(_RouteFinderMixin):
         seed: int,
         gui: bool,
         mesosim: bool,
+        track_running: bool = True,
     ):
+        """
+        ``track_running`` controls whether ``simulation_step`` reports the
+        distance, road and position of every running vehicle.  Callers that
+        only account energy at arrival can turn it off.  When it is on, the
+        backend subscribes to these variables when a vehicle departs and reads
+        them in bulk with ``getAllSubscriptionResults`` once per step.
+        """
         self._snet = snet
+        self._track_running = track_running
         self._sumocfg_file = sumocfg_file
         self._net_file = net_file
         self._start_time = start_time
@@ -402,6 +431,7 @@ class SUMOSingleBackend(_RouteFinderMixin):
     def start(self):
         self._api = _import_single_sumo_api(self._gui)
         self._tc = self._api.constants
+        self._sub_vars = (self._tc.VAR_DISTANCE, self._tc.VAR_ROAD_ID, self._tc.VAR_POSITION)
         sumo_cmd = [
             "sumo-gui" if self._gui else "sumo",
             "-c", self._sumocfg_file,
@@ -452,14 +482,50 @@ class SUMOSingleBackend(_RouteFinderMixin):
             except Exception:
                 self._managed_stops.pop(veh_id, None)
 
-        arrived_ids = set(arrived)
+        departed = list(self._api.simulation.getDepartedIDList())
         running: Dict[str, SUMOVehicleSnapshot] = {}
-        for veh_id in self._api.vehicle.getIDList():
-            if veh_id not in arrived_ids:
-                running[veh_id] = self._snapshot(veh_id)
-        self._last = SUMOStepResult(new_time, arrived, list(self._api.simulation.getDepartedIDList()), running)
+        if self._track_running:
+            # Subscribe on depart.  libsumo fills the results of a new
+            # subscription immediately, so the departed vehicles are included
+            # in the bulk results below.
+            for veh_id in departed:
+                self._subscribe(veh_id)
+            results = self._api.vehicle.getAllSubscriptionResults()
+            # getIDList keeps the order of SUMO, which the caller relies on.
+            for veh_id in self._api.vehicle.getIDList():
+                if veh_id in arrived:
+                    continue
+                res = results.get(veh_id)
+                if res is None:
+                    # Not subscribed, e.g. restored from a saved SUMO state
+                    running[veh_id] = self._snapshot(veh_id)
+                    self._subscribe(veh_id)
+                else:
+                    running[veh_id] = self._snapshot_from_result(veh_id, res)
+        self._last = SUMOStepResult(new_time, arrived, departed, running)
         return self._last
 
+    def _subscribe(self, veh_id: str):
+        try:
+            self._api.vehicle.subscribe(veh_id, self._sub_vars)
+        except Exception:
+            pass
+
+    def _snapshot_from_result(self, veh_id: str, res: Dict[int, Any]) -> SUMOVehicleSnapshot:
+        dist_id, road_id, pos_id = self._sub_vars
+        try:
+            dist = float(res[dist_id])
+        except Exception:
+            dist = 0.0
+        road = str(res.get(road_id, ""))
+        try:
+            pos = tuple(res[pos_id])
+            if len(pos) != 2:
+                pos = (math.nan, math.nan)
+        except Exception:
+            pos = (math.nan, math.nan)
+        return SUMOVehicleSnapshot(veh_id, dist, road, pos)  # type: ignore[arg-type]
+
     def _snapshot(self, veh_id: str) -> SUMOVehicleSnapshot:
         try:
             dist = float(self._api.vehicle.getDistance(veh_id))
@@ -593,13 +659,68 @@ class SUMOSingleBackend(_RouteFinderMixin):
         self._api.simulation.loadState(str(path))
 
 
+class _TravelTimeReporter:
+    """Worker-side record of the edge travel times already known to the parent.
+
+    Every ``interval`` seconds the worker reads the current travel time of all
+    its edges and reports only those that moved by more than ``threshold``
+    (relative) from the last reported value.  The reply is a pair of arrays:
+    positions in the worker's edge order and the new travel times.
+    """
+
+    def __init__(self, edge_tt: Dict[str, float], interval: int, threshold: float):
+        self.ids = list(edge_tt.keys())
+        self.free = np.array(list(edge_tt.values()), dtype=np.float64)
+        self.sent = self.free.copy()
+        self.interval = interval
+        self.threshold = threshold
+        self.next_time = -math.inf
+
+    def reset(self):
+        """Forget reported values, e.g. after the parent reloaded a state."""
+        self.sent[:] = self.free
+        self.next_time = -math.inf
+
+    def poll(self, api: Any, now: float) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if self.interval <= 0 or len(self.ids) == 0 or now < self.next_time:
+            return None
+        self.next_time = now + self.interval
+        cur = self.sent.copy()
+        for i, eid in enumerate(self.ids):
+            try:
+                cur[i] = float(api.edge.getTraveltime(eid))
+            except Exception:
+                pass
+        changed = np.flatnonzero(np.abs(cur - self.sent) > self.threshold * self.sent)
+        if len(changed) == 0:
+            return None
+        self.sent[changed] = cur[changed]
+        return changed.astype(np.int32), cur[changed]
+
+
 class _PartitionWorker:
-    def __init__(self, ctx: Any, part_id: int, cmd: List[str], edge_speeds: Dict[str, float]):
+    def __init__(
+        self,
+        ctx: Any,
+        part_id: int,
+        cmd: List[str],
+        edge_speeds: Dict[str, float],
+        edge_tt: Optional[Dict[str, float]] = None,
+        tt_interval: int = 0,
+        tt_threshold: float = 0.0,
+        channel: Optional[ShmChannel] = None,
+    ):
         self.part_id = part_id
+        self.channel = channel
+        # A "step" whose reply has not been read yet, and a reply read early
+        # because another request had to go through the pipe first.
+        self.step_pending = False
+        self.stashed: Optional[dict] = None
         self.parent_conn, child_conn = ctx.Pipe()
+        shm = None if channel is None else (channel.ring_names, channel.roads.names)
         self.process = ctx.Process(
             target=_sumo_partition_worker_main,
-            args=(child_conn, part_id, cmd, edge_speeds),
+            args=(child_conn, part_id, cmd, edge_speeds, edge_tt or {}, tt_interval, tt_threshold, shm),
             daemon=True,
         )
         self.process.start()
@@ -608,7 +729,39 @@ class _PartitionWorker:
             raise RuntimeError(f"Failed to start SUMO partition {part_id}:\n{payload}")
         self.time = int(payload)
 
+    def send_routes(self, items: List[Tuple[str, List[str], bool, Optional[float], Optional[float]]]):
+        """Send an ``add_routes`` batch, through shared memory when possible."""
+        self.drain_step()
+        msg = None if self.channel is None else self.channel.pack_routes(items)
+        if msg is None:
+            self.send("add_routes", items)
+        else:
+            self.send("add_routes_shm", msg)
+
+    def recv_step(self) -> dict:
+        """Receive a step reply, decoding it from shared memory when needed."""
+        if self.stashed is not None:
+            result, self.stashed = self.stashed, None
+            return result
+        self.step_pending = False
+        result = self.recv()
+        if "shm" in result:
+            assert self.channel is not None
+            result = self.channel.unpack_step(result)
+        return result
+
+    def drain_step(self):
+        """
+        Read the reply of a pending step and keep it for :meth:`recv_step`.
+        Requests and replies share one pipe, so this is needed before anything
+        else is sent while the worker is stepping.
+        """
+        if self.step_pending:
+            self.stashed = self.recv_step()
+
     def send(self, op: str, *args: Any):
+        if op == "step":
+            self.step_pending = True
         self.parent_conn.send((op, args))
 
     def recv(self) -> Any:
@@ -618,6 +771,7 @@ class _PartitionWorker:
         return payload
 
     def call(self, op: str, *args: Any) -> Any:
+        self.drain_step()
         self.send(op, *args)
         return self.recv()
 
@@ -634,11 +788,26 @@ class _PartitionWorker:
         if self.process.is_alive():
             self.process.terminate()
             self.process.join(timeout=2)
-
-
-def _sumo_partition_worker_main(conn: Any, part_id: int, cmd: List[str], edge_speeds: Dict[str, float]):
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+
+def _sumo_partition_worker_main(
+    conn: Any,
+    part_id: int,
+    cmd: List[str],
+    edge_speeds: Dict[str, float],
+    edge_tt: Optional[Dict[str, float]] = None,
+    tt_interval: int = 0,
+    tt_threshold: float = 0.0,
+    shm: Optional[Tuple[Tuple[str, str], List[str]]] = None,
+):
     api = None
+    channel: Optional[ShmChannel] = None
     try:
+        if shm is not None:
+            channel = ShmChannel.attach(*shm)
         import libsumo as api  # type: ignore
         api.start(cmd)
         conn.send(("ok", int(api.simulation.getTime())))
@@ -663,6 +832,7 @@ def _sumo_partition_worker_main(conn: Any, part_id: int, cmd: List[str], edge_sp
         return veh_id, dist, road, pos
 
     managed_stops: Dict[str, Tuple[str, float]] = {}
+    tt_reporter = _TravelTimeReporter(edge_tt or {}, tt_interval, tt_threshold)
 
     while True:
         try:
@@ -695,11 +865,21 @@ def _sumo_partition_worker_main(conn: Any, part_id: int, cmd: List[str], edge_sp
                 # trip actually ends.  Do not query or transfer distances for
                 # every still-running vehicle; only final/segment arrivals need
                 # snapshots so route transfer and trip completion stay exact.
-                conn.send(("ok", {
-                    "time": int(api.simulation.getTime()),
+                now = int(api.simulation.getTime())
+                reply = {
+                    "time": now,
                     "arrived": arrived,
                     "departed": list(api.simulation.getDepartedIDList()),
-                }))
+                }
+                # Travel-time changes ride on the step reply so the parent
+                # router sees congestion without another round-trip.
+                tt = tt_reporter.poll(api, now)
+                packed = None if channel is None else channel.pack_step(now, arrived, reply["departed"], tt)
+                if packed is not None:
+                    reply = packed
+                elif tt is not None:
+                    reply["tt"] = tt
+                conn.send(("ok", reply))
             elif op == "vcr":
                 # Average VCR is rarely requested in core V2Sim.  Computing it
                 # on every step adds an O(edges) libsumo loop and larger IPC
@@ -719,11 +899,14 @@ def _sumo_partition_worker_main(conn: Any, part_id: int, cmd: List[str], edge_sp
                 if agg_routing:
                     api.vehicle.setRoutingMode(veh_id, api.constants.ROUTING_MODE_AGGREGATED)
                 conn.send(("ok", None))
-            elif op == "add_routes":
+            elif op == "add_routes" or op == "add_routes_shm":
                 # Batch insertion is important in partition mode: otherwise a
                 # burst of vehicles crossing a boundary creates one blocking
                 # IPC round-trip per vehicle.
                 items = args[0]
+                if op == "add_routes_shm":
+                    assert channel is not None
+                    items = channel.unpack_routes(items)
                 for veh_id, route_edges, agg_routing, depart_pos, arrival_pos in items:
                     _add_vehicle_with_route(api, veh_id, route_edges, depart_pos, arrival_pos)
                     if agg_routing:
@@ -756,12 +939,15 @@ def _sumo_partition_worker_main(conn: Any, part_id: int, cmd: List[str], edge_sp
                 conn.send(("ok", int(api.simulation.getTime())))
             elif op == "load":
                 api.simulation.loadState(str(args[0]))
+                tt_reporter.reset()
                 conn.send(("ok", int(api.simulation.getTime())))
             elif op == "time":
                 conn.send(("ok", int(api.simulation.getTime())))
             elif op == "close":
                 try:
                     api.close()
+                    if channel is not None:
+                        channel.close()
                 finally:
                     conn.send(("ok", None))
                 break
@@ -785,7 +971,26 @@ class SUMOParallelBackend(_RouteFinderMixin):
         routing_algo: str,
         seed: int,
         gui: bool,
-    ):
+        tt_interval: int = 60,
+        tt_threshold: float = 0.05,
+        shm_ipc: bool = True,
+        shm_bytes: int = 1 << 22,
+       ):
+        """
+        Workers report edge travel times every ``tt_interval`` seconds of
+        simulation time, sending only the edges whose travel time changed by
+        more than ``tt_threshold`` (relative).  The router then uses these live
+        values instead of free-flow times.  ``tt_interval <= 0`` disables it.
+
+        With ``shm_ipc``, step replies and route batches travel through a
+        shared-memory ring of ``shm_bytes`` bytes per direction and worker (see
+        :mod:`v2sim.sim.sumo_ipc`); the pipe only carries control messages.
+        Messages that do not fit fall back to the pipe.
+
+        :meth:`simulation_step` can also be split into :meth:`begin_step` and
+        :meth:`finish_step`, so that the caller works while the partitions step.
+        Time spent in each phase is accumulated in :attr:`phase_times`.
+        """
         self._snet = snet
         self._partition = partition
         self._start_time = start_time
@@ -810,6 +1015,22 @@ class SUMOParallelBackend(_RouteFinderMixin):
         self._last = SUMOStepResult(start_time, {}, [], {})
         self._last_speed_sum = 0.0
         self._last_speed_count = 0
+        self._tt_interval = tt_interval
+        self._tt_threshold = tt_threshold
+        # Live travel times of all partition edges.  ``_tt_index[pid]`` maps a
+        # worker's edge order to positions in ``_tt``.
+        self._edge_index: Dict[str, int] = {}
+        self._tt_free = np.zeros(0, dtype=np.float64)
+        self._tt = np.zeros(0, dtype=np.float64)
+        self._tt_index: Dict[int, np.ndarray] = {}
+        self._shm_ipc = shm_ipc
+        self._shm_bytes = shm_bytes
+        # Target time of the step issued by begin_step(), if its replies have
+        # not been reconciled yet.
+        self._inflight: Optional[int] = None
+        self._issued_at = 0.0
+        self._phase_times: Dict[str, float] = dict.fromkeys(("issue", "overlap", "wait", "reconcile"), 0.0)
+        self._phase_steps = 0
 
     @property
     def is_partitioned(self) -> bool:
@@ -841,23 +1062,80 @@ class SUMOParallelBackend(_RouteFinderMixin):
                 "--mesosim", str(self._partition.meso.get(pid, False)).lower(),
             ]
             edge_speeds: Dict[str, float] = {}
+            edge_tt: Dict[str, float] = {}
             for eid in self._partition.edges[pid]:
                 try:
                     edge_speeds[eid] = float(self._snet.getEdge(eid).getSpeed())
+                    edge_tt[eid] = self._static_travel_time(eid)
                 except Exception:
                     pass
-            self._workers[pid] = _PartitionWorker(ctx, pid, cmd, edge_speeds)
+            self._add_tt_edges(pid, edge_tt)
+            channel: Optional[ShmChannel] = None
+            if self._shm_ipc:
+                try:
+                    channel = ShmChannel.create(self._partition.edges[pid], self._shm_bytes)
+                except OSError:
+                    # No usable shared memory (e.g. a tiny /dev/shm); keep pipes.
+                    channel = None
+            self._workers[pid] = _PartitionWorker(
+                ctx, pid, cmd, edge_speeds, edge_tt, self._tt_interval, self._tt_threshold, channel
+            )
 
     def close(self):
         for worker in list(self._workers.values()):
             worker.close()
         self._workers.clear()
+        self._inflight = None
+
+    @property
+    def in_flight(self) -> bool:
+        """Whether a step was issued by :meth:`begin_step` and not finished yet"""
+        return self._inflight is not None
+
+    @property
+    def phase_times(self) -> Dict[str, float]:
+        """
+        Accumulated wall time (seconds) of each step phase, and the step count:
+            issue: flushing queued vehicles and sending "step" to the workers
+            overlap: caller work between begin_step() and finish_step(), done while the workers step
+            wait: blocking on the replies of the slowest worker
+            reconcile: merging travel times and transferring boundary vehicles
+        """
+        ret = dict(self._phase_times)
+        ret["steps"] = self._phase_steps
+        return ret
 
     def get_time(self) -> int:
+        if self._inflight is not None:
+            # The workers may be ahead; the caller has not seen that step yet.
+            return self._last.time
         if self._workers:
             return max(worker.call("time") for worker in self._workers.values())
         return self._last.time
 
+    def _add_tt_edges(self, pid: int, edge_tt: Dict[str, float]):
+        """Append the edges of partition ``pid`` to the travel-time array."""
+        base = len(self._tt_free)
+        for i, eid in enumerate(edge_tt):
+            self._edge_index[eid] = base + i
+        self._tt_index[pid] = np.arange(base, base + len(edge_tt), dtype=np.int64)
+        self._tt_free = np.concatenate([self._tt_free, np.fromiter(edge_tt.values(), dtype=np.float64, count=len(edge_tt))])
+        self._tt = np.concatenate([self._tt, self._tt_free[base:]])
+
+    def _merge_traveltimes(self, pid: int, tt: Tuple[np.ndarray, np.ndarray]) -> bool:
+        """Merge travel-time changes reported by worker ``pid``. Return whether anything changed."""
+        idx, vals = tt
+        if len(idx) == 0:
+            return False
+        self._tt[self._tt_index[pid][idx]] = vals
+        return True
+
+    def get_traveltime(self, edge_id: str) -> float:
+        i = self._edge_index.get(edge_id)
+        if i is None:
+            return self._static_travel_time(edge_id)
+        return float(self._tt[i])
+
     def _snapshot_from_tuple(self, data: Tuple[str, float, str, Tuple[float, float]], offset: float = 0.0) -> SUMOVehicleSnapshot:
         veh_id, dist, road, pos = data
         return SUMOVehicleSnapshot(veh_id, offset + float(dist), road, pos)
@@ -924,7 +1202,7 @@ class SUMOParallelBackend(_RouteFinderMixin):
         self._pending_adds = {}
         for pid, payload in pending.items():
             if payload:
-                self._workers[pid].send("add_routes", payload)
+                self._workers[pid].send_routes(payload)
         for pid, payload in pending.items():
             if payload:
                 self._workers[pid].recv()
@@ -941,7 +1219,7 @@ class SUMOParallelBackend(_RouteFinderMixin):
                 arrival_pos = active.arrival_pos if active.segment_index == len(active.segments) - 1 else None
                 payload.append((veh_id, list(seg.edges), bool(agg_routing), None, arrival_pos))
             if payload:
-                self._workers[pid].send("add_routes", payload)
+                self._workers[pid].send_routes(payload)
         for pid, rows in items.items():
             if rows:
                 self._workers[pid].recv()
@@ -1070,13 +1348,43 @@ class SUMOParallelBackend(_RouteFinderMixin):
                 pass
 
     def simulation_step(self, until_s: int) -> SUMOStepResult:
+        self.begin_step(until_s)
+        return self.finish_step()
+
+    def begin_step(self, until_s: int):
+        """
+        Flush queued vehicles and let all workers advance to ``until_s``
+        without waiting for them.  Vehicles added afterwards are inserted
+        after this step.
+            until_s: Target simulation time
+        """
+        assert self._inflight is None, "A SUMO step is already in flight"
+        st = time.perf_counter()
         self._flush_pending_adds()
         for worker in self._workers.values():
             worker.send("step", until_s)
-
+        self._inflight = until_s
+        self._issued_at = time.perf_counter()
+        self._phase_times["issue"] += self._issued_at - st
+
+    def finish_step(self) -> SUMOStepResult:
+        """Wait for the step issued by :meth:`begin_step` and reconcile its arrivals"""
+        assert self._inflight is not None, "No SUMO step in flight"
+        until_s = self._inflight
+        st = time.perf_counter()
         raw_results: Dict[int, dict] = {}
         for pid, worker in self._workers.items():
-            raw_results[pid] = worker.recv()
+            raw_results[pid] = worker.recv_step()
+        self._inflight = None
+        received = time.perf_counter()
+        self._phase_times["overlap"] += st - self._issued_at
+        self._phase_times["wait"] += received - st
+        self._phase_steps += 1
+        self._reconcile(until_s, raw_results)
+        self._phase_times["reconcile"] += time.perf_counter() - received
+        return self._last
+
+    def _reconcile(self, until_s: int, raw_results: Dict[int, dict]):
 
         arrived_final: Dict[str, SUMOVehicleSnapshot] = {}
         running: Dict[str, SUMOVehicleSnapshot] = {}
@@ -1084,8 +1392,15 @@ class SUMOParallelBackend(_RouteFinderMixin):
         transferred: Dict[str, SUMOVehicleSnapshot] = {}
         transfer_batches: Dict[int, List[Tuple[str, _ActiveRoute, bool]]] = {}
 
-        for result in raw_results.values():
+        tt_changed = False
+        for pid, result in raw_results.items():
             departed.extend(result.get("departed", []))
+            tt = result.get("tt")
+            if tt is not None:
+                tt_changed |= self._merge_traveltimes(pid, tt)
+        if tt_changed:
+            # Cached OD routes were found with the old travel times.
+            self._route_cache.clear()
 
         # Process arrivals after all workers have advanced to the same time.
         for pid, result in raw_results.items():
@@ -1121,7 +1436,6 @@ class SUMOParallelBackend(_RouteFinderMixin):
 
         new_time = max(int(r.get("time", until_s)) for r in raw_results.values()) if raw_results else until_s
         self._last = SUMOStepResult(new_time, arrived_final, departed, running)
-        return self._last
 
     def get_vehicle_position(self, veh_id: str) -> Tuple[float, float]:
         snap = self._last.running.get(veh_id) or self._last.arrived.get(veh_id)
@@ -1166,9 +1480,19 @@ class SUMOParallelBackend(_RouteFinderMixin):
             state_path = f / f"traffic_part_{pid}.gz"
             worker.call("save", str(state_path))
             files[str(pid)] = state_path.name
+        inflight = None
+        if self._inflight is not None:
+            # The workers were saved after the in-flight step; keep its replies
+            # so that the step is finished, not lost, after loading.
+            inflight = {
+                "until": self._inflight,
+                "time": self._last.time,
+                "replies": {str(pid): worker.stashed for pid, worker in self._workers.items()},
+            }
         return {
             "type": "partitioned-sumo",
             "files": files,
+            "inflight": inflight,
             "active": {
                 veh_id: {
                     "segments": [(seg.part_id, list(seg.edges)) for seg in active.segments],
@@ -1192,6 +1516,18 @@ class SUMOParallelBackend(_RouteFinderMixin):
             if not state_path.exists():
                 raise FileNotFoundError(f"SUMO partition state file not found: {state_path}")
             self._workers[pid].call("load", str(state_path))
+        # Workers report travel times from scratch after loading a state.
+        self._tt[:] = self._tt_free
+        self._route_cache.clear()
+        self._inflight = None
+        inflight = meta.get("inflight")
+        if inflight is not None:
+            for pid_raw, reply in inflight["replies"].items():
+                if int(pid_raw) in self._workers:
+                    self._workers[int(pid_raw)].stashed = reply
+            self._inflight = int(inflight["until"])
+            self._issued_at = time.perf_counter()
+            self._last = SUMOStepResult(int(inflight["time"]), {}, [], {})
         self._active.clear()
         for veh_id, item in meta.get("active", {}).items():
             segments = [_RouteSegment(int(pid), list(edges)) for pid, edges in item["segments"]]
@@ -0,0 +1,308 @@
+"""Shared-memory transport between :class:`SUMOParallelBackend` and its workers.
+
+Each partition worker owns two single-producer/single-consumer ring buffers in
+shared memory, one per direction.  Bulk payloads (step replies and batched
+route insertions) are written into a ring as fixed-layout NumPy records, and
+only a small ``(start, nbytes)`` locator plus newly interned names travel over
+the ``multiprocessing`` pipe, which stays the control channel.  Vehicle and
+edge IDs, as well as whole route segments, are interned to integers in
+per-worker tables that are mirrored on both ends.  Route segments repeat a lot
+(OD routes are cached by the backend), so a batch of insertions usually costs
+a few numbers per vehicle.
+
+The channel relies on the strict request/reply discipline of the backend: an
+end only interns names while building a message and ships them with that
+message, so both tables always agree when the other end reads it.  If a
+message does not fit into the ring, the caller sends the usual pickled payload
+instead.
+"""
+
+from __future__ import annotations
+
+import math
+from operator import itemgetter
+from itertools import chain
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+__all__ = ["ShmRing", "SyncedNames", "ShmChannel"]
+
+_HEADER = 64 # head (uint64), tail (uint64), capacity (uint64), padding
+
+# Record layouts of the two bulk messages, as lists of array dtypes.
+# Step reply: departed vehicles; arrived vehicle, distance, road, position (x, y pairs); travel-time edges and values.
+_STEP_DTYPES = (np.int32, np.int32, np.float64, np.int32, np.float64, np.int32, np.float64)
+# Route insertion: vehicle, aggregated routing flag, depart position, arrival position (NaN for None), route segment.
+_ROUTE_DTYPES = (np.int32, np.int32, np.float64, np.float64, np.int32)
+# Route segments are interned as their edge IDs joined by this separator, which cannot occur in SUMO IDs.
+_ROUTE_SEP = "\x00"
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _nan_to_none(a: np.ndarray) -> List[Optional[float]]:
+    return np.where(np.isnan(a), None, a.astype(object)).tolist()
+
+
+def _split_route(key: str) -> Tuple[str, ...]:
+    return tuple(key.split(_ROUTE_SEP))
+
+
+class ShmRing:
+    """Single-producer/single-consumer byte ring in shared memory.
+
+    Only the producer moves the head and only the consumer moves the tail, so
+    no lock is needed.  Messages never wrap: a message that does not fit at the
+    end of the buffer starts again at offset 0.
+    """
+
+    def __init__(self, name: Optional[str] = None, size: int = 1 << 22):
+        """
+        :param name: Name of an existing ring to attach to, or None to create a new one
+        :param size: Capacity in bytes of a new ring
+        """
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=_HEADER + _pad8(size))
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._ctr = np.ndarray((3,), dtype=np.uint64, buffer=self._shm.buf[:24])
+        if self._owner:
+            self._ctr[:] = (0, 0, _pad8(size))
+        self.capacity = int(self._ctr[2])
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def write(self, arrays: Sequence[np.ndarray]) -> Optional[Tuple[int, int]]:
+        """Write one message made of flat arrays. Return its ``(start, nbytes)`` locator, or None if the ring is full."""
+        header = np.array([len(arrays)] + [a.size for a in arrays], dtype=np.int64)
+        nbytes = header.nbytes + sum(_pad8(a.nbytes) for a in arrays)
+        cap = self.capacity
+        head, tail = int(self._ctr[0]), int(self._ctr[1])
+        start = head
+        if head % cap + nbytes > cap:
+            start = head + cap - head % cap
+        if start + nbytes - tail > cap:
+            return None
+        off = _HEADER + start % cap
+        buf = self._shm.buf
+        for a in (header, *arrays):
+            buf[off:off + a.nbytes] = np.ascontiguousarray(a).view(np.uint8).reshape(-1)
+            off += _pad8(a.nbytes)
+        del buf
+        self._ctr[0] = start + nbytes
+        return start, nbytes
+
+    def read(self, loc: Tuple[int, int], dtypes: Sequence[Any]) -> List[np.ndarray]:
+        """Copy the message at ``loc`` out of the ring and release its space."""
+        start, nbytes = loc
+        off = _HEADER + start % self.capacity
+        buf = self._shm.buf
+        n = int(np.frombuffer(buf, np.int64, 1, off)[0])
+        if n != len(dtypes):
+            raise RuntimeError(f"Shared-memory message has {n} arrays, expected {len(dtypes)}")
+        lens = np.frombuffer(buf, np.int64, n, off + 8).tolist()
+        off += _pad8(8 * (n + 1))
+        ret: List[np.ndarray] = []
+        for ln, dt in zip(lens, dtypes):
+            a = np.frombuffer(buf, dt, ln, off).copy()
+            off += _pad8(a.nbytes)
+            ret.append(a)
+        del buf
+        self._ctr[1] = start + nbytes
+        return ret
+
+    def close(self):
+        """Detach from the ring. The creating end also removes it."""
+        self._ctr = None # type: ignore
+        self._shm.close()
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SyncedNames:
+    """String table mirrored on both ends of a request/reply channel."""
+
+    def __init__(self, names: Sequence[str] = (), decode: Optional[Callable[[str], Any]] = None):
+        """
+        :param names: Initial names, known to both ends
+        :param decode: Function applied once to each name to produce the value returned by :meth:`lookup`
+        """
+        self.names: List[str] = list(names)
+        self.index: Dict[str, int] = {n: i for i, n in enumerate(self.names)}
+        self.shipped = len(self.names)
+        self._decode = decode
+        self._obj = np.empty(0, dtype=object)
+        self._filled = 0
+
+    def intern(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.index[name] = i
+        return i
+
+    def lookup(self, ids: np.ndarray) -> List[Any]:
+        """Return the (decoded) names of an array of IDs."""
+        n = len(self.names)
+        if self._filled < n:
+            if len(self._obj) < n:
+                # Grow geometrically so a growing table is not copied on every message
+                obj = np.empty(max(n, 2 * len(self._obj)), dtype=object)
+                obj[:self._filled] = self._obj[:self._filled]
+                self._obj = obj
+            obj = self._obj
+            dec = self._decode
+            # Element-wise, so that sequences returned by ``decode`` are stored as objects
+            for i in range(self._filled, n):
+                obj[i] = self.names[i] if dec is None else dec(self.names[i])
+            self._filled = n
+        return self._obj.take(ids).tolist()
+
+    def ids(self, names: Sequence[str]) -> np.ndarray:
+        """Intern a sequence of names and return their IDs as an int32 array."""
+        try:
+            return np.fromiter(map(self.index.__getitem__, names), np.int32, len(names))
+        except KeyError:
+            return np.fromiter(map(self.intern, names), np.int32, len(names))
+
+    def take_new(self) -> Optional[Tuple[int, List[str]]]:
+        """Return the names interned since the last call, as ``(first id, names)``, and mark them shipped."""
+        if self.shipped == len(self.names):
+            return None
+        start = self.shipped
+        self.shipped = len(self.names)
+        return start, self.names[start:]
+
+    def rollback(self):
+        """Forget names interned for a message that was not sent."""
+        for n in self.names[self.shipped:]:
+            del self.index[n]
+        del self.names[self.shipped:]
+        self._filled = min(self._filled, self.shipped)
+
+    def merge(self, new: Optional[Tuple[int, List[str]]]):
+        """Apply names shipped by the other end."""
+        if new is None:
+            return
+        start, names = new
+        if start != len(self.names):
+            raise RuntimeError(f"Interned name tables are out of sync: {start} != {len(self.names)}")
+        for n in names:
+            self.intern(n)
+        self.shipped = len(self.names)
+
+
+class ShmChannel:
+    """One end of the shared-memory channel between the backend and a partition worker."""
+
+    def __init__(self, send_ring: ShmRing, recv_ring: ShmRing, roads: Sequence[str]):
+        self._send = send_ring
+        self._recv = recv_ring
+        self.vehs = SyncedNames()
+        self.roads = SyncedNames(roads)
+        self.routes = SyncedNames(decode=_split_route)
+        self._tables = {"vehs": self.vehs, "roads": self.roads, "routes": self.routes}
+
+    @staticmethod
+    def create(roads: Sequence[str], size: int = 1 << 22) -> "ShmChannel":
+        """Create the rings. The returned end is the backend (parent) end."""
+        return ShmChannel(ShmRing(size=size), ShmRing(size=size), roads)
+
+    @property
+    def ring_names(self) -> Tuple[str, str]:
+        """Ring names to pass to :meth:`attach` in the worker process."""
+        return self._send.name, self._recv.name
+
+    @staticmethod
+    def attach(ring_names: Tuple[str, str], roads: Sequence[str]) -> "ShmChannel":
+        """Attach the worker end to rings created by :meth:`create`."""
+        to_worker, to_parent = ring_names
+        return ShmChannel(ShmRing(to_parent), ShmRing(to_worker), roads)
+
+    def _write(self, arrays: Sequence[np.ndarray]) -> Optional[dict]:
+        loc = self._send.write(arrays)
+        if loc is None:
+            for table in self._tables.values():
+                table.rollback()
+            return None
+        msg: dict = {"shm": loc}
+        for key, table in self._tables.items():
+            new = table.take_new()
+            if new is not None:
+                msg[key] = new
+        return msg
+
+    def _read(self, msg: dict, dtypes: Sequence[Any]) -> List[np.ndarray]:
+        for key, table in self._tables.items():
+            table.merge(msg.get(key))
+        return self._recv.read(msg["shm"], dtypes)
+
+    def pack_step(
+        self,
+        time: int,
+        arrived: Dict[str, Tuple[str, float, str, Tuple[float, float]]],
+        departed: Sequence[str],
+        tt: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> Optional[dict]:
+        """Encode a worker step reply. Return the pipe message, or None if it must be sent pickled."""
+        if arrived:
+            # itemgetter passes instead of zip(*...), which would allocate one iterator per vehicle
+            vals = list(arrived.values())
+            n = len(vals)
+            veh = self.vehs.ids(list(map(itemgetter(0), vals)))
+            road = self.roads.ids(list(map(itemgetter(2), vals)))
+            dist = np.fromiter(map(itemgetter(1), vals), np.float64, n)
+            pos = np.fromiter(chain.from_iterable(map(itemgetter(3), vals)), np.float64, 2 * n)
+        else:
+            veh = road = np.zeros(0, np.int32)
+            dist = pos = np.zeros(0, np.float64)
+        dep = self.vehs.ids(departed)
+        if tt is None:
+            tt = (np.zeros(0, np.int32), np.zeros(0, np.float64))
+        msg = self._write((dep, veh, dist, road, pos, tt[0].astype(np.int32, copy=False), tt[1]))
+        if msg is not None:
+            msg["time"] = time
+        return msg
+
+    def unpack_step(self, msg: dict) -> dict:
+        """Decode a step reply produced by :meth:`pack_step` into the pickled reply format."""
+        dep, veh, dist, road, pos, tt_idx, tt_val = self._read(msg, _STEP_DTYPES)
+        vids = self.vehs.lookup(veh)
+        xy = zip(pos[0::2].tolist(), pos[1::2].tolist())
+        arrived = dict(zip(vids, zip(vids, dist.tolist(), self.roads.lookup(road), xy)))
+        ret = {"time": msg["time"], "arrived": arrived, "departed": self.vehs.lookup(dep)}
+        if len(tt_idx) > 0:
+            ret["tt"] = (tt_idx, tt_val)
+        return ret
+
+    def pack_routes(self, items: Sequence[Tuple[str, List[str], bool, Optional[float], Optional[float]]]) -> Optional[dict]:
+        """Encode a batch of ``add_routes`` items. Return the pipe message, or None if it must be sent pickled."""
+        if not items:
+            return None
+        n = len(items)
+        veh = self.vehs.ids(list(map(itemgetter(0), items)))
+        agg = np.fromiter(map(itemgetter(2), items), np.int32, n)
+        dpos = np.fromiter((math.nan if it[3] is None else it[3] for it in items), np.float64, n)
+        apos = np.fromiter((math.nan if it[4] is None else it[4] for it in items), np.float64, n)
+        route = self.routes.ids(list(map(_ROUTE_SEP.join, map(itemgetter(1), items))))
+        return self._write((veh, agg, dpos, apos, route))
+
+    def unpack_routes(self, msg: dict) -> List[Tuple[str, Sequence[str], bool, Optional[float], Optional[float]]]:
+        """Decode a batch produced by :meth:`pack_routes` into ``add_routes`` items. Routes come back as shared tuples."""
+        veh, agg, dpos, apos, route = self._read(msg, _ROUTE_DTYPES)
+        return list(zip(self.vehs.lookup(veh), self.routes.lookup(route), agg.astype(bool).tolist(), _nan_to_none(dpos), _nan_to_none(apos)))
+
+    def close(self):
+        self._send.close()
+        self._recv.close()
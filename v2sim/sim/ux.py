@@ -6,17 +6,20 @@ from dataclasses import asdict
 from itertools import chain
 from warnings import warn
 from pathlib import Path
-from typing import List, Optional, Union
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Union
 from ..utils import *
 from ..hub import *
 from ..veh import *
 from ..locale import Lang
 from ..net import RoadNet
 from .routing import *
+from .ch import ContractionHierarchy
 from .uxsim import Link
 from .tlog import TripLogger
 from .utils import CaseData
-from .base import CommonConfig, TrafficInst, TRAFFIC_INST_FILE_NAME, UXsimConfig
+from .base import CommonConfig, TrafficInst, TRAFFIC_INST_FILE_NAME, TRAFFIC_CHECKPOINT_FOLDER, UXsimConfig
+from .checkpoint import is_checkpoint, load_checkpoint, save_checkpoint
 
 WORLD_FILE_NAME = "world.gz"
 
@@ -28,18 +31,43 @@ class TrafficUX(TrafficInst):
         hubs: MixedHub, pdn: Grid, gasoline_price: TimeFunc, 
         seed: int = 0, silent: bool = False, *,
         add_veh_to_scs: bool = True,
+        ev_fleet: bool = False,
         routing_algorithm: str = "dijkstra",  # or "astar"
         show_uxsim_info: bool = False,
         randomize_uxsim: bool = True,
         no_parallel: bool = False,
+        route_cache_bucket: int = 0,
+        route_cache_size: int = 65536,
+        route_cache_tolerance: float = 0.2,
+        station_batch_min: int = 0,
+        use_ch: bool = False,
+        array_links: bool = False,
+        link_history_window: float = 0,
+        rebalance_interval: int = 0,
+        rebalance_threshold: float = 1.25,
+        rebalance_log: str = "",
+        rebalance_replay: str = "",
+        net_file: Optional[str] = None,
     ):  
-        super().__init__(start_time, step_len, end_time, roadnet, trip_logger, vehs, hubs, pdn, gasoline_price, seed, silent)
+        super().__init__(start_time, step_len, end_time, roadnet, trip_logger, vehs, hubs, pdn, gasoline_price, seed, silent, ev_fleet=ev_fleet)
         self.__stall_warned = False
         self.__stall_count = 0
         self.__stall_last_check = 0
         
         assert routing_algorithm in ("dijkstra", "astar"), Lang.ROUTE_ALGO_NOT_SUPPORTED
         self.__use_astar = routing_algorithm == "astar"
+
+        # Route cache shared by all OD queries. Non-positive bucket length disables it.
+        self.__rcache = RouteCache(route_cache_bucket, route_cache_size, route_cache_tolerance) if route_cache_bucket > 0 else None
+
+        # Station selection in batch: once a group of stations is queried station_batch_min times
+        # in one step, a reverse search table from the stations serves the rest of the step.
+        # The table keeps only the fastest of parallel edges and may break ties differently from
+        # astarMC/dijMC, so it is off unless enabled. Non-positive value (the default) disables it.
+        self.__sbatch_min = station_batch_min
+        self.__rtables: Dict[FrozenSet[str], ReverseTable] = {}
+        self.__rtables_cnt: Dict[FrozenSet[str], int] = defaultdict(int)
+        self.__rtables_time = -1
         
         # Get all road names
         self.__names: List[str] = list(self._rnet.edges.keys())
@@ -50,6 +78,7 @@ class TrafficUX(TrafficInst):
             warn(Lang.WARN_CS_NOT_IN_SCC.format(','.join(bad_s)))
         
         # Create uxsim world
+        from .uxworld import RebalanceConfig
         create_func = self._rnet.create_singleworld if no_parallel else self._rnet.create_world
         self.__show_uxsim_info = show_uxsim_info
         self.W = create_func(
@@ -61,12 +90,32 @@ class TrafficUX(TrafficInst):
             reduce_memory_delete_vehicle_route_pref=True,
             vehicle_logging_timestep_interval=-1,
             print_mode=1 if self.__show_uxsim_info else 0,
+            array_links=array_links,
+            # Keep only the last link_history_window seconds of the link series. Non-positive value (the default) keeps the full
+            # history, which the analyzer and the post-processing of the whole horizon need.
+            link_history_window=link_history_window if link_history_window > 0 else None,
+            # Load rebalancing between the partitions. Non-positive interval disables it.
+            rebalance=RebalanceConfig(rebalance_interval, rebalance_threshold,
+                log_file=rebalance_log or None, replay=rebalance_replay or None) if rebalance_interval > 0 else None,
             silent=self.silent,
         )
+        
+        # Contraction hierarchy for shortest route queries, persisted next to the network file if given
+        self.__ch: Optional[ContractionHierarchy] = None
+        if use_ch:
+            if net_file is None:
+                self.__ch = ContractionHierarchy.build(self.W.get_cgl())
+            else:
+                self.__ch = ContractionHierarchy.load_or_build(net_file, self.W.get_cgl(), self.silent)
+            if not self.silent:
+                print(Lang.CH_LOADED.format(len(self.__ch.arc_edge)))
+
         if not self.silent:
-            from .uxworld import ParaWorlds
+            from .uxworld import ParaWorlds, ProcParaWorlds
             if isinstance(self.W, ParaWorlds):
-                print(Lang.PARA_WORLDS.format(len(self.W.worlds)))
+                print(Lang.PARA_WORLDS.format(self.W.world_count))
+            elif isinstance(self.W, ProcParaWorlds):
+                print(Lang.PROC_PARA_WORLDS.format(self.W.world_count))
             else:
                 print(Lang.SINGLE_WORLD)
 
@@ -90,16 +139,25 @@ class TrafficUX(TrafficInst):
         
         :param fastest: True = fastest route, False = shortest route
         """
-        if self.__use_astar:
+        cg = self.W.get_cgl()
+        if self.__rcache is not None:
+            ret = self.__rcache.get(cg, self._ct, O, D, fastest)
+            if ret is not None: return ret
+        if not fastest and self.__ch is not None:
+            ret = self.__ch.query(cg, self._ct, O, {D})
+        elif self.__use_astar:
             if fastest:
-                return astarF(self.W.get_gl(), self.W.get_coords(), self._ct, O, D)
+                ret = astarF(cg, self.W.get_coords(), self._ct, O, D)
             else:
-                return astarS(self.W.get_gl(), self.W.get_coords(), self._ct, O, D)
+                ret = astarS(cg, self.W.get_coords(), self._ct, O, D)
         else:
             if fastest:
-                return dijMF(self.W.get_gl(), self._ct, O, {D})
+                ret = dijMF(cg, self._ct, O, {D})
             else:
-                return dijMS(self.W.get_gl(), self._ct, O, {D})
+                ret = dijMS(cg, self._ct, O, {D})
+        if self.__rcache is not None:
+            self.__rcache.put(cg, self._ct, O, D, fastest, ret)
+        return ret
         
     def find_best_route(self, O:str, Ds:Iterable[str], fastest:bool = True):
         """
@@ -109,17 +167,19 @@ class TrafficUX(TrafficInst):
         :param Ds: Destination nodes/edges
         :param fastest: Whether to find the fastest route (True) or the shortest route (False)
         """
+        if not fastest and self.__ch is not None:
+            return self.__ch.query(self.W.get_cgl(), self._ct, O, Ds)
         if self.__use_astar:
             if fastest:
-                return astarMF(self.W.get_gl(), self.W.get_coords(), self._ct,
+                return astarMF(self.W.get_cgl(), self.W.get_coords(), self._ct,
                     O, Ds, max(0.1, self.W.get_average_speed()))
             else:
-                return astarMS(self.W.get_gl(), self.W.get_coords(), self._ct, O, Ds)
+                return astarMS(self.W.get_cgl(), self.W.get_coords(), self._ct, O, Ds)
         else:
             if fastest:
-                return dijMF(self.W.get_gl(), self._ct, O, Ds)
+                return dijMF(self.W.get_cgl(), self._ct, O, Ds)
             else:
-                return dijMS(self.W.get_gl(), self._ct, O, Ds)
+                return dijMS(self.W.get_cgl(), self._ct, O, Ds)
     
     def find_best_station(self, veh: Vehicle, O:str, to_stations: List[str], omega:float, 
             to_charge:float, max_dist:float, hub: StationHub) -> Tuple[str, Stage]:
@@ -136,21 +196,50 @@ class TrafficUX(TrafficInst):
         """
         Ds, scores = self._prepare_stations(veh, to_stations, omega, to_charge, hub)
 
-        if self.__use_astar:
-            ret = astarMC(self.W.get_gl(), self.W.get_coords(), self._ct, O, omega, Ds.keys(),
-                scores, max_dist, max(0.1, self.W.get_average_speed()))
-        else:
-            ret = dijMC(self.W.get_gl(), self._ct, O, omega, Ds.keys(), scores, max_dist)
+        rt = self.__get_reverse_table(Ds.keys())
+        ret = None if rt is None else rt.best(O, omega, scores, max_dist)
+        if ret is None:
+            if self.__use_astar:
+                ret = astarMC(self.W.get_cgl(), self.W.get_coords(), self._ct, O, omega, Ds.keys(),
+                    scores, max_dist, max(0.1, self.W.get_average_speed()))
+            else:
+                ret = dijMC(self.W.get_cgl(), self._ct, O, omega, Ds.keys(), scores, max_dist)
         
         if len(ret.nodes) == 0:  # No available station within range
             return "", ret
         return Ds[ret.nodes[-1]], ret
     
+    def __get_reverse_table(self, binds: Iterable[str]) -> Optional[ReverseTable]:
+        """Get the reverse search table of the given station binds in this step, None if not worth building yet"""
+        if self.__sbatch_min <= 0: return None
+        if self.__rtables_time != self._ct:
+            self.__rtables.clear()
+            self.__rtables_cnt.clear()
+            self.__rtables_time = self._ct
+        key = frozenset(binds)
+        rt = self.__rtables.get(key)
+        if rt is None:
+            self.__rtables_cnt[key] += 1
+            if self.__rtables_cnt[key] >= self.__sbatch_min:
+                rt = ReverseTable(self.W.get_cgl(), self._ct, key)
+                self.__rtables[key] = rt
+        return rt
+
     @property
     def routing_algo(self) -> str:
         """Routing algorithm, can be "dijkstra" or "astar" """
         return "astar" if self.__use_astar else "dijkstra"
     
+    @property
+    def route_cache(self) -> Optional[RouteCache]:
+        """Route cache of find_route, None if disabled. Use route_cache.stats() to get hit/miss/eviction counters."""
+        return self.__rcache
+
+    @property
+    def contraction_hierarchy(self) -> Optional[ContractionHierarchy]:
+        """Contraction hierarchy serving shortest route queries, None if disabled"""
+        return self.__ch
+
     @property
     def show_uxsim_info(self) -> bool:
         """Whether to display uxsim information"""
@@ -410,16 +499,35 @@ class TrafficUX(TrafficInst):
     def simulation_stop(self):
         if not self.silent:
             print(self.W.shutdown())
+            if self.__rcache is not None:
+                print(Lang.ROUTE_CACHE_STATS.format(**self.__rcache.stats()))
+        self._hubs.close_pools()
         self._log.close()
     
     def save(self, folder: Union[str, Path]):
         """
-        Save the current state of the simulation
+        Save the current state of the simulation as an incremental checkpoint.
+        Saving again into the same folder only rewrites the parts that changed.
+            folder: Folder path
+        """
+        f = Path(folder) if isinstance(folder, str) else folder
+        self.__rtables.clear()  # Tables refer to the world and are rebuilt on demand
+        tmpTL = self._log
+        del self._log
+        try:
+            save_checkpoint(f / TRAFFIC_CHECKPOINT_FOLDER, self)
+        finally:
+            self._log = tmpTL
+
+    def save_legacy(self, folder: Union[str, Path]):
+        """
+        Save the current state of the simulation as a full pickle of the instance and the world
             folder: Folder path
         """
         f = Path(folder) if isinstance(folder, str) else folder
         f.mkdir(parents=True, exist_ok=True)
         self.W.save(str(f / WORLD_FILE_NAME))
+        self.__rtables.clear()  # Tables refer to the world, which is saved separately
         tmpW = self.W
         tmpTL = self._log
         del self._log
@@ -434,6 +542,7 @@ class TrafficUX(TrafficInst):
         self._log = tmpTL
 
     def _save_obj(self):
+        self.__rtables.clear()  # Tables refer to the world, which is saved separately
         tmpW = self.W
         tmpTL = self._log
         del self._log
@@ -477,6 +586,11 @@ class TrafficUX(TrafficInst):
             TrafficUX instance
         """
         folder = Path(folder) if isinstance(folder, str) else folder
+        if is_checkpoint(folder / TRAFFIC_CHECKPOINT_FOLDER):
+            ti = load_checkpoint(folder / TRAFFIC_CHECKPOINT_FOLDER)
+            assert isinstance(ti, TrafficUX), "Invalid TrafficUX checkpoint."
+            ti._log = tlogger
+            return ti
         inst = folder / TRAFFIC_INST_FILE_NAME
         if not inst.exists():
             raise FileNotFoundError(Lang.ERROR_STATE_FILE_NOT_FOUND.format(inst))
@@ -504,6 +618,7 @@ class TrafficUX(TrafficInst):
             case.road_network, tlogger, case.vehicles,
             case.mixed_hub, case.power_network, 
             seed = seed, silent = silent, 
+            net_file = case.files.net,
             **asdict(vscfg),
             **asdict(config)
         )
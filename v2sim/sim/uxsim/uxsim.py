@@ -3,7 +3,7 @@ UXsim: Macroscopic/mesoscopic traffic flow simulator in a network.
 This `uxsim.py` is the core of UXsim. It summarizes the classes and methods that are essential for the simulation.
 """
 
-import csv, time, math, string, warnings, copy
+import csv, time, math, string, warnings, copy, heapq
 from collections import deque, OrderedDict
 from collections import defaultdict as ddict
 from typing import Any, Callable
@@ -112,7 +112,7 @@ class Node:
                 if i >= len(s.signal):
                     i = 0
 
-        s.signal_log = []
+        s.signal_log = s.W._new_time_series()
 
         #flow capacity (macroscopic/continuous representation for signal)
         s.flag_lanes_automatically_determined = False
@@ -485,16 +485,17 @@ class Link:
         # s.vehicles_enter_log = {}
         # 流入车辆不统计以减小内存占用
 
-        #旅行時間
-        s.traveltime_instant = []
+        #旅行時間. With a retention window, the time series below only keep the latest timesteps
+        s.traveltime_instant = s.W._new_time_series()
 
         #経路選択補正（混雑課金）
         s.congestion_pricing = congestion_pricing
         s.route_choice_penalty = 0
 
         #累積図関係
-        s.cum_arrival = []
-        s.cum_departure = []
+        s.cum_arrival = s.W._new_time_series()
+        s.cum_departure = s.W._new_time_series()
+        s.series_count = 0 #number of timesteps appended to the time series, including the dropped ones
         s.traveltime_actual = []
 
         #信号関係
@@ -586,11 +587,13 @@ class Link:
         s.in_out_flow_constraint()
 
         s.set_traveltime_instant()
-        s.cum_arrival.append(0)
-        s.cum_departure.append(0)
-        if len(s.cum_arrival) > 1:
-            s.cum_arrival[-1] = s.cum_arrival[-2]
-            s.cum_departure[-1] = s.cum_departure[-2]
+        if len(s.cum_arrival) > 0:
+            s.cum_arrival.append(s.cum_arrival[-1])
+            s.cum_departure.append(s.cum_departure[-1])
+        else:
+            s.cum_arrival.append(0)
+            s.cum_departure.append(0)
+        s.series_count += 1
 
         if s.user_function is not None:
             s.user_function(s)
@@ -642,7 +645,7 @@ class Link:
         float
             The cumulative arrival vehicle count.
         """
-        tt = int(t//s.W.DELTAT)
+        tt = int(t//s.W.DELTAT) - (s.series_count - len(s.cum_arrival)) #timesteps before the retention window are dropped
         if tt >= len(s.cum_arrival):
             return s.cum_arrival[-1]
         if tt < 0:
@@ -663,7 +666,7 @@ class Link:
         float
             The cumulative departure vehicle count.
         """
-        tt = int(t//s.W.DELTAT)
+        tt = int(t//s.W.DELTAT) - (s.series_count - len(s.cum_departure)) #timesteps before the retention window are dropped
         if tt >= len(s.cum_departure):
             return s.cum_departure[-1]
         if tt < 0:
@@ -755,7 +758,7 @@ class Link:
         float
             The instantaneous travel time.
         """
-        tt = int(t//s.W.DELTAT)
+        tt = int(t//s.W.DELTAT) - (s.series_count - len(s.traveltime_instant)) #timesteps before the retention window are dropped
         if tt >= len(s.traveltime_instant):
             return s.traveltime_instant[-1]
         if tt < 0:
@@ -923,6 +926,273 @@ class Link:
 
 
 
+class _LinkSeries:
+    """
+    List-like view of one link's column in a LinkArrays time series, so that `link.cum_arrival[-1] += 1`,
+    `len(link.cum_arrival)` and slicing work as with the list in the default mode.
+    """
+    __slots__ = ("A", "arr", "k")
+
+    def __init__(s, A: "LinkArrays", arr: str, k: int):
+        s.A = A
+        s.arr = arr
+        s.k = k
+
+    def __len__(s):
+        return s.A.retained
+
+    def __row(s, i):
+        n = s.A.retained
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("link time series index out of range")
+        return s.A.row(s.A.n - n + i)
+
+    def __rows(s):
+        return np.arange(s.A.n - s.A.retained, s.A.n) % s.A.size
+
+    def __getitem__(s, i):
+        col = getattr(s.A, s.arr)
+        if isinstance(i, slice):
+            return col[s.__rows(), s.k][i]
+        return float(col[s.__row(i), s.k])
+
+    def __setitem__(s, i, value):
+        col = getattr(s.A, s.arr)
+        if isinstance(i, slice):
+            rows = s.__rows()[i]
+            col[rows, s.k] = value
+        else:
+            col[s.__row(i), s.k] = value
+
+    def __iter__(s):
+        return iter(s[:].tolist())
+
+    def __array__(s, dtype=None, copy=None):
+        return np.array(s[:], dtype=dtype)
+
+    def __repr__(s):
+        return repr(s[:].tolist())
+
+
+class ArrayLink(Link):
+    """
+    Link of a World in array mode. Its capacities, remaining capacities and time series are stored in
+    World.LINK_ARRAYS and updated for all links at once, while this class keeps the API of Link.
+    """
+    @property
+    def capacity_out(s):
+        v = s.W.LINK_ARRAYS.cap_out[s.id]
+        return None if np.isnan(v) else float(v)
+
+    @capacity_out.setter
+    def capacity_out(s, value):
+        s.W.LINK_ARRAYS.cap_out[s.id] = np.nan if value is None else value
+
+    @property
+    def capacity_in(s):
+        v = s.W.LINK_ARRAYS.cap_in[s.id]
+        return None if np.isnan(v) else float(v)
+
+    @capacity_in.setter
+    def capacity_in(s, value):
+        s.W.LINK_ARRAYS.cap_in[s.id] = np.nan if value is None else value
+
+    @property
+    def capacity_out_remain(s):
+        return float(s.W.LINK_ARRAYS.cap_out_remain[s.id])
+
+    @capacity_out_remain.setter
+    def capacity_out_remain(s, value):
+        s.W.LINK_ARRAYS.cap_out_remain[s.id] = value
+
+    @property
+    def capacity_in_remain(s):
+        return float(s.W.LINK_ARRAYS.cap_in_remain[s.id])
+
+    @capacity_in_remain.setter
+    def capacity_in_remain(s, value):
+        s.W.LINK_ARRAYS.cap_in_remain[s.id] = value
+
+    @property
+    def cum_arrival(s):
+        return s._series[0]
+
+    @property
+    def cum_departure(s):
+        return s._series[1]
+
+    @property
+    def traveltime_instant(s):
+        return s._series[2]
+
+    def update(s):
+        """
+        Links in array mode are updated together by World.LINK_ARRAYS.update().
+        """
+        raise RuntimeError("ArrayLink is updated by World.LINK_ARRAYS.update()")
+
+    def __at(s, arr, t):
+        A = s.W.LINK_ARRAYS
+        tt = int(t//s.W.DELTAT)
+        if tt >= A.n:
+            tt = A.n-1
+        if tt < A.n - A.retained:
+            tt = A.n - A.retained
+        return float(arr[A.row(tt), s.id])
+
+    def arrival_count(s, t: float) -> float:
+        return s.__at(s.W.LINK_ARRAYS.cum_arrival, t)
+
+    def departure_count(s, t: float) -> float:
+        return s.__at(s.W.LINK_ARRAYS.cum_departure, t)
+
+    def instant_travel_time(s, t: float) -> float:
+        return s.__at(s.W.LINK_ARRAYS.traveltime_instant, t)
+
+    #リアルタイム状態: the cached states are dropped when LINK_ARRAYS.epoch changes, i.e., once per timestep
+    def __rt(s):
+        e = s.W.LINK_ARRAYS.epoch
+        if s._rt_epoch != e:
+            s._rt_epoch = e
+            s._speed = s._density = s._flow = s._num_vehicles = s._num_vehicles_queue = -1
+
+    @property
+    def speed(s):
+        s.__rt()
+        return Link.speed.fget(s)
+
+    @property
+    def density(s):
+        s.__rt()
+        return Link.density.fget(s)
+
+    @property
+    def flow(s):
+        s.__rt()
+        return Link.flow.fget(s)
+
+    @property
+    def num_vehicles(s):
+        s.__rt()
+        return Link.num_vehicles.fget(s)
+
+    @property
+    def num_vehicles_queue(s):
+        s.__rt()
+        return Link.num_vehicles_queue.fget(s)
+
+    def change_free_flow_speed(s, new_value):
+        super().change_free_flow_speed(new_value)
+        s.W.LINK_ARRAYS.u[s.id] = s.u
+
+
+class LinkArrays:
+    """
+    Per-link state of a World in array mode (World(array_links=True)).
+    Time series are preallocated as (TSIZE+1) x (number of links) arrays, or as ring buffers of the retention
+    window if World(link_history_window=...) is set. The link phase of a timestep runs as a few vectorized
+    operations instead of calling Link.update() for every link.
+    """
+    def __init__(s, W: "World"):
+        """
+        Allocate the arrays and switch all links of W to ArrayLink.
+        """
+        s.W = W
+        links = W.LINKS
+        L = len(links)
+        T = W.TSIZE+1
+        if W.link_history_ticks is not None:
+            T = min(T, W.link_history_ticks)
+        s.size = T     #number of rows of the time series
+        s.n = 0        #記録済みのタイムステップ数: number of recorded timesteps
+        s.epoch = 0    #incremented once per timestep to invalidate cached link states
+
+        s.length = np.array([l.length for l in links], dtype=float)
+        s.u = np.array([l.u for l in links], dtype=float)
+        s.lanes = np.array([l.number_of_lanes for l in links], dtype=float)
+        s.cap_out = np.array([np.nan if l.capacity_out is None else l.capacity_out for l in links], dtype=float)
+        s.cap_in = np.array([np.nan if l.capacity_in is None else l.capacity_in for l in links], dtype=float)
+        s.cap_out_remain = np.array([l.capacity_out_remain for l in links], dtype=float)
+        s.cap_in_remain = np.array([l.capacity_in_remain for l in links], dtype=float)
+        #直近の交通状態: speed and density at the last travel time sample
+        s.speed = s.u.copy()
+        s.density = np.zeros(L)
+
+        s.cum_arrival = np.zeros([T, L])
+        s.cum_departure = np.zeros([T, L])
+        s.traveltime_instant = np.zeros([T, L])
+
+        s.user_function_links = [l for l in links if l.user_function is not None]
+
+        for l in links:
+            for key in ("capacity_out", "capacity_in", "capacity_out_remain", "capacity_in_remain",
+                        "cum_arrival", "cum_departure", "traveltime_instant"):
+                l.__dict__.pop(key, None)
+            l.__class__ = ArrayLink
+            l._series = (_LinkSeries(s, "cum_arrival", l.id), _LinkSeries(s, "cum_departure", l.id), _LinkSeries(s, "traveltime_instant", l.id))
+            l._rt_epoch = -1
+
+    @property
+    def retained(s) -> int:
+        """
+        Number of timesteps kept in the time series
+        """
+        return min(s.n, s.size)
+
+    def row(s, t: int) -> int:
+        """
+        Row of timestep t in the time series
+        """
+        return t % s.size
+
+    def update(s):
+        """
+        Make necessary updates of all links when the timestep is incremented. Equivalent to Link.update() of every link.
+        """
+        W = s.W
+        t = W.T
+        thr = W.DELTAN*s.lanes
+
+        #流入出容量: in/out flow constraint
+        limited = ~np.isnan(s.cap_in)
+        low = limited & (s.cap_out_remain < thr)
+        s.cap_out_remain[low] += s.cap_out[low]*W.DELTAT
+        low = limited & (s.cap_in_remain < thr)
+        s.cap_in_remain[low] += s.cap_in[low]*W.DELTAT
+        s.cap_out_remain[~limited] = 10e10
+        s.cap_in_remain[~limited] = 10e10
+
+        #旅行時間: instantaneous travel time
+        if t%W.instantaneous_TT_timestep_interval == 0:
+            L = len(s.length)
+            ids = np.fromiter((veh.link.id for veh in W.VEHICLES_RUNNING.values()), dtype=np.int64, count=len(W.VEHICLES_RUNNING))
+            vs = np.fromiter((veh.v for veh in W.VEHICLES_RUNNING.values()), dtype=float, count=len(W.VEHICLES_RUNNING))
+            cnt = np.bincount(ids, minlength=L)
+            vsum = np.bincount(ids, weights=vs, minlength=L)
+            occupied = cnt > 0
+            s.speed = np.where(occupied, vsum/np.maximum(cnt, 1), s.u)
+            s.density = cnt*W.DELTAN/s.length
+            with np.errstate(divide="ignore"):
+                s.traveltime_instant[s.row(t)] = np.where(s.speed > 0, s.length/np.where(s.speed > 0, s.speed, 1), s.length/(s.u/100))
+        else:
+            s.traveltime_instant[s.row(t)] = s.traveltime_instant[s.row(t-1)]
+
+        #累積図: cumulative counts
+        if t > 0:
+            s.cum_arrival[s.row(t)] = s.cum_arrival[s.row(t-1)]
+            s.cum_departure[s.row(t)] = s.cum_departure[s.row(t-1)]
+        else:
+            s.cum_arrival[s.row(t)] = 0
+            s.cum_departure[s.row(t)] = 0
+        s.n = t+1
+
+        for l in s.user_function_links:
+            l.user_function(l)
+
+        s.epoch += 1
+
 
 class Vehicle:
     """
@@ -1082,6 +1352,15 @@ class Vehicle:
         s.W.VEHICLES[s.name] = s
         s.W.VEHICLES_LIVING[s.name] = s
 
+        #event-driven update: a vehicle at "home" does nothing until its departure, unless it is logged or has a user function
+        s.seq = s.W.vehicle_seq #creation order, which is the update order of living vehicles
+        s.W.vehicle_seq += 1
+        if s.W.vehicle_logging_timestep_interval != -1 or s.user_function is not None:
+            activation_time = -1
+        else:
+            activation_time = s.departure_time
+        heapq.heappush(s.W.VEHICLES_DEPARTURE_QUEUE, (activation_time, s.seq, s))
+
     def __repr__(s):
         return f"<Vehicle {s.name}: {s.state}, x={s.x}, link={s.link}>"
 
@@ -1180,6 +1459,7 @@ class Vehicle:
         s.travel_time = (s.arrival_time - s.departure_time)*s.W.DELTAT
         s.W.VEHICLES_RUNNING.pop(s.name)
         s.W.VEHICLES_LIVING.pop(s.name)
+        s.W.vehicles_active_ended += 1
 
         if s.flag_trip_aborted:
             s.state = "abort"
@@ -1260,7 +1540,7 @@ class Vehicle:
             for l in s.W.LINKS:
                 i = l.start_node.id
                 j = l.end_node.id
-                if j == s.W.ROUTECHOICE.next[i,k]:
+                if j == s.W.ROUTECHOICE.next_node(i,k):
                     route_pref_new[l.id] = 1
 
             if sum(list(s.route_pref.values())) == 0:
@@ -1409,7 +1689,7 @@ class Vehicle:
             l = log[1]
             if l == "home" and include_departure_time:
                 ts.append(t)
-            if type(l) == Link:
+            if isinstance(l, Link):
                 ts.append(t)
                 route.append(l)
         
@@ -1502,9 +1782,62 @@ class Vehicle:
             s.link_old = s.link
 
 
+class _PrefRow(np.ndarray):
+    """
+    Row of a preference block. It is pickled as a reference to its block, so that it is still a view of the block after unpickling.
+    """
+    def __reduce__(s):
+        block = getattr(s, "block", None)
+        if block is None:
+            return np.asarray(s).copy().__reduce__()
+        return (_pref_row, (block, s.index))
+
+
+def _pref_row(block, index):
+    row = block[index].view(_PrefRow)
+    row.block = block
+    row.index = index
+    return row
+
+
+class _DestRoutePref:
+    """
+    Link preference rows of the destinations, accessed like `route_pref[dest_node_id][link_id]`.
+    A node becomes a destination on its first access. Each row is a view of a fixed-size block, so rows
+    held by vehicles keep following the in-place updates after more destinations are added.
+    """
+    BLOCK = 64
+
+    def __init__(s, rc: "RouteChoice"):
+        s.rc = rc
+        s.rows = {}     # node id -> row
+        s.blocks = []   # list of (BLOCK, number of links) arrays
+
+    def __getitem__(s, k):
+        row = s.rows.get(k)
+        if row is None:
+            row = s.rc.add_dest(k)
+        return row
+
+    def __contains__(s, k):
+        return k in s.rows
+
+    def __len__(s):
+        return len(s.rows)
+
+    def new_row(s, k):
+        r = len(s.rows)
+        if r % s.BLOCK == 0:
+            s.blocks.append(np.zeros([s.BLOCK, len(s.rc.W.LINKS)]))
+        row = _pref_row(s.blocks[r // s.BLOCK], r % s.BLOCK)
+        s.rows[k] = row
+        return row
+
+
 class RouteChoice:
     """
     Class for computing shortest path for all vehicles.
+    Shortest paths are only computed towards the nodes which are actually used as destinations.
     """
 
     def __init__(s, W: "World"):
@@ -1516,26 +1849,101 @@ class RouteChoice:
         W : object
             The world to which this belongs.
         """
+        from scipy.sparse import csr_matrix
         s.W = W
-        #リンク旅行時間行列: adjacency matrix whose cost is link travel cost
-        s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #ij間最短距離: the shortest path cost (based on the current instantaneous travel time) from node i to j
-        s.dist = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #iからjに行くために次に進むべきノード: the node to proceed from i when the destination is j
-        s.next = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #iからjに行くために来たノード. This is not used anymore
-        s.pred = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-
-        # s.dist_record = {}
-        # 不记录距离以减少内存占用
-
-        #homogeneous DUO用．kに行くための最短経路的上にあれば1: array[dest,link]==1 if link is on the shortest path to dest
-        #s.route_pref = {k.id: {l:0 for l in s.W.LINKS} for k in s.W.NODES} #old definition, {node_id: {link: preference}. preference of link is 1 if it is on the shortest path to node_id
-        s.route_pref = np.zeros([len(W.NODES), len(W.LINKS)])
+        n_nodes = len(W.NODES)
+        #リンクの始点・終点: start and end node of each link
+        s.link_start = np.array([l.start_node.id for l in W.LINKS], dtype=np.int64)
+        s.link_end = np.array([l.end_node.id for l in W.LINKS], dtype=np.int64)
+        #ノード対: links between the same pair of nodes share one edge in the routing graph
+        pairs, s.link_pair = np.unique(s.link_start*n_nodes + s.link_end, return_inverse=True)
+        s.link_pair = s.link_pair.reshape(-1)
+        s.pair_count = np.bincount(s.link_pair, minlength=len(pairs)).astype(float)
+        #逆向きのCSR隣接行列: reversed adjacency in CSR. Its data[pair_pos[p]] is the weight of pair p
+        rev = csr_matrix((np.arange(1, len(pairs)+1, dtype=float), (pairs % n_nodes, pairs // n_nodes)), shape=(n_nodes, n_nodes))
+        rev.sort_indices()
+        s.pair_pos = np.empty(len(pairs), dtype=np.int64)
+        s.pair_pos[rev.data.astype(np.int64)-1] = np.arange(len(pairs))
+        s.adj_rev = rev
+        s.searched = False
+
+        #目的地: node ids of the destinations, in the order of the rows below
+        s.dests = []
+        #ij間最短距離: dist_to[r, i] is the shortest path cost (based on the current instantaneous travel time) from node i to dests[r]
+        s.dist_to = np.zeros([0, n_nodes])
+        #iから目的地に行くために次に進むべきノード: next_to[r, i] is the node to proceed from i when the destination is dests[r]
+        s.next_to = np.zeros([0, n_nodes], dtype=np.int64)
+
+        #homogeneous DUO用．kに行くための最短経路的上にあれば1: route_pref[dest][link]==1 if link is on the shortest path to dest
+        s.route_pref = _DestRoutePref(s)
+        #DUO履歴: [pair travel times, number of DUO updates] of each route search, replayed for the destinations added later.
+        #Kept until every node is a destination.
+        s.duo_history = []
+
+    def __search(s, dests):
+        from scipy.sparse.csgraph import dijkstra
+        #computes the shortest path from *destination* to *origin* on the reversed graph, so that the predecessor becomes the next node in the original problem.
+        dist, pred = dijkstra(s.adj_rev, directed=True, indices=dests, return_predecessors=True)
+        return dist.reshape(len(dests), -1), pred.reshape(len(dests), -1).astype(np.int64)
+
+    def __mask(s, next_to):
+        #kに行くための最短経路的上のリンク: links on the shortest path to each destination
+        return next_to[:, s.link_start] == s.link_end[np.newaxis, :]
+
+    def add_dest(s, k):
+        """
+        Start tracking node k as a destination and return its link preference row.
+        The DUO updates made before are replayed on the row, so it is the same as if k had been tracked from the start.
+        """
+        s.dests.append(k)
+        row = s.route_pref.new_row(k)
+        if s.searched:
+            dist, nxt = s.__search([k])
+            s.dist_to = np.vstack([s.dist_to, dist])
+            s.next_to = np.vstack([s.next_to, nxt])
+            s.__replay(k, row, nxt)
+        else:
+            s.dist_to = np.vstack([s.dist_to, np.zeros([1, len(s.W.NODES)])])
+            s.next_to = np.vstack([s.next_to, np.full([1, len(s.W.NODES)], -9999, dtype=np.int64)])
+        if len(s.dests) == len(s.W.NODES):
+            s.duo_history = []
+        return row
+
+    def __replay(s, k, row, next_now):
+        from scipy.sparse.csgraph import dijkstra
+        weight0 = s.__duo_weight()
+        adj = s.adj_rev.copy()
+        for h, (pair_tt, updates) in enumerate(s.duo_history):
+            if updates == 0:
+                continue
+            if h == len(s.duo_history) - 1:
+                nxt = next_now # The last search used the current travel times
+            else:
+                adj.data[s.pair_pos] = pair_tt
+                _, pred = dijkstra(adj, directed=True, indices=[k], return_predecessors=True)
+                nxt = pred.reshape(1, -1).astype(np.int64)
+            mask = s.__mask(nxt)[0]
+            for _ in range(updates):
+                weight = weight0 if row.any() else 1
+                row *= (1 - weight)
+                row += weight * mask
+
+    def __duo_weight(s):
+        if s.W.route_choice_update_gradual:
+            return s.W.DUO_UPDATE_WEIGHT * (s.W.DELTAT / s.W.DUO_UPDATE_TIME)
+        return s.W.DUO_UPDATE_WEIGHT
+
+    def next_node(s, i, k):
+        """
+        The node to proceed from node i when the destination is node k. -9999 if k is not reachable.
+        """
+        if k not in s.route_pref:
+            s.add_dest(k)
+        return s.next_to[s.dests.index(k), i]
 
     def route_search_all(s, t:float, infty=np.inf, noise=0):
         """
-        Compute the current shortest path based on instantaneous travel time.
+        Compute the current shortest path to all destinations based on instantaneous travel time.
 
         Parameters
         ----------
@@ -1546,70 +1954,58 @@ class RouteChoice:
         noise : float
             very small noise to slightly randomize route choice. useful to eliminate strange results at an initial stage of simulation where many routes has identical travel time.
         """
-        s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        adj_mat_link_count = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-
-        for link in s.W.LINKS:
-            i = link.start_node.id
-            j = link.end_node.id
-            if s.W.ADJ_MAT[i,j]:
-                if s.W.hard_deterministic_mode == False:
-                    new_link_tt = link.traveltime_instant[-1]*s.W.rng.uniform(1, 1+noise) + link.get_toll(t)
-                else:
-                    new_link_tt = link.traveltime_instant[-1] + link.get_toll(t)
-                n = adj_mat_link_count[i,j]
-                s.adj_mat_time[i,j] = s.adj_mat_time[i,j]*n/(n+1) + new_link_tt/(n+1) # if there are multiple links between the same nodes, average the travel time
-                # s.adj_mat_time[i,j] = new_link_tt #if there is only one link between the nodes, this line is fine, but for generality we use the above line
-                adj_mat_link_count[i,j] += 1
-                if link.capacity_in == 0: #if the inflow is prohibited, travel time is assumed to be infinite
-                    s.adj_mat_time[i,j] = np.inf
-            else:
-                s.adj_mat_time[i,j] = np.inf
-        
-        #computes the shortest path from *destination* to *origin*, so that the pred_matrix becomes the next_matrix in the original problem. It is simply achieved by tranposing the matrices twice.
-        from scipy.sparse import csr_matrix
-        from scipy.sparse.csgraph import dijkstra
-        dist, pred = dijkstra(csr_matrix(s.adj_mat_time).T, return_predecessors=True)
-        s.dist = dist.T
-        s.next = pred.T
+        links = s.W.LINKS
+        A = s.W.LINK_ARRAYS
+        if A is not None:
+            link_tt = A.traveltime_instant[A.row(A.n-1)].copy()
+        else:
+            link_tt = np.array([l.traveltime_instant[-1] for l in links], dtype=float)
+        if s.W.hard_deterministic_mode == False:
+            link_tt *= s.W.rng.uniform(1, 1+noise, size=len(links))
+        link_tt += np.array([l.get_toll(t) for l in links], dtype=float)
+        #if the inflow is prohibited, travel time is assumed to be infinite
+        if A is not None:
+            link_tt[A.cap_in == 0] = np.inf
+        else:
+            link_tt[np.array([l.capacity_in == 0 for l in links], dtype=bool)] = np.inf
+
+        # if there are multiple links between the same nodes, average the travel time of the links admitting inflow
+        closed = np.isinf(link_tt)
+        if closed.any():
+            n_open = s.pair_count - np.bincount(s.link_pair, weights=closed, minlength=len(s.pair_count))
+            pair_tt = np.bincount(s.link_pair, weights=np.where(closed, 0, link_tt), minlength=len(s.pair_count))
+            pair_tt = np.divide(pair_tt, n_open, out=np.full(len(pair_tt), np.inf), where=n_open > 0)
+        else:
+            pair_tt = np.bincount(s.link_pair, weights=link_tt, minlength=len(s.pair_count)) / s.pair_count
+        s.adj_rev.data[s.pair_pos] = pair_tt
+        s.searched = True
+        if len(s.dests) < len(s.W.NODES):
+            s.duo_history.append([pair_tt, 0])
 
-        # s.dist_record[s.W.T] = s.dist
+        if len(s.dests) > 0:
+            s.dist_to, s.next_to = s.__search(s.dests)
 
     def homogeneous_DUO_update(s):
         """
         Update link preference of all homogeneous travelers based on DUO principle.
-        Vectorized by Claude 3.5 Sonnet.
         """
-        if s.W.route_choice_update_gradual:
-            weight0 = s.W.DUO_UPDATE_WEIGHT * (s.W.DELTAT / s.W.DUO_UPDATE_TIME)
-        else:
-            weight0 = s.W.DUO_UPDATE_WEIGHT
-
-        num_nodes = len(s.W.NODES)
-        num_links = len(s.W.LINKS)
-
-        # Create a mask for empty preferences
-        empty_pref_mask = np.sum(s.route_pref, axis=1) == 0
-
-        # Initialize weight array
-        weights = np.full(num_nodes, weight0)
-        weights[empty_pref_mask] = 1
+        weight0 = s.__duo_weight()
+        if s.duo_history:
+            s.duo_history[-1][1] += 1
 
-        # Create arrays for start and end nodes of links
-        start_nodes = np.array([l.start_node.id for l in s.W.LINKS])
-        end_nodes = np.array([l.end_node.id for l in s.W.LINKS])
+        B = _DestRoutePref.BLOCK
+        D = len(s.dests)
+        for b, block in enumerate(s.route_pref.blocks):
+            rows = block[:min(B, D - b*B)]
+            next_node_mask = s.__mask(s.next_to[b*B:b*B+len(rows)])
 
-        # Create the next_node_mask
-        next_node_mask = np.zeros((num_nodes, num_links), dtype=bool)
-        for k in range(num_nodes):
-            next_node_mask[k] = end_nodes == s.next[start_nodes, k]
+            # Rows with empty preferences are initialized deterministically
+            weights = np.full(len(rows), weight0)
+            weights[np.sum(rows, axis=1) == 0] = 1
 
-        # Update route preferences
-        # In-place scaling of all elements
-        s.route_pref *= (1 - weights[:, np.newaxis])
-
-        # In-place addition of weights where next_node_mask is True
-        s.route_pref += weights[:, np.newaxis] * next_node_mask
+            # Update route preferences in place, since vehicles hold views of the rows
+            rows *= (1 - weights[:, np.newaxis])
+            rows += weights[:, np.newaxis] * next_node_mask
 
 
 class World:
@@ -1627,6 +2023,8 @@ class World:
                  vehicle_logging_timestep_interval: int=1, 
                  reduce_memory_delete_vehicle_route_pref: bool=False,
                  hard_deterministic_mode: bool=False, 
+                 array_links: bool=False,
+                 link_history_window: float|None=None,
                  meta_data: dict={}, user_attribute=None, user_function=None):
         """
         Create a World.
@@ -1677,6 +2075,10 @@ class World:
             If True, the simulation will not use any random variables. At a merging node, a link with higher merge_priority will be always prioritized, and vehicles always choose the shortest path. This may be useful for analysis that need strict predictability. Be aware that the simulation results will be significantly different from ones with `hard_deterministic_mode=False`.
         reduce_memory_delete_vehicle_route_pref : bool, optional
             If True, the simulation will delete the route preference of vehicles after its ends. This is useful when the route preference is not needed after the simulation ends.
+        array_links : bool, optional
+            If True, the states of all links are stored in preallocated NumPy arrays (`W.LINK_ARRAYS`) and the link phase of each timestep is vectorized. Links become `ArrayLink` objects with the same API. Default is False.
+        link_history_window : float | None, optional
+            Retention window (s) of the per-timestep series: `traveltime_instant`, `cum_arrival` and `cum_departure` of links and `signal_log` of nodes. Only the latest timesteps within the window are kept, so that the memory does not grow with the simulation length; queries before the window return the oldest kept value. None (default) keeps the full history, which is needed by the analyzer.
         meta_data : dict, optional
             Meta data for simulation scenario. Can store arbitrary data, such as licences and simulation explanation.
         user_attribute : any, optional
@@ -1719,6 +2121,10 @@ class World:
         W.VEHICLES: OrderedDict[str,Vehicle] = OrderedDict()            #home, wait, run, end
         W.VEHICLES_LIVING: OrderedDict[str,Vehicle] = OrderedDict()     #home, wait, run
         W.VEHICLES_RUNNING: OrderedDict[str,Vehicle] = OrderedDict()    #run
+        W.VEHICLES_ACTIVE: list[Vehicle] = []                           #wait, run, in the order of creation. Ended vehicles are removed lazily
+        W.VEHICLES_DEPARTURE_QUEUE: list[tuple[int,int,Vehicle]] = []  #home, heap by (activation timestep, creation order)
+        W.vehicle_seq = 0
+        W.vehicles_active_ended = 0
         W.NODES: list[Node] = []
         W.LINKS: list[Link] = []
 
@@ -1751,6 +2157,12 @@ class World:
 
         W.hard_deterministic_mode = hard_deterministic_mode
 
+        W.array_links = array_links
+        W.LINK_ARRAYS: LinkArrays|None = None
+
+        W.link_history_window = link_history_window
+        W.link_history_ticks = None if link_history_window is None else max(2, int(math.ceil(link_history_window/W.DELTAT))+1)
+
         W.meta_data = meta_data
         W.network_info = ddict(list)
         W.demand_info = ddict(list)
@@ -1771,6 +2183,14 @@ class World:
         W.user_attribute = user_attribute
         W.user_function = user_function
 
+    def _new_time_series(W):
+        """
+        Create an empty per-timestep series, bounded by the retention window if it is set.
+        """
+        if W.link_history_ticks is None:
+            return []
+        return deque(maxlen=W.link_history_ticks)
+
     def addNode(W, name: str, x: float, y: float, signal: list[float]=[0], signal_offset: float=0, signal_offset_old: float|None=None, flow_capacity: float|None=None, number_of_lanes: int=None, auto_rename=False, attribute=None, user_attribute=None, user_function=None) -> Node:
         """
         Add a node to world.
@@ -2269,19 +2689,20 @@ class World:
 
         #generate adjacency matrix
         W.ROUTECHOICE = RouteChoice(W)
-        W.ADJ_MAT = np.zeros([len(W.NODES), len(W.NODES)])
+        from scipy.sparse import csr_matrix
         W.ADJ_MAT_LINKS = dict() #リンクオブジェクトが入った隣接行列（的な辞書）
         W.NODE_PAIR_LINKS = dict() #リンクオブジェクトが入った隣接行列（的な辞書）．キーはノード名
         for link in W.LINKS:
-            for i,start_node in enumerate(W.NODES):
-                if start_node == link.start_node:
-                    break
-            for j,end_node in enumerate(W.NODES):
-                if end_node == link.end_node:
-                    break
-            W.ADJ_MAT[i,j] = 1
+            i = link.start_node.id
+            j = link.end_node.id
             W.ADJ_MAT_LINKS[i,j] = link
-            W.NODE_PAIR_LINKS[start_node.name,end_node.name] = link
+            W.NODE_PAIR_LINKS[link.start_node.name,link.end_node.name] = link
+        #sparse adjacency matrix
+        W.ADJ_MAT = csr_matrix((np.ones(len(W.LINKS)), (W.ROUTECHOICE.link_start, W.ROUTECHOICE.link_end)), shape=(len(W.NODES), len(W.NODES)))
+        W.ADJ_MAT.data[:] = 1
+
+        if W.array_links:
+            W.LINK_ARRAYS = LinkArrays(W)
 
         W.analyzer = Analyzer(W)
 
@@ -2379,8 +2800,11 @@ class World:
                 W.print("      time| # of vehicles| ave speed| computation time", flush=True)
                 W.analyzer.show_simulation_progress()
 
-            for link in W.LINKS:
-                link.update()
+            if W.LINK_ARRAYS is not None:
+                W.LINK_ARRAYS.update()
+            else:
+                for link in W.LINKS:
+                    link.update()
 
             for node in W.NODES:
                 node.generate()
@@ -2392,8 +2816,13 @@ class World:
             for veh in W.VEHICLES_RUNNING.values():
                 veh.carfollow()
 
-            for name in list(W.VEHICLES_LIVING.keys()):
-                W.VEHICLES_LIVING[name].update()
+            W.activate_vehicles()
+            for veh in W.VEHICLES_ACTIVE:
+                if veh.state != "end" and veh.state != "abort": #may have ended at a node transfer
+                    veh.update()
+            if W.vehicles_active_ended:
+                W.VEHICLES_ACTIVE = [veh for veh in W.VEHICLES_ACTIVE if veh.state != "end" and veh.state != "abort"]
+                W.vehicles_active_ended = 0
 
             if W.route_choice_update_gradual == True:
                 if W.T % W.DELTAT_ROUTE == 0:
@@ -2429,6 +2858,27 @@ class World:
         
         return 0 #simulation not yet finished
 
+    def activate_vehicles(W):
+        """
+        Move the vehicles whose departure time has come from the departure queue to the active vehicles.
+
+        Notes
+        -----
+        The active vehicles are kept in the order of creation, which is the order that the living vehicles were updated in, so that the results do not depend on the departure times.
+        """
+        Q = W.VEHICLES_DEPARTURE_QUEUE
+        if len(Q) == 0 or Q[0][0] > W.T:
+            return
+        batch = []
+        while len(Q) > 0 and Q[0][0] <= W.T:
+            batch.append(heapq.heappop(Q)[2])
+        batch.sort(key=lambda veh: veh.seq)
+        active = W.VEHICLES_ACTIVE
+        if len(active) == 0 or active[-1].seq < batch[0].seq:
+            active.extend(batch)
+        else:
+            W.VEHICLES_ACTIVE = list(heapq.merge(active, batch, key=lambda veh: veh.seq))
+
     def check_simulation_ongoing(W) -> bool:
         """
         Check whether the simulation is has not reached its final time.
@@ -2494,7 +2944,7 @@ class World:
         if link == None:
             return None
         
-        if type(link) is Link:
+        if isinstance(link, Link):
             if link in W.LINKS:
                 return link
             else:
@@ -1,13 +1,18 @@
 import enum, os, sys, threading, time, gzip
 import dill as pickle
+import numpy as np
 from collections import deque, defaultdict
+from dataclasses import dataclass
 from itertools import chain
-from typing import Deque, Dict, Generator, List, Optional, Set, Tuple, Iterable, Union
+from typing import Deque, Dict, Generator, List, NamedTuple, Optional, Set, Tuple, Iterable, Union
 from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+from ..locale import Lang
 from ..utils import *
 from .uxsim import World, Vehicle, Link
 from .routing import *
+from .checkpoint import checkpoint_folder, dumps_checkpoint, loads_checkpoint, load_checkpoint, save_checkpoint
 
 
 class RoutingAlgorithm(enum.Enum):
@@ -16,7 +21,7 @@ class RoutingAlgorithm(enum.Enum):
     DijkstraFastest = 2
     DijkstraShortest = 3
 
-    def run(self, gl:Graph, coords:CoordsDict, start_time:int, from_node:str, to_node:str):
+    def run(self, gl:GraphLike, coords:CoordsDict, start_time:int, from_node:str, to_node:str):
         if self == RoutingAlgorithm.AstarFastest:
             return astarF(gl, coords, start_time, from_node, to_node)
         elif self == RoutingAlgorithm.AstarShortest:
@@ -52,6 +57,10 @@ class WorldSpec(ABC):
     @abstractmethod
     def get_gl(self) -> Graph: ...
 
+    @abstractmethod
+    def get_cgl(self) -> CSRGraph:
+        """Compiled routing graph, whose travel times are refreshed after each step"""
+
     @abstractmethod
     def has_vehicle(self, veh_id:str) -> bool: ...
 
@@ -72,6 +81,15 @@ class WorldSpec(ABC):
 
     @abstractmethod
     def get_neighbor_links(self, node_id:str) -> Iterable[Link]: ...
+
+    @abstractmethod
+    def change_free_flow_speed(self, link_id:str, speed:float):
+        """
+        Change the free-flow speed of a link, keeping the routing heuristics of the compiled graph valid
+        
+        :param link_id: name of the link
+        :param speed: new free-flow speed in m/s
+        """
     
     @abstractmethod
     def links(self) -> Iterable[Link]: ...
@@ -107,6 +125,44 @@ def _load_world(filepath:str) -> WorldSpec:
     return _load_world_unsafe(data)
 
 
+def _split_itinerary(pw: Union['ParaWorlds', 'ProcParaWorlds'], from_node:str, to_node:str,
+        route:Union[None, Stage, List[str]], algo:RoutingAlgorithm) -> List[Tuple[str, int]]:
+    """
+    Split the route of a vehicle at the nodes where it crosses partitions.
+
+    :return: Splitting nodes: (node_name, next_world_id). The last one is the destination, whose next world is -1.
+    """
+    if from_node == to_node:
+        for wid in pw.wid_of_nodes[from_node]:
+            splitting_nodes:List[Tuple[str, int]] = [(from_node, wid), (to_node, -1)]
+            break
+    else:
+        if route is None:
+            stage = algo.run(pw.cgl, pw.node_coords, pw.get_time(), from_node, to_node)
+            nodes = stage.nodes
+            edges = stage.edges
+        elif isinstance(route, Stage):
+            nodes = route.nodes
+            edges = route.edges
+        else:
+            nodes = [from_node]
+            for edge in route:
+                link = pw.get_link(edge)
+                assert link is not None, f"Invalid link name {edge} in the route"
+                assert link.start_node.name == nodes[-1], "The provided route is invalid."
+                nodes.append(link.end_node.name)
+            assert nodes[-1] == to_node, "The provided route does not lead to the destination node."
+            edges = route
+        Ecnt = len(edges)
+        assert Ecnt > 0, "Route not found."
+        splitting_nodes:List[Tuple[str, int]] = [(nodes[0], pw.wid_of_edges[edges[0]])]  # (node_name, prev_world_id, next_world_id)
+        for i in range(Ecnt - 1):
+            if pw.wid_of_edges[edges[i]] != pw.wid_of_edges[edges[i + 1]]:
+                splitting_nodes.append((nodes[i + 1], pw.wid_of_edges[edges[i + 1]]))
+        splitting_nodes.append((nodes[-1], -1))  # Destination node, no next world
+    return splitting_nodes
+
+
 class SingleWorld(WorldSpec):
     def __init__(self, world:World, gl:Graph):
         self.world = world
@@ -118,12 +174,14 @@ class SingleWorld(WorldSpec):
         self.__cnt = 0
         for node in self.world.NODES:
             self.coords[node.name] = (node.x, node.y)
+        self.cgl = CSRGraph(gl, self.coords)
     
     def exec_simulation(self, until_s:int):
         self.__aQ.clear()
         self.world.exec_simulation(until_s)
         self.__ct = until_s
         self.__cnt += 1
+        self.cgl.refresh(until_s)
     
     def add_vehicle(self, veh_id:str, from_node:str, to_node:str, route:Union[None, Stage, List[str]] = None):
         def __add_to_arrQ(veh:Vehicle):
@@ -154,6 +212,10 @@ class SingleWorld(WorldSpec):
             return chain(node.inlinks.values(), node.outlinks.values())
         return []
     
+    def change_free_flow_speed(self, link_id:str, speed:float):
+        self.world.get_link(link_id).change_free_flow_speed(speed)
+        self.cgl.update_free_flow((link_id,))
+
     def links(self) -> List[Link]:
         return self.world.LINKS
 
@@ -170,6 +232,9 @@ class SingleWorld(WorldSpec):
     def get_gl(self) -> Graph:
         return self.gl
     
+    def get_cgl(self) -> CSRGraph:
+        return self.cgl
+    
     def get_coords(self) -> CoordsDict:
         return self.coords
     
@@ -210,16 +275,81 @@ class SingleWorld(WorldSpec):
         assert isinstance(data, SingleWorld)
         return data
 
+@dataclass
+class RebalanceConfig:
+    """
+    Adaptive load rebalancing between the partitions of ParaWorlds.
+
+    The edges of the neighbouring partitions within a few hops are copied into each world, closed:
+    they are detached from their nodes and admit no inflow, so that the world behaves as without them.
+    At each checkpoint, if the load of the hottest world exceeds the mean load by the threshold ratio,
+    its busiest edges adjacent to cooler worlds holding copies of them are handed over to them:
+    the copy in the cooler world is opened, and the following trip segments over the edges are simulated there.
+    The copy in the old world admits no inflow from then on, and is closed once the vehicles on it leave.
+    Vehicles in the old world that can no longer reach the ends of their trip segments end them at their next nodes
+    and continue along new itineraries.
+    """
+    # Simulated seconds between checkpoints
+    interval: int = 900
+    # Rebalance when the load of the hottest world exceeds threshold * mean load
+    threshold: float = 1.25
+    # Maximum number of edges migrated at a checkpoint
+    max_edges: int = 16
+    # Edges within this many hops from the region of a world are copied into it, bounding how far a world can grow
+    depth: int = 2
+    # Load of a world: "vehicles" = average number of running vehicles (deterministic), "time" = average CPU time of a step
+    metric: str = "vehicles"
+    # CSV file the migrations are written to. None = not written.
+    log_file: Optional[str] = None
+    # Migration log of an earlier run. If given, the logged migrations are applied at their times instead of being decided.
+    replay: Optional[str] = None
+
+
+class Migration(NamedTuple):
+    """A boundary edge handed over between worlds by the rebalancer"""
+    time: int
+    edge: str
+    src: int
+    dst: int
+    # Loads of the source and destination worlds when the decision was made
+    src_load: float
+    dst_load: float
+
+
+_MIGRATION_LOG_HEADER = "time,edge,src,dst,src_load,dst_load\n"
+
+
+def _read_migrations(filepath:str) -> Deque[Migration]:
+    ret:Deque[Migration] = deque()
+    with open(filepath, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i == 0 or line.strip() == "": continue
+            t, rest = line.strip().split(",", 1)
+            edge, src, dst, sl, dl = rest.rsplit(",", 4)
+            ret.append(Migration(int(t), edge, int(src), int(dst), float(sl), float(dl)))
+    return ret
+
+
 class ParaWorlds(WorldSpec):
-    def __init__(self, worlds:Dict[int, World], gl:Graph):
+    def __init__(self, worlds:Dict[int, World], gl:Graph, owners:Optional[Dict[str, int]] = None, rebalance:Optional[RebalanceConfig] = None):
+        """
+        :param worlds: world_id -> World
+        :param gl: Routing graph holding the links of the owning worlds
+        :param owners: edge name -> world_id owning the edge. Needed when some edges are copied into several worlds.
+            The copies not owned are closed until migrated. None means each edge is in exactly one world.
+        :param rebalance: Configuration of the adaptive load rebalancing. None means disabled.
+        """
         self.worlds = worlds
         self.gl = gl
         self.node_coords:Dict[str, Tuple[float, float]] = {}
         self.wid_of_edges:Dict[str, int] = {}
         self.wid_of_nodes:Dict[str, Set[int]] = defaultdict(set)
+        # Edges copied into several worlds: edge name -> world_id -> link
+        copies:Dict[str, Dict[int, Link]] = defaultdict(dict)
         for wid, W in worlds.items():
             for edge in W.LINKS:
                 self.wid_of_edges[edge.name] = wid
+                copies[edge.name][wid] = edge
             for node in W.NODES:
                 self.wid_of_nodes[node.name].add(wid)
                 if node.name in self.node_coords:
@@ -227,6 +357,47 @@ class ParaWorlds(WorldSpec):
                         f"Node {node.name} has inconsistent coordinates across worlds."
                 else:
                     self.node_coords[node.name] = (node.x, node.y)
+        self.__copies:Dict[str, Dict[int, Link]] = {e: c for e, c in copies.items() if len(c) > 1}
+        # Inflow capacities of the closed copies: (edge name, world_id) -> capacity
+        self.__closed:Dict[Tuple[str, int], float] = {}
+        # Inflow capacities of the copies migrated away, which admit no inflow and are closed once the vehicles on them leave
+        self.__draining:Dict[Tuple[str, int], float] = {}
+        if owners is not None:
+            self.wid_of_edges = dict(owners)
+            for edge, c in self.__copies.items():
+                for wid, link in c.items():
+                    if wid != owners[edge]: self.__close(wid, link)
+            # A world only holds the nodes of its open edges
+            self.wid_of_nodes = defaultdict(set)
+            for wid, W in worlds.items():
+                for edge in W.LINKS:
+                    if (edge.name, wid) not in self.__closed:
+                        self.wid_of_nodes[edge.start_node.name].add(wid)
+                        self.wid_of_nodes[edge.end_node.name].add(wid)
+        self.cgl = CSRGraph(gl, self.node_coords)
+
+        # Per-world load: CPU time of the last step, total CPU time, and running vehicles after the last step
+        self.__wtime:Dict[int, float] = {wid: 0.0 for wid in worlds}
+        self.__wbusy:Dict[int, float] = {wid: 0.0 for wid in worlds}
+        self.__wveh:Dict[int, int] = {wid: 0 for wid in worlds}
+        self.__crit = 0.0
+        # Sums of the step times and running vehicles since the last checkpoint
+        self.__win_time:Dict[int, float] = {wid: 0.0 for wid in worlds}
+        self.__win_veh:Dict[int, int] = {wid: 0 for wid in worlds}
+        self.__win_steps = 0
+
+        self.__rb = rebalance
+        self.__migrations:List[Migration] = []
+        self.__replay:Optional[Deque[Migration]] = None
+        if rebalance is not None:
+            assert rebalance.interval > 0, "Rebalance interval must be positive."
+            assert rebalance.metric in ("vehicles", "time"), f"Unknown load metric {rebalance.metric}."
+            self.__next_check = rebalance.interval
+            if rebalance.replay is not None:
+                self.__replay = _read_migrations(rebalance.replay)
+            if rebalance.log_file is not None:
+                with open(rebalance.log_file, "w", encoding="utf-8") as f:
+                    f.write(_MIGRATION_LOG_HEADER)
         
         # Deque of (arrival vehicle id, current trip segment id)
         self.__aQs:List[Deque[Tuple[str, int]]] = [deque() for _ in range(len(worlds))]
@@ -239,6 +410,8 @@ class ParaWorlds(WorldSpec):
 
         # Vehicle itineraries: vehicle id -> list of splitting nodes: (node_name, next_world_id)
         self.__veh_itineraies:Dict[str, List[Tuple[str, int]]] = {}
+        # Current trip segment of each vehicle
+        self.__veh_segments:Dict[str, int] = {}
 
         self.__uvi: Dict[str, Vehicle] = {}
 
@@ -250,15 +423,32 @@ class ParaWorlds(WorldSpec):
     def __create_pool(self):
         self.__pool = ThreadPoolExecutor(os.cpu_count())
     
+    def __getstate__(self):
+        # The pool is not saved
+        state = self.__dict__.copy()
+        state.pop("_ParaWorlds__pool", None)
+        return state
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        self.__create_pool()
+    
     def get_coords(self) -> CoordsDict:
         return self.node_coords
     
     def __getitem__(self, wid:int) -> World:
         return self.worlds[wid]
 
+    @property
+    def world_count(self) -> int:
+        return len(self.worlds)
+
     def get_gl(self) -> Graph:
         return self.gl
     
+    def get_cgl(self) -> CSRGraph:
+        return self.cgl
+    
     def get_arrived_vehicles(self):
         while len(self.__aQ) > 0:
             veh_id = self.__aQ.popleft()
@@ -268,28 +458,73 @@ class ParaWorlds(WorldSpec):
     def get_time(self) -> int:
         return self.__ctime
 
+    @property
+    def step_times(self) -> Dict[int, float]:
+        """CPU time of the last step of each world in seconds"""
+        return dict(self.__wtime)
+
+    @property
+    def vehicle_counts(self) -> Dict[int, int]:
+        """Number of running vehicles in each world after the last step"""
+        return dict(self.__wveh)
+
+    @property
+    def busy_time(self) -> Tuple[float, float]:
+        """
+        CPU time spent in the worlds: (total, critical path).
+        The critical path sums the slowest world of each step, which bounds the wall time with enough cores.
+        """
+        return sum(self.__wbusy.values()), self.__crit
+
+    @property
+    def migrations(self) -> List[Migration]:
+        """Edges handed over between worlds by the rebalancer, in order"""
+        return list(self.__migrations)
+
+    def __step_world(self, wid:int, until_s:int):
+        st = time.thread_time()
+        self.worlds[wid].exec_simulation(until_s)
+        self.__wtime[wid] = time.thread_time() - st
+
     def exec_simulation(self, until_s:int):
         self.__aQ.clear()
         
         st = time.time()
         if self.__lt < 0.01:
-            for W in self.worlds.values():
-                W.exec_simulation(until_s)
+            for wid in self.worlds:
+                self.__step_world(wid, until_s)
             self.__cnt_ser += 1
         else:
             futures = []
-            for W in self.worlds.values():
+            for wid in self.worlds:
                 if len(futures) + 1 == len(self.worlds):
                     # The last task in conduct in main thread to reduce the overhead
-                    W.exec_simulation(until_s)
+                    self.__step_world(wid, until_s)
                 else:
-                    futures.append(self.__pool.submit(W.exec_simulation, until_s))
+                    futures.append(self.__pool.submit(self.__step_world, wid, until_s))
             self.__cnt_para += 1
             for _ in as_completed(futures): pass
 
         self.__lt = time.time() - st
         
         self.__ctime = until_s
+        self.cgl.refresh(until_s)
+
+        for wid, W in self.worlds.items():
+            n = len(W.VEHICLES_RUNNING)
+            self.__wveh[wid] = n
+            self.__wbusy[wid] += self.__wtime[wid]
+            self.__win_time[wid] += self.__wtime[wid]
+            self.__win_veh[wid] += n
+        self.__crit += max(self.__wtime.values())
+        self.__win_steps += 1
+        for edge, wid in list(self.__draining):
+            link = self.__copies[edge][wid]
+            if len(link.vehicles) == 0: self.__close(wid, link)
+        if self.__rb is not None and until_s >= self.__next_check:
+            self.__checkpoint(until_s)
+            while self.__next_check <= until_s:
+                self.__next_check += self.__rb.interval
 
         for i, aQ in enumerate(self.__aQs):
             while len(aQ) > 0:
@@ -305,6 +540,154 @@ class ParaWorlds(WorldSpec):
                 else:
                     self.__aQ.append(veh_id)
                     self.__veh_itineraies.pop(veh_id)
+                    self.__veh_segments.pop(veh_id)
+
+    def __checkpoint(self, t:int):
+        assert self.__rb is not None
+        steps = max(self.__win_steps, 1)
+        if self.__rb.metric == "time":
+            loads = {wid: v / steps for wid, v in self.__win_time.items()}
+        else:
+            loads = {wid: v / steps for wid, v in self.__win_veh.items()}
+        for wid in self.worlds:
+            self.__win_time[wid] = 0.0
+            self.__win_veh[wid] = 0
+        self.__win_steps = 0
+
+        if self.__replay is not None:
+            changed:Set[int] = set()
+            srcs:Set[int] = set()
+            while len(self.__replay) > 0 and self.__replay[0].time <= t:
+                m = self.__replay.popleft()
+                self.__migrate(m)
+                changed.update((m.src, m.dst))
+                srcs.add(m.src)
+            self.__reroute(changed)
+            self.__resplit(srcs)
+            return
+        
+        mean = sum(loads.values()) / len(loads)
+        hot = max(self.worlds, key=lambda wid: (loads[wid], -wid))
+        if mean <= 0 or loads[hot] < self.__rb.threshold * mean: return
+
+        # Load of a vehicle in the hottest world, and the load to move out of it
+        unit = loads[hot] / max(self.__wveh[hot], 1)
+        target = loads[hot] - mean
+        # Copied edges owned by the hottest world by the number of vehicles on them, busiest first
+        cands:List[Tuple[int, str]] = []
+        for edge, copies in self.__copies.items():
+            if self.wid_of_edges[edge] != hot: continue
+            n = len(copies[hot].vehicles)
+            if n > 0: cands.append((-n, edge))
+        cands.sort()
+        
+        proj = dict(loads)
+        moved = 0.0
+        cnt = 0
+        changed:Set[int] = set()
+        for n, edge in cands:
+            if moved >= target or cnt >= self.__rb.max_edges: break
+            amount = -n * unit
+            # Only worlds already holding an end node of the edge, so that the worlds stay contiguous
+            link = self.__copies[edge][hot]
+            nbrs = [wid for wid in self.__copies[edge] if wid != hot and (
+                wid in self.wid_of_nodes[link.start_node.name] or wid in self.wid_of_nodes[link.end_node.name])]
+            if len(nbrs) == 0: continue
+            dst = min(nbrs, key=lambda wid: (proj[wid], wid))
+            if proj[dst] + amount > mean: continue
+            self.__migrate(Migration(t, edge, hot, dst, loads[hot], loads[dst]))
+            changed.update((hot, dst))
+            proj[dst] += amount
+            moved += amount
+            cnt += 1
+        self.__reroute(changed)
+        if len(changed) > 0: self.__resplit({hot})
+    
+    def __reroute(self, wids:Set[int]):
+        # Search the routes over the opened and closed copies at once, otherwise the vehicles added before
+        # the next route update find their destinations unreachable and wander, or keep heading for the closed copies
+        for wid in sorted(wids):
+            W = self.worlds[wid]
+            W.ROUTECHOICE.route_search_all(W.T*W.DELTAT, noise=W.DUO_NOISE)
+            W.ROUTECHOICE.homogeneous_DUO_update()
+    
+    def __resplit(self, wids:Set[int]):
+        # Vehicles in the worlds that gave edges away may have lost every route to the end of their trip segments.
+        # Their segments end at their next nodes instead, from where they follow new itineraries.
+        for wid in sorted(wids):
+            W = self.worlds[wid]
+            rc = W.ROUTECHOICE
+            rows = {k: r for r, k in enumerate(rc.dests)}
+            for veh in list(W.VEHICLES_LIVING.values()):
+                if veh.state == "run":
+                    node = veh.link.end_node
+                elif veh.state == "wait":
+                    node = veh.orig
+                else:
+                    continue
+                r = rows.get(veh.dest.id)
+                if node == veh.dest or r is None or np.isfinite(rc.dist_to[r, node.id]): continue
+                veh_id = veh.name
+                seg = self.__veh_segments[veh_id]
+                splitting_nodes = self.__veh_itineraies[veh_id]
+                to_node = splitting_nodes[-1][0]
+                if veh.state == "run":
+                    # The segment ends at the end of the current link
+                    if node.name == to_node:
+                        rest = [(to_node, -1)]
+                    else:
+                        rest = _split_itinerary(self, node.name, to_node, None, RoutingAlgorithm.AstarFastest)
+                    self.__veh_itineraies[veh_id] = splitting_nodes[:seg + 1] + rest
+                    veh.dest = node
+                    veh.route_next_link = None
+                    if veh in node.incoming_vehicles: node.incoming_vehicles.remove(veh)
+                else:
+                    # Not departed yet: the segment starts over in the world of the new itinerary
+                    node.generation_queue.remove(veh)
+                    W.VEHICLES_LIVING.pop(veh_id)
+                    W.VEHICLES.pop(veh_id)
+                    del self.__uvi[veh_id]
+                    rest = _split_itinerary(self, node.name, to_node, None, RoutingAlgorithm.AstarFastest)
+                    self.__veh_itineraies[veh_id] = splitting_nodes[:seg] + rest
+                    self.__add_veh(rest[0][1], veh_id, rest[0][0], rest[1][0], seg)
+
+    def __close(self, wid:int, link:Link):
+        self.__closed[(link.name, wid)] = self.__draining.pop((link.name, wid), link.capacity_in)
+        link.capacity_in = 0
+        link.capacity_in_remain = 0
+        link.start_node.outlinks.pop(link.name)
+        link.end_node.inlinks.pop(link.name)
+    
+    def __open(self, wid:int, link:Link):
+        key = (link.name, wid)
+        cap = self.__closed.pop(key) if key in self.__closed else self.__draining.pop(key)
+        link.capacity_in = cap
+        link.capacity_in_remain = cap * link.W.DELTAT
+        link.start_node.outlinks[link.name] = link
+        link.end_node.inlinks[link.name] = link
+        self.wid_of_nodes[link.start_node.name].add(wid)
+        self.wid_of_nodes[link.end_node.name].add(wid)
+
+    def __migrate(self, m:Migration):
+        copies = self.__copies.get(m.edge)
+        assert copies is not None and m.dst in copies, f"Edge {m.edge} has no copy in world {m.dst}."
+        assert self.wid_of_edges[m.edge] == m.src, f"Edge {m.edge} is not in world {m.src}."
+        link = copies[m.dst]
+        if (m.edge, m.dst) in self.__closed or (m.edge, m.dst) in self.__draining:
+            self.__open(m.dst, link)
+        # The old copy admits no new inflow. It is closed once the vehicles on it leave.
+        old = copies[m.src]
+        self.__draining[(m.edge, m.src)] = old.capacity_in
+        old.capacity_in = 0
+        old.capacity_in_remain = 0
+        self.wid_of_edges[m.edge] = m.dst
+        self.cgl.replace_link(m.edge, link)
+        fr = link.start_node.name
+        self.gl[fr] = [(to, link if l.name == m.edge else l) for to, l in self.gl[fr]]
+        self.__migrations.append(m)
+        if self.__rb is not None and self.__rb.log_file is not None:
+            with open(self.__rb.log_file, "a", encoding="utf-8") as f:
+                f.write(f"{m.time},{m.edge},{m.src},{m.dst},{m.src_load:.6g},{m.dst_load:.6g}\n")
 
     def get_link(self, link_id:str) -> Optional[Link]:
         return self.worlds[self.wid_of_edges[link_id]].get_link(link_id)
@@ -313,10 +696,18 @@ class ParaWorlds(WorldSpec):
         for wid in self.wid_of_nodes[node_id]:
             node = self.worlds[wid].get_node(node_id)
             if node:
-                yield from chain(node.inlinks.values(), node.outlinks.values())
+                for link in chain(node.inlinks.values(), node.outlinks.values()):
+                    if self.wid_of_edges[link.name] == wid: yield link
+
+    def change_free_flow_speed(self, link_id:str, speed:float):
+        # All copies of the edge, so that a migration keeps the new speed
+        copies = self.__copies.get(link_id)
+        for link in (copies.values() if copies is not None else (self.get_link(link_id),)):
+            link.change_free_flow_speed(speed)
+        self.cgl.update_free_flow((link_id,))
 
     def links(self) -> Iterable[Link]:
-        return (link for W in self.worlds.values() for link in W.LINKS)
+        return (link for wid, W in self.worlds.items() for link in W.LINKS if self.wid_of_edges[link.name] == wid)
 
     def __add_veh(self, world_id:int, veh_id:str, from_node:str, to_node:str, trip_segment:int):
         assert world_id in self.wid_of_nodes[from_node], \
@@ -328,39 +719,12 @@ class ParaWorlds(WorldSpec):
         def add_to_aQ(veh:Vehicle):
             self.__aQs[world_id].append((veh.name, trip_segment))
 
+        self.__veh_segments[veh_id] = trip_segment
         self.__uvi[veh_id] = W.addVehicle(orig=from_node, dest=to_node, 
             departure_time=self.__ctime, name=veh_id, end_trip_callback=add_to_aQ)
 
     def add_vehicle(self, veh_id:str, from_node:str, to_node:str, route:Union[None, Stage, List[str]] = None, algo:RoutingAlgorithm = RoutingAlgorithm.AstarFastest):
-        if from_node == to_node:
-            for wid in self.wid_of_nodes[from_node]:
-                splitting_nodes:List[Tuple[str, int]] = [(from_node, wid), (to_node, -1)]
-                break
-        else:
-            if route is None:
-                stage = algo.run(self.gl, self.node_coords, self.__ctime, from_node, to_node)
-                nodes = stage.nodes
-                edges = stage.edges
-            elif isinstance(route, Stage):
-                nodes = route.nodes
-                edges = route.edges
-            else:
-                nodes = [from_node]
-                for edge in route:
-                    link = self.get_link(edge)
-                    assert link is not None, f"Invalid link name {edge} in the route"
-                    assert link.start_node.name == nodes[-1], "The provided route is invalid."
-                    nodes.append(link.end_node.name)
-                assert nodes[-1] == to_node, "The provided route does not lead to the destination node."
-                edges = route
-            Ecnt = len(edges)
-            assert Ecnt > 0, "Route not found."
-            splitting_nodes:List[Tuple[str, int]] = [(nodes[0], self.wid_of_edges[edges[0]])]  # (node_name, prev_world_id, next_world_id)
-            for i in range(Ecnt - 1):
-                if self.wid_of_edges[edges[i]] != self.wid_of_edges[edges[i + 1]]:
-                    splitting_nodes.append((nodes[i + 1], self.wid_of_edges[edges[i + 1]]))
-            splitting_nodes.append((nodes[-1], -1))  # Destination node, no next world
-
+        splitting_nodes = _split_itinerary(self, from_node, to_node, route, algo)
         self.__veh_itineraies[veh_id] = splitting_nodes
         self.__add_veh(splitting_nodes[0][1], veh_id, splitting_nodes[0][0], splitting_nodes[1][0], 0)
 
@@ -381,7 +745,10 @@ class ParaWorlds(WorldSpec):
     
     def shutdown(self):
         self.__pool.shutdown(wait=True)
-        return f"Total steps: {self.__cnt_ser} serial + {self.__cnt_para} parallel"
+        ret = f"Total steps: {self.__cnt_ser} serial + {self.__cnt_para} parallel"
+        if self.__rb is not None:
+            ret += f", {len(self.__migrations)} edges migrated"
+        return ret
 
     def __lstack_save(self, filepath:str):
         sys.setrecursionlimit(10**9)
@@ -419,9 +786,430 @@ class ParaWorlds(WorldSpec):
         assert isinstance(data, ParaWorlds), "Invalid world object."
         return data
 
+class RemoteNode(NamedTuple):
+    """Node of a partition simulated in a worker process"""
+    name: str
+    x: float
+    y: float
+
+
+class RemoteLink:
+    """
+    Mirror of a link simulated in a worker process of ProcParaWorlds.
+    The speed and the instant travel time are refreshed after each step.
+    """
+    __slots__ = ("name", "start_node", "end_node", "length", "free_flow_speed", "number_of_lanes", "speed", "traveltime")
+
+    def __init__(self, name:str, start_node:RemoteNode, end_node:RemoteNode, length:float, free_flow_speed:float, number_of_lanes:int):
+        self.name = name
+        self.start_node = start_node
+        self.end_node = end_node
+        self.length = length
+        self.free_flow_speed = free_flow_speed
+        self.number_of_lanes = number_of_lanes
+        self.speed = free_flow_speed
+        self.traveltime = length / free_flow_speed
+
+    def instant_travel_time(self, t:int) -> float:
+        """Travel time at the end of the last step. t is ignored since only the current time is queried."""
+        return self.traveltime
+
+    def __repr__(self):
+        return f"<RemoteLink {self.name}>"
+
+
+class RemoteRoute(NamedTuple):
+    links: List[RemoteLink]
+
+
+class RemoteVehicle:
+    """Snapshot of a vehicle simulated in a worker process of ProcParaWorlds"""
+    def __init__(self, name:str, state:str, link:Optional[RemoteLink], x:float, xy:Tuple[float, float],
+            route:List[RemoteLink], timepoints:List[float]):
+        self.name = name
+        self.state = state
+        self.link = link
+        self.x = x
+        self.__xy = xy
+        self.__route = route
+        self.__timepoints = timepoints
+
+    def get_xy_coords(self) -> Tuple[float, float]:
+        return self.__xy
+
+    def traveled_route(self) -> Tuple[RemoteRoute, List[float]]:
+        """Links traveled over all partitions and the time entering each of them. The last time point is the arrival time."""
+        return RemoteRoute(self.__route), self.__timepoints
+
+    def __repr__(self):
+        return f"<RemoteVehicle {self.name}: {self.state}, x={self.x}, link={self.link}>"
+
+
+# Edge of a partition: (name, from_node, to_node, length, speed_limit, lanes)
+_RemoteEdge = Tuple[str, RemoteNode, RemoteNode, float, float, int]
+
+
+class _WorldWorker:
+    """A partition world living in a worker process"""
+    def __init__(self, edges:List[_RemoteEdge], **kwargs):
+        self.world = W = World(**kwargs)
+        for name, fr, to, length, speed, lanes in edges:
+            if fr.name not in W.NODES_NAME_DICT:
+                W.addNode(name = fr.name, x = fr.x, y = fr.y)
+            if to.name not in W.NODES_NAME_DICT:
+                W.addNode(name = to.name, x = to.x, y = to.y)
+            W.addLink(name = name, start_node = fr.name, end_node = to.name,
+                length = length, free_flow_speed = speed, number_of_lanes = lanes)
+        self.arrived:List[Vehicle] = []
+
+    def _arrive(self, veh:Vehicle):
+        self.arrived.append(veh)
+
+    def add(self, ctime:int, vehs:List[Tuple[str, str, str, int]]):
+        for veh_id, from_node, to_node, trip_segment in vehs:
+            self.world.addVehicle(orig=from_node, dest=to_node, departure_time=ctime, name=veh_id,
+                attribute=trip_segment, end_trip_callback=self._arrive)
+
+    def step(self, ctime:int, until_s:int, vehs:List[Tuple[str, str, str, int]]):
+        W = self.world
+        self.add(ctime, vehs)
+        # CPU time, which is not inflated when the workers share CPU cores
+        st = time.process_time()
+        W.exec_simulation(until_s)
+        elapsed = time.process_time() - st
+        arrivals = []
+        for veh in self.arrived:
+            route, ts = veh.traveled_route()
+            arrivals.append((veh.name, veh.attribute, [link.name for link in route.links], list(ts)))
+            W.VEHICLES.pop(veh.name)
+        self.arrived.clear()
+        tt = np.fromiter((link.instant_travel_time(until_s) for link in W.LINKS), dtype=np.float64, count=len(W.LINKS))
+        speed = np.fromiter((link.speed for link in W.LINKS), dtype=np.float64, count=len(W.LINKS))
+        return arrivals, tt, speed, len(W.VEHICLES_RUNNING), W.analyzer.average_speed, elapsed
+
+    def set_speed(self, link_id:str, speed:float):
+        self.world.get_link(link_id).change_free_flow_speed(speed)
+
+    def vehicle(self, veh_id:str):
+        veh = self.world.VEHICLES[veh_id]
+        route, ts = veh.traveled_route()
+        if veh.link is None:
+            return veh.state, None, veh.x, (veh.orig.x, veh.orig.y), [l.name for l in route.links], list(ts)
+        return veh.state, veh.link.name, veh.x, veh.get_xy_coords(), [l.name for l in route.links], list(ts)
+
+    def dump(self) -> bytes:
+        return dumps_checkpoint(self)
+
+    def save(self, folder:str):
+        save_checkpoint(folder, self)
+
+
+def _world_worker_main(conn, init:Union[bytes, str, Tuple[List[_RemoteEdge], dict]]):
+    import traceback
+    try:
+        if isinstance(init, bytes):
+            worker = loads_checkpoint(init)
+        elif isinstance(init, str):
+            worker = load_checkpoint(init)
+        else:
+            worker = _WorldWorker(init[0], **init[1])
+        conn.send((True, None))
+    except BaseException:
+        conn.send((False, traceback.format_exc()))
+        return
+    while True:
+        try:
+            cmd, args = conn.recv()
+        except EOFError:
+            break
+        if cmd == "close":
+            conn.send((True, None))
+            break
+        try:
+            conn.send((True, getattr(worker, cmd)(*args)))
+        except BaseException:
+            conn.send((False, traceback.format_exc()))
+
+
+class ProcParaWorlds(WorldSpec):
+    """
+    Partitioned worlds simulated in worker processes, one process per partition.
+    Unlike ParaWorlds, it runs in parallel on the CPython builds with GIL.
+    The worlds are stepped in lock-step by exec_simulation. Vehicles crossing partitions,
+    as well as the vehicles added between steps, are sent to the workers in one batch per step.
+    Links and vehicles are only visible as RemoteLink and RemoteVehicle in the main process.
+    """
+    def __init__(self, nodes:Iterable[RemoteNode], edges:Iterable[Tuple[int, _RemoteEdge]], world_kwargs:dict):
+        """
+        :param nodes: Nodes of the road network
+        :param edges: (World ID, Edge) of the road network
+        :param world_kwargs: Keyword arguments passed to every World
+        """
+        self.node_coords:Dict[str, Tuple[float, float]] = {}
+        self.wid_of_edges:Dict[str, int] = {}
+        self.wid_of_nodes:Dict[str, Set[int]] = defaultdict(set)
+        self.__links:Dict[str, RemoteLink] = {}
+        self.__wlinks:Dict[int, List[RemoteLink]] = defaultdict(list)
+        # Node name -> links entering or leaving the node
+        self.__nlinks:Dict[str, List[RemoteLink]] = defaultdict(list)
+        self.gl:Graph = {node.name: [] for node in nodes}
+        parts:Dict[int, List[_RemoteEdge]] = defaultdict(list)
+        for wid, edge in edges:
+            name, fr, to, length, speed, lanes = edge
+            parts[wid].append(edge)
+            link = RemoteLink(name, fr, to, length, speed, lanes)
+            self.__links[name] = link
+            self.__wlinks[wid].append(link)
+            self.wid_of_edges[name] = wid
+            for node in (fr, to):
+                self.wid_of_nodes[node.name].add(wid)
+                self.node_coords[node.name] = (node.x, node.y)
+            self.__nlinks[fr.name].append(link)
+            if to.name != fr.name:
+                self.__nlinks[to.name].append(link)
+            self.gl[fr.name].append((to.name, link))
+        self.__wlinks = dict(self.__wlinks)
+        self.__nlinks = dict(self.__nlinks)
+        self.cgl = CSRGraph(self.gl, self.node_coords)
+
+        self.__ctime = 0
+        self.__aQ:Deque[Tuple[str, RemoteVehicle]] = deque()
+        # Vehicle itineraries: vehicle id -> list of splitting nodes: (node_name, next_world_id)
+        self.__veh_itineraies:Dict[str, List[Tuple[str, int]]] = {}
+        # Vehicle id -> world id of the current trip segment
+        self.__uvi:Dict[str, int] = {}
+        # Traveled links and time points of the finished trip segments
+        self.__routes:Dict[str, Tuple[List[RemoteLink], List[float]]] = {}
+        # Vehicles to be added to each world at the beginning of the next step: (veh_id, from_node, to_node, trip_segment)
+        self.__pending:Dict[int, List[Tuple[str, str, str, int]]] = {wid: [] for wid in parts}
+        self.__running = 0
+        self.__avg_speed = 0.0
+        self.__busy = 0.0
+        self.__critical = 0.0
+        self.__cnt = 0
+        self.__start({wid: (edges, dict(world_kwargs, name=str(wid), print_mode=False, save_mode=False))
+            for wid, edges in parts.items()})
+
+    def __start(self, inits:Dict[int, Union[bytes, str, Tuple[List[_RemoteEdge], dict]]]):
+        ctx = get_context("spawn")
+        self.__conns = {}
+        self.__procs = {}
+        for wid, init in inits.items():
+            conn, child = ctx.Pipe()
+            p = ctx.Process(target=_world_worker_main, args=(child, init), daemon=True)
+            p.start()
+            child.close()
+            self.__conns[wid] = conn
+            self.__procs[wid] = p
+        for wid in inits:
+            self.__recv(wid)
+
+    def __recv(self, wid:int):
+        ok, ret = self.__conns[wid].recv()
+        if not ok:
+            raise RuntimeError(Lang.PROC_WORLD_FAILED.format(wid, ret))
+        return ret
+
+    def __call(self, wid:int, cmd:str, *args):
+        self.__conns[wid].send((cmd, args))
+        return self.__recv(wid)
+
+    def __flush(self, wid:int):
+        if len(self.__pending[wid]) > 0:
+            self.__call(wid, "add", self.__ctime, self.__pending[wid])
+            self.__pending[wid] = []
+
+    @property
+    def world_count(self) -> int:
+        return len(self.__conns)
+
+    @property
+    def busy_time(self) -> Tuple[float, float]:
+        """CPU time of the workers in simulation: (sum over workers, sum over steps of the slowest worker)"""
+        return self.__busy, self.__critical
+
+    def get_coords(self) -> CoordsDict:
+        return self.node_coords
+
+    def get_gl(self) -> Graph:
+        return self.gl
+
+    def get_cgl(self) -> CSRGraph:
+        return self.cgl
+
+    def get_time(self) -> int:
+        return self.__ctime
+
+    def get_arrived_vehicles(self):
+        while len(self.__aQ) > 0:
+            yield self.__aQ.popleft()
+
+    def exec_simulation(self, until_s:int):
+        self.__aQ.clear()
+        for wid, conn in self.__conns.items():
+            conn.send(("step", (self.__ctime, until_s, self.__pending[wid])))
+            self.__pending[wid] = []
+        replies = {wid: self.__recv(wid) for wid in self.__conns}
+        self.__ctime = until_s
+        self.__cnt += 1
+        self.__running = 0
+        avg_speed = 0.0
+        slowest = 0.0
+        for wid, (arrivals, tt, speed, running, wspeed, elapsed) in replies.items():
+            for link, t, v in zip(self.__wlinks[wid], tt.tolist(), speed.tolist()):
+                link.traveltime = t
+                link.speed = v
+            self.__running += running
+            avg_speed += wspeed
+            self.__busy += elapsed
+            slowest = max(slowest, elapsed)
+        self.__critical += slowest
+        self.__avg_speed = avg_speed / len(replies)
+        self.cgl.refresh(until_s)
+
+        for wid, (arrivals, *_) in replies.items():
+            for veh_id, trip_segment, route, ts in arrivals:
+                links, tps = self.__routes.setdefault(veh_id, ([], []))
+                links.extend(self.__links[name] for name in route)
+                if len(tps) > 0: tps.pop()  # Arrival time of the previous segment
+                tps.extend(ts)
+                splitting_nodes = self.__veh_itineraies[veh_id]
+                if trip_segment + 2 < len(splitting_nodes):
+                    trip_segment += 1
+                    from_node, next_wid = splitting_nodes[trip_segment]
+                    to_node, _ = splitting_nodes[trip_segment + 1]
+                    self.__add_veh(next_wid, veh_id, from_node, to_node, trip_segment)
+                else:
+                    self.__veh_itineraies.pop(veh_id)
+                    del self.__uvi[veh_id]
+                    del self.__routes[veh_id]
+                    last = links[-1] if len(links) > 0 else None
+                    self.__aQ.append((veh_id, RemoteVehicle(veh_id, "end", last, 0, (0., 0.), links, tps)))
+
+    def get_link(self, link_id:str) -> Optional[RemoteLink]:
+        return self.__links.get(link_id)
+
+    def get_neighbor_links(self, node_id:str) -> Iterable[RemoteLink]:
+        return self.__nlinks.get(node_id, [])
+
+    def change_free_flow_speed(self, link_id:str, speed:float):
+        self.__call(self.wid_of_edges[link_id], "set_speed", link_id, speed)
+        self.__links[link_id].free_flow_speed = speed
+        self.cgl.update_free_flow((link_id,))
+
+    def links(self) -> Iterable[RemoteLink]:
+        return self.__links.values()
+
+    def __add_veh(self, world_id:int, veh_id:str, from_node:str, to_node:str, trip_segment:int):
+        assert world_id in self.wid_of_nodes[from_node], \
+            f"Node {from_node} is not in world {world_id}, cannot add vehicle {veh_id}."
+        assert world_id in self.wid_of_nodes[to_node], \
+            f"Node {to_node} is not in world {world_id}, cannot add vehicle {veh_id}."
+        self.__pending[world_id].append((veh_id, from_node, to_node, trip_segment))
+        self.__uvi[veh_id] = world_id
+
+    def add_vehicle(self, veh_id:str, from_node:str, to_node:str, route:Union[None, Stage, List[str]] = None, algo:RoutingAlgorithm = RoutingAlgorithm.AstarFastest):
+        splitting_nodes = _split_itinerary(self, from_node, to_node, route, algo)
+        self.__veh_itineraies[veh_id] = splitting_nodes
+        self.__add_veh(splitting_nodes[0][1], veh_id, splitting_nodes[0][0], splitting_nodes[1][0], 0)
+
+    def has_vehicle(self, veh_id:str) -> bool:
+        return veh_id in self.__uvi
+
+    def get_vehicle(self, veh_id:str) -> RemoteVehicle:
+        """Fetch a snapshot of the vehicle from the worker process simulating it"""
+        wid = self.__uvi[veh_id]
+        self.__flush(wid)
+        state, link, x, xy, route, ts = self.__call(wid, "vehicle", veh_id)
+        links, tps = self.__routes.get(veh_id, ([], []))
+        links = links + [self.__links[name] for name in route]
+        tps = tps[:-1] + ts
+        return RemoteVehicle(veh_id, state, None if link is None else self.__links[link], x, xy, links, tps)
+
+    def get_vehicle_count(self) -> int:
+        return len(self.__uvi)
+
+    def get_running_vehicle_count(self) -> int:
+        return self.__running
+
+    def get_average_speed(self) -> float:
+        return self.__avg_speed
+
+    def __close(self):
+        for wid, conn in self.__conns.items():
+            try:
+                conn.send(("close", ()))
+                conn.recv()
+            except (EOFError, OSError):
+                pass
+            conn.close()
+        for p in self.__procs.values():
+            p.join()
+        self.__conns.clear()
+        self.__procs.clear()
+
+    def shutdown(self):
+        n = len(self.__conns)
+        self.__close()
+        return f"Total steps: {self.__cnt} parallel in {n} processes, busy time: {self.__busy:.1f}s total, {self.__critical:.1f}s critical path"
+
+    def __getstate__(self):
+        for wid in self.__conns:
+            self.__flush(wid)
+        state = self.__dict__.copy()
+        folder = checkpoint_folder()
+        if folder is None:
+            # The worlds are encoded as checkpoints in memory
+            for conn in self.__conns.values():
+                conn.send(("dump", ()))
+            state["_ProcParaWorlds__blobs"] = {wid: self.__recv(wid) for wid in self.__conns}
+        else:
+            # Each worker saves its world as a checkpoint in a subfolder, so that only the changed chunks of each world are written
+            parts = {wid: f"world{wid}" for wid in self.__conns}
+            for wid, conn in self.__conns.items():
+                conn.send(("save", (str(folder / parts[wid]),)))
+            for wid in self.__conns:
+                self.__recv(wid)
+            state["_ProcParaWorlds__parts"] = parts
+        del state["_ProcParaWorlds__conns"]
+        del state["_ProcParaWorlds__procs"]
+        return state
+
+    def __setstate__(self, state:dict):
+        inits:Dict[int, Union[bytes, str]] = state.pop("_ProcParaWorlds__blobs", {})
+        parts:Dict[int, str] = state.pop("_ProcParaWorlds__parts", {})
+        if len(parts) > 0:
+            folder = checkpoint_folder()
+            assert folder is not None, "The worlds are saved in a checkpoint folder, which is not being loaded."
+            inits = {wid: str(folder / part) for wid, part in parts.items()}
+        self.__dict__.update(state)
+        self.__start(inits)
+
+    # The worlds are encoded by the workers as records (see __getstate__), so no deep recursion is needed here
+    def save(self, filepath:str):
+        with gzip.open(filepath, 'wb') as f:
+            pickle.dump({
+                "obj": self,
+                "version": PyVersion(),
+                "pickler": pickle.__name__
+            }, f)
+
+    def _save_obj(self):
+        return pickle.dumps({
+            "obj": self,
+            "version": PyVersion(),
+            "pickler": pickle.__name__
+        })
+
+    @staticmethod
+    def load(filepath:str):
+        data = _load_world(filepath)
+        assert isinstance(data, ProcParaWorlds), "Invalid world object."
+        return data
+
 def load_world(filepath:str) -> WorldSpec:
     data = _load_world(filepath)
-    assert isinstance(data, (SingleWorld, ParaWorlds)), "Invalid world object."
+    assert isinstance(data, (SingleWorld, ParaWorlds, ProcParaWorlds)), "Invalid world object."
     return data
 
-__all__ = ["WorldSpec", "SingleWorld", "ParaWorlds", "RoutingAlgorithm", "load_world", "_load_world_unsafe"]
\ No newline at end of file
+__all__ = ["WorldSpec", "SingleWorld", "ParaWorlds", "RebalanceConfig", "Migration", "ProcParaWorlds", "RemoteLink", "RemoteNode", "RemoteVehicle", "RoutingAlgorithm", "load_world", "_load_world_unsafe"]
\ No newline at end of file
@@ -1,3 +1,4 @@
 from .veh import *
 from .ev import *
+from .fleet import *
 from .vdict import *
\ No newline at end of file
@@ -1,10 +1,13 @@
-from typing import Any, Dict, Callable, List, Optional, Tuple, Union
+from typing import Any, Dict, Callable, List, Optional, Sequence, Tuple, Union
 from xml.etree.ElementTree import Element
+import numpy as np
 from feasytools import RangeList
 from .veh import *
 
 _INF = float('inf')
 
+VectorChargeRate = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
 def _EqualChargeRate(rate: float, ev: 'EV') -> float:
     return rate
 
@@ -14,23 +17,96 @@ def _LinearChargeRate(rate: float, ev: 'EV') -> float:
     return rate * (3.4 - 3 * ev.soc)
 
 
+class ChargeRateCurve:
+    """
+    Piecewise-linear charging rate correction over SoC, e.g. a CC-CV taper.
+    The corrected rate is rate * ratio(SoC), where ratio interpolates the given points.
+    """
+    def __init__(self, soc: Sequence[float], ratio: Sequence[float]):
+        """
+        :param soc: SoC of the points (0.0~1.0), strictly increasing
+        :param ratio: Ratio of the charging rate at the points. SoC outside the points takes the nearest ratio.
+        """
+        self._soc = np.array(soc, dtype=np.float64)
+        self._ratio = np.array(ratio, dtype=np.float64)
+        assert self._soc.ndim == 1 and self._soc.shape == self._ratio.shape and len(self._soc) >= 1
+        assert np.all(np.diff(self._soc) > 0), "SoC points must be strictly increasing"
+
+    @property
+    def points(self) -> 'Tuple[np.ndarray, np.ndarray]':
+        """(soc, ratio) points of the curve"""
+        return self._soc, self._ratio
+
+    def __call__(self, rate: float, ev: 'EV') -> float:
+        return rate * float(np.interp(ev.soc, self._soc, self._ratio))
+
+    def vector(self, rate: np.ndarray, soc: np.ndarray) -> np.ndarray:
+        """Corrected charging rate of an array of EVs"""
+        return rate * np.interp(soc, self._soc, self._ratio)
+
+
+def _EqualChargeRateVec(rate: np.ndarray, soc: np.ndarray) -> np.ndarray:
+    return rate
+
+# Lookup table of _LinearChargeRate: ratio is 1 up to SoC 0.8, then 3.4 - 3 * SoC
+_LinearChargeCurve = ChargeRateCurve([0.0, 0.8, 1.0], [1.0, 1.0, 0.4])
+
+
 class ChargeRatePool:
-    """Charging rate correction function pool"""
+    """
+    Charging rate correction function pool.
+    Each function may have a vectorised counterpart, which takes arrays of (rate, SoC) and returns the corrected rates.
+    Functions without a vectorised counterpart are called once per EV by batched updates.
+    """
     _pool:'Dict[str, Callable[[float, EV], float]]' = {
         "Equal":_EqualChargeRate, 
         "Linear":_LinearChargeRate,
     }
+    _vpool:'Dict[str, VectorChargeRate]' = {
+        "Equal":_EqualChargeRateVec,
+        "Linear":_LinearChargeCurve.vector,
+    }
 
     @staticmethod
-    def add(name: str, func: 'Callable[[float, EV], float]'):
-        """Add charging rate correction function"""
+    def add(name: str, func: 'Callable[[float, EV], float]', vfunc: 'Optional[VectorChargeRate]' = None):
+        """
+        Add charging rate correction function
+
+        :param name: Function name
+        :param func: Scalar function, (rate, EV) -> corrected rate
+        :param vfunc: Vectorised function, (rate array, SoC array) -> corrected rate array.
+            It must agree with func. None means no vectorised counterpart.
+        """
         ChargeRatePool._pool[name] = func
+        if vfunc is None:
+            ChargeRatePool._vpool.pop(name, None)
+        else:
+            ChargeRatePool._vpool[name] = vfunc
+
+    @staticmethod
+    def add_curve(name: str, soc: Sequence[float], ratio: Sequence[float]) -> ChargeRateCurve:
+        """
+        Add a piecewise-linear charging rate correction curve, with both scalar and vectorised functions
+
+        :param name: Function name
+        :param soc: SoC of the points (0.0~1.0), strictly increasing
+        :param ratio: Ratio of the charging rate at the points
+        :return: The curve
+        """
+        curve = ChargeRateCurve(soc, ratio)
+        ChargeRatePool.add(name, curve, curve.vector)
+        return curve
 
     @staticmethod
     def get(name: str) -> 'Callable[[float, EV], float]':
         """Get charging rate correction function"""
         return ChargeRatePool._pool[name]
 
+    @staticmethod
+    def get_vector(name: str) -> 'Optional[VectorChargeRate]':
+        """Get the vectorised charging rate correction function, or None if there is no vectorised counterpart"""
+        return ChargeRatePool._vpool.get(name)
+
 
 class EV(Vehicle):
     """Electric Vehicle Class"""
@@ -430,4 +506,4 @@ class SV(EV):
         return e
 
 
-__all__ = ["EV", "SV", "ChargeRatePool"]
\ No newline at end of file
+__all__ = ["EV", "SV", "ChargeRatePool", "ChargeRateCurve", "VectorChargeRate"]
\ No newline at end of file
@@ -0,0 +1,349 @@
+from itertools import chain
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Type, Union
+import numpy as np
+from feasytools import RangeList
+from .ev import EV, SV, ChargeRatePool, VectorChargeRate
+
+
+# Attributes of EV stored in the fleet arrays: attribute name -> array name
+_FIELDS: Dict[str, str] = {
+    "_energy": "energy",            # Current energy, kWh
+    "_cap": "cap",                  # Battery capacity, kWh
+    "_etar": "etar",                # Target energy, kWh
+    "_cost": "cost",                # Total charging cost, $
+    "_earn": "earn",                # Total V2G revenue, $
+    "_pcf": "pcf",                  # Maximal fast charging power, kWh/s
+    "_pcs": "pcs",                  # Maximal slow charging power, kWh/s
+    "_pdv": "pdv",                  # Maximal V2G power, kWh/s
+    "_ecf": "ecf",                  # Fast charging efficiency
+    "_ecs": "ecs",                  # Slow charging efficiency
+    "_ed": "ed",                    # Discharge efficiency
+    "_kv": "kv",                    # SoC threshold of V2G
+    "_pcr": "pcr",                  # Actual charging power, kWh/s
+    "_pdr": "pdr",                  # Actual discharging power, kWh/s
+    "_max_sc_cost": "max_sc_cost",  # Maximum slow charging cost, $/kWh
+    "_min_v2g_earn": "min_v2g_earn",# Minimum V2G earn, $/kWh
+    "_EV__tmp_pc_max": "pc_max",    # Temporary maximum charging power, kWh/s
+    "_EV__tmp_pd": "pd_max",        # Temporary maximum discharging power, kWh/s
+    "_EV__pcm": "pcm",              # Maximal charging power of the current session, kWh/s
+    "_EV__ec": "ec",                # Charging efficiency of the current session
+    "_EV__pdm": "pdm",              # Maximal discharging power of the current session, kWh/s
+}
+
+# Boolean attributes of EV stored in the fleet arrays
+_FLAGS: Dict[str, str] = {
+    "_leave_at_etar": "leave",      # Whether to leave at target energy immediately
+}
+
+# Defaults of the attributes that EV only sets when a charging session starts
+_DEFAULTS: Dict[str, float] = {"_EV__pcm": 0.0, "_EV__ec": 1.0, "_EV__pdm": 0.0}
+
+# Willingness windows of EV, compiled into the event timeline of EVFleet: attribute name -> window kind
+_WINDOWS: Dict[str, int] = {"_sc_time": 0, "_v2g_time": 1}
+
+# All arrays of EVFleet
+_ARRAYS = list(_FIELDS.values()) + list(_FLAGS.values()) + ["rmod", "sc_ok", "v2g_ok"]
+
+# rmod of EVs whose charging rate correction function has no vectorised counterpart
+_RMOD_SCALAR = -1
+
+
+def _view(arr: str) -> property:
+    # item() returns a Python float or bool, so the views behave like the plain attributes
+    def fget(self: '_FleetView'):
+        return getattr(self._fleet, arr).item(self._fleet_slot)
+    def fset(self: '_FleetView', val):
+        getattr(self._fleet, arr)[self._fleet_slot] = val
+    return property(fget, fset)
+
+
+def _window(attr: str) -> property:
+    # Replacing a window makes the fleet recompile its timeline
+    key = "_fleet" + attr
+    def fget(self: '_FleetView'):
+        return self.__dict__[key]
+    def fset(self: '_FleetView', val: RangeList):
+        self.__dict__[key] = val
+        self._fleet._timeline = None
+    return property(fget, fset)
+
+
+def _window_events(rl: RangeList, always_if_empty: bool) -> Tuple[bool, List[Tuple[int, bool]]]:
+    """
+    Compile a time window into its state before any event and the (time, state) events where the state changes.
+    The membership of RangeList only changes at the ends of its ranges, so testing each end reproduces it exactly.
+    """
+    if getattr(rl, "_RangeList__always_true", False) or (always_if_empty and len(rl) == 0):
+        return True, []
+    ret: List[Tuple[int, bool]] = []
+    state = False
+    for b in sorted(set(chain.from_iterable(rl))):
+        s = rl.__contains__(b)
+        if s != state:
+            ret.append((b, s)); state = s
+    return False, ret
+
+
+def _empty() -> np.ndarray:
+    return np.zeros(0, dtype=np.float64)
+
+
+class _FleetView:
+    """Redirects the charging state of an EV to the arrays of its fleet"""
+    _fleet: 'EVFleet'
+    _fleet_slot: int
+
+for _attr, _arr in chain(_FIELDS.items(), _FLAGS.items()):
+    setattr(_FleetView, _attr, _view(_arr))
+for _attr in _WINDOWS:
+    setattr(_FleetView, _attr, _window(_attr))
+
+
+class FleetEV(_FleetView, EV):
+    """EV whose charging state is stored in an EVFleet"""
+
+class FleetSV(_FleetView, SV):
+    """SV whose charging state is stored in an EVFleet"""
+
+_VIEW_CLASSES: Dict[Type[EV], Type[EV]] = {EV: FleetEV, SV: FleetSV}
+
+
+class EVFleet:
+    """
+    Structure-of-arrays store of the charging state of EVs.
+    Each EV in the fleet owns a slot in the arrays, and the EV object becomes a thin view over its slot,
+    so the scalar methods of EV and the vectorised kernels of the fleet work on the same data.
+    """
+    def __init__(self, evs: Iterable[EV] = (), min_batch: int = 8):
+        """
+        :param evs: EVs to be stored in the fleet. Only EV and SV instances are supported,
+            others are left unchanged and charged by the scalar methods of EV.
+        :param min_batch: Minimum number of EVs in a station to use the vectorised kernels.
+            Below it, the overhead of NumPy calls exceeds the per-EV cost, and the scalar methods of EV are used.
+            Note that the scalar methods are slower on a fleet EV than on a plain EV, since each attribute is a view.
+        """
+        self.min_batch = min_batch
+        self._evs: List[EV] = []
+        f = _empty
+        self.energy = f(); self.cap = f(); self.etar = f(); self.cost = f(); self.earn = f()
+        self.pcf = f(); self.pcs = f(); self.pdv = f(); self.ecf = f(); self.ecs = f(); self.ed = f(); self.kv = f()
+        self.pcr = f(); self.pdr = f(); self.pc_max = f(); self.pd_max = f(); self.pcm = f(); self.ec = f(); self.pdm = f()
+        self.max_sc_cost = f(); self.min_v2g_earn = f()
+        self.leave = np.zeros(0, dtype=np.bool_)
+        self.sc_ok = np.zeros(0, dtype=np.bool_)       # Whether the slow charging window is open
+        self.v2g_ok = np.zeros(0, dtype=np.bool_)      # Whether the V2G window is open
+        self.rmod = np.zeros(0, dtype=np.int16)
+        # Vectorised charging rate correction functions, indexed by rmod
+        self._vrates: List[VectorChargeRate] = []
+        # Event timeline of the willingness windows: (times, slots, kinds, states), compiled on demand
+        self._timeline: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+        self._tl_pos = 0
+        self._tl_now: Optional[int] = None
+        self._tl_lock = Lock()
+        self.extend(evs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_tl_lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._tl_lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._evs)
+
+    def __contains__(self, ev: EV) -> bool:
+        return getattr(ev, "_fleet", None) is self
+
+    def extend(self, evs: Iterable[EV]) -> int:
+        """
+        Move the charging state of the EVs into the fleet.
+
+        :param evs: EVs to be added. EVs already in a fleet and unsupported EV subclasses are skipped.
+        :return: Number of EVs added
+        """
+        new = [ev for ev in evs if type(ev) in _VIEW_CLASSES]
+        if len(new) == 0: return 0
+        n0 = len(self._evs); n = n0 + len(new)
+        for arr in _ARRAYS:
+            old = getattr(self, arr)
+            grown = np.zeros(n, dtype=old.dtype)
+            grown[:n0] = old
+            setattr(self, arr, grown)
+        for i, ev in enumerate(new, n0):
+            d = ev.__dict__
+            for attr, arr in _FIELDS.items():
+                getattr(self, arr)[i] = d.pop(attr, _DEFAULTS.get(attr, 0.0))
+            for attr, arr in _FLAGS.items():
+                getattr(self, arr)[i] = d.pop(attr)
+            for attr in _WINDOWS:
+                d["_fleet" + attr] = d.pop(attr)
+            self.rmod[i] = self._rmod_of(ev)
+            ev.__class__ = _VIEW_CLASSES[type(ev)]
+            d["_fleet"] = self
+            d["_fleet_slot"] = i
+            self._evs.append(ev)
+        self._timeline = None
+        return len(new)
+
+    def _rmod_of(self, ev: EV) -> int:
+        # The vectorised function is only trusted if the EV still uses the registered scalar function
+        name: str = ev._EV__rmod_name # type: ignore
+        vfunc = ChargeRatePool.get_vector(name)
+        if vfunc is None or ChargeRatePool._pool.get(name) is not ev._chrate_mod:
+            return _RMOD_SCALAR
+        for k, f in enumerate(self._vrates):
+            if f == vfunc: return k
+        self._vrates.append(vfunc)
+        return len(self._vrates) - 1
+
+    def slots_of(self, evs: Sequence[EV]) -> Optional[np.ndarray]:
+        """
+        Get the slots of the EVs.
+
+        :param evs: EVs to look up
+        :return: Array of slots, or None if any of the EVs is not in this fleet
+        """
+        ret = np.empty(len(evs), dtype=np.intp)
+        for i, ev in enumerate(evs):
+            if getattr(ev, "_fleet", None) is not self: return None
+            ret[i] = ev._fleet_slot # type: ignore
+        return ret
+
+    def soc(self, slots: np.ndarray) -> np.ndarray:
+        """SoC of the EVs in the slots"""
+        return self.energy[slots] / self.cap[slots]
+
+    def _compile_timeline(self):
+        # Sorted events of all windows. Events at the same time keep the order of slots and kinds,
+        # so the events of the same window stay in time order.
+        init = {0: self.sc_ok, 1: self.v2g_ok}
+        evts: List[Tuple[int, int, int, bool]] = []
+        for i, ev in enumerate(self._evs):
+            for attr, kind in _WINDOWS.items():
+                s0, lst = _window_events(ev.__dict__["_fleet" + attr], kind == 1)
+                init[kind][i] = s0
+                evts.extend((t, i, kind, s) for t, s in lst)
+        evts.sort(key=lambda x: x[0])
+        self._timeline = (
+            np.array([e[0] for e in evts], dtype=np.int64),
+            np.array([e[1] for e in evts], dtype=np.intp),
+            np.array([e[2] for e in evts], dtype=np.int8),
+            np.array([e[3] for e in evts], dtype=np.bool_),
+        )
+        self._tl_pos = 0
+        self._tl_now = None
+
+    def advance(self, t: int):
+        """
+        Bring the willingness windows (sc_ok and v2g_ok) to time t.
+        Only the windows opening or closing since the last call are flipped.
+        Going back in time replays the timeline from the start.
+        """
+        if self._tl_now == t and self._timeline is not None: return
+        with self._tl_lock:
+            if self._tl_now == t and self._timeline is not None: return
+            if self._timeline is None or (self._tl_now is not None and t < self._tl_now):
+                self._compile_timeline()
+            assert self._timeline is not None
+            times, slots, kinds, states = self._timeline
+            k = int(np.searchsorted(times, t, side="right"))
+            if k > self._tl_pos:
+                sl = slice(self._tl_pos, k)
+                # Only the last event of each window in the range matters
+                key = slots[sl] * 2 + kinds[sl]
+                _, last = np.unique(key[::-1], return_index=True)
+                last = k - 1 - last
+                for kind, arr in ((0, self.sc_ok), (1, self.v2g_ok)):
+                    m = last[kinds[last] == kind]
+                    arr[slots[m]] = states[m]
+                self._tl_pos = k
+            self._tl_now = t
+
+    def willing_to_slow_charge(self, slots: np.ndarray, t: int, cost: Union[float, np.ndarray]) -> np.ndarray:
+        """Vectorised EV.willing_to_slow_charge() of the EVs in the slots"""
+        self.advance(t)
+        return self.sc_ok[slots] & (cost <= self.max_sc_cost[slots])
+
+    def willing_to_v2g(self, slots: np.ndarray, t: int, earn: Union[float, np.ndarray]) -> np.ndarray:
+        """Vectorised EV.willing_to_v2g() of the EVs in the slots"""
+        self.advance(t)
+        return (self.v2g_ok[slots] & (self.energy[slots] / self.cap[slots] > self.kv[slots]) &
+            (earn >= self.min_v2g_earn[slots]) & ~self.leave[slots])
+
+    def _charge_rate(self, slots: np.ndarray, soc: np.ndarray) -> np.ndarray:
+        # Each group of EVs sharing a vectorised function is corrected by one call.
+        # Functions without a vectorised counterpart fall back to the scalar call.
+        pcm = self.pcm[slots]
+        rmod = self.rmod[slots]
+        if len(rmod) == 0: return pcm
+        r0 = rmod[0]
+        if (rmod == r0).all():
+            if r0 != _RMOD_SCALAR:
+                return self._vrates[r0](pcm, soc)
+            groups = [r0]
+        else:
+            groups = np.unique(rmod).tolist()
+        rate = pcm.copy()
+        for r in groups:
+            idx = np.flatnonzero(rmod == r)
+            if r == _RMOD_SCALAR:
+                for k in idx:
+                    ev = self._evs[slots[k]]
+                    rate[k] = ev._chrate_mod(float(pcm[k]), ev)
+            else:
+                rate[idx] = self._vrates[r](pcm[idx], soc[idx])
+        return rate
+
+    def charge(
+        self, slots: np.ndarray, sec: int, unit_cost: Union[float, np.ndarray],
+        real_etar: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorised EV.charge() and EV._bidirectional_charge() of the EVs in the slots.
+
+        :param slots: Slots of the EVs, must be unique
+        :param sec: Charging duration (seconds)
+        :param unit_cost: Unit cost of charging of each EV ($/kWh)
+        :param real_etar: Energy the EVs charge to (kWh). None means their target energy.
+        :return: (delta_energy, money), energy drawn from the charger (kWh) and cost ($) of each EV
+        """
+        energy = self.energy
+        e0 = energy[slots]
+        pcr = np.minimum(self._charge_rate(slots, e0 / self.cap[slots]), self.pc_max[slots])
+        self.pc_max[slots] = np.inf
+        self.pcr[slots] = pcr
+        ec = self.ec[slots]
+        e1 = np.minimum(e0 + pcr * sec * ec, self.etar[slots] if real_etar is None else real_etar)
+        energy[slots] = e1
+        delta = (e1 - e0) / ec
+        money = delta * unit_cost
+        self.cost[slots] += money
+        return delta, money
+
+    def discharge(self, slots: np.ndarray, sec: int, unit_earn: Union[float, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorised EV.bidirectional_discharge() of the EVs in the slots.
+
+        :param slots: Slots of the EVs, must be unique
+        :param sec: Discharging duration (seconds)
+        :param unit_earn: Unit earning of discharging of each EV ($/kWh)
+        :return: (delta_energy, money), energy delivered to the grid (kWh) and earning ($) of each EV
+        """
+        energy = self.energy
+        e0 = energy[slots]
+        pdr = np.minimum(self.pdm[slots], self.pd_max[slots])
+        self.pd_max[slots] = self.pdv[slots]
+        self.pdr[slots] = pdr
+        e1 = np.maximum(e0 - pdr * sec, self.cap[slots] * self.kv[slots])
+        energy[slots] = e1
+        delta = (e0 - e1) * self.ed[slots]
+        money = delta * unit_earn
+        self.earn[slots] += money
+        return delta, money
+
+
+__all__ = ["EVFleet", "FleetEV", "FleetSV"]
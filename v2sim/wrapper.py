@@ -177,30 +177,48 @@ def get_sim_params(args:Union[str, ArgChecker], check_illegal:bool = True) -> Di
     ralgo = args.pop_str("route-algo", "astar")
     gasoline_price = args.pop_float("gasoline-price", 5.0)
     add_veh_to_scs = not args.pop_bool("dont-add-veh-to-scs")
+    ev_fleet = args.pop_bool("ev-fleet")
     vscfg = CommonConfig(
         routing_algorithm = ralgo,
         gasoline_price = ConstFunc(gasoline_price),
-        add_veh_to_scs=add_veh_to_scs
+        add_veh_to_scs=add_veh_to_scs,
+        ev_fleet=ev_fleet
     )
 
     # SUMO or UXsim Config
     config = None
-    uxsim_show = args.pop_bool("uxsim-show-info")
-    uxsim_rand = args.pop_bool("uxsim-randomize")
-    uxsim_nopara = args.pop_bool("uxsim-no-parallel")
+    ux_def = UXsimConfig()
+    ux_kw = dict(
+        show_uxsim_info = args.pop_bool("uxsim-show-info"),
+        randomize_uxsim = args.pop_bool("uxsim-randomize"),
+        no_parallel = args.pop_bool("uxsim-no-parallel"),
+        route_cache_bucket = args.pop_int("uxsim-route-cache", ux_def.route_cache_bucket),
+        route_cache_size = args.pop_int("uxsim-route-cache-size", ux_def.route_cache_size),
+        route_cache_tolerance = args.pop_float("uxsim-route-cache-tol", ux_def.route_cache_tolerance),
+        station_batch_min = args.pop_int("uxsim-station-batch", ux_def.station_batch_min),
+        use_ch = args.pop_bool("uxsim-ch"),
+        array_links = args.pop_bool("uxsim-array-links"),
+        link_history_window = args.pop_float("uxsim-link-history", ux_def.link_history_window),
+        rebalance_interval = args.pop_int("uxsim-rebalance", ux_def.rebalance_interval),
+        rebalance_threshold = args.pop_float("uxsim-rebalance-threshold", ux_def.rebalance_threshold),
+        rebalance_log = args.pop_str("uxsim-rebalance-log", ux_def.rebalance_log),
+        rebalance_replay = args.pop_str("uxsim-rebalance-replay", ux_def.rebalance_replay),
+    )
+    ux_cfg = UXsimConfig(**ux_kw)
     sumo_ignd = args.pop_bool("sumo-ignore-driving")
     sumo_raise = args.pop_bool("sumo-raise-routing-error")
     sumo_meso = args.pop_bool("sumo-mesosim")
+    sumo_pipe = args.pop_bool("sumo-pipelined")
 
-    if uxsim_show or uxsim_nopara or uxsim_rand:
-        from .sim import UXsimConfig
-        config = UXsimConfig(uxsim_show, uxsim_rand, uxsim_nopara)
+    # A UXsim config is only given if any UXsim option is set
+    if ux_cfg != ux_def:
+        config = ux_cfg
     
-    if sumo_ignd or sumo_raise or sumo_meso:
+    if sumo_ignd or sumo_raise or sumo_meso or sumo_pipe:
         assert config is None, "Cannot use both SUMO and UXsim configurations."
         from .sim import SUMOConfig
         config = SUMOConfig(ignore_driving=sumo_ignd, 
-                suppress_route_not_found=not sumo_raise, mesosim=sumo_meso)
+                suppress_route_not_found=not sumo_raise, mesosim=sumo_meso, pipelined=sumo_pipe)
 
     if isinstance(args, ArgChecker):
         kwargs = {
@@ -220,6 +238,7 @@ def get_sim_params(args:Union[str, ArgChecker], check_illegal:bool = True) -> Di
             "plot_cmd":             plot_cmd,
             "copy_proj_to_out":     args.pop_bool("copy-proj-to-out"),
             "copy_state_to_proj":   args.pop_bool("copy-state-to-proj"),
+            "checkpoint_interval":  args.pop_int("checkpoint-interval", 0),
         }
     if check_illegal and len(args) > 0:
         for key in args.keys(): raise ValueError(Lang.ERROR_ILLEGAL_CMD.format(key))
@@ -234,6 +253,7 @@ def simulate_single(
     save_option: SaveStateOptions = SaveStateOptions.Skip, client_options: Optional[ClientOptions] = None, 
     gen_cmds:Optional[GenerationCommand] = None, plot_cmd:Optional[PlotCommand] = None,
     copy_proj_to_out:bool = False, copy_state_to_proj:bool = False, alt_cmds:Optional[AltCommand] = None,
+    checkpoint_interval:int = 0,
 ):
     # Generate traffic components if needed
     if gen_cmds is not None:
@@ -250,6 +270,7 @@ def simulate_single(
         assert state_option == LoadStateOption.Skip, Lang.ALT_COMMAND_NOT_SUPPORTED
         alt_cmds.apply(inst)
 
+    inst.checkpoint_interval = checkpoint_interval
     ok = inst.simulate()[0]
     out_dir = inst.result_dir  # Get the actual output directory used
     